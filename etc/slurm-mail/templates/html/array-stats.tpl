@@ -0,0 +1,50 @@
+<p>Statistics for the $TASKS jobs in the array ($STATES):</p>
+
+<table>
+	<tr>
+		<th></th>
+		<th>Min</th>
+		<th>Mean</th>
+		<th>Median</th>
+		<th>95th Percentile</th>
+		<th>Max</th>
+	</tr>
+	<tr>
+		<td>Elapsed:</td>
+		<td>$ELAPSED_MIN</td>
+		<td>$ELAPSED_MEAN</td>
+		<td>$ELAPSED_MEDIAN</td>
+		<td>$ELAPSED_P95</td>
+		<td>$ELAPSED_MAX</td>
+	</tr>
+	<tr>
+		<td>CPU Efficiency:</td>
+		<td>$CPU_EFFICIENCY_MIN</td>
+		<td>$CPU_EFFICIENCY_MEAN</td>
+		<td>$CPU_EFFICIENCY_MEDIAN</td>
+		<td>$CPU_EFFICIENCY_P95</td>
+		<td>$CPU_EFFICIENCY_MAX</td>
+	</tr>
+	<tr>
+		<td>Max memory usage per node:</td>
+		<td>$MAX_MEMORY_MIN</td>
+		<td>$MAX_MEMORY_MEAN</td>
+		<td>$MAX_MEMORY_MEDIAN</td>
+		<td>$MAX_MEMORY_P95</td>
+		<td>$MAX_MEMORY_MAX</td>
+	</tr>
+</table>
+
+<p>Jobs that did not complete successfully, then the longest running jobs:</p>
+
+<table>
+	<tr>
+		<th>ID</th>
+		<th>State</th>
+		<th>Exit Code</th>
+		<th>Elapsed</th>
+		<th>CPU Efficiency</th>
+		<th>Max memory usage per node</th>
+	</tr>
+$WORST_TASKS
+</table>
@@ -0,0 +1,3 @@
+<p>Job $JOB_ID ($JOB_NAME): $STATE</p>
+
+$JOB_TABLE
@@ -0,0 +1,18 @@
+<html>
+<head>
+<style>
+	$CSS
+</style>
+</head>
+<body>
+
+<p>Dear $USER,</p>
+
+<p>There have been $COUNT updates to your jobs on $CLUSTER. Details about each job can be found in the tables below:</p>
+
+$JOBS
+
+$SIGNATURE
+
+</body>
+</html>
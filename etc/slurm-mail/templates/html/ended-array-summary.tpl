@@ -16,6 +16,8 @@ $JOB_TABLE
 
 $TRES_TABLE
 
+$ARRAY_STATS
+
 <p>Note: you have not been sent e-mail notifications for each job in the array. To receive individual job end e-mails for each job in your next array, add the "ARRAY_TASKS" option to the mail-type SBATCH parameter.</p>
 
 $SIGNATURE
@@ -0,0 +1,9 @@
+Statistics for the $TASKS jobs in the array ($STATES):
+
+Elapsed:                    min $ELAPSED_MIN, mean $ELAPSED_MEAN, median $ELAPSED_MEDIAN, 95th percentile $ELAPSED_P95, max $ELAPSED_MAX
+CPU Efficiency:             min $CPU_EFFICIENCY_MIN, mean $CPU_EFFICIENCY_MEAN, median $CPU_EFFICIENCY_MEDIAN, 95th percentile $CPU_EFFICIENCY_P95, max $CPU_EFFICIENCY_MAX
+Max memory usage per node:  min $MAX_MEMORY_MIN, mean $MAX_MEMORY_MEAN, median $MAX_MEMORY_MEDIAN, 95th percentile $MAX_MEMORY_P95, max $MAX_MEMORY_MAX
+
+Jobs that did not complete successfully, then the longest running jobs:
+
+$WORST_TASKS
@@ -0,0 +1,3 @@
+Job $JOB_ID ($JOB_NAME): $STATE
+
+$JOB_TABLE
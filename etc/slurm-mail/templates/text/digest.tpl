@@ -0,0 +1,7 @@
+Dear $USER,
+
+There have been $COUNT updates to your jobs on $CLUSTER. Details about each job can be found in the tables below:
+
+$JOBS
+
+$SIGNATURE
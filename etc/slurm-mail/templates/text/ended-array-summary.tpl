@@ -6,6 +6,8 @@ Details about the last job in the array that finished are shown in the table bel
 
 $JOB_TABLE
 
+$ARRAY_STATS
+
 Note: you have not been sent e-mail notifications for each job in the array. To receive individual job end e-mails for each job in your next array, add the "ARRAY_TASKS" option to the mail-type SBATCH parameter.
 
 $SIGNATURE
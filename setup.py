@@ -48,6 +48,9 @@ setuptools.setup(
             'etc/slurm-mail/style.css'
         ]),
         ('/etc/slurm-mail/templates/html', [
+            'etc/slurm-mail/templates/html/array-stats.tpl',
+            'etc/slurm-mail/templates/html/digest.tpl',
+            'etc/slurm-mail/templates/html/digest-job.tpl',
             'etc/slurm-mail/templates/html/ended-array-summary.tpl',
             'etc/slurm-mail/templates/html/ended-array.tpl',
             'etc/slurm-mail/templates/html/ended.tpl',
@@ -66,6 +69,9 @@ setuptools.setup(
             'etc/slurm-mail/templates/html/tres.tpl'
         ]),
         ('/etc/slurm-mail/templates/text', [
+            'etc/slurm-mail/templates/text/array-stats.tpl',
+            'etc/slurm-mail/templates/text/digest.tpl',
+            'etc/slurm-mail/templates/text/digest-job.tpl',
             'etc/slurm-mail/templates/text/ended-array-summary.tpl',
             'etc/slurm-mail/templates/text/ended-array.tpl',
             'etc/slurm-mail/templates/text/ended.tpl',
@@ -88,7 +94,7 @@ setuptools.setup(
     entry_points={
         'console_scripts': [
             'slurm-send-mail=slurmmail.cli:send_mail_main',
-            'slurm-spool-mail=slurmmail.cli:spool_mail_main'
+            'slurm-spool-mail=slurmmail.spool:spool_mail_main'
         ],
     },
     install_requires=[
@@ -24,8 +24,8 @@
 #
 
 """
-This module provides the source for the `slurm-send-mail` and
-`slurm-spool-mail` applications.
+This module provides the source for the `slurm-send-mail` application.
+`slurm-spool-mail` is provided by `slurmmail.spool`.
 
 See also:
 
@@ -38,38 +38,68 @@ README.md              -> Set-up info
 import argparse
 import configparser
 import email.utils
-import grp
-import json
 import logging
 import pathlib
 import os
-import pwd
 import re
+import signal
 import smtplib
-import sys
+import sqlite3
 import time
 
-from collections import namedtuple
+from collections import deque, namedtuple
 from datetime import timedelta
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from string import Template
-from time import sleep
-from typing import Dict, List, Optional, Set
+from typing import Any, Callable, Deque, Dict, Generator, Iterable, Iterator, List, Optional, Set, Tuple
 
 from slurmmail import conf_dir, conf_file, html_tpl_dir, text_tpl_dir
 from slurmmail.common import (
     check_dir,
+    CommandException,
     check_file,
+    clear_nss_cache,
     delete_spool_file,
     die,
     get_file_contents,
-    get_kbytes_from_str,
-    get_usec_from_str,
+    get_group_entry,
+    get_passwd_entry,
+    get_str_from_kbytes,
+    open_command,
     run_command,
     tail_file,
+    TAIL_MAX_BYTES,
 )
+from slurmmail.deferred import DeferredQueue, SpoolFile
+from slurmmail.delivery import (
+    is_transient_error,
+    OutgoingMail,
+    SMTP_IDLE_CHECK_SECONDS,
+    SmtpDeliveryPool,
+    SpoolFileDelivery,
+)
+from slurmmail.output import OutputReaderPool
+from slurmmail.receiver import EventReceiver
+from slurmmail.restd import RESTD_API_VERSION, RestdClient, RestdException
+from slurmmail.sacct import decode_row, SacctDecoder, SacctRecord
 from slurmmail.slurm import check_job_output_file_path, Job
+from slurmmail.slurmdb import get_sacct_rows_from_jobs, iter_json_array
+# slurm-spool-mail used to be provided by this module
+from slurmmail.spool import (  # noqa: F401 pylint: disable=unused-import
+    claim_spool_file,
+    scan_spool_dir,
+    SPOOL_BACKENDS,
+    spool_event,
+    SPOOL_LEASE,
+    SPOOL_LEASE_INFIX,
+    spool_mail_main,
+    SPOOL_SUBDIR_RE,
+)
+from slurmmail.spooldb import SPOOL_DB_BATCH_SIZE, SPOOL_DB_NAME, SpoolDatabase, SpoolEvent
+from slurmmail.spoolitem import SpoolItem
+from slurmmail.stats import ArrayStatistics, StreamingStatistic
+from slurmmail.watcher import SpoolWatcher
 
 logger = logging.getLogger(__name__)
 
@@ -77,6 +107,50 @@ TemplateResult = namedtuple("TemplateResult", ["html", "text"])
 
 MAX_EMAIL_SEND_ATTEMPTS = 3
 
+# the events that are superseded by each event for the same job when
+# spool files are coalesced
+TIME_REACHED_STATES = {"Time reached 50%", "Time reached 80%", "Time reached 90%"}
+COALESCE_RULES: Dict[str, Set[str]] = {
+    "Ended": {"Began"} | TIME_REACHED_STATES,
+    "Failed": {"Began"} | TIME_REACHED_STATES,
+    "Time limit reached": {"Began"} | TIME_REACHED_STATES,
+    "Time reached 90%": {"Time reached 50%", "Time reached 80%"},
+    "Time reached 80%": {"Time reached 50%"},
+}
+
+SACCT_FIELDS = [
+    "JobId",
+    "User",
+    "Group",
+    "Partition",
+    "Account",
+    "Start",
+    "End",
+    "State",
+    "ReqMem",
+    "MaxRSS",
+    "NCPUS",
+    "CPUTimeRaw",
+    "TotalCPU",
+    "NNodes",
+    "WorkDir",
+    "Elapsed",
+    "ExitCode",
+    "AdminComment",
+    "Comment",
+    "Cluster",
+    "NodeList",
+    "TimeLimit",
+    "TimelimitRaw",
+    "JobIdRaw",
+    "AllocTRES",
+    "JobName",
+]
+
+SACCT_DECODER = SacctDecoder(SACCT_FIELDS)
+# keys in the output of scontrol -o, e.g. " AllocNode:Sid="
+SCONTROL_KEY_RE = re.compile(r"(?:^| )([\w/:]+)=", re.MULTILINE)
+
 
 class ProcessSpoolFileOptions:
     # pylint: disable=too-few-public-methods,too-many-instance-attributes
@@ -85,12 +159,24 @@ class ProcessSpoolFileOptions:
     """
 
     def __init__(self) -> None:
+        # pylint: disable=too-many-statements
+        self.accounting_backend: str = "sacct"
         self.array_max_notifications: int
+        self.array_summary_stats: bool = False
+        self.array_summary_worst_tasks: int = 5
         self.css: Optional[str] = None
         self.datetime_format: str
+        self.deferred: Optional[DeferredQueue] = None
+        self.spool_backend: str = "files"
+        self.spool_db: Optional[SpoolDatabase] = None
+        self.spool_socket: Optional[pathlib.Path] = None
+        self.digest_states: Set[str] = set()
+        self.digest_users: Set[str] = set()
+        self.digest_window: int = 300
         self.email_from_address: str
         self.email_from_name: Optional[str] = None
         self.email_subject: str
+        self.email_digest_subject: str = "$CLUSTER: $COUNT job notifications"
         self.email_headers: Dict[str, str] = {}
         self.mail_regex: str = r"\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b"
         self.mail_domain: Optional[str] = None
@@ -99,13 +185,223 @@ class ProcessSpoolFileOptions:
         self.scontrol_exe: pathlib.Path
         self.smtp_port: Optional[int] = None
         self.smtp_server: str
-        self.tail_exe: pathlib.Path
+        self.tail_exe: Optional[pathlib.Path] = None
         self.tail_lines: int
+        self.tail_max_bytes: int = TAIL_MAX_BYTES
         self.html_templates: Dict[str, pathlib.Path]
         self.text_templates: Dict[str, pathlib.Path]
+        self.retry_backoff: int = 60
+        self.retry_backoff_max: int = 3600
         self.retry_delay: int = 0
+        self.retry_max_attempts: int = 10
         self.retry_on_failure: bool = True
         self.ignore_tres_keys: Set[str] = set()
+        self.coalesce_events: bool = False
+        self.coalesce_rules: Dict[str, Set[str]] = {state: set(states) for state, states in COALESCE_RULES.items()}
+        self.sacct_batch_size: int = 100
+        self.daemon_poll_interval: int = 60
+        self.spool_lease: int = SPOOL_LEASE
+        self.spool_max_files: int = 0
+        self.smtp_connections: int = 1
+        # monotonic time until which the SMTP connection is trusted
+        # without checking it with NOOP
+        self.smtp_checked_until: float = 0
+        self.smtp_use_ssl: bool = False
+        self.smtp_use_tls: bool = False
+        self.smtp_username: str = ""
+        self.smtp_password: str = ""
+        self.stylesheet: pathlib.Path
+        self.templates: Optional["TemplateRegistry"] = None
+        self.output_reader_processes: int = 0
+        self.output_readers: Optional[OutputReaderPool] = None
+        self.restd: Optional[RestdClient] = None
+        self.restd_api_version: str = RESTD_API_VERSION
+        self.restd_connections: int = 2
+        self.restd_token: Optional[str] = None
+        self.restd_url: str = ""
+        self.restd_user: Optional[str] = None
+
+
+class TemplateRegistry:
+    """
+    Holds the compiled HTML and text e-mail templates so that each
+    template file is only read and parsed once. Templates are reloaded
+    by `refresh` if their files have been modified.
+    """
+
+    def __init__(self, html_templates: Dict[str, pathlib.Path], text_templates: Dict[str, pathlib.Path]):
+        self.__html_templates = html_templates
+        self.__text_templates = text_templates
+        self.__templates: Dict[pathlib.Path, Tuple[Optional[float], Template]] = {}
+        self.__signatures: Dict[Optional[str], TemplateResult] = {}
+
+    def html(self, name: str) -> Template:
+        """
+        Returns the compiled HTML template with the given name.
+        """
+        return self.__get(self.__html_templates[name])
+
+    def refresh(self):
+        """
+        Discard any compiled templates whose files have been modified
+        since they were loaded.
+        """
+        for path, (mtime, _) in list(self.__templates.items()):
+            if self.__get_mtime(path) != mtime:
+                logger.info("Template %s has been modified, reloading", path)
+                del self.__templates[path]
+                self.__signatures = {}
+
+    def signature(self, email_from: Optional[str]) -> TemplateResult:
+        """
+        Returns the rendered HTML and text e-mail signatures. These are
+        the same for every e-mail so are only rendered once.
+        """
+        if email_from not in self.__signatures:
+            logger.debug("Creating e-mail signature template")
+            self.__signatures[email_from] = TemplateResult(
+                self.html("signature").substitute(EMAIL_FROM=email_from),
+                self.text("signature").substitute(EMAIL_FROM=email_from),
+            )
+        return self.__signatures[email_from]
+
+    def text(self, name: str) -> Template:
+        """
+        Returns the compiled text template with the given name.
+        """
+        return self.__get(self.__text_templates[name])
+
+    def __get(self, path: pathlib.Path) -> Template:
+        if path not in self.__templates:
+            mtime = self.__get_mtime(path)
+            self.__templates[path] = (mtime, Template(get_file_contents(path)))
+        return self.__templates[path][1]
+
+    @staticmethod
+    def __get_mtime(path: pathlib.Path) -> Optional[float]:
+        try:
+            return path.stat().st_mtime
+        except OSError:
+            return None
+
+
+def get_job_table_values(job: Job, display_job_id: str) -> Dict[str, object]:
+    """
+    Returns the values used to populate the job table templates for
+    the given job.
+
+    :param job:             the job
+    :type job:              Job
+    :param display_job_id:  the job ID to show in the table
+    :type display_job_id:   str
+    :return:                a dictionary of template values
+    :rtype:                 Dict[str, object]
+    """
+    return {
+        "JOB_ID": display_job_id,
+        "JOB_NAME": job.name,
+        "PARTITION": job.partition,
+        "START": job.start,
+        "END": job.end,
+        "WORKDIR": job.workdir,
+        "START_TS": job.start_ts,
+        "END_TS": job.end_ts,
+        "ELAPSED": str(timedelta(seconds=job.elapsed)),
+        "EXIT_STATE": job.state,
+        "EXIT_CODE": job.exit_code,
+        "ADMIN_COMMENT": job.admin_comment,
+        "COMMENT": job.comment,
+        "REQ_MEMORY": job.requested_mem_str,
+        "MAX_MEMORY": job.max_rss_str,
+        "NODES": job.nodes,
+        "NODE_LIST": job.nodelist,
+        "STDOUT": job.stdout,
+        "STDERR": job.stderr,
+        "CPU_EFFICIENCY": job.cpu_efficiency,
+        "CPU_TIME": job.used_cpu_str,
+        "WALLCLOCK": job.wc_string,
+        "WALLCLOCK_ACCURACY": job.wc_accuracy,
+        "ACCOUNT": job.account,
+    }
+
+
+def get_sacct_rows(job_ids: List[int], options: ProcessSpoolFileOptions) -> Dict[int, List[SacctRecord]]:
+    """
+    Retrieve the sacct records for several jobs using as few sacct
+    invocations as possible. At most `options.sacct_batch_size` job IDs
+    are passed to each invocation of sacct.
+
+    Job IDs whose batch failed are not included in the returned dictionary
+    so that the caller can fall back to querying them individually.
+
+    :param job_ids: the job IDs to query
+    :type job_ids:  List[int]
+    :param options: processing options
+    :type options:  ProcessSpoolFileOptions
+    :return:        a dictionary of job ID to sacct records
+    :rtype:         Dict[int, List[SacctRecord]]
+    """
+    rows_by_job_id: Dict[int, List[SacctRecord]] = {}
+    unique_job_ids = list(dict.fromkeys(job_ids))
+    batch_size = max(1, options.sacct_batch_size)
+    for i in range(0, len(unique_job_ids), batch_size):
+        batch = unique_job_ids[i:i + batch_size]
+        rows = run_sacct(batch, options)
+        if rows is None:
+            continue
+        batch_rows: Dict[int, List[SacctRecord]] = {job_id: [] for job_id in batch}
+        for row in rows:
+            # a row belongs to a requested job if either its job ID
+            # (e.g. 1000_5 or 1000+1) or its raw job ID starts with it
+            if row.job_id_base in batch_rows:
+                batch_rows[row.job_id_base].append(row)
+            if row.job_id_raw_base != row.job_id_base and row.job_id_raw_base in batch_rows:
+                batch_rows[row.job_id_raw_base].append(row)
+        rows_by_job_id.update(batch_rows)
+    return rows_by_job_id
+
+
+def __get_scontrol_records(input_str: str) -> Iterator[Dict[str, str]]:
+    """
+    Split the output of `scontrol -o` into key/value pairs in a single
+    pass, yielding a dictionary for each line.
+
+    A key starts at the beginning of a line or after a space, so values
+    such as "TRES=cpu=1,node=1" are kept intact and values run until the
+    next key.
+    """
+    values: Dict[str, str] = {}
+    key = None
+    start = 0
+    for match in SCONTROL_KEY_RE.finditer(input_str):
+        new_line = match.start() == 0 or input_str[match.start() - 1] == "\n"
+        if key is not None:
+            value = input_str[start:match.start()]
+            values[key] = value.rstrip("\r\n") if new_line else value
+        if new_line and values:
+            yield values
+            values = {}
+        key = match.group(1)
+        start = match.end()
+    if key is not None:
+        values[key] = input_str[start:].rstrip("\r\n")
+    if values:
+        yield values
+
+
+def get_scontrol_jobs(input_str: str) -> Dict[str, Dict[str, str]]:
+    """
+    Helper method to extract the keys and values for every job in
+    the (multi-line) output of `scontrol -o show job`.
+
+    Returns a dictionary of key/value pairs for each job, indexed
+    by JobId.
+    """
+    return {
+        values["JobId"]: values
+        for values in __get_scontrol_records(input_str)
+        if "JobId" in values
+    }
 
 
 def get_scontrol_values(input_str: str) -> Dict[str, str]:
@@ -115,53 +411,216 @@ def get_scontrol_values(input_str: str) -> Dict[str, str]:
 
     Returns a dictionary of key/value pairs.
     """
-    # add double quotes around values
-    equalsRe = re.compile(r"( ?[\w/:]+=)")
-    for s in equalsRe.findall(input_str):
-        if s.startswith(" "):
-            input_str = input_str.replace(s, f'" {s}"')
-        else:
-            input_str = input_str.replace(s, f'{s}"')
-    input_str += '"'
+    for values in __get_scontrol_records(input_str):
+        return values
+    return {}
+
+
+def get_smtp_connection(options: ProcessSpoolFileOptions) -> smtplib.SMTP:
+    """
+    Create a new SMTP connection using the given options.
+
+    :param options: processing options
+    :type options:  ProcessSpoolFileOptions
+    :return:        an SMTP connection
+    :rtype:         smtplib.SMTP
+    """
+    # check if ssl is being requested (usually port 465)
+    smtp_conn: smtplib.SMTP
+    if options.smtp_use_ssl:
+        smtp_conn = smtplib.SMTP_SSL(
+            host=options.smtp_server, port=options.smtp_port, timeout=60
+        )
+    else:
+        smtp_conn = smtplib.SMTP(
+            host=options.smtp_server, port=options.smtp_port, timeout=60
+        )
+
+    if options.smtp_use_tls:
+        smtp_conn.starttls()
+    if options.smtp_username != "" and options.smtp_password != "":
+        smtp_conn.login(options.smtp_username, options.smtp_password)
+    return smtp_conn
+
+
+def get_spool_file_job_id(json_file: SpoolItem) -> Optional[int]:
+    """
+    Returns the job ID from the given spool file or None if the
+    file could not be read.
 
-    output = {}
-    # extract keys and values
-    extractRe = re.compile(r'(?P<key>[\w/:]+)="(?P<value>.*?)"')
-    for key, value in extractRe.findall(input_str):
-        output[key] = value
-    return output
+    :param json_file:   the claimed spool file
+    :type json_file:    SpoolItem
+    :return:            the job ID or None
+    :rtype:             Optional[int]
+    """
+    try:
+        return int(json_file.read()["job_id"])
+    except Exception:
+        return None
 
 
-def get_tres_tables(job: Job, tres_html_tpl: pathlib.Path, tres_text_tpl: pathlib.Path) -> TemplateResult:
+def get_tres_tables(job: Job, tres_html_tpl: Template, tres_text_tpl: Template) -> TemplateResult:
     """
     Helper function to return TRES tables for use in HTML and plain
     text e-mails.
 
     :param job:             the job
     :type job:              Job
-    :param tres_html_tpl:   path to TRES HTML template
-    :type tres_html_tpl:    pathlib.Path
-    :param tres_text_tpl:   path to TRES text template
-    :type tres_text_tpl:    pathlib.Path
+    :param tres_html_tpl:   TRES HTML template
+    :type tres_html_tpl:    Template
+    :param tres_text_tpl:   TRES text template
+    :type tres_text_tpl:    Template
     :return:                a TemplateResult
     :rtype:                 TemplateResult
     """
-
-    tpl_html = Template(get_file_contents(tres_html_tpl))
-    tres_table_html = tpl_html.substitute(
+    tres = job.tres
+    tres_table_html = tres_html_tpl.substitute(
         TRACKABLE_RESOURCES="\n".join([
-            f"<tr>\n<td>{key}:</td>\n<td>{value}</td>\n</tr>\n" for key, value in job.tres.items()
+            f"<tr>\n<td>{key}:</td>\n<td>{value}</td>\n</tr>\n" for key, value in tres.items()
         ])
     )
 
-    tpl_text = Template(get_file_contents(tres_text_tpl))
-    tres_table_text = tpl_text.substitute(
-        TRACKABLE_RESOURCES="\n".join([f"{key}: {value}" for key, value in job.tres.items()])
+    tres_table_text = tres_text_tpl.substitute(
+        TRACKABLE_RESOURCES="\n".join([f"{key}: {value}" for key, value in tres.items()])
     )
 
     return TemplateResult(tres_table_html, tres_table_text)
 
 
+def get_array_stats_tables(
+    stats: ArrayStatistics, stats_html_tpl: Template, stats_text_tpl: Template
+) -> TemplateResult:
+    """
+    Helper function to return the statistics of the tasks of a job array
+    for use in HTML and plain text e-mails.
+
+    :param stats:           the array's statistics
+    :type stats:            ArrayStatistics
+    :param stats_html_tpl:  array statistics HTML template
+    :type stats_html_tpl:   Template
+    :param stats_text_tpl:  array statistics text template
+    :type stats_text_tpl:   Template
+    :return:                a TemplateResult
+    :rtype:                 TemplateResult
+    """
+    def elapsed_str(value: Optional[float]) -> str:
+        return "N/A" if value is None else str(timedelta(seconds=round(value)))
+
+    def cpu_efficiency_str(value: Optional[float]) -> str:
+        return "N/A" if value is None else "{0:.2f}%".format(value)
+
+    def max_memory_str(value: Optional[float]) -> str:
+        return "N/A" if value is None else get_str_from_kbytes(value)
+
+    values = {
+        "TASKS": stats.tasks,
+        "STATES": ", ".join(
+            "{0}: {1}".format(state, count) for state, count in sorted(
+                stats.states.items(), key=lambda item: (-item[1], item[0])
+            )
+        ),
+    }
+    statistic: StreamingStatistic
+    for prefix, statistic, to_str in [
+        ("ELAPSED", stats.elapsed, elapsed_str),
+        ("CPU_EFFICIENCY", stats.cpu_efficiency, cpu_efficiency_str),
+        ("MAX_MEMORY", stats.max_rss, max_memory_str),
+    ]:
+        values[prefix + "_MIN"] = to_str(statistic.min)
+        values[prefix + "_MEAN"] = to_str(statistic.mean)
+        values[prefix + "_MEDIAN"] = to_str(statistic.percentile(50))
+        values[prefix + "_P95"] = to_str(statistic.percentile(95))
+        values[prefix + "_MAX"] = to_str(statistic.max)
+
+    worst_tasks = [
+        (
+            task.job_id,
+            task.state,
+            task.exit_code,
+            elapsed_str(task.elapsed),
+            cpu_efficiency_str(task.cpu_efficiency),
+            max_memory_str(task.max_rss),
+        )
+        for task in stats.worst_tasks()
+    ]
+    stats_html = stats_html_tpl.substitute(
+        WORST_TASKS="\n".join([
+            "<tr>\n{0}\n</tr>".format("\n".join(f"<td>{value}</td>" for value in task)) for task in worst_tasks
+        ]),
+        **values
+    )
+    stats_text = stats_text_tpl.substitute(
+        WORST_TASKS="\n".join([
+            f"{job_id}: {state}, exit code {exit_code}, elapsed {elapsed}, CPU efficiency {cpu_efficiency}, "
+            f"max memory usage per node {max_memory}"
+            for job_id, state, exit_code, elapsed, cpu_efficiency, max_memory in worst_tasks
+        ]),
+        **values
+    )
+
+    return TemplateResult(stats_html, stats_text)
+
+
+def iter_sacct(
+    job_ids: List[int], options: ProcessSpoolFileOptions, extra_args: str = ""
+) -> Iterator[SacctRecord]:
+    """
+    Query the accounting records of the given job IDs, yielding each
+    record as soon as sacct has output it. If the iterator is closed
+    before all records have been read then sacct is terminated.
+
+    :param job_ids:     the job IDs to query
+    :type job_ids:      List[int]
+    :param options:     processing options
+    :type options:      ProcessSpoolFileOptions
+    :param extra_args:  additional arguments to pass to sacct
+    :type extra_args:   str
+    :return:            an iterator of sacct records
+    :rtype:             Iterator[SacctRecord]
+    :raises CommandException:   if sacct fails
+    :raises RestdException:     if slurmrestd could not be queried
+    """
+    if options.restd is not None and not extra_args:
+        for job_id in job_ids:
+            rows = options.restd.get_sacct_rows(job_id)
+            if rows is None:
+                raise RestdException("Failed to retrieve job {0} from slurmrestd".format(job_id))
+            for row in rows:
+                yield decode_row(row)
+        return
+
+    job_ids_str = ",".join([str(job_id) for job_id in job_ids])
+    extra_args_str = "{0} ".format(extra_args) if extra_args else ""
+    if options.accounting_backend == "sacct-json":
+        cmd = "{0} {1}-j {2} --json".format(options.sacct_exe, extra_args_str, job_ids_str)
+        parse_error = None
+        with open_command(cmd) as stdout:
+            try:
+                # convert one job at a time rather than parsing the whole
+                # document
+                for job in iter_json_array(stdout, "jobs"):
+                    for row in get_sacct_rows_from_jobs([job]):
+                        yield decode_row(row)
+            except ValueError as e:
+                # read the rest of the output so that a failure of sacct
+                # itself is reported instead
+                parse_error = e
+                stdout.read()
+        if parse_error is not None:
+            raise CommandException("Failed to parse the output of {0}: {1}".format(cmd, parse_error))
+        return
+
+    cmd = "{0} {1}-j {2} -P -n --fields={3}".format(
+        options.sacct_exe, extra_args_str, job_ids_str, ",".join(SACCT_FIELDS)
+    )
+    with open_command(cmd) as stdout:
+        for line in stdout:
+            logger.debug(line.rstrip("\n"))
+            record = SACCT_DECODER.decode(line.rstrip("\n"))
+            if record is not None:
+                yield record
+
+
 def resolve_user_email(user_email: str, options: ProcessSpoolFileOptions) -> Optional[str]:
     """
     Resolves a user's email address.
@@ -202,6 +661,55 @@ def resolve_user_email(user_email: str, options: ProcessSpoolFileOptions) -> Opt
     return ",".join(resolved)
 
 
+def run_sacct(
+    job_ids: List[int], options: ProcessSpoolFileOptions, extra_args: str = ""
+) -> Optional[List[SacctRecord]]:
+    """
+    Execute sacct for the given job IDs.
+
+    :param job_ids:     the job IDs to query
+    :type job_ids:      List[int]
+    :param options:     processing options
+    :type options:      ProcessSpoolFileOptions
+    :param extra_args:  additional arguments to pass to sacct
+    :type extra_args:   str
+    :return:            a list of sacct records or None if the command failed
+    :rtype:             Optional[List[SacctRecord]]
+    """
+    try:
+        return list(iter_sacct(job_ids, options, extra_args))
+    except (CommandException, RestdException) as e:
+        logger.error(e)
+        return None
+
+
+def run_scontrol_array(array_job_id: str, scontrol_exe: pathlib.Path) -> Optional[Dict[str, Dict[str, str]]]:
+    """
+    Execute scontrol once against the given job array ID and index the
+    details of every task in the array by their (raw) JobId.
+
+    :param array_job_id:    the job array ID
+    :type array_job_id:     str
+    :param scontrol_exe:    path to scontrol exe
+    :type scontrol_exe:     pathlib.Path
+    :return:                a dictionary of scontrol output for each task or None if the command failed
+    :rtype:                 Optional[Dict[str, Dict[str, str]]]
+    """
+    cmd = "{0} -o show job={1}".format(scontrol_exe, array_job_id)
+    rc, stdout, stderr = run_command(cmd)
+    if rc == 0:
+        logger.debug(stdout)
+        return get_scontrol_jobs(stdout)
+
+    if "Invalid job id specified" in stderr:
+        return None
+
+    logger.error("Failed to run: %s", cmd)
+    logger.error(stdout)
+    logger.error(stderr)
+    return None
+
+
 def run_scontrol(job_id: str, scontrol_exe: pathlib.Path) -> Optional[Dict[str, str]]:
     """
     Execute scontrol against the given Slurm job ID.
@@ -233,835 +741,941 @@ def run_scontrol(job_id: str, scontrol_exe: pathlib.Path) -> Optional[Dict[str,
     return None
 
 
-def __process_spool_file(
-    json_file: pathlib.Path, smtp_conn: smtplib.SMTP, options: ProcessSpoolFileOptions
-):
-    # pylint: disable=too-many-branches,too-many-locals,too-many-statements,too-many-nested-blocks  # noqa
-    # data is JSON encoded as of version 2.6
-    with json_file.open() as spool_file:
-        try:
-            data = json.load(spool_file)
-        except Exception:
-            logger.error("Could not parse JSON from: %s", json_file)
-            delete_spool_file(json_file)
-            return
+def __get_job_output_files(job: Job, state: str, options: ProcessSpoolFileOptions) -> List[str]:
+    """
+    Returns the output files of the job to include in its notification.
+    """
+    if (
+        options.tail_lines > 0
+        and state in ["Ended", "Failed", "Requeued", "Time limit reached"]
+        and job.did_start
+        and job.stdout not in ["?", "N/A"]
+        and check_job_output_file_path(job.stdout)
+    ):
+        output_files = [job.stdout]
+        if job.separate_output() and job.stderr not in ["?", "N/A", ""]:
+            output_files.append(job.stderr)
+        return output_files
+    return []
+
+
+def __read_job_output(
+    job: Job, requests: List[Tuple[str, int]], options: ProcessSpoolFileOptions
+) -> Callable[[], List[str]]:
+    """
+    Start reading the tail of each (path, number of lines) request with
+    the privileges of the job's owner. Returns a function that returns
+    the tails once they have been read.
 
-    for f in ["job_id", "email", "state", "array_summary"]:
-        if f not in data:
-            logger.error("Could not find %s in %s", f, json_file)
-            delete_spool_file(json_file)
-            return
+    With a pool of output readers the requests are submitted straight
+    away, otherwise the files are read in this process when the returned
+    function is called.
+    """
+    uid = get_passwd_entry(job.user).pw_uid
+    gid = get_group_entry(job.group).gr_gid
+    if options.output_readers is not None:
+        future = options.output_readers.submit(uid, gid, requests)
 
-    first_job_id = int(data["job_id"])
-    user_email = data["email"]
-    state = data["state"]
-    array_summary = data["array_summary"]
+        def collect() -> List[str]:
+            try:
+                return future.result()
+            except Exception as e:
+                logger.error("Failed to read output files for job %s: %s", job.id, e)
+                return ["Unable to return contents of file: {0}".format(e) for _ in requests]
 
-    logger.debug("spool file content: %s", data)
+        return collect
 
-    resolved_email = resolve_user_email(user_email, options)
-    if resolved_email is None:
-        logger.error("Email address not valid: %s", user_email)
-        delete_spool_file(json_file)
-        return
+    def read() -> List[str]:
+        # Drop privileges prior to tailing output
+        os.setegid(gid)
+        os.seteuid(uid)
+        try:
+            return [
+                tail_file(path, num_lines, options.tail_max_bytes, options.tail_exe)
+                for path, num_lines in requests
+            ]
+        finally:
+            # Restore root privileges
+            os.seteuid(0)
+            os.setegid(0)
+
+    return read
+
+
+def __iter_jobs(
+    sacct_rows: Iterable[SacctRecord],
+    *,
+    first_job_id: int,
+    state: str,
+    array_summary: bool,
+    slurm_env: Dict[str, str],
+    options: ProcessSpoolFileOptions,
+    scontrol_arrays: Optional[Dict[str, Dict[str, Dict[str, str]]]],
+) -> Generator[Job, None, None]:
+    """
+    Build a Job for each sacct record that a notification should be sent
+    for. Each job is yielded as soon as the records of its steps have been
+    read, so that its notification can be sent before sacct has output the
+    rest of a (large) job array.
+    """
+    # pylint: disable=too-many-arguments,too-many-branches,too-many-locals,too-many-statements,too-many-nested-blocks  # noqa
+    job = None
+    for record in sacct_rows:
+        if not record.is_job:
+            logger.debug("job ID %s is a job step", record.job_id)
+            # grab MaxRSS value
+            if (
+                state != "Began"
+                and record.max_rss is not None
+                and job is not None
+                and (job.max_rss is None or record.max_rss > job.max_rss)
+            ):
+                job.max_rss = record.max_rss
+            continue
 
-    user_email = resolved_email
+        if job is not None:
+            # all of the previous job's steps have been read
+            yield job
+            job = None
+            if not array_summary:
+                # raw job IDs are unique, so no other record can match
+                return
+
+        job_id = record.job_id
+        job_raw_id = record.job_id_raw
+        if job_raw_id is None:
+            logger.warning("job %s: could not parse raw job ID", job_id)
+            continue
 
-    jobs: List[Job] = []  # store job object for each job in this array
+        if not array_summary and job_raw_id != int(first_job_id):
+            logger.debug("skipping %s, it does not equal %s", job_raw_id, first_job_id)
+            continue
 
-    if state not in [
-        "Began",
-        "Ended",
-        "Failed",
-        "Invalid dependency",
-        "Requeued",
-        "Staged Out",
-        "Time reached 50%",
-        "Time reached 80%",
-        "Time reached 90%",
-        "Time limit reached",
-    ]:
-        logger.warning(
-            "Unsupported job state: %s - no emails will be generated", state
-        )
-    else:
-        fields = [
-            "JobId",
-            "User",
-            "Group",
-            "Partition",
-            "Account",
-            "Start",
-            "End",
-            "State",
-            "ReqMem",
-            "MaxRSS",
-            "NCPUS",
-            "CPUTimeRaw",
-            "TotalCPU",
-            "NNodes",
-            "WorkDir",
-            "Elapsed",
-            "ExitCode",
-            "AdminComment",
-            "Comment",
-            "Cluster",
-            "NodeList",
-            "TimeLimit",
-            "TimelimitRaw",
-            "JobIdRaw",
-            "AllocTRES",
-            "JobName",
-        ]
-        field_num = len(fields)
-        field_str = ",".join(fields)
+        if array_summary and "{0}".format(first_job_id) not in job_id:
+            logger.debug("skipping %s for job array summary", job_id)
+            continue
+        job = Job(options.datetime_format, job_id, job_raw_id)
+
+        job.cluster = record.cluster
+        job.admin_comment = record.admin_comment
+        job.comment = record.comment
+        if record.ncpus is not None:
+            job.cpus = record.ncpus
+        job.cpu_time = record.cpu_time_raw
+        job.group = record.group
+        job.name = record.job_name
+        job.nodelist = record.node_list
+        job.nodes = record.nnodes
+        job.partition = record.partition
+        job.account = record.account
+        # for Slurm < 21, the ReqMem value will have 'n' or 'c'
+        # appended depending on whether the user has requested per node
+        # see issue #38
+        if record.req_mem_per_cpu and record.req_mem is not None and job.cpus is not None:
+            logger.debug("Applying ReqMem workaround for Slurm versions < 21")
+            # need to multiply by job.cpus
+            job.requested_mem = record.req_mem * job.cpus
+        else:
+            job.requested_mem = record.req_mem
+        # if job start is "None", then the job was never despatched
+        # e.g. pending job was cancelled
+        if record.start_ts is not None:
+            job.start_ts = record.start_ts
+        elif record.start != "None":
+            logger.warning(
+                "job %s: could not parse '%s' for job start timestamp",
+                job.raw_id,
+                record.start,
+            )
+        job.used_cpu_usec = record.total_cpu_usec
+        job.user = record.user
+        job.workdir = record.work_dir
+
+        if record.time_limit == "UNLIMITED":
+            job.wallclock = 0
+        elif record.time_limit_mins is None:
+            logger.warning(
+                "job %s: could not parse: '%s' for job time limit",
+                job.raw_id,
+                record.time_limit_raw,
+            )
+            job.wallclock = 0
+        else:
+            job.wallclock = record.time_limit_mins * 60
 
-        # Get job info from sacct
-        cmd = "{0} -j {1} -P -n --fields={2}".format(
-            options.sacct_exe, first_job_id, field_str
-        )
-        rc, stdout, stderr = run_command(cmd)
-        if rc != 0:
-            logger.error("Failed to run %s", cmd)
-            logger.error(stdout)
-            logger.error(stderr)
+        for key, value in record.alloc_tres:
+            if key.lower() in options.ignore_tres_keys:
+                continue
+            job.add_tres(key, value)
+
+        # a scron job that has been requeued looks like this, scontrol
+        # is needed to confirm that it is a scron job
+        maybe_cronjob = state != "Began" and record.state == "PENDING"
+
+        # Get job info from scontrol (if it exists)
+        if (
+            slurm_env.get("SLURM_JOB_ID") == str(job_raw_id)
+            and "SLURM_JOB_STDOUT" in slurm_env
+            and not maybe_cronjob
+        ):
+            # slurmctld provided the output paths when it ran MailProg
+            logger.debug("job %s: using output paths from MailProg environment", job_raw_id)
+            scontrol_dict = {"StdOut": slurm_env["SLURM_JOB_STDOUT"]}
+            if "SLURM_JOB_STDERR" in slurm_env:
+                scontrol_dict["StdErr"] = slurm_env["SLURM_JOB_STDERR"]
+        elif record.stdout is not None and not maybe_cronjob:
+            # sacct --json and slurmrestd provide the output paths
+            logger.debug("job %s: using output paths from accounting record", job_raw_id)
+            scontrol_dict = {"StdOut": record.stdout}
+            if record.stderr is not None:
+                scontrol_dict["StdErr"] = record.stderr
+        elif options.restd is not None:
+            scontrol_dict = options.restd.get_scontrol_values(job_raw_id)
+        elif "_" in job_id:
+            # a single scontrol call returns every task in the array,
+            # so cache the output for the other tasks
+            if scontrol_arrays is None:
+                scontrol_arrays = {}
+            array_job_id = job_id.split("_", maxsplit=1)[0]
+            array_tasks = scontrol_arrays.get(array_job_id)
+            if array_tasks is None or (array_tasks and str(job_raw_id) not in array_tasks):
+                # not seen yet, or the task was not known to Slurm last time,
+                # a failed query is not repeated for the array's other tasks
+                array_tasks = run_scontrol_array(array_job_id, options.scontrol_exe) or {}
+                scontrol_arrays[array_job_id] = array_tasks
+            scontrol_dict = array_tasks.get(str(job_raw_id))
         else:
-            logger.debug(stdout)
-            job = None
-            for line in stdout.split("\n"):
-                data = line.split("|", (field_num - 1))
-                if len(data) != field_num:
-                    logger.debug("sacct field length expected: %s, found %s", field_num, len(data))
-                    continue
+            scontrol_dict = run_scontrol(job_id, options.scontrol_exe)
 
-                sacct_dict = {}
-                for i in range(field_num):
-                    sacct_dict[fields[i]] = data[i]
-
-                # possible job ID formats:
-                # [0-9]+
-                # [0-9]+_[0-9]+             --> job array
-                # [0-9]+_\[[0-9]+-[0-9]+\]  --> job array, not started
-                # [0-9]+\+[0-9]+            --> HET job
-                if not re.match(
-                    r"^([0-9]+|[0-9]+_[0-9]+|[0-9]+_\[[0-9]+-[0-9]+\]|[0-9]+\+[0-9]+)$",
-                    sacct_dict["JobId"]
-                ):
-                    logger.debug("job ID %s failed reg ex match", sacct_dict["JobId"])
-                    # grab MaxRSS value
-                    if (
-                        state != "Began"
-                        and sacct_dict["MaxRSS"] != ""
-                        and job is not None
-                        and (
-                            job.max_rss is None
-                            or get_kbytes_from_str(sacct_dict["MaxRSS"]) > job.max_rss
-                        )
-                    ):
-                        job.max_rss_str = sacct_dict["MaxRSS"]
-                    continue
+        if scontrol_dict is not None:
+            if "StdErr" in scontrol_dict:
+                job.stderr = scontrol_dict["StdErr"]
+            else:
+                job.stderr = "N/A"
 
-                job_id = sacct_dict["JobId"]
-                job_raw_id = int(sacct_dict["JobIdRaw"])
+            if "StdOut" in scontrol_dict:
+                job.stdout = scontrol_dict["StdOut"]
+            else:
+                job.stdout = "N/A"
+
+            if "CronJob" in scontrol_dict and scontrol_dict["CronJob"] == "Yes":
+                job.cronjob = True
+                logger.debug("job %s: is a scron job", job.raw_id)
+                # need to find last completed record by running sacct again but
+                # with -D flag using a time range of the last few minutes
+
+                cron_rows = run_sacct([first_job_id], options, "-S now-1minutes -D")
+                if cron_rows is not None:
+                    found_completed_record = False
+
+                    # only look for completed line
+                    for cron_record in cron_rows:
+                        if cron_record.state == "COMPLETED":
+                            job.state = cron_record.state
+                            job.nodelist = cron_record.node_list
+                            if cron_record.start_ts is not None:
+                                job.start_ts = cron_record.start_ts
+                            if cron_record.end_ts is not None:
+                                job.end_ts = cron_record.end_ts
+                            if cron_record.ncpus is not None:
+                                job.cpus = cron_record.ncpus
+                            job.cpu_time = cron_record.cpu_time_raw
+                            job.used_cpu_usec = cron_record.total_cpu_usec
+                            job.exit_code = cron_record.exit_code
+                            if (
+                                cron_record.max_rss is not None
+                                and job.max_rss is not None
+                                and cron_record.max_rss > job.max_rss
+                            ):
+                                job.max_rss = cron_record.max_rss
+
+                            found_completed_record = True
+                            break
+
+                    if not found_completed_record:
+                        logger.error("Could not find job completion record for scron job: %s", job.raw_id)
+
+        if state in ["Ended", "Failed", "Time limit reached"]:
+            if not job.cronjob:
+                job.state = record.state
+            if record.end_ts is not None:
+                job.end_ts = record.end_ts
+            else:
+                logger.warning(
+                    "job %s: could not parse: '%s' for job end timestamp",
+                    job.raw_id,
+                    record.end,
+                )
+            job.exit_code = record.exit_code
+            if (
+                record.max_rss is not None
+                and job.max_rss is not None
+                and record.max_rss > job.max_rss
+            ):
+                job.max_rss = record.max_rss
+
+        job.save()
+
+    if job is not None:
+        yield job
+
+
+def __send_job_notification(
+    job: Job,
+    json_file: SpoolItem,
+    *,
+    state: str,
+    array_summary: bool,
+    first_job_id: int,
+    user_email: str,
+    smtp_conn: Optional[smtplib.SMTP],
+    options: ProcessSpoolFileOptions,
+    delivery: Optional[SmtpDeliveryPool],
+    array_stats: Optional[ArrayStatistics] = None,
+    job_output: Optional[Callable[[], List[str]]] = None,
+) -> bool:
+    """
+    Render and send the notification e-mail for the given job. For array
+    summaries, `array_stats` holds the statistics of all of the array's
+    tasks if they were collected. `job_output` returns the tails of the
+    job's output files if they have already been requested with
+    `__read_job_output`.
+
+    Returns True if the e-mail was handed to the delivery pool, in which
+    case the spool file is deleted once it has been delivered.
+    """
+    # pylint: disable=too-many-arguments,too-many-branches,too-many-locals,too-many-statements  # noqa
+    templates: TemplateRegistry = options.templates  # type: ignore
+    display_job_id = (
+        str(first_job_id)
+        if array_summary
+        else job.id
+    )
 
-                if not array_summary and job_raw_id != int(first_job_id):
-                    logger.debug("skipping %s, it does not equal %s", job_raw_id, first_job_id)
-                    continue
+    display_array_job_id = (
+        str(first_job_id)
+        if array_summary
+        else job.array_id
+    )
+    logger.debug("Creating template for job %s", job.raw_id)
+    job_table_values = get_job_table_values(job, display_job_id)
+    job_table_html = templates.html("job_table").substitute(**job_table_values)
+    job_table_text = templates.text("job_table").substitute(**job_table_values)
 
-                if array_summary and "{0}".format(first_job_id) not in sacct_dict["JobId"]:
-                    logger.debug("skipping %s for job array summary", sacct_dict["JobId"])
-                    continue
-                if array_summary and jobs:
-                    logger.info(
-                        "Array summary for %s already has representative task %s;"
-                        "stopping detailed processing",
-                        first_job_id,
-                        jobs[0].id,
-                        )
-                    break
-                if (
-                    not array_summary
-                    and options.array_max_notifications > 0
-                    and len(jobs) >= options.array_max_notifications
-                ):
-                    logger.info(
-                        "Reached array notification processing limit of %d "
-                        "for job %s; stopping detailed task processing",
-                        options.array_max_notifications,
-                        first_job_id,
-                    )
-                    break
-                job = Job(options.datetime_format, job_id, job_raw_id)
-
-                job.cluster = sacct_dict["Cluster"]
-                job.admin_comment = sacct_dict["AdminComment"]
-                job.comment = sacct_dict["Comment"]
-                job.cpus = int(sacct_dict["NCPUS"])
-                job.cpu_time = int(sacct_dict["CPUTimeRaw"])
-                job.group = sacct_dict["Group"]
-                job.name = sacct_dict["JobName"]
-                job.nodelist = sacct_dict["NodeList"]
-                job.nodes = sacct_dict["NNodes"]
-                job.partition = sacct_dict["Partition"]
-                job.account = sacct_dict["Account"]
-                # for Slurm < 21, the ReqMem value will have 'n' or 'c'
-                # appended depending on whether the user has requested per node
-                # see issue #38
-                if sacct_dict["ReqMem"][-1:] == "c" and job.cpus is not None:
-                    logger.debug("Applying ReqMem workaround for Slurm versions < 21")
-                    # need to multiply by job.cpus
-                    try:
-                        sacct_dict["ReqMem"] = "{0}{1}".format(
-                            float(sacct_dict["ReqMem"][:-2]) * job.cpus,  # type: ignore
-                            sacct_dict["ReqMem"][-2:-1],
-                        )
-                    except ValueError:
-                        logger.error(
-                            'Failed to convert ReqMem "%s" to a float',
-                            sacct_dict["ReqMem"][:-2],
-                        )
-                elif sacct_dict["ReqMem"][-1:] == "n":
-                    logger.debug("Applying ReqMem workaround for Slurm versions < 21")
-                    sacct_dict["ReqMem"] = sacct_dict["ReqMem"][:-1]
-                job.requested_mem_str = sacct_dict["ReqMem"]
-                # if job start is "None", then the job was never despatched
-                # e.g. pending job was cancelled
-                if sacct_dict["Start"] != "None":
-                    try:
-                        job.start_ts = sacct_dict["Start"]
-                    except ValueError:
-                        logger.warning(
-                            "job %s: could not parse '%s' for job start timestamp",
-                            job.raw_id,
-                            sacct_dict["Start"],
-                        )
-                job.used_cpu_usec = get_usec_from_str(sacct_dict["TotalCPU"])
-                job.user = sacct_dict["User"]
-                job.workdir = sacct_dict["WorkDir"]
+    signature_html, signature_text = templates.signature(options.email_from_name)
 
-                if sacct_dict["TimeLimit"] == "UNLIMITED":
-                    job.wallclock = 0
-                else:
-                    try:
-                        job.wallclock = int(sacct_dict["TimelimitRaw"]) * 60
-                    except ValueError:
-                        logger.warning(
-                            "job %s: could not parse: '%s' for job time limit",
-                            job.raw_id,
-                            sacct_dict["TimelimitRaw"],
-                        )
-                        job.wallclock = 0
-
-                if len(sacct_dict["AllocTRES"]) > 0:
-                    for item in sacct_dict["AllocTRES"].split(","):
-                        key, value = item.split("=", 1)
-                        if key.lower() in options.ignore_tres_keys:
-                            continue
-                        job.add_tres(key, value)
-
-                # Get jon info from scrontrol (if it exists)
-                scontrol_dict = run_scontrol(job_id, options.scontrol_exe)
-
-                if scontrol_dict is not None:
-                    if "StdErr" in scontrol_dict:
-                        job.stderr = scontrol_dict["StdErr"]
-                    else:
-                        job.stderr = "N/A"
-
-                    if "StdOut" in scontrol_dict:
-                        job.stdout = scontrol_dict["StdOut"]
-                    else:
-                        job.stdout = "N/A"
-
-                    if "CronJob" in scontrol_dict and scontrol_dict["CronJob"] == "Yes":
-                        job.cronjob = True
-                        logger.debug("job %s: is a scron job", job.raw_id)
-                        # need to find last completed record by running sacct again but
-                        # with -D flag using a time range of the last few minutes
-
-                        cmd = "{0} -S now-1minutes -D -j {1} -P -n --fields={2}".format(
-                            options.sacct_exe, first_job_id, field_str
-                        )
-                        rc, stdout, stderr = run_command(cmd)
-                        if rc != 0:
-                            logger.error("Failed to run %s", cmd)
-                            logger.error(stdout)
-                            logger.error(stderr)
-                        else:
-                            logger.debug(stdout)
-
-                            found_completed_record = False
-
-                            # only look for completed line
-                            for line in stdout.split("\n"):
-                                data = line.split("|", (field_num - 1))
-                                if len(data) != field_num:
-                                    logger.debug("sacct field length expected: %s, found %s", field_num, len(data))
-                                    continue
-
-                                sacct_dict = {}
-                                for i in range(field_num):
-                                    sacct_dict[fields[i]] = data[i]
-
-                                if sacct_dict["State"] == "COMPLETED":
-                                    job.state = sacct_dict["State"]
-                                    job.nodelist = sacct_dict["NodeList"]
-                                    job.start_ts = sacct_dict["Start"]
-                                    job.end_ts = sacct_dict["End"]
-                                    job.cpus = int(sacct_dict["NCPUS"])
-                                    job.cpu_time = int(sacct_dict["CPUTimeRaw"])
-                                    job.used_cpu_usec = get_usec_from_str(sacct_dict["TotalCPU"])
-                                    job.exit_code = sacct_dict["ExitCode"]
-                                    if (
-                                        sacct_dict["MaxRSS"] != ""
-                                        and job.max_rss is not None
-                                        and get_kbytes_from_str(sacct_dict["MaxRSS"]) > job.max_rss
-                                    ):
-                                        job.max_rss_str = sacct_dict["MaxRSS"]
-
-                                    found_completed_record = True
-                                    break
-
-                            if not found_completed_record:
-                                logger.error("Could not find job completion record for scron job: %s", job.raw_id)
-
-                if state in ["Ended", "Failed", "Time limit reached"]:
-                    if not job.cronjob:
-                        job.state = sacct_dict["State"]
-                    try:
-                        job.end_ts = sacct_dict["End"]
-                    except ValueError:
-                        logger.warning(
-                            "job %s: could not parse: '%s' for job end timestamp",
-                            job.raw_id,
-                            sacct_dict["End"],
-                        )
-                    job.exit_code = sacct_dict["ExitCode"]
-                    if (
-                        sacct_dict["MaxRSS"] != ""
-                        and job.max_rss is not None
-                        and get_kbytes_from_str(sacct_dict["MaxRSS"]) > job.max_rss
-                    ):
-                        job.max_rss_str = sacct_dict["MaxRSS"]
-
-                job.save()
-                jobs.append(job)
-
-    if (array_summary and len(jobs) > 0) or len(jobs) == 1:
-        jobs = [jobs[0]]
-
-    if not array_summary and 0 < options.array_max_notifications < len(jobs):
-        logger.info(
-            "Asked to send notifications for %d array-jobs which exceeds the limit of"
-            " %d. Will send only send the first %d.",
-            len(jobs),
-            options.array_max_notifications,
-            options.array_max_notifications,
-        )
-        jobs = jobs[: options.array_max_notifications]
-
-    for job in jobs:
-        # Will only be one job regardless of if it is an array in the
-        # "began" state. For jobs that have ended there can be mulitple
-        # jobs objects if it is an array.
-        display_job_id = (
-            str(first_job_id)
-            if array_summary
-            else job.id
-        )
+    body_html = ""
+    body_text = ""
 
-        display_array_job_id = (
-            str(first_job_id)
-            if array_summary
-            else job.array_id
-        )
-        logger.debug("Creating template for job %s", job.raw_id)
-        tpl = Template(get_file_contents(options.html_templates["job_table"]))
-        job_table_html = tpl.substitute(
-            JOB_ID=display_job_id,
-            JOB_NAME=job.name,
-            PARTITION=job.partition,
-            START=job.start,
-            END=job.end,
-            WORKDIR=job.workdir,
-            START_TS=job.start_ts,
-            END_TS=job.end_ts,
-            ELAPSED=str(timedelta(seconds=job.elapsed)),
-            EXIT_STATE=job.state,
-            EXIT_CODE=job.exit_code,
-            ADMIN_COMMENT=job.admin_comment,
-            COMMENT=job.comment,
-            REQ_MEMORY=job.requested_mem_str,
-            MAX_MEMORY=job.max_rss_str,
-            NODES=job.nodes,
-            NODE_LIST=job.nodelist,
-            STDOUT=job.stdout,
-            STDERR=job.stderr,
-            CPU_EFFICIENCY=job.cpu_efficiency,
-            CPU_TIME=job.used_cpu_str,
-            WALLCLOCK=job.wc_string,
-            WALLCLOCK_ACCURACY=job.wc_accuracy,
-            ACCOUNT=job.account,
-        )
+    if state == "Began":
+        if job.is_array():
+            tpl_html = None  # type: ignore
+            tpl_text = None  # type: ignore
 
-        tpl = Template(get_file_contents(options.text_templates["job_table"]))
-        job_table_text = tpl.substitute(
-            JOB_ID=display_job_id,
-            JOB_NAME=job.name,
-            PARTITION=job.partition,
-            START=job.start,
-            END=job.end,
-            WORKDIR=job.workdir,
-            START_TS=job.start_ts,
-            END_TS=job.end_ts,
-            ELAPSED=str(timedelta(seconds=job.elapsed)),
-            EXIT_STATE=job.state,
-            EXIT_CODE=job.exit_code,
-            ADMIN_COMMENT=job.admin_comment,
-            COMMENT=job.comment,
-            REQ_MEMORY=job.requested_mem_str,
-            MAX_MEMORY=job.max_rss_str,
-            NODES=job.nodes,
-            NODE_LIST=job.nodelist,
-            STDOUT=job.stdout,
-            STDERR=job.stderr,
-            CPU_EFFICIENCY=job.cpu_efficiency,
-            CPU_TIME=job.used_cpu_str,
-            WALLCLOCK=job.wc_string,
-            WALLCLOCK_ACCURACY=job.wc_accuracy,
-            ACCOUNT=job.account,
-        )
+            if array_summary:
+                tpl_html = templates.html("array_summary_started")
+                tpl_text = templates.text("array_summary_started")
+            else:
+                tpl_html = templates.html("array_started")
+                tpl_text = templates.text("array_started")
 
-        logger.debug("Creating e-mail signature template")
-        tpl = Template(get_file_contents(options.html_templates["signature"]))
-        signature_html = tpl.substitute(EMAIL_FROM=options.email_from_name)
-        tpl = Template(get_file_contents(options.text_templates["signature"]))
-        signature_text = tpl.substitute(EMAIL_FROM=options.email_from_name)
+            body_html = tpl_html.substitute(
+                CSS=options.css,
+                JOB_ID=display_job_id,
+                ARRAY_JOB_ID=display_array_job_id,
+                USER=job.user_real_name,
+                JOB_TABLE=job_table_html,
+                CLUSTER=job.cluster,
+                SIGNATURE=signature_html,
+            )
 
-        body_html = ""
-        body_text = ""
+            body_text = tpl_text.substitute(
+                JOB_ID=display_job_id,
+                ARRAY_JOB_ID=display_array_job_id,
+                USER=job.user_real_name,
+                JOB_TABLE=job_table_text,
+                CLUSTER=job.cluster,
+                SIGNATURE=signature_text,
+            )
+        elif job.is_hetjob():
+            tpl_html = templates.html("hetjob_started")
+            body_html = tpl_html.substitute(
+                CSS=options.css,
+                JOB_ID=display_job_id,
+                SIGNATURE=signature_html,
+                USER=job.user_real_name,
+                JOB_TABLE=job_table_html,
+                CLUSTER=job.cluster,
+            )
+            tpl_text = templates.text("hetjob_started")
+            body_text = tpl_text.substitute(
+                JOB_ID=display_job_id,
+                SIGNATURE=signature_text,
+                USER=job.user_real_name,
+                JOB_TABLE=job_table_text,
+                CLUSTER=job.cluster,
+            )
+        else:
+            tpl_html = templates.html("started")
+            body_html = tpl_html.substitute(
+                CSS=options.css,
+                JOB_ID=display_job_id,
+                SIGNATURE=signature_html,
+                USER=job.user_real_name,
+                JOB_TABLE=job_table_html,
+                CLUSTER=job.cluster,
+            )
+            tpl_text = templates.text("started")
+            body_text = tpl_text.substitute(
+                JOB_ID=display_job_id,
+                SIGNATURE=signature_text,
+                USER=job.user_real_name,
+                JOB_TABLE=job_table_text,
+                CLUSTER=job.cluster,
+            )
+    elif state in ["Ended", "Failed", "Requeued", "Time limit reached"]:
 
-        if state == "Began":
-            if job.is_array():
-                tpl_html = None  # type: ignore
-                tpl_text = None  # type: ignore
+        tres_template_result = get_tres_tables(
+            job,
+            templates.html("tres"),
+            templates.text("tres")
+        )
 
-                if array_summary:
-                    tpl_html = Template(
-                        get_file_contents(options.html_templates["array_summary_started"])
-                    )
-                    tpl_text = Template(
-                        get_file_contents(options.text_templates["array_summary_started"])
-                    )
-                else:
-                    tpl_html = Template(
-                        get_file_contents(options.html_templates["array_started"])
-                    )
-                    tpl_text = Template(
-                        get_file_contents(options.text_templates["array_started"])
+        if job.did_start:
+            end_txt = state.lower()
+            if end_txt == "time limit reached":
+                end_txt = "reached its time limit"
+            job_output_html = ""
+            job_output_text = ""
+
+            output_files = __get_job_output_files(job, state, options)
+            if output_files:
+                tpl_html = templates.html("job_output")
+                tpl_text = templates.text("job_output")
+
+                if job_output is None:
+                    job_output = __read_job_output(
+                        job, [(f, options.tail_lines) for f in output_files], options
                     )
+                tail_outputs = job_output()
+                tail_output = tail_outputs[0]
 
-                body_html = tpl_html.substitute(
-                    CSS=options.css,
-                    JOB_ID=display_job_id,
-                    ARRAY_JOB_ID=display_array_job_id,
-                    USER=job.user_real_name,
-                    JOB_TABLE=job_table_html,
-                    CLUSTER=job.cluster,
-                    SIGNATURE=signature_html,
+                job_output_html = tpl_html.substitute(
+                    OUTPUT_LINES=options.tail_lines,
+                    OUTPUT_FILE=job.stdout,
+                    JOB_OUTPUT=tail_output,
                 )
-
-                body_text = tpl_text.substitute(
-                    JOB_ID=display_job_id,
-                    ARRAY_JOB_ID=display_array_job_id,
-                    USER=job.user_real_name,
-                    JOB_TABLE=job_table_text,
-                    CLUSTER=job.cluster,
-                    SIGNATURE=signature_text,
+                job_output_text = tpl_text.substitute(
+                    OUTPUT_LINES=options.tail_lines,
+                    OUTPUT_FILE=job.stdout,
+                    JOB_OUTPUT=tail_output,
                 )
-            elif job.is_hetjob():
-                tpl_html = Template(get_file_contents(options.html_templates["hetjob_started"]))
-                body_html = tpl_html.substitute(
-                    CSS=options.css,
-                    JOB_ID=display_job_id,
-                    SIGNATURE=signature_html,
-                    USER=job.user_real_name,
-                    JOB_TABLE=job_table_html,
-                    CLUSTER=job.cluster,
-                )
-                tpl_text = Template(get_file_contents(options.text_templates["hetjob_started"]))
-                body_text = tpl_text.substitute(
-                    JOB_ID=display_job_id,
-                    SIGNATURE=signature_text,
-                    USER=job.user_real_name,
-                    JOB_TABLE=job_table_text,
-                    CLUSTER=job.cluster,
-                )
-            else:
-                tpl_html = Template(get_file_contents(options.html_templates["started"]))
-                body_html = tpl_html.substitute(
-                    CSS=options.css,
-                    JOB_ID=display_job_id,
-                    SIGNATURE=signature_html,
-                    USER=job.user_real_name,
-                    JOB_TABLE=job_table_html,
-                    CLUSTER=job.cluster,
-                )
-                tpl_text = Template(get_file_contents(options.text_templates["started"]))
-                body_text = tpl_text.substitute(
-                    JOB_ID=display_job_id,
-                    SIGNATURE=signature_text,
-                    USER=job.user_real_name,
-                    JOB_TABLE=job_table_text,
-                    CLUSTER=job.cluster,
-                )
-        elif state in ["Ended", "Failed", "Requeued", "Time limit reached"]:
-
-            tres_template_result = get_tres_tables(
-                job,
-                options.html_templates["tres"],
-                options.text_templates["tres"]
-            )
 
-            if job.did_start:
-                end_txt = state.lower()
-                if end_txt == "time limit reached":
-                    end_txt = "reached its time limit"
-                job_output_html = ""
-                job_output_text = ""
-
-                if (
-                    options.tail_lines > 0
-                    and job.stdout not in ["?", "N/A"]
-                    and check_job_output_file_path(job.stdout)
-                ):
-                    tpl_html = Template(get_file_contents(options.html_templates["job_output"]))
-                    tpl_text = Template(get_file_contents(options.text_templates["job_output"]))
-
-                    # Drop privileges prior to tailing output
-                    os.setegid(grp.getgrnam(job.group).gr_gid)
-                    os.seteuid(pwd.getpwnam(job.user).pw_uid)
-
-                    tail_output = tail_file(
-                        job.stdout, options.tail_lines, options.tail_exe
-                    )
-
-                    job_output_html = tpl_html.substitute(
-                        OUTPUT_LINES=options.tail_lines,
-                        OUTPUT_FILE=job.stdout,
-                        JOB_OUTPUT=tail_output,
-                    )
-                    job_output_text = tpl_text.substitute(
+                if len(tail_outputs) > 1:
+                    job_output_text += tpl_text.substitute(
                         OUTPUT_LINES=options.tail_lines,
-                        OUTPUT_FILE=job.stdout,
-                        JOB_OUTPUT=tail_output,
+                        OUTPUT_FILE=job.stderr,
+                        JOB_OUTPUT=tail_outputs[1],
                     )
 
-                    if job.separate_output() and job.stderr not in ["?", "N/A", ""]:
-                        job_output_text += tpl_text.substitute(
-                            OUTPUT_LINES=options.tail_lines,
-                            OUTPUT_FILE=job.stderr,
-                            JOB_OUTPUT=tail_file(
-                                job.stderr, options.tail_lines, options.tail_exe
-                            ),
-                        )
-
-                    # Restore root privileges
-                    os.setegid(0)
-                    os.seteuid(0)
-
-                if job.is_array():
-                    if array_summary:
-                        tpl_html = Template(
-                            get_file_contents(options.html_templates["array_summary_ended"])
-                        )
-                        body_html = tpl_html.substitute(
-                            CSS=options.css,
-                            END_TXT=end_txt,
-                            JOB_ID=display_job_id,
-                            ARRAY_JOB_ID=display_array_job_id,
-                            SIGNATURE=signature_html,
-                            USER=job.user_real_name,
-                            JOB_TABLE=job_table_html,
-                            JOB_OUTPUT=job_output_html,
-                            TRES_TABLE=tres_template_result.html,
-                            CLUSTER=job.cluster,
-                        )
-                        tpl_text = Template(
-                            get_file_contents(options.text_templates["array_summary_ended"])
-                        )
-                        body_text = tpl_text.substitute(
-                            END_TXT=end_txt,
-                            JOB_ID=display_job_id,
-                            ARRAY_JOB_ID=display_array_job_id,
-                            SIGNATURE=signature_text,
-                            USER=job.user_real_name,
-                            JOB_TABLE=job_table_text,
-                            JOB_OUTPUT=job_output_text,
-                            TRES_TABLE=tres_template_result.text,
-                            CLUSTER=job.cluster,
-                        )
-                    else:
-                        tpl_html = Template(
-                            get_file_contents(options.html_templates["array_ended"])
-                        )
-                        body_html = tpl_html.substitute(
-                            CSS=options.css,
-                            END_TXT=end_txt,
-                            JOB_ID=display_job_id,
-                            ARRAY_JOB_ID=display_array_job_id,
-                            SIGNATURE=signature_html,
-                            USER=job.user_real_name,
-                            JOB_TABLE=job_table_html,
-                            TRES_TABLE=tres_template_result.html,
-                            JOB_OUTPUT=job_output_html,
-                            CLUSTER=job.cluster,
-                        )
-                        tpl_text = Template(
-                            get_file_contents(options.text_templates["array_ended"])
-                        )
-                        body_text = tpl_text.substitute(
-                            END_TXT=end_txt,
-                            JOB_ID=display_job_id,
-                            ARRAY_JOB_ID=display_array_job_id,
-                            SIGNATURE=signature_text,
-                            USER=job.user_real_name,
-                            JOB_TABLE=job_table_text,
-                            TRES_TABLE=tres_template_result.text,
-                            JOB_OUTPUT=job_output_text,
-                            CLUSTER=job.cluster,
+            if job.is_array():
+                if array_summary:
+                    array_stats_result = TemplateResult("", "")
+                    if array_stats is not None:
+                        array_stats_result = get_array_stats_tables(
+                            array_stats, templates.html("array_stats"), templates.text("array_stats")
                         )
-                elif job.is_hetjob():
-                    tpl_html = Template(get_file_contents(options.html_templates["hetjob_ended"]))
+                    tpl_html = templates.html("array_summary_ended")
                     body_html = tpl_html.substitute(
                         CSS=options.css,
                         END_TXT=end_txt,
                         JOB_ID=display_job_id,
+                        ARRAY_JOB_ID=display_array_job_id,
+                        SIGNATURE=signature_html,
                         USER=job.user_real_name,
                         JOB_TABLE=job_table_html,
                         JOB_OUTPUT=job_output_html,
                         TRES_TABLE=tres_template_result.html,
+                        ARRAY_STATS=array_stats_result.html,
                         CLUSTER=job.cluster,
-                        SIGNATURE=signature_html,
                     )
-                    tpl_text = Template(get_file_contents(options.text_templates["hetjob_ended"]))
+                    tpl_text = templates.text("array_summary_ended")
                     body_text = tpl_text.substitute(
                         END_TXT=end_txt,
                         JOB_ID=display_job_id,
+                        ARRAY_JOB_ID=display_array_job_id,
+                        SIGNATURE=signature_text,
                         USER=job.user_real_name,
                         JOB_TABLE=job_table_text,
-                        TRES_TABLE=tres_template_result.text,
                         JOB_OUTPUT=job_output_text,
+                        TRES_TABLE=tres_template_result.text,
+                        ARRAY_STATS=array_stats_result.text,
                         CLUSTER=job.cluster,
-                        SIGNATURE=signature_text,
                     )
                 else:
-                    tpl_html = Template(get_file_contents(options.html_templates["ended"]))
+                    tpl_html = templates.html("array_ended")
                     body_html = tpl_html.substitute(
                         CSS=options.css,
                         END_TXT=end_txt,
                         JOB_ID=display_job_id,
+                        ARRAY_JOB_ID=display_array_job_id,
+                        SIGNATURE=signature_html,
                         USER=job.user_real_name,
                         JOB_TABLE=job_table_html,
                         TRES_TABLE=tres_template_result.html,
                         JOB_OUTPUT=job_output_html,
                         CLUSTER=job.cluster,
-                        SIGNATURE=signature_html,
                     )
-                    tpl_text = Template(get_file_contents(options.text_templates["ended"]))
+                    tpl_text = templates.text("array_ended")
                     body_text = tpl_text.substitute(
                         END_TXT=end_txt,
                         JOB_ID=display_job_id,
+                        ARRAY_JOB_ID=display_array_job_id,
+                        SIGNATURE=signature_text,
                         USER=job.user_real_name,
                         JOB_TABLE=job_table_text,
                         TRES_TABLE=tres_template_result.text,
                         JOB_OUTPUT=job_output_text,
                         CLUSTER=job.cluster,
-                        SIGNATURE=signature_text,
                     )
+            elif job.is_hetjob():
+                tpl_html = templates.html("hetjob_ended")
+                body_html = tpl_html.substitute(
+                    CSS=options.css,
+                    END_TXT=end_txt,
+                    JOB_ID=display_job_id,
+                    USER=job.user_real_name,
+                    JOB_TABLE=job_table_html,
+                    JOB_OUTPUT=job_output_html,
+                    TRES_TABLE=tres_template_result.html,
+                    CLUSTER=job.cluster,
+                    SIGNATURE=signature_html,
+                )
+                tpl_text = templates.text("hetjob_ended")
+                body_text = tpl_text.substitute(
+                    END_TXT=end_txt,
+                    JOB_ID=display_job_id,
+                    USER=job.user_real_name,
+                    JOB_TABLE=job_table_text,
+                    TRES_TABLE=tres_template_result.text,
+                    JOB_OUTPUT=job_output_text,
+                    CLUSTER=job.cluster,
+                    SIGNATURE=signature_text,
+                )
             else:
-                # job was cancelled whilst pending
-                tpl_html = Template(get_file_contents(options.html_templates["never_ran"]))
+                tpl_html = templates.html("ended")
                 body_html = tpl_html.substitute(
                     CSS=options.css,
+                    END_TXT=end_txt,
                     JOB_ID=display_job_id,
                     USER=job.user_real_name,
                     JOB_TABLE=job_table_html,
+                    TRES_TABLE=tres_template_result.html,
+                    JOB_OUTPUT=job_output_html,
                     CLUSTER=job.cluster,
                     SIGNATURE=signature_html,
                 )
-                tpl_text = Template(get_file_contents(options.text_templates["never_ran"]))
+                tpl_text = templates.text("ended")
                 body_text = tpl_text.substitute(
+                    END_TXT=end_txt,
                     JOB_ID=display_job_id,
                     USER=job.user_real_name,
                     JOB_TABLE=job_table_text,
+                    TRES_TABLE=tres_template_result.text,
+                    JOB_OUTPUT=job_output_text,
                     CLUSTER=job.cluster,
                     SIGNATURE=signature_text,
                 )
-        elif state in ["Time reached 50%", "Time reached 80%", "Time reached 90%"]:
-            reached = int(state[-3:-1])
-            remaining = (1 - (reached / 100)) * job.wallclock
-            remaining_str = str(timedelta(seconds=remaining))
-
-            tres_template_result = get_tres_tables(
-                job,
-                options.html_templates["tres"],
-                options.text_templates["tres"]
-            )
-
-            tpl_html = Template(get_file_contents(options.html_templates["time"]))
+        else:
+            # job was cancelled whilst pending
+            tpl_html = templates.html("never_ran")
             body_html = tpl_html.substitute(
                 CSS=options.css,
-                REACHED=reached,
                 JOB_ID=display_job_id,
-                REMAINING=remaining_str,
                 USER=job.user_real_name,
                 JOB_TABLE=job_table_html,
-                TRES_TABLE=tres_template_result.html,
                 CLUSTER=job.cluster,
                 SIGNATURE=signature_html,
             )
-            tpl_text = Template(get_file_contents(options.text_templates["time"]))
+            tpl_text = templates.text("never_ran")
             body_text = tpl_text.substitute(
-                REACHED=reached,
                 JOB_ID=display_job_id,
-                REMAINING=remaining_str,
                 USER=job.user_real_name,
                 JOB_TABLE=job_table_text,
-                TRES_TABLE=tres_template_result.text,
                 CLUSTER=job.cluster,
                 SIGNATURE=signature_text,
             )
-            # change state value for upcomming e-mail send
-            state = "{0}% of time limit reached".format(reached)
-        elif state == "Invalid dependency":
-            tpl_html = Template(get_file_contents(options.html_templates["invalid_dependency"]))
-            body_html = tpl_html.substitute(
-                CSS=options.css,
-                CLUSTER=job.cluster,
-                JOB_ID=display_job_id,
-                SIGNATURE=signature_html,
-                USER=job.user_real_name,
-                JOB_TABLE=job_table_html,
-            )
-            tpl_text = Template(get_file_contents(options.text_templates["invalid_dependency"]))
-            body_text = tpl_text.substitute(
-                CLUSTER=job.cluster,
-                JOB_ID=display_job_id,
-                SIGNATURE=signature_text,
-                USER=job.user_real_name,
-                JOB_TABLE=job_table_text,
-            )
-        elif state == "Staged Out":
-            tpl_html = Template(get_file_contents(options.html_templates["staged_out"]))
-            body_html = tpl_html.substitute(
-                CSS=options.css,
-                CLUSTER=job.cluster,
-                JOB_ID=display_job_id,
-                SIGNATURE=signature_html,
-                USER=job.user_real_name,
-                JOB_TABLE=job_table_html,
-            )
-            tpl_text = Template(get_file_contents(options.text_templates["staged_out"]))
-            body_text = tpl_text.substitute(
-                CLUSTER=job.cluster,
-                JOB_ID=display_job_id,
-                SIGNATURE=signature_text,
-                USER=job.user_real_name,
-                JOB_TABLE=job_table_text,
-            )
+    elif state in ["Time reached 50%", "Time reached 80%", "Time reached 90%"]:
+        reached = int(state[-3:-1])
+        remaining = (1 - (reached / 100)) * job.wallclock
+        remaining_str = str(timedelta(seconds=remaining))
+
+        tres_template_result = get_tres_tables(
+            job,
+            templates.html("tres"),
+            templates.text("tres")
+        )
 
-        if job.cancelled:
-            subject_state = "cancelled"
-        else:
-            subject_state = state
+        tpl_html = templates.html("time")
+        body_html = tpl_html.substitute(
+            CSS=options.css,
+            REACHED=reached,
+            JOB_ID=display_job_id,
+            REMAINING=remaining_str,
+            USER=job.user_real_name,
+            JOB_TABLE=job_table_html,
+            TRES_TABLE=tres_template_result.html,
+            CLUSTER=job.cluster,
+            SIGNATURE=signature_html,
+        )
+        tpl_text = templates.text("time")
+        body_text = tpl_text.substitute(
+            REACHED=reached,
+            JOB_ID=display_job_id,
+            REMAINING=remaining_str,
+            USER=job.user_real_name,
+            JOB_TABLE=job_table_text,
+            TRES_TABLE=tres_template_result.text,
+            CLUSTER=job.cluster,
+            SIGNATURE=signature_text,
+        )
+        # change state value for upcomming e-mail send
+        state = "{0}% of time limit reached".format(reached)
+    elif state == "Invalid dependency":
+        tpl_html = templates.html("invalid_dependency")
+        body_html = tpl_html.substitute(
+            CSS=options.css,
+            CLUSTER=job.cluster,
+            JOB_ID=display_job_id,
+            SIGNATURE=signature_html,
+            USER=job.user_real_name,
+            JOB_TABLE=job_table_html,
+        )
+        tpl_text = templates.text("invalid_dependency")
+        body_text = tpl_text.substitute(
+            CLUSTER=job.cluster,
+            JOB_ID=display_job_id,
+            SIGNATURE=signature_text,
+            USER=job.user_real_name,
+            JOB_TABLE=job_table_text,
+        )
+    elif state == "Staged Out":
+        tpl_html = templates.html("staged_out")
+        body_html = tpl_html.substitute(
+            CSS=options.css,
+            CLUSTER=job.cluster,
+            JOB_ID=display_job_id,
+            SIGNATURE=signature_html,
+            USER=job.user_real_name,
+            JOB_TABLE=job_table_html,
+        )
+        tpl_text = templates.text("staged_out")
+        body_text = tpl_text.substitute(
+            CLUSTER=job.cluster,
+            JOB_ID=display_job_id,
+            SIGNATURE=signature_text,
+            USER=job.user_real_name,
+            JOB_TABLE=job_table_text,
+        )
 
-        msg = MIMEMultipart("alternative")
-        msg["Subject"] = Template(options.email_subject).substitute(
+    if job.cancelled:
+        subject_state = "cancelled"
+    else:
+        subject_state = state
+
+    msg = __create_message(
+        Template(options.email_subject).substitute(
             CLUSTER=job.cluster, JOB_ID=display_job_id, JOB_NAME=job.name, STATE=subject_state
-        )
-        msg["To"] = user_email
-        msg["From"] = options.email_from_address
-        msg["Date"] = email.utils.formatdate(localtime=True)
-        msg["Message-ID"] = email.utils.make_msgid()
-
-        # add optional headers
-        if options.email_headers:
-            for header_name, header_value in options.email_headers.items():
-                if header_name in msg:
-                    logger.warning(
-                        "Ignoring header_name %s - header is already set",
-                        header_name
-                    )
-                    continue
+        ),
+        user_email,
+        body_text,
+        body_html,
+        options,
+    )
 
-                msg[header_name] = header_value
-
-        # prefer HTML to plain text, so we add the plain text attachment first (see rfc2046 5.1.4)
-        msg.attach(MIMEText(body_text, "plain"))
-        msg.attach(MIMEText(body_html, "html"))
-        logger.info(
-            "Sending e-mail to: %s using %s for job %s (%s) via SMTP server %s:%s",
-            job.user,
-            user_email,
-            display_job_id,
-            state,
-            options.smtp_server,
-            options.smtp_port,
-        )
+    if delivery is not None:
+        delivery.submit(OutgoingMail(
+            options.email_from_address,
+            user_email.split(","),
+            msg.as_string(),
+            json_file,
+            "to: {0} using {1} for job {2} ({3})".format(job.user, user_email, display_job_id, state),
+        ))
+        return True
+
+    logger.info(
+        "Sending e-mail to: %s using %s for job %s (%s) via SMTP server %s:%s",
+        job.user,
+        user_email,
+        display_job_id,
+        state,
+        options.smtp_server,
+        options.smtp_port,
+    )
+    __send_message(msg, user_email, smtp_conn, options)
+    return False
 
-        attempt = 0
 
-        while True:
-            attempt += 1
-            try:
-                smtp_conn.sendmail(
-                    options.email_from_address, user_email.split(","), msg.as_string()
+def __create_message(
+    subject: str, user_email: str, body_text: str, body_html: str, options: ProcessSpoolFileOptions
+) -> MIMEMultipart:
+    """
+    Create an e-mail with the given plain text and HTML bodies.
+    """
+    msg = MIMEMultipart("alternative")
+    msg["Subject"] = subject
+    msg["To"] = user_email
+    msg["From"] = options.email_from_address
+    msg["Date"] = email.utils.formatdate(localtime=True)
+    msg["Message-ID"] = email.utils.make_msgid()
+
+    # add optional headers
+    if options.email_headers:
+        for header_name, header_value in options.email_headers.items():
+            if header_name in msg:
+                logger.warning(
+                    "Ignoring header_name %s - header is already set",
+                    header_name
                 )
-                break
-            except (
-                smtplib.SMTPHeloError,
-                smtplib.SMTPRecipientsRefused,
-                smtplib.SMTPSenderRefused,
-                smtplib.SMTPNotSupportedError
-            ) as e:
-                logger.error("Failed to send e-mail: %s", e)
-                if options.retry_on_failure:
-                    if options.retry_delay > 0:
-                        logger.info("Waiting %ds before trying again", options.retry_delay)
-                        sleep(options.retry_delay)
-                else:
-                    break
+                continue
 
-            if attempt == MAX_EMAIL_SEND_ATTEMPTS:
-                logger.error("Failed to send e-mail to %s after %d attempts", user_email, attempt)
-                break
+            msg[header_name] = header_value
+
+    # prefer HTML to plain text, so we add the plain text attachment first (see rfc2046 5.1.4)
+    msg.attach(MIMEText(body_text, "plain"))
+    msg.attach(MIMEText(body_html, "html"))
+    return msg
 
+
+def __send_message(msg: MIMEMultipart, user_email: str, smtp_conn: smtplib.SMTP, options: ProcessSpoolFileOptions):
+    """
+    Send the given e-mail using `smtp_conn`. Failed e-mails are not
+    retried here, the exception is raised so that the spool file can be
+    deferred (see `__retry_later`).
+    """
+    try:
+        smtp_conn.sendmail(
+            options.email_from_address, user_email.split(","), msg.as_string()
+        )
+    except (smtplib.SMTPException, OSError) as e:
+        logger.error("Failed to send e-mail to %s: %s", user_email, e)
+        # check the connection before it is used again
+        options.smtp_checked_until = 0
+        raise
+    options.smtp_checked_until = time.monotonic() + SMTP_IDLE_CHECK_SECONDS
+
+
+def __is_transient_error(error: Exception) -> bool:
+    """
+    Returns True if processing a spool file that failed with the given
+    error may succeed later. Errors from sacct, scontrol and slurmrestd
+    are always treated as temporary (see `is_transient_error`).
+    """
+    return isinstance(error, (CommandException, RestdException)) or is_transient_error(error)
+
+
+def __retry_later(json_file: SpoolItem, error: Exception, options: ProcessSpoolFileOptions, transient: bool):
+    """
+    Defer the given spool file so that it is tried again by a later run if
+    the error is transient, otherwise delete it. Spool files that have been
+    tried too many times are also deleted.
+    """
+    if transient and options.retry_on_failure and json_file.defer(str(error)):
+        return
     delete_spool_file(json_file)
 
 
-def send_mail_main():
-    # pylint: disable=too-many-branches,too-many-locals,too-many-statements
+def __read_spool_file(json_file: SpoolItem) -> Optional[Dict[str, Any]]:
     """
-    Examines the Slurm-Mail spool directory as defined in slurm-mail.conf
-    for any new e-mail notifications that have been created by
-    slurm-spool-mail.py. If any notifications are found an HTML e-mail is
-    sent to the user who has requested e-mail notification for the given
-    job. The e-mails include additional information retrieved from sacct.
+    Returns the contents of the given spool file. Spool files that are
+    invalid are deleted and None is returned.
     """
-    parser = argparse.ArgumentParser(
-        description="Send pending Slurm e-mails to users", add_help=True
-    )
-    parser.add_argument(
-        "-v",
-        "--verbose",
-        help="Turn on debug messages",
-        dest="verbose",
-        action="store_true",
+    # data is JSON encoded as of version 2.6
+    try:
+        data = json_file.read()
+    except ValueError:
+        logger.error("Could not parse JSON from: %s", json_file)
+        delete_spool_file(json_file)
+        return None
+
+    for f in ["job_id", "email", "state", "array_summary"]:
+        if f not in data:
+            logger.error("Could not find %s in %s", f, json_file)
+            delete_spool_file(json_file)
+            return None
+    return data
+
+
+def __process_spool_file(  # pylint: disable=too-many-arguments
+    json_file: SpoolItem,
+    smtp_conn: smtplib.SMTP,
+    options: ProcessSpoolFileOptions,
+    *,
+    sacct_rows: Optional[List[SacctRecord]] = None,
+    delivery: Optional[SmtpDeliveryPool] = None,
+    scontrol_arrays: Optional[Dict[str, Dict[str, Dict[str, str]]]] = None,
+    data: Optional[Dict[str, Any]] = None,
+):
+    # pylint: disable=too-many-branches,too-many-locals,too-many-statements,too-many-nested-blocks  # noqa
+    if data is None:
+        data = __read_spool_file(json_file)
+        if data is None:
+            return
+
+    first_job_id = int(data["job_id"])
+    user_email = data["email"]
+    state = data["state"]
+    array_summary = data["array_summary"]
+    # spool files written by older versions do not include this
+    slurm_env = data.get("slurm_env", {})
+
+    logger.debug("spool file content: %s", data)
+
+    resolved_email = resolve_user_email(user_email, options)
+    if resolved_email is None:
+        logger.error("Email address not valid: %s", user_email)
+        delete_spool_file(json_file)
+        return
+
+    user_email = resolved_email
+
+    if options.templates is None:
+        options.templates = TemplateRegistry(options.html_templates, options.text_templates)
+
+    if state not in [
+        "Began",
+        "Ended",
+        "Failed",
+        "Invalid dependency",
+        "Requeued",
+        "Staged Out",
+        "Time reached 50%",
+        "Time reached 80%",
+        "Time reached 90%",
+        "Time limit reached",
+    ]:
+        logger.warning(
+            "Unsupported job state: %s - no emails will be generated", state
+        )
+        delete_spool_file(json_file)
+        return
+
+    # sacct's output is read lazily so that it can be stopped as soon as
+    # enough jobs have been found
+    rows = iter_sacct([first_job_id], options) if sacct_rows is None else iter(sacct_rows)
+    array_stats = None
+    job_rows: Iterator[SacctRecord] = rows
+    if (
+        array_summary
+        and options.array_summary_stats
+        and state in ["Ended", "Failed", "Requeued", "Time limit reached"]
+    ):
+        # every task's records are aggregated as they are passed to
+        # __iter_jobs, the rest are read once the representative task has
+        # been found
+        array_stats = ArrayStatistics(first_job_id, options.array_summary_worst_tasks)
+        job_rows = array_stats.observe(rows)
+    jobs: Generator[Job, None, None] = __iter_jobs(
+        job_rows,
+        first_job_id=first_job_id,
+        state=state,
+        array_summary=array_summary,
+        slurm_env=slurm_env,
+        options=options,
+        scontrol_arrays=scontrol_arrays,
     )
-    args = parser.parse_args()
-    os.environ["SLURM_TIME_FORMAT"] = "%s"
+    sent = 0
+    queued_mails = 0
+    error: Optional[Exception] = None
+    # with a pool of output readers, the output files of the next few jobs
+    # are read while the current job's notification is rendered and sent
+    lookahead = options.output_reader_processes if options.output_readers is not None and not array_summary else 0
+    pending: Deque[Tuple[Job, Optional[Callable[[], List[str]]]]] = deque()
+
+    def send(job: Job, job_output: Optional[Callable[[], List[str]]]):
+        nonlocal array_stats, queued_mails
+        if array_stats is not None:
+            try:
+                for _ in job_rows:
+                    pass
+                array_stats.finish()
+            except (CommandException, RestdException) as e:
+                logger.warning("Sending array summary for %s without statistics: %s", first_job_id, e)
+                array_stats = None
+        if __send_job_notification(
+            job,
+            json_file,
+            state=state,
+            array_summary=array_summary,
+            first_job_id=first_job_id,
+            user_email=user_email,
+            smtp_conn=smtp_conn,
+            options=options,
+            delivery=delivery,
+            array_stats=array_stats,
+            job_output=job_output,
+        ):
+            queued_mails += 1
+
+    try:
+        for job in jobs:
+            output_files = __get_job_output_files(job, state, options) if lookahead > 0 else []
+            pending.append((
+                job,
+                __read_job_output(job, [(f, options.tail_lines) for f in output_files], options)
+                if output_files else None
+            ))
+            if len(pending) > lookahead:
+                send(*pending.popleft())
+            sent += 1
+            if array_summary:
+                logger.debug("Array summary for %s sent using representative task %s", first_job_id, job.id)
+                break
+            if 0 < options.array_max_notifications <= sent:
+                logger.info(
+                    "Reached array notification limit of %d for job %s; stopping",
+                    options.array_max_notifications,
+                    first_job_id,
+                )
+                break
+        while pending:
+            send(*pending.popleft())
+    except (CommandException, RestdException) as e:
+        logger.error(e)
+        error = e
+    except (smtplib.SMTPException, OSError) as e:
+        error = e
+    finally:
+        # stops sacct if it is still running
+        jobs.close()
+        if job_rows is not rows:
+            job_rows.close()  # type: ignore
+        if hasattr(rows, "close"):
+            rows.close()  # type: ignore
+
+    if queued_mails > 0:
+        # the spool file is deleted once its e-mails have been delivered,
+        # or retried by __handle_deliveries if the error stopped the rest
+        # of its e-mails from being queued
+        if error is not None and delivery is not None:
+            delivery.fail(json_file, error)
+        return
+    if error is not None:
+        # n.b. e-mails for array tasks that were sent before the error
+        # are sent again when the spool file is retried
+        __retry_later(json_file, error, options, __is_transient_error(error))
+    else:
+        delete_spool_file(json_file)
+
+
+def __get_send_mail_config() -> tuple:
+    # pylint: disable=too-many-branches,too-many-locals,too-many-statements
+    """
+    Read slurm-send-mail's settings from slurm-mail.conf.
 
+    Returns a tuple of the processing options, spool directory, log file
+    and verbose flag.
+    """
     options = ProcessSpoolFileOptions()
 
     check_dir(conf_dir, False)
@@ -1072,8 +1686,11 @@ def send_mail_main():
     options.html_templates = {}
     options.html_templates["array_ended"] = html_tpl_dir / "ended-array.tpl"
     options.html_templates["array_started"] = html_tpl_dir / "started-array.tpl"
+    options.html_templates["array_stats"] = html_tpl_dir / "array-stats.tpl"
     options.html_templates["array_summary_started"] = html_tpl_dir / "started-array-summary.tpl"
     options.html_templates["array_summary_ended"] = html_tpl_dir / "ended-array-summary.tpl"
+    options.html_templates["digest"] = html_tpl_dir / "digest.tpl"
+    options.html_templates["digest_job"] = html_tpl_dir / "digest-job.tpl"
     options.html_templates["ended"] = html_tpl_dir / "ended.tpl"
     options.html_templates["hetjob_started"] = html_tpl_dir / "started-hetjob.tpl"
     options.html_templates["hetjob_ended"] = html_tpl_dir / "ended-hetjob.tpl"
@@ -1090,8 +1707,11 @@ def send_mail_main():
     options.text_templates = {}
     options.text_templates["array_ended"] = text_tpl_dir / "ended-array.tpl"
     options.text_templates["array_started"] = text_tpl_dir / "started-array.tpl"
+    options.text_templates["array_stats"] = text_tpl_dir / "array-stats.tpl"
     options.text_templates["array_summary_started"] = text_tpl_dir / "started-array-summary.tpl"
     options.text_templates["array_summary_ended"] = text_tpl_dir / "ended-array-summary.tpl"
+    options.text_templates["digest"] = text_tpl_dir / "digest.tpl"
+    options.text_templates["digest_job"] = text_tpl_dir / "digest-job.tpl"
     options.text_templates["ended"] = text_tpl_dir / "ended.tpl"
     options.text_templates["hetjob_started"] = text_tpl_dir / "started-hetjob.tpl"
     options.text_templates["hetjob_ended"] = text_tpl_dir / "ended-hetjob.tpl"
@@ -1111,8 +1731,10 @@ def send_mail_main():
     for _, tpl_file in options.text_templates.items():
         check_file(tpl_file)
 
-    stylesheet = conf_dir / "style.css"
-    check_file(stylesheet)
+    options.templates = TemplateRegistry(options.html_templates, options.text_templates)
+
+    options.stylesheet = conf_dir / "style.css"
+    check_file(options.stylesheet)
 
     # Parse config file
     log_file = None
@@ -1126,6 +1748,14 @@ def send_mail_main():
             die("Could not find config section '{0}' in {1}".format(section, conf_file))
 
         spool_dir = pathlib.Path(config.get("common", "spoolDir"))
+        if config.has_option("common", "spoolBackend"):
+            spool_backend = config.get("common", "spoolBackend")
+            if spool_backend not in SPOOL_BACKENDS:
+                logger.error("spoolBackend must be one of: %s", ", ".join(SPOOL_BACKENDS))
+            else:
+                options.spool_backend = spool_backend
+        if config.has_option("common", "spoolSocket") and config.get("common", "spoolSocket"):
+            options.spool_socket = pathlib.Path(config.get("common", "spoolSocket"))
         if config.has_option(section, "logFile"):
             log_file = pathlib.Path(config.get(section, "logFile"))
         verbose = config.getboolean(section, "verbose")
@@ -1153,13 +1783,119 @@ def send_mail_main():
         options.datetime_format = config.get(section, "datetimeFormat")
         options.smtp_server = config.get(section, "smtpServer")
         options.smtp_port = config.getint(section, "smtpPort")
-        smtp_use_tls = config.getboolean(section, "smtpUseTls")
-        smtp_use_ssl = config.getboolean(section, "smtpUseSsl")
-        smtp_username = config.get(section, "smtpUserName")
-        smtp_password = config.get(section, "smtpPassword")
+        options.smtp_use_tls = config.getboolean(section, "smtpUseTls")
+        options.smtp_use_ssl = config.getboolean(section, "smtpUseSsl")
+        options.smtp_username = config.get(section, "smtpUserName")
+        options.smtp_password = config.get(section, "smtpPassword")
         options.tail_exe = pathlib.Path(config.get(section, "tailExe"))
         options.tail_lines = config.getint(section, "includeOutputLines")
         options.retry_on_failure = config.getboolean(section, "retryOnFailure")
+        if config.has_option(section, "includeOutputMaxBytes"):
+            tail_max_bytes = config.getint(section, "includeOutputMaxBytes")
+            if tail_max_bytes < 1:
+                logger.error("includeOutputMaxBytes must be greater than zero")
+            else:
+                options.tail_max_bytes = tail_max_bytes
+        if config.has_option(section, "outputReaderProcesses"):
+            output_reader_processes = config.getint(section, "outputReaderProcesses")
+            if output_reader_processes < 0:
+                logger.error("outputReaderProcesses must be greater than or equal to zero")
+            else:
+                options.output_reader_processes = output_reader_processes
+        if config.has_option(section, "coalesceEvents"):
+            options.coalesce_events = config.getboolean(section, "coalesceEvents")
+        if config.has_option(section, "coalesceRules"):
+            coalesce_rules: Dict[str, Set[str]] = {}
+            for rule in config.get(section, "coalesceRules").split(";"):
+                if not rule.strip():
+                    continue
+                state, sep, superseded = rule.partition(":")
+                if not sep:
+                    logger.error("Ignoring invalid coalesce rule: '%s'", rule.strip())
+                    continue
+                coalesce_rules[state.strip()] = {item.strip() for item in superseded.split(",") if item.strip()}
+            if coalesce_rules:
+                options.coalesce_rules = coalesce_rules
+        if config.has_option(section, "digestStates"):
+            options.digest_states = {
+                item.strip()
+                for item in config.get(section, "digestStates").split(",")
+                if item.strip()
+            }
+        if config.has_option(section, "digestUsers"):
+            options.digest_users = {
+                item.strip()
+                for item in config.get(section, "digestUsers").split(",")
+                if item.strip()
+            }
+        if config.has_option(section, "digestWindow"):
+            digest_window = config.getint(section, "digestWindow")
+            if digest_window < 0:
+                logger.error("digestWindow must be greater than or equal to zero")
+            else:
+                options.digest_window = digest_window
+        if config.has_option(section, "emailDigestSubject"):
+            options.email_digest_subject = config.get(section, "emailDigestSubject")
+        if config.has_option(section, "arraySummaryStats"):
+            options.array_summary_stats = config.getboolean(section, "arraySummaryStats")
+        if config.has_option(section, "arraySummaryWorstTasks"):
+            array_summary_worst_tasks = config.getint(section, "arraySummaryWorstTasks")
+            if array_summary_worst_tasks < 0:
+                logger.error("arraySummaryWorstTasks must be greater than or equal to zero")
+            else:
+                options.array_summary_worst_tasks = array_summary_worst_tasks
+        if config.has_option(section, "sacctBatchSize"):
+            sacct_batch_size = config.getint(section, "sacctBatchSize")
+            if sacct_batch_size < 1:
+                logger.error("sacctBatchSize must be greater than zero")
+            else:
+                options.sacct_batch_size = sacct_batch_size
+        if config.has_option(section, "smtpConnections"):
+            smtp_connections = config.getint(section, "smtpConnections")
+            if smtp_connections < 1:
+                logger.error("smtpConnections must be greater than zero")
+            else:
+                options.smtp_connections = smtp_connections
+        if config.has_option(section, "accountingBackend"):
+            accounting_backend = config.get(section, "accountingBackend").strip().lower()
+            if accounting_backend not in ["restd", "sacct", "sacct-json"]:
+                logger.error("accountingBackend must be one of 'sacct', 'sacct-json' or 'restd'")
+            else:
+                options.accounting_backend = accounting_backend
+        if options.accounting_backend == "restd":
+            options.restd_url = config.get(section, "restdUrl")
+            if config.has_option(section, "restdApiVersion"):
+                options.restd_api_version = config.get(section, "restdApiVersion")
+            if config.has_option(section, "restdToken"):
+                options.restd_token = config.get(section, "restdToken") or None
+            else:
+                options.restd_token = os.environ.get("SLURM_JWT")
+            if config.has_option(section, "restdUser"):
+                options.restd_user = config.get(section, "restdUser") or None
+            if config.has_option(section, "restdConnections"):
+                restd_connections = config.getint(section, "restdConnections")
+                if restd_connections < 1:
+                    logger.error("restdConnections must be greater than zero")
+                else:
+                    options.restd_connections = restd_connections
+        if config.has_option(section, "daemonPollInterval"):
+            daemon_poll_interval = config.getint(section, "daemonPollInterval")
+            if daemon_poll_interval < 1:
+                logger.error("daemonPollInterval must be greater than zero")
+            else:
+                options.daemon_poll_interval = daemon_poll_interval
+        if config.has_option(section, "spoolLease"):
+            spool_lease = config.getint(section, "spoolLease")
+            if spool_lease < 1:
+                logger.error("spoolLease must be greater than zero")
+            else:
+                options.spool_lease = spool_lease
+        if config.has_option(section, "spoolMaxFiles"):
+            spool_max_files = config.getint(section, "spoolMaxFiles")
+            if spool_max_files < 0:
+                logger.error("spoolMaxFiles must be greater than or equal to zero")
+            else:
+                options.spool_max_files = spool_max_files
         if config.has_option(section, "ignoreTRESKeys"):
             options.ignore_tres_keys = {
                 item.strip().lower()
@@ -1179,28 +1915,52 @@ def send_mail_main():
                 logger.error("retryDelay must be greater than or equal to zero and less than or equal to 20")
             else:
                 options.retry_delay = retry_delay
+                if retry_delay > 0:
+                    logger.warning("retryDelay is no longer used, failed e-mails are retried using retryBackoff")
+        for option, attr in [
+            ("retryBackoff", "retry_backoff"),
+            ("retryBackoffMax", "retry_backoff_max"),
+            ("retryMaxAttempts", "retry_max_attempts"),
+        ]:
+            if config.has_option(section, option):
+                value = config.getint(section, option)
+                if value < 1:
+                    logger.error("%s must be greater than zero", option)
+                else:
+                    setattr(options, attr, value)
 
     except Exception as e:
         die("Error: {0}".format(e))
 
-    log_date = "%Y/%m/%d %H:%M:%S"
-    log_format = "%(asctime)s:%(levelname)s: %(message)s"
-    log_level = logging.INFO
-    if args.verbose or verbose:
-        log_level = logging.DEBUG
-
-    if log_file:
-        check_dir(log_file.parent)
-        logging.basicConfig(
-            format=log_format, datefmt=log_date, level=log_level, filename=log_file
+    if options.tail_lines > 0 and options.output_reader_processes > 0:
+        options.output_readers = OutputReaderPool(
+            options.output_reader_processes, options.tail_max_bytes, options.tail_exe
         )
-    else:
-        logging.basicConfig(format=log_format, datefmt=log_date, level=log_level)
 
+    if options.accounting_backend == "restd":
+        try:
+            options.restd = RestdClient(
+                options.restd_url,
+                api_version=options.restd_api_version,
+                token=options.restd_token,
+                user=options.restd_user,
+                size=options.restd_connections,
+            )
+        except RestdException as e:
+            die("Error: {0}".format(e))
+
+    return options, spool_dir, log_file, verbose
+
+
+def __check_send_mail_options(options: ProcessSpoolFileOptions, spool_dir: pathlib.Path):
+    """
+    Check that the executables, stylesheet and spool directory referenced
+    by the given options are usable. Exits if they are not.
+    """
     check_file(options.tail_exe)
     check_file(options.sacct_exe)
     check_file(options.scontrol_exe)
-    options.css = get_file_contents(stylesheet)
+    options.css = get_file_contents(options.stylesheet)
 
     if not os.access(str(spool_dir), os.R_OK | os.W_OK):
         die(
@@ -1208,146 +1968,768 @@ def send_mail_main():
             "and that the directory exists.".format(spool_dir)
         )
 
-    smtp_conn = None
-    # Look for any new mail notifications in the spool dir
-    for f in spool_dir.glob("*.mail"):
+
+def __read_spool_files(spool_files: List[SpoolItem]) -> List[Tuple[SpoolItem, Dict[str, Any]]]:
+    """
+    Returns the contents of each of the given spool files that is valid.
+    """
+    spool_data = []
+    for f in spool_files:
+        try:
+            data = __read_spool_file(f)
+        except OSError as e:
+            # e.g. already processed by another instance
+            logger.warning("Failed to read %s: %s", f, e)
+            continue
+        if data is not None:
+            spool_data.append((f, data))
+    return spool_data
+
+
+def __coalesce_events(
+    spool_data: List[Tuple[SpoolItem, Dict[str, Any]]], options: ProcessSpoolFileOptions
+) -> List[Tuple[SpoolItem, Dict[str, Any]]]:
+    """
+    Delete the spool files whose events are superseded by another pending
+    event for the same job according to `options.coalesce_rules`, e.g. a
+    job's Began event when it has also Ended.
+
+    Returns the contents of the remaining spool files.
+    """
+    states: Dict[Tuple[Any, ...], Set[str]] = {}
+    for _, data in spool_data:
+        key = (data["job_id"], data["array_summary"], data["email"])
+        states.setdefault(key, set()).add(data["state"])
+
+    remaining = []
+    suppressed = 0
+    for f, data in spool_data:
+        key = (data["job_id"], data["array_summary"], data["email"])
+        superseded_by = [
+            state for state in sorted(states[key])
+            if data["state"] in options.coalesce_rules.get(state, set())
+        ]
+        if not superseded_by:
+            remaining.append((f, data))
+            continue
+        logger.info("Skipping %s: %s is superseded by %s", f, data["state"], ", ".join(superseded_by))
+        delete_spool_file(f)
+        suppressed += 1
+
+    if suppressed:
+        logger.info("Suppressed %d superseded event(s)", suppressed)
+    return remaining
+
+
+def __get_digests(
+    spool_data: List[Tuple[SpoolItem, Dict[str, Any]]], options: ProcessSpoolFileOptions
+) -> Tuple[List[Tuple[SpoolItem, Dict[str, Any]]], Dict[str, List[Tuple[SpoolItem, Dict[str, Any]]]]]:
+    """
+    Separate the spool files whose events are sent in digests from the
+    rest of the given spool files. A recipient's digest is held back until their oldest event is
+    `options.digest_window` seconds old, so that later events can be
+    added to it.
+
+    Returns the contents of the spool files that are not part of a digest
+    and the events of each digest that is due, keyed on recipient.
+    """
+    remaining: List[Tuple[SpoolItem, Dict[str, Any]]] = []
+    digests: Dict[str, List[Tuple[float, SpoolItem, Dict[str, Any]]]] = {}
+    for f, data in spool_data:
+        user_email = None
+        if data["state"] in options.digest_states:
+            user_email = resolve_user_email(data["email"], options)
+        if user_email is None or (
+            options.digest_users and data["email"] not in options.digest_users
+            and user_email not in options.digest_users
+        ):
+            # invalid e-mail addresses are reported by __process_spool_file
+            remaining.append((f, data))
+            continue
+        try:
+            enqueued = f.enqueued
+        except OSError:
+            # already processed by another instance
+            continue
+        digests.setdefault(user_email, []).append((enqueued, f, data))
+
+    due: Dict[str, List[Tuple[SpoolItem, Dict[str, Any]]]] = {}
+    now = time.time()
+    for user_email, events in digests.items():
+        events.sort(key=lambda event: event[0])
+        if now - events[0][0] < options.digest_window:
+            logger.debug("holding %d event(s) for %s until the digest window has passed", len(events), user_email)
+            continue
+        due[user_email] = [(f, data) for _, f, data in events]
+    return remaining, due
+
+
+def __send_digest(
+    user_email: str,
+    events: List[Tuple[SpoolItem, Dict[str, Any]]],
+    *,
+    smtp_conn: Optional[smtplib.SMTP],
+    options: ProcessSpoolFileOptions,
+    sacct_rows: Dict[int, List[SacctRecord]],
+    delivery: Optional[SmtpDeliveryPool],
+    scontrol_arrays: Dict[str, Dict[str, Dict[str, str]]],
+):
+    # pylint: disable=too-many-arguments,too-many-branches,too-many-locals
+    """
+    Render the given spool files' events into a single e-mail with a job
+    table for each job and send it to `user_email`. The spool files are
+    deleted once the e-mail has been sent.
+    """
+    if options.templates is None:
+        options.templates = TemplateRegistry(options.html_templates, options.text_templates)
+    templates = options.templates
+    spool_files: List[SpoolItem] = []
+    jobs_html: List[str] = []
+    jobs_text: List[str] = []
+    first_job: Optional[Job] = None
+
+    for json_file, data in events:
+        first_job_id = int(data["job_id"])
+        state = data["state"]
+        array_summary = data["array_summary"]
+        logger.info("adding %s to the digest for %s", json_file, user_email)
+        job_rows = sacct_rows.get(first_job_id)
+        rows = iter_sacct([first_job_id], options) if job_rows is None else iter(job_rows)
+        jobs: Generator[Job, None, None] = __iter_jobs(
+            rows,
+            first_job_id=first_job_id,
+            state=state,
+            array_summary=array_summary,
+            slurm_env=data.get("slurm_env", {}),
+            options=options,
+            scontrol_arrays=scontrol_arrays,
+        )
+        spool_files.append(json_file)
+        try:
+            for sent, job in enumerate(jobs, 1):
+                display_job_id = str(first_job_id) if array_summary else job.id
+                job_table_values = get_job_table_values(job, display_job_id)
+                job_values = {"CLUSTER": job.cluster, "JOB_ID": display_job_id, "JOB_NAME": job.name, "STATE": state}
+                jobs_html.append(templates.html("digest_job").substitute(
+                    JOB_TABLE=templates.html("job_table").substitute(**job_table_values), **job_values
+                ))
+                jobs_text.append(templates.text("digest_job").substitute(
+                    JOB_TABLE=templates.text("job_table").substitute(**job_table_values), **job_values
+                ))
+                if first_job is None:
+                    first_job = job
+                if array_summary or 0 < options.array_max_notifications <= sent:
+                    break
+        except (CommandException, RestdException) as e:
+            logger.error(e)
+            spool_files.remove(json_file)
+            __retry_later(json_file, e, options, True)
+        finally:
+            # stops sacct if it is still running
+            jobs.close()
+            if hasattr(rows, "close"):
+                rows.close()  # type: ignore
+
+    if first_job is None:
+        for f in spool_files:
+            delete_spool_file(f)
+        return
+
+    signature_html, signature_text = templates.signature(options.email_from_name)
+    values = {"CLUSTER": first_job.cluster, "COUNT": len(jobs_html), "USER": first_job.user_real_name}
+    msg = __create_message(
+        Template(options.email_digest_subject).substitute(**values),
+        user_email,
+        templates.text("digest").substitute(JOBS="\n".join(jobs_text), SIGNATURE=signature_text, **values),
+        templates.html("digest").substitute(
+            CSS=options.css, JOBS="\n".join(jobs_html), SIGNATURE=signature_html, **values
+        ),
+        options,
+    )
+
+    if delivery is not None:
+        delivery.submit(OutgoingMail(
+            options.email_from_address,
+            user_email.split(","),
+            msg.as_string(),
+            tuple(spool_files),
+            "to: {0} using {1} for {2} job(s) (digest)".format(first_job.user, user_email, len(jobs_html)),
+        ))
+        return
+
+    logger.info(
+        "Sending digest e-mail to: %s using %s for %d job(s) via SMTP server %s:%s",
+        first_job.user,
+        user_email,
+        len(jobs_html),
+        options.smtp_server,
+        options.smtp_port,
+    )
+    try:
+        __send_message(msg, user_email, smtp_conn, options)  # type: ignore
+    except (smtplib.SMTPException, OSError) as e:
+        transient = is_transient_error(e)
+        for f in spool_files:
+            __retry_later(f, e, options, transient)
+        return
+    for f in spool_files:
+        delete_spool_file(f)
+
+
+def __check_smtp_connection(
+    smtp_conn: Optional[smtplib.SMTP], options: ProcessSpoolFileOptions, daemon: bool
+) -> Optional[smtplib.SMTP]:
+    """
+    Returns `smtp_conn` if it is still alive, otherwise a new SMTP
+    connection. The connection is only checked with NOOP if sending the
+    last e-mail failed or it has been idle for `SMTP_IDLE_CHECK_SECONDS`.
+    If a new connection cannot be made then None is returned in daemon
+    mode, otherwise slurm-send-mail exits.
+    """
+    if smtp_conn is not None:
+        if time.monotonic() < options.smtp_checked_until:
+            return smtp_conn
+        try:
+            # check if connection is still alive
+            smtp_conn.noop()[0]  # pylint: disable=expression-not-assigned
+            options.smtp_checked_until = time.monotonic() + SMTP_IDLE_CHECK_SECONDS
+            return smtp_conn
+        except Exception as e:
+            logger.warning(
+                "SMTP connection failed:\n%s\nWill attempt to reconnect.", e
+            )
+
+    # start new connection if previous connection dies or not exists
+    try:
+        smtp_conn = get_smtp_connection(options)
+        options.smtp_checked_until = time.monotonic() + SMTP_IDLE_CHECK_SECONDS
+        return smtp_conn
+    except Exception as e:
+        if not daemon:
+            die("Failed to create SMTP connection due to:\n{0}".format(e))
+        logger.error("Failed to create SMTP connection due to:\n%s", e)
+        return None
+
+
+def __process_spool_dir(
+    spool_dir: pathlib.Path,
+    options: ProcessSpoolFileOptions,
+    smtp_conn: Optional[smtplib.SMTP] = None,
+    daemon: bool = False,
+    delivery: Optional[SmtpDeliveryPool] = None,
+) -> Tuple[Optional[smtplib.SMTP], bool]:
+    """
+    Process the pending spool files in the given directory, up to
+    `options.spool_max_files` of them if it is greater than zero.
+
+    Spool files are claimed before they are processed, so that several
+    instances of slurm-send-mail, e.g. overlapping cron runs or instances
+    on hosts that share the spool directory, never process the same spool
+    file. Claims that are not completed are released at the end of the
+    pass, and those of an instance that crashed are released after
+    `options.spool_lease` seconds.
+
+    If a delivery pool is given then e-mails are handed to it rather
+    than being sent using `smtp_conn` and this function waits for all
+    of them to be delivered before returning.
+
+    Returns the SMTP connection used so that it can be reused
+    by subsequent calls, and True if the number of spool files was
+    limited and more may be pending.
+    """
+    if options.templates is not None:
+        # pick up any changes made to the templates since the last pass
+        options.templates.refresh()
+
+    if options.deferred is None:
+        options.deferred = DeferredQueue(
+            spool_dir,
+            options.retry_backoff,
+            options.retry_backoff_max,
+            options.retry_max_attempts,
+            lease=options.spool_lease,
+        )
+
+    # Look for any new mail notifications in the spool dir, and those
+    # that failed previously and are due to be tried again
+    new_spool_files = scan_spool_dir(spool_dir, options.spool_max_files, options.spool_lease)
+    claims = [(f, claim_spool_file(f)) for f in new_spool_files + options.deferred.due()]
+    spool_files: List[SpoolItem] = [SpoolFile(lease, options.deferred) for _, lease in claims if lease is not None]
+    # and the events in the spool database if it is being used, spool
+    # files are still read as slurm-spool-mail falls back to them
+    claimed = __claim_spool_events(spool_dir, options)
+
+    try:
+        smtp_conn, completed = __process_claimed_spool_files(
+            spool_files, claimed, options, smtp_conn=smtp_conn, daemon=daemon, delivery=delivery
+        )
+        # spool files claimed by another instance count as processed
+        backlog = completed and (
+            __has_backlog([lease or f for f, lease in claims[:len(new_spool_files)]], options.spool_max_files)
+            or __has_backlog([event for event, _ in claimed], options.spool_max_files or SPOOL_DB_BATCH_SIZE)
+        )
+    finally:
+        # e.g. spool files held back for a digest or left for the next pass
+        for item in spool_files + [event for event, _ in claimed]:
+            item.release()
+    return smtp_conn, backlog
+
+
+def __process_claimed_spool_files(
+    spool_files: List[SpoolItem],
+    claimed: List[Tuple[SpoolEvent, Dict[str, Any]]],
+    options: ProcessSpoolFileOptions,
+    *,
+    smtp_conn: Optional[smtplib.SMTP],
+    daemon: bool,
+    delivery: Optional[SmtpDeliveryPool],
+) -> Tuple[Optional[smtplib.SMTP], bool]:
+    # pylint: disable=too-many-arguments,too-many-branches,too-many-locals,too-many-statements
+    """
+    Process the given claimed spool files and spool database events.
+
+    Returns the SMTP connection used, and False if processing stopped
+    early because an SMTP connection could not be made.
+    """
+    spool_contents: Dict[SpoolItem, Dict[str, Any]] = {}
+    digests: Dict[str, List[Tuple[SpoolItem, Dict[str, Any]]]] = {}
+    if claimed or options.coalesce_events or options.digest_states:
+        # each spool file is read once up front
+        spool_data = __read_spool_files(spool_files) + list(claimed)
+        if options.coalesce_events:
+            spool_data = __coalesce_events(spool_data, options)
+        if options.digest_states:
+            spool_data, digests = __get_digests(spool_data, options)
+        spool_files = [f for f, _ in spool_data]
+        spool_contents = dict(spool_data)
+        spool_job_ids = {f: int(data["job_id"]) for f, data in spool_data}
+        for events in digests.values():
+            spool_job_ids.update((f, int(data["job_id"])) for f, data in events)
+    else:
+        spool_job_ids = {f: get_spool_file_job_id(f) for f in spool_files}
+
+    # Query sacct for all pending notifications up front rather than
+    # once per spool file
+    sacct_rows = get_sacct_rows(
+        [job_id for job_id in spool_job_ids.values() if job_id is not None],
+        options
+    )
+    # scontrol output for job arrays, shared by the spool files of each task
+    scontrol_arrays: Dict[str, Dict[str, Dict[str, str]]] = {}
+
+    renewed = time.time()
+    held = [f for events in digests.values() for f, _ in events]
+
+    for i, f in enumerate(spool_files):
+        if time.time() - renewed >= options.spool_lease / 2:
+            # a long pass must not lose the claims on the spool files that
+            # are still waiting to be processed
+            __renew_claims(spool_files[i + 1:] + held)
+            renewed = time.time()
+        if not f.renew():
+            logger.warning("Skipping %s as it has been claimed by another process", f)
+            continue
         logger.info("processing: %s", f)
-        smtp_connection_ok = False
-        if smtp_conn is not None:
+        if delivery is not None:
             try:
-                # check if connection is still alive
-                smtp_conn.noop()[0]  # pylint: disable=expression-not-assigned
-                smtp_connection_ok = True
-            except Exception as e:
-                logger.warning(
-                    "SMTP connection failed:\n%s\nWill attempt to reconnect.", e
+                __process_spool_file(
+                    f,
+                    None,
+                    options,
+                    sacct_rows=sacct_rows.get(spool_job_ids[f]),
+                    delivery=delivery,
+                    scontrol_arrays=scontrol_arrays,
+                    data=spool_contents.get(f),
                 )
-                smtp_connection_ok = False
-
-        if not smtp_connection_ok or smtp_conn is None:
-            # start new connection if previous connection dies or not exists
-            # check if ssl is being requested (usually port 465)
-            try:
-                if smtp_use_ssl:
-                    smtp_conn = smtplib.SMTP_SSL(
-                        host=options.smtp_server, port=options.smtp_port, timeout=60
-                    )
-                else:
-                    smtp_conn = smtplib.SMTP(
-                        host=options.smtp_server, port=options.smtp_port, timeout=60
-                    )
-
-                if smtp_use_tls:
-                    smtp_conn.starttls()
-                if smtp_username != "" and smtp_password != "":
-                    smtp_conn.login(smtp_username, smtp_password)
             except Exception as e:
-                die("Failed to create SMTP connection due to:\n{0}".format(e))
+                logger.error("Failed to process: %s", f)
+                logger.error(e, exc_info=True)
+            __handle_deliveries(delivery.collect(), options)
+            continue
+
+        smtp_conn = __check_smtp_connection(smtp_conn, options, daemon)
+        if smtp_conn is None:
+            # leave the remaining spool files for the next pass
+            return None, False
 
         try:
-            __process_spool_file(f, smtp_conn, options)
+            __process_spool_file(
+                f,
+                smtp_conn,
+                options,
+                sacct_rows=sacct_rows.get(spool_job_ids[f]),
+                scontrol_arrays=scontrol_arrays,
+                data=spool_contents.get(f),
+            )
         except Exception as e:
             logger.error("Failed to process: %s", f)
             logger.error(e, exc_info=True)
 
+    pending_digests = list(digests.items())
+    for i, (user_email, events) in enumerate(pending_digests):
+        if time.time() - renewed >= options.spool_lease / 2:
+            __renew_claims([f for _, later in pending_digests[i + 1:] for f, _ in later])
+            renewed = time.time()
+        events = [(f, data) for f, data in events if f.renew()]
+        if not events:
+            continue
+        if delivery is None:
+            smtp_conn = __check_smtp_connection(smtp_conn, options, daemon)
+            if smtp_conn is None:
+                return None, False
+        try:
+            __send_digest(
+                user_email,
+                events,
+                smtp_conn=smtp_conn,
+                options=options,
+                sacct_rows=sacct_rows,
+                delivery=delivery,
+                scontrol_arrays=scontrol_arrays,
+            )
+        except Exception as e:
+            logger.error("Failed to send the digest for: %s", user_email)
+            logger.error(e, exc_info=True)
+        if delivery is not None:
+            __handle_deliveries(delivery.collect(), options)
+
+    if delivery is not None:
+        __handle_deliveries(delivery.wait(), options)
+
+    return smtp_conn, True
 
-def spool_mail_main():
-    # pylint: disable=too-many-locals,too-many-statements
+
+def __claim_spool_events(
+    spool_dir: pathlib.Path, options: ProcessSpoolFileOptions
+) -> List[Tuple[SpoolEvent, Dict[str, Any]]]:
     """
-    A drop in replacement for MailProg in Slurm's slurm.conf file.
-    Instead of sending an e-mail the details about the requested e-mail are
-    written to a spool directory (e.g. /var/spool/slurm-mail). Then when
-    slurm-spool-mail.py is executed it will process these files and send
-    HTML e-mails to users containing additional information about their jobs
-    compared to the default Slurm e-mails.
+    Claim a batch of events from the spool database if it is being used.
+    The database is created by slurm-spool-mail, so that it is owned by
+    the user that runs it, and until then no events are returned.
     """
-    check_file(conf_file)
-    verbose = False
+    if options.spool_backend != "sqlite":
+        return []
+    try:
+        if options.spool_db is None:
+            db_path = spool_dir / SPOOL_DB_NAME
+            if not db_path.exists():
+                logger.debug("%s does not exist yet", db_path)
+                return []
+            options.spool_db = SpoolDatabase(
+                db_path,
+                base_delay=options.retry_backoff,
+                max_delay=options.retry_backoff_max,
+                max_attempts=options.retry_max_attempts,
+                lease=options.spool_lease,
+            )
+        return options.spool_db.claim(options.spool_max_files or SPOOL_DB_BATCH_SIZE)
+    except sqlite3.Error as e:
+        logger.error("Failed to read the spool database: %s", e)
+        return []
+
+
+def __renew_claims(spool_files: List[SpoolItem]) -> int:
+    """
+    Renew the claims on the given spool files and spool database events.
+    Returns the number of them that are still claimed by this process.
+    """
+    return sum(1 for f in spool_files if f.renew())
+
+
+def __has_backlog(spool_files: List[Any], limit: int) -> bool:
+    """
+    Returns True if the number of spool files (or events) read by a pass
+    reached the given limit and some of them were processed, so more may
+    be pending. No backlog is reported if none of them were processed,
+    e.g. if they are all held for a digest.
+    """
+    return 0 < limit == len(spool_files) and any(not f.exists() for f in spool_files)
+
+
+def __run_daemon(spool_dir: pathlib.Path, options: ProcessSpoolFileOptions):
+    # pylint: disable=too-many-branches,too-many-statements
+    """
+    Process the spool directory whenever a new spool file is written to
+    it, or an event is received from slurm-spool-mail, until SIGTERM (or
+    SIGINT) is received. SIGHUP causes slurm-mail.conf to be re-read
+    before the next pass.
+    """
+    watcher = __get_spool_watcher(spool_dir, options)
+    signals = {"reload": False, "stop": False}
+
+    def receive_event(data: Dict[str, Any]):
+        # called by the receiver's threads, so the spool database
+        # connection of `options` is not used
+        spool_event(spool_dir, data, options.spool_backend, create_db=False)
+        watcher.wake()
+
+    receiver = __get_event_receiver(spool_dir, options, receive_event)
 
+    def handle_signal(signum, _frame):
+        if signum == signal.SIGHUP:
+            signals["reload"] = True
+        else:
+            signals["stop"] = True
+        watcher.wake()
+
+    previous_handlers = {
+        signum: signal.signal(signum, handle_signal)
+        for signum in [signal.SIGHUP, signal.SIGINT, signal.SIGTERM]
+    }
+    logger.info(
+        "Watching %s for new spool files (inotify %s)",
+        spool_dir,
+        "enabled" if watcher.inotify_enabled else "unavailable, polling every {0}s".format(
+            options.daemon_poll_interval
+        ),
+    )
+
+    smtp_conn = None
+    delivery = __get_delivery_pool(options)
     try:
-        section = "slurm-spool-mail"
-        config = configparser.RawConfigParser()
-        config.read(str(conf_file))
-        if not config.has_section(section):
-            die("Could not find config section '{0}' in {1}".format(section, conf_file))
-        spool_dir = config.get("common", "spoolDir")
-        log_file = pathlib.Path(config.get(section, "logFile"))
-        verbose = config.getboolean(section, "verbose")
-    except Exception as e:
-        die("Error: {0}".format(e))
+        while not signals["stop"]:
+            if signals["reload"]:
+                signals["reload"] = False
+                logger.info("Reloading %s", conf_file)
+                clear_nss_cache()
+                try:
+                    new_options, new_spool_dir, _, _ = __get_send_mail_config()
+                    __check_send_mail_options(new_options, new_spool_dir)
+                except SystemExit:
+                    logger.error("Failed to reload %s, keeping previous settings", conf_file)
+                else:
+                    if new_options.spool_socket != options.spool_socket:
+                        logger.warning("Changes to spoolSocket take effect when slurm-send-mail is restarted")
+                    __close_output_readers(options)
+                    __close_restd_client(options)
+                    __close_spool_db(options)
+                    # SMTP settings may have changed
+                    if smtp_conn is not None:
+                        __close_smtp_connection(smtp_conn)
+                        smtp_conn = None
+                    if delivery is not None:
+                        __handle_deliveries(delivery.close(), options)
+                    options = new_options
+                    if new_spool_dir != spool_dir:
+                        spool_dir = new_spool_dir
+                        watcher.close()
+                        watcher = __get_spool_watcher(spool_dir, options)
+                    delivery = __get_delivery_pool(options)
+
+            smtp_conn, backlog = __process_spool_dir(spool_dir, options, smtp_conn, daemon=True, delivery=delivery)
+
+            if not signals["stop"] and not signals["reload"] and not backlog:
+                watcher.wait()
+    finally:
+        logger.info("Shutting down")
+        if receiver is not None:
+            receiver.close()
+        if smtp_conn is not None:
+            __close_smtp_connection(smtp_conn)
+        if delivery is not None:
+            __handle_deliveries(delivery.close(), options)
+        __close_output_readers(options)
+        __close_restd_client(options)
+        __close_spool_db(options)
+        watcher.close()
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+
+
+def __get_spool_watcher(spool_dir: pathlib.Path, options: ProcessSpoolFileOptions) -> SpoolWatcher:
+    """
+    Returns a watcher for new spool files in the given spool directory
+    and its hashed sub-directories.
+    """
+    return SpoolWatcher(
+        spool_dir, options.daemon_poll_interval, subdir_re=SPOOL_SUBDIR_RE, lease_infix=SPOOL_LEASE_INFIX
+    )
 
-    check_dir(log_file.parent)
-    check_dir(pathlib.Path(spool_dir))
 
-    log_level = logging.INFO
-    if verbose:
-        log_level = logging.DEBUG
+def __get_event_receiver(
+    spool_dir: pathlib.Path, options: ProcessSpoolFileOptions, handler: Callable[[Dict[str, Any]], None]
+) -> Optional[EventReceiver]:
+    """
+    Returns a started receiver for the events sent by slurm-spool-mail if
+    spoolSocket is set or slurm-send-mail was started by systemd socket
+    activation, otherwise None. Events are only accepted from root, this
+    user and the owner of the spool directory (the user that runs
+    slurm-spool-mail).
+    """
+    if options.spool_socket is None and "LISTEN_FDS" not in os.environ:
+        return None
+    try:
+        receiver = EventReceiver(options.spool_socket, handler, {0, os.getuid(), spool_dir.stat().st_uid})
+    except (OSError, ValueError) as e:
+        logger.error("Failed to create the event receiver, only watching %s: %s", spool_dir, e)
+        return None
+    receiver.start()
+    return receiver
 
-    logging.basicConfig(
-        format="%(asctime)s:%(levelname)s: %(message)s",
-        datefmt="%Y/%m/%d %H:%M:%S",
-        level=log_level,
-        filename=log_file,
+
+def __get_delivery_pool(options: ProcessSpoolFileOptions) -> Optional[SmtpDeliveryPool]:
+    """
+    Returns a pool of SMTP connections if more than one connection
+    has been requested, otherwise None.
+    """
+    if options.smtp_connections < 2:
+        return None
+    # the pool only reconnects when a connection is lost, e-mails that are
+    # rejected are deferred by __handle_deliveries instead
+    return SmtpDeliveryPool(
+        lambda: get_smtp_connection(options),
+        options.smtp_connections,
+        max_attempts=MAX_EMAIL_SEND_ATTEMPTS,
+        retry_on_failure=False,
     )
-    logger.debug("Called with: %s", sys.argv)
 
-    if len(sys.argv) != 4:
-        die("Incorrect number of command line arguments")
 
+def __handle_deliveries(deliveries: List[SpoolFileDelivery], options: ProcessSpoolFileOptions):
+    """
+    Delete the spool files whose e-mails have all been processed by
+    a delivery pool, or defer them if any of their e-mails failed with
+    a transient error.
+    """
+    for spool_file, errors in deliveries:
+        if errors:
+            logger.error("Failed to deliver %d e-mail(s) for %s", len(errors), spool_file)
+        # digests are delivered for several spool files
+        for f in spool_file if isinstance(spool_file, tuple) else [spool_file]:
+            if errors:
+                __retry_later(f, errors[-1], options, any(__is_transient_error(e) for e in errors))
+            else:
+                delete_spool_file(f)
+
+
+def __close_output_readers(options: ProcessSpoolFileOptions):
+    """
+    Stop the output reader processes (if any) used by the given options.
+    """
+    if options.output_readers is not None:
+        options.output_readers.close()
+        options.output_readers = None
+
+
+def __close_spool_db(options: ProcessSpoolFileOptions):
+    """
+    Close the spool database (if any) used by the given options.
+    """
+    if options.spool_db is not None:
+        options.spool_db.close()
+        options.spool_db = None
+
+
+def __print_backlog(spool_dir: pathlib.Path, options: ProcessSpoolFileOptions):
+    """
+    Print the number of events in the spool database for each state and
+    recipient.
+    """
+    if options.spool_backend != "sqlite":
+        die("--backlog requires spoolBackend = sqlite")
+    db_path = spool_dir / SPOOL_DB_NAME
+    if not db_path.exists():
+        return
     try:
-        info = sys.argv[2]
-        logger.debug("info str: %s", info)
-        match = None
-        if "Array" in info:
-            match = re.search(
-                r"Slurm ((?P<array_summary>Array Summary)|Array Task)"
-                r" Job_id=[0-9]+_([0-9]+|\*)"
-                r" \((?P<job_id>[0-9]+)\).*?(?P<state>(Began|Ended|Failed|Requeued|Invalid"  # noqa
-                r" dependency|Reached time limit|Reached (?P<limit>[0-9]+)% of time"
-                r" limit|Staged Out))",
-                info,
-            )
-            if not match:
-                die("Failed to parse Slurm info.")
-            array_summary = match.group("array_summary") is not None
-        else:
-            match = re.search(
-                r"Slurm"
-                r" Job_id=(?P<job_id>[0-9]+).*?(?P<state>(Began|Ended|Failed|Requeued|Invalid"  # noqa
-                r" dependency|Reached time limit|Reached (?P<limit>[0-9]+)% of time"
-                r" limit|Staged Out))",
-                info,
-            )
-            if not match:
-                die("Failed to parse Slurm info.")
-            array_summary = False
-
-        job_id = int(match.group("job_id"))
-        email_to = sys.argv[3]
-        state = match.group("state")
-        if state == "Reached time limit":
-            state = "Time limit reached"
-        time_reached = match.group("limit")
-        if time_reached:
-            state = "Time reached {0}%".format(time_reached)
-
-        logger.debug("Job ID: %d", job_id)
-        logger.debug("State: %s", state)
-        logger.debug("Array Summary: %s", array_summary)
-        logger.debug("E-mail to: %s", email_to)
-
-        data = {
-            "job_id": job_id,
-            "state": state,
-            "email": email_to,
-            "array_summary": array_summary,
-        }
-
-        output_path = pathlib.Path(spool_dir).joinpath(
-            "{0}_{1}.mail".format(match.group("job_id"), time.time())
-        )
-        logger.info("writing file: %s", output_path)
-        with output_path.open(mode="w", encoding="utf-8") as f:
-            json.dump(data, f)
+        db = SpoolDatabase(db_path)
+        try:
+            rows = db.backlog()
+        finally:
+            db.close()
+    except sqlite3.Error as e:
+        die("Failed to read the spool database: {0}".format(e))
+    for state, email_to, count in rows:
+        print("{0}\t{1}\t{2}".format(state, email_to, count))
+
+
+def __close_restd_client(options: ProcessSpoolFileOptions):
+    """
+    Close the slurmrestd connections (if any) used by the given options.
+    """
+    if options.restd is not None:
+        options.restd.close()
+        options.restd = None
+
+
+def __close_smtp_connection(smtp_conn: smtplib.SMTP):
+    """
+    Politely close the given SMTP connection, ignoring any errors.
+    """
+    try:
+        smtp_conn.quit()
     except Exception as e:
-        logger.error(e, exc_info=True)
+        logger.debug("Failed to close SMTP connection: %s", e)
+
+
+def send_mail_main():
+    """
+    Examines the Slurm-Mail spool directory as defined in slurm-mail.conf
+    for any new e-mail notifications that have been created by
+    slurm-spool-mail.py. If any notifications are found an HTML e-mail is
+    sent to the user who has requested e-mail notification for the given
+    job. The e-mails include additional information retrieved from sacct.
+
+    When run with `--daemon` the spool directory is watched for new
+    notifications until SIGTERM is received instead of being processed once.
+    """
+    parser = argparse.ArgumentParser(
+        description="Send pending Slurm e-mails to users", add_help=True
+    )
+    parser.add_argument(
+        "-d",
+        "--daemon",
+        help="Keep running and process new spool files as they are written",
+        dest="daemon",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-b",
+        "--backlog",
+        help="Print the number of pending notifications for each state and recipient, then exit",
+        dest="backlog",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        help="Turn on debug messages",
+        dest="verbose",
+        action="store_true",
+    )
+    args = parser.parse_args()
+    os.environ["SLURM_TIME_FORMAT"] = "%s"
+
+    options, spool_dir, log_file, verbose = __get_send_mail_config()
+
+    log_date = "%Y/%m/%d %H:%M:%S"
+    log_format = "%(asctime)s:%(levelname)s: %(message)s"
+    log_level = logging.INFO
+    if args.verbose or verbose:
+        log_level = logging.DEBUG
+
+    if log_file:
+        check_dir(log_file.parent)
+        logging.basicConfig(
+            format=log_format, datefmt=log_date, level=log_level, filename=log_file
+        )
+    else:
+        logging.basicConfig(format=log_format, datefmt=log_date, level=log_level)
+
+    __check_send_mail_options(options, spool_dir)
+
+    if args.backlog:
+        __print_backlog(spool_dir, options)
+    elif args.daemon:
+        __run_daemon(spool_dir, options)
+    else:
+        delivery = __get_delivery_pool(options)
+        smtp_conn = None
+        backlog = True
+        while backlog:
+            smtp_conn, backlog = __process_spool_dir(spool_dir, options, smtp_conn, delivery=delivery)
+        if smtp_conn is not None:
+            __close_smtp_connection(smtp_conn)
+        if delivery is not None:
+            __handle_deliveries(delivery.close(), options)
+        __close_output_readers(options)
+        __close_restd_client(options)
+        __close_spool_db(options)
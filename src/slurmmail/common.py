@@ -27,18 +27,98 @@
 This module provides common functions required by Slurm-Mail.
 """
 
+import contextlib
+import grp
+import io
 import logging
 import os
 import pathlib
+import pwd
 import re
 import shlex
+import stat
 import subprocess
 import sys
+import tempfile
+import time
 
-from typing import NoReturn
+from collections import OrderedDict
+from typing import Any, Callable, Iterator, NoReturn, Optional, TextIO, Tuple
+
+from slurmmail.spoolitem import SpoolItem
 
 logger = logging.getLogger(__name__)
 
+# size of each block read when tailing a file
+TAIL_BLOCK_SIZE = 8192
+# default limit on the number of bytes returned when tailing a file
+TAIL_MAX_BYTES = 65536
+# number of seconds to wait for tailExe when it is used as a fallback
+TAIL_EXE_TIMEOUT = 10
+# maximum number of passwd/group entries to cache
+NSS_CACHE_SIZE = 1024
+# how long (in seconds) cached passwd/group entries remain valid
+NSS_CACHE_TTL = 300
+
+
+class CommandException(Exception):
+    """
+    Raised when a command started by `open_command` fails.
+    """
+
+
+class LookupCache:
+    """
+    A size bounded cache of name service lookups, e.g. pwd.getpwnam.
+    Entries expire after `ttl` seconds so that a long running process
+    picks up changes. Unknown names are cached too.
+    """
+
+    def __init__(
+        self,
+        lookup: Callable[[str], Any],
+        max_size: int = NSS_CACHE_SIZE,
+        ttl: float = NSS_CACHE_TTL,
+    ):
+        self.__entries: "OrderedDict[str, Tuple[float, Any, Optional[str]]]" = OrderedDict()
+        self.__lookup = lookup
+        self.__max_size = max_size
+        self.__ttl = ttl
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def clear(self):
+        """
+        Remove all cached entries.
+        """
+        self.__entries.clear()
+
+    def get(self, name: str) -> Any:
+        """
+        Returns the entry for the given name, raising KeyError if the
+        name is not known.
+        """
+        now = time.monotonic()
+        entry = self.__entries.get(name)
+        if entry is None or now - entry[0] >= self.__ttl:
+            try:
+                entry = (now, self.__lookup(name), None)
+            except KeyError as e:
+                entry = (now, None, str(e))
+            self.__entries[name] = entry
+            while len(self.__entries) > self.__max_size:
+                self.__entries.popitem(last=False)
+        self.__entries.move_to_end(name)
+        if entry[2] is not None:
+            raise KeyError(entry[2])
+        return entry[1]
+
+
+# pwd/grp are looked up on each call so that they can be patched
+__group_cache = LookupCache(lambda name: grp.getgrnam(name))  # pylint: disable=unnecessary-lambda
+__passwd_cache = LookupCache(lambda name: pwd.getpwnam(name))  # pylint: disable=unnecessary-lambda
+
 
 def check_dir(path: pathlib.Path, check_writeable=True):
     """
@@ -61,12 +141,25 @@ def check_file(f: pathlib.Path):
         die("{0} does not exist".format(f))
 
 
-def delete_spool_file(f: pathlib.Path):
+def clear_nss_cache():
     """
-    Delete the given file.
+    Forget all cached passwd and group entries.
+    """
+    __group_cache.clear()
+    __passwd_cache.clear()
+
+
+def delete_spool_file(f: SpoolItem):
+    """
+    Delete the given spool file or event. A spool file that has already been removed,
+    e.g. because the claim on it expired and another instance of
+    slurm-send-mail processed it, is logged rather than raising an error.
     """
     logger.info("Deleting: %s", f)
-    f.unlink()
+    try:
+        f.unlink()
+    except FileNotFoundError:
+        logger.warning("%s has already been removed", f)
 
 
 def die(msg: str) -> NoReturn:
@@ -86,6 +179,13 @@ def get_file_contents(path: pathlib.Path) -> str:
         return f.read()
 
 
+def get_group_entry(name: str) -> grp.struct_group:
+    """
+    Returns the (cached) group database entry for the given group name.
+    """
+    return __group_cache.get(name)
+
+
 def get_kbytes_from_str(value: str) -> int:
     """
     From the given Slurm memory usage input string
@@ -117,6 +217,13 @@ def get_kbytes_from_str(value: str) -> int:
     return 0
 
 
+def get_passwd_entry(name: str) -> pwd.struct_passwd:
+    """
+    Returns the (cached) password database entry for the given user name.
+    """
+    return __passwd_cache.get(name)
+
+
 def get_str_from_kbytes(value: float) -> str:
     """
     Convert the given value in KiB to a human readable
@@ -152,22 +259,131 @@ def get_usec_from_str(time_str: str) -> int:
     return usec
 
 
-def run_command(cmd: str) -> tuple:
+@contextlib.contextmanager
+def open_command(cmd: str) -> Iterator[TextIO]:
+    """
+    Execute the given command and provide its std out as a text stream
+    that can be read whilst the command is still running.
+
+    If the block is left early by an exception (including GeneratorExit
+    when a generator reading the stream is closed) the command is killed.
+    Otherwise all of std out must have been read. Raises CommandException
+    if the command fails.
+    """
+    logger.debug('Running "%s"', cmd)
+    # std err is written to a file so that the command cannot block on
+    # it whilst std out is being read
+    with tempfile.TemporaryFile() as stderr_file:
+        with subprocess.Popen(shlex.split(cmd), stdout=subprocess.PIPE, stderr=stderr_file) as process:
+            completed = False
+            try:
+                yield io.TextIOWrapper(process.stdout, encoding="utf-8")  # type: ignore
+                completed = True
+            finally:
+                if not completed:
+                    process.kill()
+            rc = process.wait()
+        if rc != 0:
+            stderr_file.seek(0)
+            raise CommandException(
+                "Failed to run {0}: {1}".format(cmd, stderr_file.read().decode("utf-8", errors="replace").strip())
+            )
+
+
+def read_last_lines(f: str, num_lines: int, max_bytes: int = TAIL_MAX_BYTES) -> Optional[str]:
+    """
+    Returns the last N lines of the given file by reading backwards from
+    the end of the file in blocks. At most `max_bytes` bytes are read, so
+    a very long final line is truncated. Bytes that are not valid UTF-8
+    are replaced.
+
+    Returns None if the file is not a regular file and so cannot be read
+    backwards.
+    """
+    # O_NONBLOCK so that opening a named pipe does not wait for a writer
+    fd = os.open(f, os.O_RDONLY | os.O_NONBLOCK)
+    file_stat = os.fstat(fd)
+    if not stat.S_ISREG(file_stat.st_mode):
+        os.close(fd)
+        return None
+    with os.fdopen(fd, "rb") as fh:
+        pos = file_stat.st_size
+        chunks = []
+        newlines = 0
+        bytes_read = 0
+        # one extra newline is needed as the file normally ends with one
+        while pos > 0 and bytes_read < max_bytes and newlines <= num_lines:
+            size = min(TAIL_BLOCK_SIZE, pos, max_bytes - bytes_read)
+            pos -= size
+            fh.seek(pos)
+            chunk = fh.read(size)
+            chunks.append(chunk)
+            bytes_read += size
+            newlines += chunk.count(b"\n")
+
+    data = b"".join(reversed(chunks))
+    end = len(data) - 1 if data.endswith(b"\n") else len(data)
+    start = end
+    for _ in range(num_lines):
+        start = data.rfind(b"\n", 0, start)
+        if start == -1:
+            break
+    data = data[start + 1:] if start >= 0 else data
+    return data.decode("utf-8", errors="replace").replace("\0", "")
+
+
+def run_command(cmd: str, timeout: Optional[float] = None) -> tuple:
     """
     Execute the given command and return a tuple that contains the
     return code, std out and std err output.
+
+    If `timeout` is given and the command has not finished after that
+    many seconds it is killed and subprocess.TimeoutExpired is raised.
     """
     logger.debug('Running "%s"', cmd)
     with subprocess.Popen(
         shlex.split(cmd), stdout=subprocess.PIPE, stderr=subprocess.PIPE
     ) as process:
-        stdout, stderr = process.communicate()
+        try:
+            stdout, stderr = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            raise
         return (process.returncode, stdout.decode("utf-8"), stderr.decode("utf-8"))
 
 
-def tail_file(f: str, num_lines: int, tail_exe: pathlib.Path) -> str:
+def __run_tail_exe(f: str, num_lines: int, max_bytes: int, tail_exe: pathlib.Path) -> str:
+    """
+    Returns the last N lines of the given file using `tail_exe`.
+    """
+    try:
+        rtn, stdout, _ = run_command(
+            "{0} -{1} '{2}'".format(tail_exe, num_lines, f), timeout=TAIL_EXE_TIMEOUT
+        )
+    except subprocess.TimeoutExpired:
+        err_msg = "slurm-mail: timed out trying to read the last {0} lines of {1}".format(num_lines, f)
+        logger.error(err_msg)
+        return err_msg
+    if rtn != 0:
+        err_msg = (
+            "slurm-mail: error trying to read "
+            "the last {0} lines of {1}".format(num_lines, f)
+        )
+        logger.error(err_msg)
+        return err_msg
+    return stdout[-max_bytes:]
+
+
+def tail_file(
+    f: str, num_lines: int, max_bytes: int = TAIL_MAX_BYTES, tail_exe: Optional[pathlib.Path] = None
+) -> str:
     """
-    Returns the last N lines of the given file.
+    Returns the last N lines of the given file, up to `max_bytes` bytes.
+
+    Only regular files are read, so that e.g. a named pipe cannot block
+    slurm-send-mail. If the file cannot be read directly then `tail_exe`
+    is used instead, if given, with a timeout of TAIL_EXE_TIMEOUT seconds.
     """
     if num_lines < 1:
         err_msg = "slurm-mail: invalid number of lines " "to tail: {0}".format(
@@ -181,14 +397,17 @@ def tail_file(f: str, num_lines: int, tail_exe: pathlib.Path) -> str:
             logger.error(err_msg)
             return err_msg
 
-        rtn, stdout, _ = run_command("{0} -{1} '{2}'".format(tail_exe, num_lines, f))
-        if rtn != 0:
-            err_msg = (
-                "slurm-mail: error trying to read "
-                "the last {0} lines of {1}".format(num_lines, f)
-            )
+        try:
+            output = read_last_lines(f, num_lines, max_bytes)
+        except OSError as e:
+            if tail_exe is None:
+                raise
+            logger.warning("Failed to read %s, using %s instead: %s", f, tail_exe, e)
+            return __run_tail_exe(f, num_lines, max_bytes, tail_exe)
+        if output is None:
+            err_msg = "slurm-mail: {0} is not a regular file".format(f)
             logger.error(err_msg)
             return err_msg
-        return stdout
+        return output
     except Exception as e:
         return "Unable to return contents of file: {0}".format(e)
@@ -0,0 +1,230 @@
+# pylint: disable=consider-using-f-string
+
+#
+#  This file is part of Slurm-Mail.
+#
+#  Slurm-Mail is a drop in replacement for Slurm's e-mails to give users
+#  much more information about their jobs compared to the standard Slurm
+#  e-mails.
+#
+#   Copyright (C) 2018-2026 Neil Munday (neil@mundayweb.com)
+#
+#  Slurm-Mail is free software: you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the
+#  Free Software Foundation, either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  Slurm-Mail is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Slurm-Mail.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""
+This module provides a queue of spool files whose e-mails could not be
+sent, e.g. because the SMTP server or slurmdbd was unavailable, so that
+they can be tried again by later runs of slurm-send-mail, and the
+`SpoolItem` for spool files claimed by slurm-send-mail.
+"""
+
+import json
+import logging
+import os
+import pathlib
+import time
+
+from typing import Any, Dict, List, Optional
+
+from slurmmail.spool import (
+    get_spool_file_time,
+    get_spool_lease_renewed,
+    is_stale_spool_lease,
+    release_spool_file,
+    renew_spool_file,
+    SPOOL_LEASE_INFIX,
+    strip_spool_lease,
+)
+from slurmmail.spoolitem import get_retry_delay, SpoolItem
+
+logger = logging.getLogger(__name__)
+
+# name of the sub-directory of the spool directory that holds the queue
+DEFERRED_DIR = "deferred"
+
+
+class DeferredQueue:
+    """
+    Holds spool files until they are due to be tried again.
+
+    Deferred spool files are moved to the `deferred` sub-directory of the
+    spool directory with the number of attempts made, the time of the next
+    attempt and the last error added to their contents. The time of the
+    next attempt also prefixes their file name, so that the files that are
+    due can be found without reading them.
+
+    The delay between attempts doubles from `base_delay` up to `max_delay`
+    seconds and is randomly reduced by up to half, so that the spool files
+    deferred by an outage are not all tried again at the same time.
+
+    If `lease` is greater than zero then deferred spool files whose claim
+    by slurm-send-mail is stale are released by `due`.
+    """
+
+    def __init__(
+        self,
+        spool_dir: pathlib.Path,
+        base_delay: int = 60,
+        max_delay: int = 3600,
+        max_attempts: int = 10,
+        lease: int = 0,
+    ):
+        self.path = spool_dir / DEFERRED_DIR
+        self.base_delay = base_delay
+        self.lease = lease
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+
+    def defer(self, spool_file: pathlib.Path, error: str) -> bool:
+        """
+        Move the given spool file to the queue. Returns False if it has
+        already been attempted `max_attempts` times, in which case it is
+        left where it is for the caller to delete.
+        """
+        try:
+            with spool_file.open() as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            # e.g. the claim on it expired and it was processed by another
+            # instance of slurm-send-mail
+            logger.warning("Not deferring %s as it has been removed", spool_file)
+            return True
+        except (OSError, ValueError) as e:
+            logger.error("Failed to read %s: %s", spool_file, e)
+            return False
+
+        attempts = data.get("attempts", 0) + 1
+        if attempts >= self.max_attempts:
+            logger.error("Giving up on %s after %d attempts: %s", spool_file, attempts, error)
+            return False
+
+        delay = self.get_delay(attempts)
+        next_attempt = int(time.time() + delay)
+        data["attempts"] = attempts
+        data["next_attempt"] = next_attempt
+        data["error"] = error
+
+        name = strip_spool_lease(spool_file.name)
+        if spool_file.parent == self.path:
+            # remove the previous attempt's prefix
+            name = name.partition("-")[2]
+        target = self.path / "{0}-{1}".format(next_attempt, name)
+        tmp_file = self.path / ".{0}.tmp".format(name)
+        try:
+            self.path.mkdir(exist_ok=True)
+            with tmp_file.open("w") as f:
+                json.dump(data, f)
+            os.replace(str(tmp_file), str(target))
+            if spool_file != target:
+                spool_file.unlink()
+        except OSError as e:
+            # leave the spool file where it is so that it is tried again
+            # by the next run
+            logger.error("Failed to defer %s: %s", spool_file, e)
+            return True
+
+        logger.warning(
+            "Deferred %s for %ds after attempt %d of %d: %s",
+            spool_file, delay, attempts, self.max_attempts, error
+        )
+        return True
+
+    def due(self, now: Optional[float] = None) -> List[pathlib.Path]:
+        """
+        Returns the deferred spool files that are due to be tried again.
+        """
+        if now is None:
+            now = time.time()
+        due = []
+        try:
+            entries = list(os.scandir(str(self.path)))
+        except FileNotFoundError:
+            return []
+        for entry in entries:
+            name = entry.name
+            if (
+                self.lease > 0
+                and SPOOL_LEASE_INFIX in name
+                and is_stale_spool_lease(name, self.lease, now, get_spool_lease_renewed(entry))
+            ):
+                logger.warning("Releasing stale claim on %s", entry.path)
+                released = release_spool_file(pathlib.Path(entry.path))
+                if released is None:
+                    continue
+                name = released.name
+            prefix, sep, _ = name.partition("-")
+            if sep and name.endswith(".mail") and prefix.isdecimal() and int(prefix) <= now:
+                due.append(self.path / name)
+        return sorted(due)
+
+    def get_delay(self, attempts: int) -> float:
+        """
+        Returns the number of seconds to wait after the given number of
+        failed attempts.
+        """
+        return get_retry_delay(attempts, self.base_delay, self.max_delay)
+
+
+class SpoolFile(SpoolItem):
+    """
+    A spool file claimed by this process (see `spool.claim_spool_file`).
+    Spool files that are deferred are moved to `deferred` if given.
+    """
+
+    def __init__(self, path: pathlib.Path, deferred: Optional[DeferredQueue] = None):
+        self.path = path
+        self.deferred = deferred
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, SpoolFile) and self.path == other.path
+
+    def __hash__(self) -> int:
+        return hash(self.path)
+
+    def __repr__(self) -> str:
+        return "SpoolFile({0!r})".format(self.path)
+
+    def __str__(self) -> str:
+        return str(self.path)
+
+    @property
+    def enqueued(self) -> float:
+        # the modification time is updated whenever the claim is renewed,
+        # so the time recorded in the spool file's name is used instead
+        if not self.path.exists():
+            raise FileNotFoundError("{0} has been removed".format(self.path))
+        return get_spool_file_time(self.path.name)
+
+    def defer(self, error: str) -> bool:
+        if self.deferred is None:
+            return False
+        return self.deferred.defer(self.path, error)
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def read(self) -> Dict[str, Any]:
+        with self.path.open() as f:
+            return json.load(f)
+
+    def release(self):
+        release_spool_file(self.path)
+
+    def renew(self) -> bool:
+        return renew_spool_file(self.path)
+
+    def unlink(self):
+        self.path.unlink()
@@ -0,0 +1,233 @@
+# pylint: disable=consider-using-f-string
+
+#
+#  This file is part of Slurm-Mail.
+#
+#  Slurm-Mail is a drop in replacement for Slurm's e-mails to give users
+#  much more information about their jobs compared to the standard Slurm
+#  e-mails.
+#
+#   Copyright (C) 2018-2026 Neil Munday (neil@mundayweb.com)
+#
+#  Slurm-Mail is free software: you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the
+#  Free Software Foundation, either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  Slurm-Mail is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Slurm-Mail.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module provides a pool of SMTP connections that deliver e-mails
+in parallel with the rendering of further e-mails.
+"""
+
+import logging
+import queue
+import smtplib
+import threading
+import time
+
+from collections import namedtuple
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+OutgoingMail = namedtuple("OutgoingMail", ["sender", "recipients", "message", "spool_file", "description"])
+SpoolFileDelivery = namedtuple("SpoolFileDelivery", ["spool_file", "errors"])
+
+# connections that have been idle for longer than this are checked
+# with NOOP before being reused
+SMTP_IDLE_CHECK_SECONDS = 30
+
+
+def is_transient_error(error: Exception) -> bool:
+    """
+    Returns True if the given error from sending an e-mail is temporary,
+    i.e. the SMTP server replied with a 4xx code or could not be reached,
+    so that sending the e-mail again later may succeed. Permanent (5xx)
+    errors return False.
+    """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(error, smtplib.SMTPException):
+        return False
+    return isinstance(error, OSError)
+
+
+class SmtpDeliveryPool:
+    # pylint: disable=too-many-instance-attributes
+    """
+    Delivers e-mails using a fixed number of worker threads, each with its
+    own SMTP connection.
+
+    E-mails are queued with `submit` and the outcome for each spool file
+    is reported by `collect` once every e-mail queued for it has either
+    been delivered or has failed.
+    """
+
+    def __init__(
+        self,
+        connection_factory: Callable[[], smtplib.SMTP],
+        size: int,
+        max_attempts: int = 3,
+        retry_on_failure: bool = True,
+        retry_delay: int = 0,
+    ):
+        """
+        Create a new pool of `size` SMTP connections. Connections are
+        created on demand using `connection_factory`.
+        """
+        self.__connection_factory = connection_factory
+        self.__max_attempts = max_attempts
+        self.__retry_on_failure = retry_on_failure
+        self.__retry_delay = retry_delay
+        self.__size = max(1, size)
+        # bounded so that rendering cannot get too far ahead of delivery
+        self.__queue: "queue.Queue[Optional[OutgoingMail]]" = queue.Queue(maxsize=self.__size * 100)
+        self.__results: "queue.Queue[tuple]" = queue.Queue()
+        self.__pending: Dict[Any, int] = {}
+        self.__errors: Dict[Any, List[Exception]] = {}
+        self.__workers: List[threading.Thread] = []
+
+    def close(self) -> List[SpoolFileDelivery]:
+        """
+        Wait for all queued e-mails to be processed, then close the
+        SMTP connections and stop the worker threads.
+        """
+        completed = self.wait()
+        for _ in self.__workers:
+            self.__queue.put(None)
+        for worker in self.__workers:
+            worker.join()
+        self.__workers = []
+        return completed
+
+    def collect(self, block: bool = False) -> List[SpoolFileDelivery]:
+        """
+        Returns the spool files whose e-mails have all been processed
+        since the last call. If `block` is True then wait until every
+        queued e-mail has been processed.
+        """
+        completed = []
+        while self.__pending:
+            try:
+                spool_file, error = self.__results.get(block=block)
+            except queue.Empty:
+                break
+            if error is not None:
+                self.__errors.setdefault(spool_file, []).append(error)
+            self.__pending[spool_file] -= 1
+            if self.__pending[spool_file] == 0:
+                del self.__pending[spool_file]
+                completed.append(
+                    SpoolFileDelivery(spool_file, self.__errors.pop(spool_file, []))
+                )
+        return completed
+
+    def fail(self, spool_file: Any, error: Exception):
+        """
+        Record an error for the given spool file, e.g. one that stopped
+        the rest of its e-mails from being queued. The error is reported
+        by `collect` along with any delivery errors once the e-mails that
+        were queued for the spool file have been processed.
+        """
+        self.__pending[spool_file] = self.__pending.get(spool_file, 0) + 1
+        self.__results.put((spool_file, error))
+
+    def submit(self, mail: OutgoingMail):
+        """
+        Queue the given e-mail for delivery. Blocks if the queue is full.
+        """
+        if not self.__workers:
+            self.__start()
+        self.__pending[mail.spool_file] = self.__pending.get(mail.spool_file, 0) + 1
+        self.__queue.put(mail)
+
+    def wait(self) -> List[SpoolFileDelivery]:
+        """
+        Wait for every queued e-mail to be processed.
+        """
+        return self.collect(block=True)
+
+    def __deliver(self, conn: Optional[smtplib.SMTP], mail: OutgoingMail, last_used: float) -> tuple:
+        """
+        Send the given e-mail, reconnecting if required. Returns a tuple
+        of the connection to use for the next e-mail and the error that
+        prevented delivery (or None).
+        """
+        error: Optional[Exception] = None
+        attempt = 0
+        while attempt < self.__max_attempts:
+            attempt += 1
+            try:
+                if conn is not None and time.monotonic() - last_used > SMTP_IDLE_CHECK_SECONDS:
+                    try:
+                        conn.noop()
+                    except Exception as e:  # pylint: disable=broad-except
+                        logger.warning("SMTP connection failed:\n%s\nWill attempt to reconnect.", e)
+                        conn = None
+                if conn is None:
+                    conn = self.__connection_factory()
+                conn.sendmail(mail.sender, mail.recipients, mail.message)
+                return conn, None
+            except (smtplib.SMTPServerDisconnected, ConnectionError) as e:
+                # the connection has gone away, reconnect for the next attempt
+                logger.warning("SMTP connection failed:\n%s\nWill attempt to reconnect.", e)
+                conn = None
+                error = e
+            except (
+                smtplib.SMTPResponseException,
+                smtplib.SMTPRecipientsRefused,
+                smtplib.SMTPNotSupportedError
+            ) as e:
+                # the server rejected the e-mail, the connection can still
+                # be used and only temporary (4xx) errors are retried
+                logger.error("Failed to send e-mail: %s", e)
+                error = e
+                if not self.__retry_on_failure or not is_transient_error(e):
+                    break
+            except Exception as e:  # pylint: disable=broad-except
+                logger.error("Failed to create SMTP connection due to:\n%s", e)
+                conn = None
+                error = e
+            if self.__retry_delay > 0 and attempt < self.__max_attempts:
+                logger.info("Waiting %ds before trying again", self.__retry_delay)
+                time.sleep(self.__retry_delay)
+
+        logger.error("Failed to send e-mail to %s after %d attempts", ",".join(mail.recipients), attempt)
+        return conn, error
+
+    def __run(self):
+        conn: Optional[smtplib.SMTP] = None
+        last_used = time.monotonic()
+        while True:
+            mail = self.__queue.get()
+            if mail is None:
+                break
+            logger.info("Sending e-mail %s", mail.description)
+            conn, error = self.__deliver(conn, mail, last_used)
+            last_used = time.monotonic()
+            self.__results.put((mail.spool_file, error))
+
+        if conn is not None:
+            try:
+                conn.quit()
+            except Exception as e:  # pylint: disable=broad-except
+                logger.debug("Failed to close SMTP connection: %s", e)
+
+    def __start(self):
+        for i in range(self.__size):
+            worker = threading.Thread(target=self.__run, name="smtp-{0}".format(i), daemon=True)
+            worker.start()
+            self.__workers.append(worker)
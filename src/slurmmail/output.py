@@ -0,0 +1,116 @@
+#
+#  This file is part of Slurm-Mail.
+#
+#  Slurm-Mail is a drop in replacement for Slurm's e-mails to give users
+#  much more information about their jobs compared to the standard Slurm
+#  e-mails.
+#
+#   Copyright (C) 2018-2026 Neil Munday (neil@mundayweb.com)
+#
+#  Slurm-Mail is free software: you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the
+#  Free Software Foundation, either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  Slurm-Mail is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Slurm-Mail.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module provides a pool of worker processes that read the output
+files of jobs with the privileges of the job's owner, so that the main
+slurm-send-mail process never has to change its own uid or gid.
+"""
+
+import logging
+import multiprocessing
+import os
+import pathlib
+import sys
+
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+from slurmmail.common import tail_file, TAIL_MAX_BYTES
+
+OUTPUT_READER_START_METHOD = (
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+logger = logging.getLogger(__name__)
+
+
+def read_job_output(
+    uid: int,
+    gid: int,
+    requests: List[Tuple[str, int]],
+    max_bytes: int = TAIL_MAX_BYTES,
+    tail_exe: Optional[pathlib.Path] = None,
+) -> List[str]:
+    """
+    Returns the tail of each (path, number of lines) request, reading
+    the files as the given user and group (see `tail_file`).
+
+    The effective uid and gid of the calling process are changed while
+    the files are read, so this must only be called from a single
+    threaded worker process.
+    """
+    orig_uid = os.geteuid()
+    orig_gid = os.getegid()
+    os.setegid(gid)
+    try:
+        os.seteuid(uid)
+        try:
+            return [tail_file(path, num_lines, max_bytes, tail_exe) for path, num_lines in requests]
+        finally:
+            os.seteuid(orig_uid)
+    finally:
+        os.setegid(orig_gid)
+
+
+class OutputReaderPool:
+    """
+    A pool of worker processes that read job output files on behalf of
+    the main process.
+    """
+
+    def __init__(self, size: int, max_bytes: int = TAIL_MAX_BYTES, tail_exe: Optional[pathlib.Path] = None):
+        """
+        Create a new pool of `size` worker processes. The processes are
+        not started until the first request is submitted.
+        """
+        self.__executor: Optional[ProcessPoolExecutor] = None
+        self.__max_bytes = max_bytes
+        self.__size = max(1, size)
+        self.__tail_exe = tail_exe
+
+    def close(self):
+        """
+        Stop the worker processes.
+        """
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=True)
+            self.__executor = None
+
+    def submit(self, uid: int, gid: int, requests: List[Tuple[str, int]]) -> "Future[List[str]]":
+        """
+        Queue a batch of (path, number of lines) read requests for the
+        given user and group. Returns a Future for the list of tails.
+        """
+        if self.__executor is None:
+            if sys.version_info >= (3, 7):
+                # the workers must not be forked from a process that is
+                # already running delivery and receiver threads
+                self.__executor = ProcessPoolExecutor(
+                    max_workers=self.__size, mp_context=multiprocessing.get_context(OUTPUT_READER_START_METHOD)
+                )
+            else:
+                self.__executor = ProcessPoolExecutor(max_workers=self.__size)
+        return self.__executor.submit(
+            read_job_output, uid, gid, requests, self.__max_bytes, self.__tail_exe
+        )
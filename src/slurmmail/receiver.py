@@ -0,0 +1,198 @@
+# pylint: disable=consider-using-f-string
+
+#
+#  This file is part of Slurm-Mail.
+#
+#  Slurm-Mail is a drop in replacement for Slurm's e-mails to give users
+#  much more information about their jobs compared to the standard Slurm
+#  e-mails.
+#
+#   Copyright (C) 2018-2026 Neil Munday (neil@mundayweb.com)
+#
+#  Slurm-Mail is free software: you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the
+#  Free Software Foundation, either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  Slurm-Mail is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Slurm-Mail.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""
+This module provides the event receiver of `slurm-send-mail --daemon`.
+
+`slurm-spool-mail` sends each event as a line of JSON over a Unix socket.
+The receiver spools the event and then replies with `SPOOL_SOCKET_ACK`,
+so an event is never only held in memory. If `slurm-spool-mail` does not
+receive the reply it spools the event itself.
+"""
+
+import json
+import logging
+import os
+import pathlib
+import socket
+import socketserver
+import stat
+import struct
+import threading
+
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from slurmmail.spool import SPOOL_SOCKET_ACK, SPOOL_STATE_RE
+
+logger = logging.getLogger(__name__)
+
+# maximum size of an event in bytes
+MAX_EVENT_SIZE = 65536
+# number of seconds to wait for a client to send its event
+RECEIVER_TIMEOUT = 5.0
+# the first file descriptor passed by systemd socket activation
+SD_LISTEN_FDS_START = 3
+# struct ucred returned by SO_PEERCRED: pid, uid, gid
+UCRED = struct.Struct("3i")
+# keys that every event must have
+EVENT_KEYS = ("job_id", "email", "state", "array_summary")
+
+
+class EventRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Reads a single event from a client of an EventReceiver.
+    """
+
+    timeout = RECEIVER_TIMEOUT
+
+    def handle(self):
+        receiver: EventReceiver = self.server.receiver  # type: ignore
+        uid = receiver.get_peer_uid(self.request)
+        if uid is not None and uid not in receiver.allowed_uids:
+            logger.error("Rejected event from uid %d", uid)
+            self.wfile.write(b"ERROR not allowed\n")
+            return
+        try:
+            line = self.rfile.readline(MAX_EVENT_SIZE + 1)
+            if not line.endswith(b"\n"):
+                raise ValueError("incomplete or too large event")
+            data = json.loads(line.decode())
+            self.__check_event(data)
+            receiver.handler(data)
+        except Exception as e:  # pylint: disable=broad-except
+            logger.error("Failed to receive event: %s", e)
+            self.wfile.write("ERROR {0}\n".format(e).encode())
+            return
+        self.wfile.write(SPOOL_SOCKET_ACK)
+
+    @staticmethod
+    def __check_event(data: Any):
+        # the same checks as the events written by slurm-spool-mail, so
+        # that other local clients cannot spool events that fail later
+        if not isinstance(data, dict) or any(key not in data for key in EVENT_KEYS):
+            raise ValueError("invalid event")
+        if not isinstance(data["job_id"], int) or isinstance(data["job_id"], bool):
+            raise ValueError("invalid job id: {0!r}".format(data["job_id"]))
+        if not isinstance(data["state"], str) or not SPOOL_STATE_RE.fullmatch(data["state"]):
+            raise ValueError("invalid state: {0!r}".format(data["state"]))
+
+
+class EventReceiver:
+    """
+    Receives events from `slurm-spool-mail` on a Unix socket, each in its
+    own thread, and passes them to `handler`. The handler must spool the
+    event before returning, as the event is acknowledged once it returns.
+
+    If `slurm-send-mail` was started by systemd socket activation then
+    the socket passed by systemd is used, otherwise a socket is created
+    at `path`. Only clients running as one of `allowed_uids` are accepted.
+    """
+
+    def __init__(
+        self,
+        path: Optional[pathlib.Path],
+        handler: Callable[[Dict[str, Any]], None],
+        allowed_uids: Iterable[int],
+    ):
+        self.allowed_uids = set(allowed_uids)
+        self.handler = handler
+        self.path: Optional[pathlib.Path] = None
+        self.__thread: Optional[threading.Thread] = None
+
+        self.__server = socketserver.ThreadingUnixStreamServer(
+            str(path or ""), EventRequestHandler, bind_and_activate=False
+        )
+        self.__server.daemon_threads = True
+        self.__server.receiver = self  # type: ignore
+        activated = self.__get_activated_socket()
+        try:
+            if activated is not None:
+                self.__server.socket.close()
+                self.__server.socket = activated
+                logger.info("Receiving events on the socket passed by systemd")
+            elif path is None:
+                raise ValueError("no socket path given")
+            else:
+                self.__remove_socket(path)
+                self.__server.server_bind()
+                self.path = path
+                # clients are checked using their credentials instead
+                os.chmod(str(path), 0o666)
+                self.__server.server_activate()
+                logger.info("Receiving events on %s", path)
+        except BaseException:
+            self.__server.server_close()
+            raise
+
+    def close(self):
+        """
+        Stop receiving events and remove the socket created by this
+        receiver.
+        """
+        if self.__thread is not None:
+            self.__server.shutdown()
+            self.__thread.join()
+            self.__thread = None
+        self.__server.server_close()
+        if self.path is not None:
+            self.__remove_socket(self.path)
+            self.path = None
+
+    @staticmethod
+    def get_peer_uid(sock: socket.socket) -> Optional[int]:
+        """
+        Returns the uid of the process connected to the given socket, or
+        None if it cannot be determined on this platform.
+        """
+        if not hasattr(socket, "SO_PEERCRED"):
+            return None
+        _, uid, _ = UCRED.unpack(sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, UCRED.size))
+        return uid
+
+    def start(self):
+        """
+        Start receiving events in a background thread.
+        """
+        self.__thread = threading.Thread(target=self.__server.serve_forever, name="event-receiver", daemon=True)
+        self.__thread.start()
+
+    @staticmethod
+    def __get_activated_socket() -> Optional[socket.socket]:
+        # see sd_listen_fds(3)
+        if os.environ.get("LISTEN_PID") != str(os.getpid()) or os.environ.get("LISTEN_FDS") != "1":
+            return None
+        for name in ["LISTEN_PID", "LISTEN_FDS", "LISTEN_FDNAMES"]:
+            os.environ.pop(name, None)
+        return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM, fileno=SD_LISTEN_FDS_START)
+
+    @staticmethod
+    def __remove_socket(path: pathlib.Path):
+        # only a stale socket is removed, never another kind of file
+        try:
+            if stat.S_ISSOCK(os.lstat(str(path)).st_mode):
+                os.unlink(str(path))
+        except FileNotFoundError:
+            pass
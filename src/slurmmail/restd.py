@@ -0,0 +1,208 @@
+# pylint: disable=consider-using-f-string
+
+#
+#  This file is part of Slurm-Mail.
+#
+#  Slurm-Mail is a drop in replacement for Slurm's e-mails to give users
+#  much more information about their jobs compared to the standard Slurm
+#  e-mails.
+#
+#   Copyright (C) 2018-2026 Neil Munday (neil@mundayweb.com)
+#
+#  Slurm-Mail is free software: you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the
+#  Free Software Foundation, either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  Slurm-Mail is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Slurm-Mail.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module provides a client for slurmrestd that retrieves job
+information over a pool of persistent HTTP(S) or Unix socket connections
+instead of running sacct and scontrol.
+"""
+
+import http.client
+import json
+import logging
+import queue
+import socket
+import ssl
+import threading
+import urllib.parse
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from slurmmail.slurmdb import get_sacct_rows_from_jobs
+
+logger = logging.getLogger(__name__)
+
+RESTD_API_VERSION = "v0.0.40"
+
+
+class RestdException(Exception):
+    """
+    Raised when slurmrestd cannot be queried.
+    """
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """
+    A HTTP connection to a server listening on a Unix socket.
+    """
+
+    def __init__(self, path: str, timeout: float):
+        super().__init__("localhost", timeout=timeout)
+        self.__path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.__path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+class RestdClient:
+    """
+    Queries slurmrestd for job information. Up to `size` connections are
+    kept open and reused between requests.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        url: str,
+        *,
+        api_version: str = RESTD_API_VERSION,
+        token: Optional[str] = None,
+        user: Optional[str] = None,
+        size: int = 2,
+        timeout: float = 30,
+    ):
+        """
+        Create a new client for the slurmrestd instance at the given URL,
+        e.g. http://localhost:6820 or unix:///run/slurmrestd/slurmrestd.socket
+        """
+        url_parts = urllib.parse.urlsplit(url)
+        if url_parts.scheme not in ["http", "https", "unix"]:
+            raise RestdException("Unsupported slurmrestd URL: {0}".format(url))
+        self.__url_parts = url_parts
+        self.__api_version = api_version
+        self.__timeout = timeout
+        self.__headers = {"Accept": "application/json"}
+        if token:
+            self.__headers["X-SLURM-USER-TOKEN"] = token
+        if user:
+            self.__headers["X-SLURM-USER-NAME"] = user
+        self.__connections: "queue.LifoQueue[http.client.HTTPConnection]" = queue.LifoQueue()
+        self.__slots = threading.BoundedSemaphore(max(1, size))
+
+    def close(self):
+        """
+        Close all idle connections.
+        """
+        while True:
+            try:
+                conn = self.__connections.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+
+    def get_sacct_rows(self, job_id: int) -> Optional[List[Dict[str, str]]]:
+        """
+        Returns the accounting records for the given job (and the tasks of
+        a job array) keyed by sacct's field names, i.e. the rows that
+        `sacct.decode_row` decodes as `SacctDecoder` decodes the output of
+        sacct. Returns an empty list if the job is not known, or None if
+        slurmrestd could not be queried.
+        """
+        data = self.__get_jobs("/slurmdb/{0}/job/{1}".format(self.__api_version, job_id))
+        if data is None:
+            return None
+        return get_sacct_rows_from_jobs(data)
+
+    def get_scontrol_values(self, job_id: int) -> Optional[Dict[str, str]]:
+        """
+        Returns the output file paths and scron status of the given job in
+        the same format as `cli.run_scontrol`, or None if the job is no
+        longer known to slurmctld.
+        """
+        data = self.__get_jobs("/slurm/{0}/job/{1}".format(self.__api_version, job_id))
+        if not data:
+            return None
+        job = data[0]
+        values = {"JobId": str(job["job_id"])}
+        for key, field in [("StdErr", "standard_error"), ("StdOut", "standard_output")]:
+            if job.get(field):
+                values[key] = job[field]
+        if job.get("cron") or "CRON_JOB" in job.get("flags", []):
+            values["CronJob"] = "Yes"
+        return values
+
+    def __connect(self) -> http.client.HTTPConnection:
+        if self.__url_parts.scheme == "unix":
+            return UnixHTTPConnection(self.__url_parts.path, self.__timeout)
+        if self.__url_parts.scheme == "https":
+            return http.client.HTTPSConnection(
+                self.__url_parts.netloc, timeout=self.__timeout, context=ssl.create_default_context()
+            )
+        return http.client.HTTPConnection(self.__url_parts.netloc, timeout=self.__timeout)
+
+    def __get(self, path: str) -> Tuple[int, bytes]:
+        """
+        Perform a GET request using a pooled connection. A request that
+        fails on a reused connection is retried once on a new connection
+        as the server may have closed the idle connection.
+        """
+        with self.__slots:
+            try:
+                conn = self.__connections.get_nowait()
+                reused = True
+            except queue.Empty:
+                conn = self.__connect()
+                reused = False
+            while True:
+                try:
+                    conn.request("GET", path, headers=self.__headers)
+                    response = conn.getresponse()
+                    body = response.read()
+                except (http.client.HTTPException, OSError):
+                    conn.close()
+                    if not reused:
+                        raise
+                    conn = self.__connect()
+                    reused = False
+                    continue
+                self.__connections.put(conn)
+                return response.status, body
+
+    def __get_jobs(self, path: str) -> Optional[List[Dict[str, Any]]]:
+        try:
+            status, body = self.__get(path)
+        except (http.client.HTTPException, OSError) as e:
+            logger.error("Failed to query slurmrestd %s: %s", path, e)
+            return None
+        try:
+            data = json.loads(body)
+        except ValueError:
+            logger.error("Invalid response from slurmrestd %s (HTTP %d)", path, status)
+            return None
+        errors = [error.get("description", "") or error.get("error", "") for error in data.get("errors", [])]
+        if any("Invalid job id" in error for error in errors):
+            # the job is not known, as when sacct returns no records
+            logger.debug("slurmrestd %s: %s", path, errors)
+            return []
+        if status != 200 or errors:
+            logger.error("slurmrestd %s failed (HTTP %d): %s", path, status, "; ".join(errors))
+            return None
+        return data.get("jobs", [])
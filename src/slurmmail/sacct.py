@@ -0,0 +1,313 @@
+#
+#  This file is part of Slurm-Mail.
+#
+#  Slurm-Mail is a drop in replacement for Slurm's e-mails to give users
+#  much more information about their jobs compared to the standard Slurm
+#  e-mails.
+#
+#   Copyright (C) 2018-2026 Neil Munday (neil@mundayweb.com)
+#
+#  Slurm-Mail is free software: you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the
+#  Free Software Foundation, either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  Slurm-Mail is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Slurm-Mail.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module decodes sacct records into typed SacctRecord tuples.
+
+A SacctDecoder is created once for a list of sacct fields. It holds the
+column index and converter of each record value, so decoding a row is a
+single pass over those converters with no per-row dictionary or regular
+expression compilation.
+"""
+
+import functools
+import logging
+import operator
+import re
+
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# possible job ID formats:
+# [0-9]+
+# [0-9]+_[0-9]+             --> job array
+# [0-9]+_\[[0-9]+-[0-9]+\]  --> job array, not started
+# [0-9]+\+[0-9]+            --> HET job
+# anything else (e.g. 1.batch) is a job step
+JOB_ID_RE = re.compile(r"([0-9]+|[0-9]+_[0-9]+|[0-9]+_\[[0-9]+-[0-9]+\]|[0-9]+\+[0-9]+)")
+DIGITS = "0123456789"
+# number of decoded values cached by the converters of values that are
+# often repeated, e.g. the TRES of each task of a job array
+CONVERTER_CACHE_SIZE = 1024
+KBYTES_UNITS = {"K": 1, "M": 1024, "G": 1048576, "T": 1073741824, "P": 1099511627776}
+KBYTES_UNITS.update({unit.lower(): multiplier for unit, multiplier in KBYTES_UNITS.items()})
+
+
+class SacctRecord(NamedTuple):
+    """
+    A decoded sacct record. Values that are not provided by sacct or that
+    could not be decoded are None.
+    """
+
+    account: str
+    admin_comment: str
+    alloc_tres: Tuple[Tuple[str, str], ...]
+    cluster: str
+    comment: str
+    cpu_time_raw: Optional[int]
+    elapsed: str
+    end: str
+    end_ts: Optional[int]
+    exit_code: str
+    group: str
+    is_job: bool
+    job_id: str
+    job_id_base: Optional[int]
+    job_id_raw: Optional[int]
+    job_id_raw_base: Optional[int]
+    job_name: str
+    max_rss: Optional[int]
+    ncpus: Optional[int]
+    nnodes: Optional[int]
+    node_list: str
+    partition: str
+    req_mem: Optional[int]
+    req_mem_per_cpu: bool
+    start: str
+    start_ts: Optional[int]
+    state: str
+    stderr: Optional[str]
+    stdout: Optional[str]
+    time_limit: str
+    time_limit_mins: Optional[int]
+    time_limit_raw: str
+    total_cpu_usec: Optional[int]
+    user: str
+    work_dir: str
+
+
+def decode_int(value: str) -> Optional[int]:
+    """
+    Returns the integer value of the given string, or None if it is not
+    an integer, e.g. "" or "Unknown".
+    """
+    # cheaper than handling ValueError for the many empty values
+    if value.isdecimal():
+        return int(value)
+    return None
+
+
+def decode_is_job_id(value: str) -> bool:
+    """
+    Returns True if the given JobId is a job rather than a job step.
+    """
+    return JOB_ID_RE.fullmatch(value) is not None
+
+
+def decode_job_id_base(value: str) -> Optional[int]:
+    """
+    Returns the numeric prefix of the given JobId or JobIdRaw, e.g. 1000
+    for 1000_5, 1000+1 or 1000.batch.
+    """
+    end = len(value) - len(value.lstrip(DIGITS))
+    if end == 0:
+        return None
+    return int(value[:end])
+
+
+@functools.lru_cache(maxsize=CONVERTER_CACHE_SIZE)
+def decode_kbytes(value: str) -> Optional[int]:
+    """
+    Returns the number of KiB of the given Slurm memory string. Slurm < 21
+    appends "c" (per CPU) or "n" (per node) to ReqMem, these suffixes are
+    ignored. Returns None for an empty or unknown ("?") value.
+    """
+    multiplier = KBYTES_UNITS.get(value[-1:])
+    if multiplier is None:
+        if value[-1:] in ("c", "n"):
+            return decode_kbytes(value[:-1])
+        if value == "" or value[-1:] == "?":
+            return None
+        if value == "0":
+            return 0
+        logger.error("decode_kbytes: unknown unit for value '%s'", value)
+        return 0
+    try:
+        return int(float(value[:-1])) * multiplier
+    except ValueError:
+        logger.error("decode_kbytes: could not parse value '%s'", value)
+        return 0
+
+
+def decode_per_cpu(value: str) -> bool:
+    """
+    Returns True if the given ReqMem value is per CPU (Slurm < 21).
+    """
+    return value[-1:] == "c"
+
+
+@functools.lru_cache(maxsize=CONVERTER_CACHE_SIZE)
+def decode_tres(value: str) -> Tuple[Tuple[str, str], ...]:
+    """
+    Returns the (name, value) pairs of the given TRES list, e.g.
+    "cpu=1,mem=500M".
+    """
+    if not value:
+        return ()
+    items = value.replace(",", "=").split("=")
+    if len(items) != 2 * (value.count(",") + 1):
+        # an item without exactly one "="
+        return tuple(tuple(item.split("=", 1)) for item in value.split(",") if "=" in item)  # type: ignore
+    return tuple(zip(items[::2], items[1::2]))
+
+
+@functools.lru_cache(maxsize=CONVERTER_CACHE_SIZE)
+def decode_usec(value: str) -> Optional[int]:
+    """
+    Returns the number of microseconds of the given Slurm elapsed time
+    string, e.g. "1-02:03:04" or "03:04.567", or None if it cannot be
+    parsed.
+    """
+    days, _, value = value.rpartition("-")
+    value, _, usec = value.partition(".")
+    parts = value.split(":")
+    try:
+        total = int(usec) if usec else 0
+        if len(parts) == 2:
+            return total + (int(parts[0]) * 60 + int(parts[1])) * 1000000
+        if len(parts) == 3:
+            total += (int(parts[0]) * 3600 + int(parts[1]) * 60 + int(parts[2])) * 1000000
+            if days:
+                total += int(days) * 86400000000
+            return total
+    except ValueError:
+        pass
+    return None
+
+
+# the sacct field and converter of each SacctRecord value
+SACCT_RECORD_COLUMNS: Dict[str, Tuple[str, Callable[[str], object]]] = {
+    "account": ("Account", str),
+    "admin_comment": ("AdminComment", str),
+    "alloc_tres": ("AllocTRES", decode_tres),
+    "cluster": ("Cluster", str),
+    "comment": ("Comment", str),
+    "cpu_time_raw": ("CPUTimeRaw", decode_int),
+    "elapsed": ("Elapsed", str),
+    "end": ("End", str),
+    "end_ts": ("End", decode_int),
+    "exit_code": ("ExitCode", str),
+    "group": ("Group", str),
+    "is_job": ("JobId", decode_is_job_id),
+    "job_id": ("JobId", str),
+    "job_id_base": ("JobId", decode_job_id_base),
+    "job_id_raw": ("JobIdRaw", decode_int),
+    "job_id_raw_base": ("JobIdRaw", decode_job_id_base),
+    "job_name": ("JobName", str),
+    "max_rss": ("MaxRSS", decode_kbytes),
+    "ncpus": ("NCPUS", decode_int),
+    "nnodes": ("NNodes", decode_int),
+    "node_list": ("NodeList", str),
+    "partition": ("Partition", str),
+    "req_mem": ("ReqMem", decode_kbytes),
+    "req_mem_per_cpu": ("ReqMem", decode_per_cpu),
+    "start": ("Start", str),
+    "start_ts": ("Start", decode_int),
+    "state": ("State", str),
+    "stderr": ("StdErr", str),
+    "stdout": ("StdOut", str),
+    "time_limit": ("TimeLimit", str),
+    "time_limit_mins": ("TimelimitRaw", decode_int),
+    "time_limit_raw": ("TimelimitRaw", str),
+    "total_cpu_usec": ("TotalCPU", decode_usec),
+    "user": ("User", str),
+    "work_dir": ("WorkDir", str),
+}
+
+
+class SacctDecoder:
+    """
+    Decodes sacct rows whose values are in the order of the given fields.
+    """
+
+    def __init__(self, fields: Sequence[str]):
+        self.fields = tuple(fields)
+        index = {field: i for i, field in enumerate(self.fields)}
+        # fields that are not provided are read from a None value that is
+        # appended to each row
+        missing = len(self.fields)
+        indexes = []
+        converters = []
+        for slot, name in enumerate(SacctRecord._fields):
+            field, converter = SACCT_RECORD_COLUMNS[name]
+            indexes.append(index.get(field, missing))
+            if field in index and converter is not str:
+                converters.append((slot, converter))
+        self.__getter = operator.itemgetter(*indexes)
+        self.__converters = tuple(converters)
+
+    def decode(self, line: str) -> Optional[SacctRecord]:
+        """
+        Decode a line of `sacct -P -n` output. Returns None if the line
+        does not have the expected number of fields.
+        """
+        field_num = len(self.fields)
+        data: List[Optional[str]] = line.split("|", field_num - 1)  # type: ignore
+        if len(data) != field_num:
+            logger.debug("sacct field length expected: %s, found %s", field_num, len(data))
+            return None
+        data.append(None)
+        return self.__decode(data)
+
+    def decode_block(self, stdout: str) -> List[SacctRecord]:
+        """
+        Decode every line of a block of `sacct -P -n` output, skipping
+        lines that do not have the expected number of fields.
+        """
+        decode = self.decode
+        return [record for record in map(decode, stdout.split("\n")) if record is not None]
+
+    def decode_values(self, data: Sequence[str]) -> SacctRecord:
+        """
+        Decode the given values, which must be in the order of the
+        decoder's fields.
+        """
+        values: List[Optional[str]] = list(data)
+        values.append(None)
+        return self.__decode(values)
+
+    def __decode(self, data: List[Optional[str]]) -> SacctRecord:
+        # values are copied into record order in one step, then only the
+        # values that are not strings are converted
+        values = list(self.__getter(data))
+        for slot, converter in self.__converters:
+            values[slot] = converter(values[slot])
+        return tuple.__new__(SacctRecord, values)  # type: ignore
+
+
+__decoders: Dict[Tuple[str, ...], SacctDecoder] = {}
+
+
+def decode_row(row: Dict[str, str]) -> SacctRecord:
+    """
+    Decode a sacct record dictionary, e.g. as returned by
+    `slurmdb.get_sacct_rows_from_jobs`. A decoder is compiled once for
+    each distinct set of keys.
+    """
+    fields = tuple(row)
+    decoder = __decoders.get(fields)
+    if decoder is None:
+        decoder = SacctDecoder(fields)
+        __decoders[fields] = decoder
+    return decoder.decode_values(list(row.values()))
@@ -27,13 +27,12 @@
 This module provides Slurm related classes.
 """
 
-import pwd
 import re
 
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+from typing import Dict, Optional
 
-from slurmmail.common import get_kbytes_from_str, get_str_from_kbytes
+from slurmmail.common import get_kbytes_from_str, get_passwd_entry, get_str_from_kbytes
 
 
 def check_job_output_file_path(path: str) -> bool:
@@ -70,8 +69,57 @@ class Job:
     # pylint: disable=too-many-instance-attributes,too-many-public-methods
     """
     Helper object to store job data
+
+    Jobs use __slots__ as large job arrays create many of them. Derived
+    values such as formatted dates are computed when first used and then
+    cached until the value they are derived from is changed.
     """
 
+    __slots__ = (
+        "__cpus",
+        "__cpu_efficiency",
+        "__cpu_time_usec",
+        "__datetime_format",
+        "__end",
+        "__end_ts",
+        "__max_rss",
+        "__max_rss_str",
+        "__requested_mem",
+        "__requested_mem_str",
+        "__start",
+        "__start_ts",
+        "__state",
+        "__tres",
+        "__used_cpu_str",
+        "__used_cpu_usec",
+        "__user",
+        "__user_real_name",
+        "__wallclock",
+        "__wc_accuracy",
+        "__wc_string",
+        "account",
+        "admin_comment",
+        "array_id",
+        "cluster",
+        "comment",
+        "cpu_time",
+        "cronjob",
+        "elapsed",
+        "exit_code",
+        "group",
+        "hetjob_id",
+        "id",
+        "index",
+        "name",
+        "nodelist",
+        "nodes",
+        "partition",
+        "raw_id",
+        "stderr",
+        "stdout",
+        "workdir",
+    )
+
     GECOS_NAME_FIELD: int = 0
     JOB_ARRAY_NOT_STARTED_RE = re.compile(r"([0-9]+)_\[[0-9]+-[0-9]+\]")
 
@@ -80,16 +128,28 @@ class Job:
         job_id: str,
         job_raw_id: int,
     ):
+        # pylint: disable=too-many-statements
         self.__cpus: Optional[int] = None
         self.__cpu_efficiency: Optional[float] = None
         self.__cpu_time_usec: Optional[int] = None
         self.__datetime_format: str = datetime_format
+        self.__end: Optional[str] = None
         self.__end_ts: Optional[int] = None
+        self.__max_rss: Optional[int] = None
+        self.__max_rss_str: Optional[str] = None
+        self.__requested_mem: Optional[int] = None
+        self.__requested_mem_str: Optional[str] = None
+        self.__start: Optional[str] = None
         self.__start_ts: Optional[int] = None
         self.__state: Optional[str] = None
         self.__tres: Dict[str, str] = {}
+        self.__used_cpu_str: Optional[str] = None
+        self.__used_cpu_usec: Optional[int] = None
+        self.__user: Optional[str] = None
+        self.__user_real_name: Optional[str] = None
         self.__wallclock: Optional[int] = None
         self.__wc_accuracy: Optional[float] = None
+        self.__wc_string: Optional[str] = None
 
         self.array_id: Optional[int] = None
         self.cluster: Optional[str] = None
@@ -97,24 +157,20 @@ class Job:
         self.comment: Optional[str] = None
         self.cpu_time: Optional[int] = None
         self.elapsed: Optional[int] = 0
-        self.exit_code: Optional[int] = None
+        self.exit_code: Optional[str] = None
         self.group: Optional[str] = None
         self.hetjob_id: Optional[int] = None
         self.id: str = job_id
         self.index: Optional[int] = None
-        self.max_rss: Optional[int] = None
         self.name: Optional[str] = None
-        self.nodelist: Optional[List[str]] = None
+        self.nodelist: Optional[str] = None
         self.nodes: Optional[int] = None
         self.partition: Optional[str] = None
         self.account: Optional[str] = None
         self.raw_id: int = job_raw_id
-        self.requested_mem: Optional[int] = None
         self.cronjob: bool = False
         self.stderr: str = "?"
         self.stdout: str = "?"
-        self.used_cpu_usec: Optional[int] = None
-        self.user: Optional[str] = None
         self.workdir: Optional[str] = None
 
         if "_" in job_id:
@@ -165,9 +221,11 @@ class Job:
 
     @property
     def end(self) -> str:
-        if self.end_ts is None:
+        if self.__end_ts is None:
             return "N/A"
-        return datetime.fromtimestamp(self.end_ts).strftime(self.__datetime_format)
+        if self.__end is None:
+            self.__end = datetime.fromtimestamp(self.__end_ts).strftime(self.__datetime_format)
+        return self.__end
 
     @property
     def end_ts(self) -> Optional[int]:
@@ -176,22 +234,45 @@ class Job:
     @end_ts.setter
     def end_ts(self, ts: int):
         self.__end_ts = int(ts)
+        self.__end = None
+
+    @property
+    def max_rss(self) -> Optional[int]:
+        return self.__max_rss
+
+    @max_rss.setter
+    def max_rss(self, value: Optional[int]):
+        self.__max_rss = value
+        self.__max_rss_str = None
 
     @property
     def max_rss_str(self) -> str:
-        if not self.max_rss:
+        if not self.__max_rss:
             return "?"
-        return get_str_from_kbytes(self.max_rss)
+        if self.__max_rss_str is None:
+            self.__max_rss_str = get_str_from_kbytes(self.__max_rss)
+        return self.__max_rss_str
 
     @max_rss_str.setter
     def max_rss_str(self, value: str):
         self.max_rss = get_kbytes_from_str(value)
 
+    @property
+    def requested_mem(self) -> Optional[int]:
+        return self.__requested_mem
+
+    @requested_mem.setter
+    def requested_mem(self, value: Optional[int]):
+        self.__requested_mem = value
+        self.__requested_mem_str = None
+
     @property
     def requested_mem_str(self) -> str:
-        if not self.requested_mem:
+        if not self.__requested_mem:
             return "N/A"
-        return get_str_from_kbytes(self.requested_mem)
+        if self.__requested_mem_str is None:
+            self.__requested_mem_str = get_str_from_kbytes(self.__requested_mem)
+        return self.__requested_mem_str
 
     @requested_mem_str.setter
     def requested_mem_str(self, value: str):
@@ -202,9 +283,11 @@ class Job:
 
     @property
     def start(self) -> str:
-        if self.start_ts is None:
+        if self.__start_ts is None:
             return "N/A"
-        return datetime.fromtimestamp(self.start_ts).strftime(self.__datetime_format)
+        if self.__start is None:
+            self.__start = datetime.fromtimestamp(self.__start_ts).strftime(self.__datetime_format)
+        return self.__start
 
     @property
     def start_ts(self) -> Optional[int]:
@@ -213,6 +296,7 @@ class Job:
     @start_ts.setter
     def start_ts(self, ts: int):
         self.__start_ts = int(ts)
+        self.__start = None
 
     @property
     def state(self) -> Optional[str]:
@@ -231,17 +315,39 @@ class Job:
 
     @property
     def used_cpu_str(self) -> Optional[str]:
-        if self.used_cpu_usec is not None:
-            return str(timedelta(seconds=self.used_cpu_usec / 1000000))
-        return None
+        if self.__used_cpu_usec is None:
+            return None
+        if self.__used_cpu_str is None:
+            self.__used_cpu_str = str(timedelta(seconds=self.__used_cpu_usec / 1000000))
+        return self.__used_cpu_str
+
+    @property
+    def used_cpu_usec(self) -> Optional[int]:
+        return self.__used_cpu_usec
+
+    @used_cpu_usec.setter
+    def used_cpu_usec(self, value: Optional[int]):
+        self.__used_cpu_usec = value
+        self.__used_cpu_str = None
+
+    @property
+    def user(self) -> Optional[str]:
+        return self.__user
+
+    @user.setter
+    def user(self, value: Optional[str]):
+        self.__user = value
+        self.__user_real_name = None
 
     @property
     def user_real_name(self) -> Optional[str]:
-        if self.user is None:
+        if self.__user is None:
             return None
-        pw = pwd.getpwnam(self.user)
-        name = pw.pw_gecos.split(",", maxsplit=1)[Job.GECOS_NAME_FIELD].strip()
-        return name or self.user
+        if self.__user_real_name is None:
+            pw = get_passwd_entry(self.__user)
+            name = pw.pw_gecos.split(",", maxsplit=1)[Job.GECOS_NAME_FIELD].strip()
+            self.__user_real_name = name or self.__user
+        return self.__user_real_name
 
     @property
     def wallclock(self) -> Optional[int]:
@@ -250,6 +356,7 @@ class Job:
     @wallclock.setter
     def wallclock(self, w: int):
         self.__wallclock = int(w)
+        self.__wc_string = None
 
     @property
     def wc_accuracy(self) -> str:
@@ -259,11 +366,14 @@ class Job:
 
     @property
     def wc_string(self) -> str:
-        if self.wallclock is None:
+        if self.__wallclock is None:
             raise JobException("Wallclock is None")
-        if self.wallclock == 0:
-            return "Unlimited"
-        return str(timedelta(seconds=self.wallclock))
+        if self.__wc_string is None:
+            if self.__wallclock == 0:
+                self.__wc_string = "Unlimited"
+            else:
+                self.__wc_string = str(timedelta(seconds=self.__wallclock))
+        return self.__wc_string
 
     # functions
 
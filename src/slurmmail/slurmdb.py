@@ -0,0 +1,379 @@
+# pylint: disable=consider-using-f-string
+
+#
+#  This file is part of Slurm-Mail.
+#
+#  Slurm-Mail is a drop in replacement for Slurm's e-mails to give users
+#  much more information about their jobs compared to the standard Slurm
+#  e-mails.
+#
+#   Copyright (C) 2018-2026 Neil Munday (neil@mundayweb.com)
+#
+#  Slurm-Mail is free software: you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the
+#  Free Software Foundation, either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  Slurm-Mail is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Slurm-Mail.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module converts job records in the JSON format used by Slurm's
+accounting database (as returned by slurmrestd's /slurmdb endpoints and
+`sacct --json`) into the same records that are produced by parsing the
+output of `sacct -P`, so that either source can be used to populate a
+Job.
+"""
+
+import json
+import re
+
+from typing import Any, Dict, Iterator, List, Optional, TextIO
+
+MEMORY_UNITS = ["M", "G", "T", "P"]
+# number of characters read from a stream at a time
+JSON_READ_SIZE = 65536
+JSON_WHITESPACE_RE = re.compile(r"\s*")
+
+
+def __get_number(value: Any) -> Optional[int]:
+    """
+    Returns the integer value of a (possibly unset) number. Older versions
+    of the API use plain integers, newer versions use a dictionary with
+    "set", "infinite" and "number" keys. Returns None if the number is
+    infinite.
+    """
+    if isinstance(value, dict):
+        if value.get("infinite", False):
+            return None
+        if not value.get("set", True):
+            return 0
+        return int(value.get("number", 0))
+    if value is None or value == "":
+        return 0
+    return int(value)
+
+
+def __get_state(value: Any) -> str:
+    """
+    Returns the job state, which is a string in older versions of the
+    API and a list of flags in newer versions.
+    """
+    if isinstance(value, dict):
+        value = value.get("current", "")
+    if isinstance(value, list):
+        return value[0] if value else ""
+    return str(value)
+
+
+def __get_timestamp(value: Any) -> str:
+    timestamp = __get_number(value)
+    if not timestamp:
+        return "Unknown"
+    return str(timestamp)
+
+
+def __get_duration_str(seconds: int) -> str:
+    """
+    Format a duration in seconds the same way as sacct.
+    """
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if days > 0:
+        return "{0}-{1:02d}:{2:02d}:{3:02d}".format(days, hours, minutes, seconds)
+    return "{0:02d}:{1:02d}:{2:02d}".format(hours, minutes, seconds)
+
+
+def __get_cpu_time_str(seconds: int, usec: int) -> str:
+    """
+    Format a CPU time the same way as sacct's TotalCPU field.
+    """
+    if seconds >= 3600:
+        return __get_duration_str(seconds)
+    minutes, seconds = divmod(seconds, 60)
+    return "{0:02d}:{1:02d}.{2:03d}".format(minutes, seconds, usec // 1000)
+
+
+def __get_memory_str(mbytes: int) -> str:
+    """
+    Format a number of MiB the same way as sacct, only converting to a
+    larger unit if the conversion is exact.
+    """
+    unit = 0
+    while mbytes >= 1024 and mbytes % 1024 == 0 and unit < len(MEMORY_UNITS) - 1:
+        mbytes //= 1024
+        unit += 1
+    return "{0}{1}".format(mbytes, MEMORY_UNITS[unit])
+
+
+def __get_tres(tres_list: List[Dict[str, Any]]) -> Dict[str, int]:
+    tres = {}
+    for item in tres_list:
+        key = item["type"]
+        if item.get("name"):
+            key = "{0}/{1}".format(key, item["name"])
+        tres[key] = __get_number(item.get("count", 0)) or 0
+    return tres
+
+
+def __get_tres_str(tres: Dict[str, int]) -> str:
+    return ",".join(
+        "{0}={1}".format(key, __get_memory_str(value) if key == "mem" else value)
+        for key, value in sorted(tres.items())
+    )
+
+
+def __get_job_id_str(job: Dict[str, Any]) -> str:
+    """
+    Returns the job ID as displayed by sacct, e.g. 1000, 1000_5,
+    1000_[1-10] or 1000+1.
+    """
+    array = job.get("array", {})
+    array_job_id = __get_number(array.get("job_id", 0))
+    if array_job_id:
+        task_id = array.get("task_id", {})
+        if isinstance(task_id, dict) and not task_id.get("set", True):
+            return "{0}_[{1}]".format(array_job_id, array.get("task", ""))
+        return "{0}_{1}".format(array_job_id, __get_number(task_id))
+
+    het = job.get("het", {})
+    het_job_id = __get_number(het.get("job_id", 0))
+    if het_job_id:
+        return "{0}+{1}".format(het_job_id, __get_number(het.get("job_offset", 0)))
+
+    return str(job["job_id"])
+
+
+def __get_exit_code_str(exit_code: Dict[str, Any]) -> str:
+    signal = exit_code.get("signal", {})
+    return "{0}:{1}".format(
+        __get_number(exit_code.get("return_code", 0)),
+        __get_number(signal.get("id", signal.get("signal_id", 0))),
+    )
+
+
+def __get_step_row(job_id_str: str, job_raw_id: int, step: Dict[str, Any]) -> Dict[str, str]:
+    # newer versions of the API use the full step ID e.g. "1000.batch"
+    step_id = str(step["step"]["id"]).rsplit(".", maxsplit=1)[-1]
+    row = {
+        "JobId": "{0}.{1}".format(job_id_str, step_id),
+        "JobIdRaw": "{0}.{1}".format(job_raw_id, step_id),
+        "JobName": step["step"].get("name", ""),
+        "State": __get_state(step.get("state", "")),
+        "Start": __get_timestamp(step.get("time", {}).get("start", 0)),
+        "End": __get_timestamp(step.get("time", {}).get("end", 0)),
+        "ExitCode": __get_exit_code_str(step.get("exit_code", {})),
+        "NodeList": step.get("nodes", {}).get("range", ""),
+        "MaxRSS": "",
+        "AllocTRES": __get_tres_str(__get_tres(step.get("tres", {}).get("allocated", []))),
+    }
+    max_tres = __get_tres(step.get("tres", {}).get("requested", {}).get("max", []))
+    if "mem" in max_tres:
+        # bytes
+        row["MaxRSS"] = "{0}K".format(max_tres["mem"] // 1024)
+    return row
+
+
+def __get_output_path(job: Dict[str, Any], field: str) -> Optional[str]:
+    """
+    Returns the path of the given output file (stdout or stderr) of the
+    job. Newer versions of Slurm provide the path with its replacement
+    symbols (e.g. %j) expanded. For older versions the path can only be
+    used if it does not contain any replacement symbols.
+    """
+    path = job.get("{0}_expanded".format(field))
+    if path:
+        return path
+    path = job.get(field)
+    if path and path.startswith("/") and "%" not in path:
+        return path
+    return None
+
+
+def get_sacct_rows_from_jobs(jobs: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """
+    Convert a list of job records from Slurm's accounting database into
+    a list of records keyed by sacct's field names. Each job is followed
+    by a record for each of its steps, as with sacct.
+    """
+    # pylint: disable=too-many-locals
+    rows = []
+    for job in jobs:
+        job_raw_id = int(job["job_id"])
+        job_id_str = __get_job_id_str(job)
+        time_info = job.get("time", {})
+        elapsed = __get_number(time_info.get("elapsed", 0)) or 0
+        allocated = __get_tres(job.get("tres", {}).get("allocated", []))
+        requested = __get_tres(job.get("tres", {}).get("requested", []))
+        cpus = allocated.get("cpu", __get_number(job.get("required", {}).get("CPUs", 0)) or 0)
+        total_cpu = time_info.get("total", {})
+        time_limit = __get_number(time_info.get("limit", 0))
+        comment = job.get("comment", {})
+
+        if time_limit is None:
+            time_limit_str = time_limit_raw = "UNLIMITED"
+        elif time_limit == 0:
+            time_limit_str = time_limit_raw = "Partition_Limit"
+        else:
+            time_limit_str = __get_duration_str(time_limit * 60)
+            time_limit_raw = str(time_limit)
+
+        job_row = {
+            "JobId": job_id_str,
+            "User": job.get("user", ""),
+            "Group": job.get("group", ""),
+            "Partition": job.get("partition", ""),
+            "Account": job.get("account", ""),
+            "Start": __get_timestamp(time_info.get("start", 0)),
+            "End": __get_timestamp(time_info.get("end", 0)),
+            "State": __get_state(job.get("state", "")),
+            "ReqMem": __get_memory_str(requested["mem"]) if "mem" in requested else "0",
+            "MaxRSS": "",
+            "NCPUS": str(cpus),
+            "CPUTimeRaw": str(elapsed * cpus),
+            "TotalCPU": __get_cpu_time_str(
+                __get_number(total_cpu.get("seconds", 0)) or 0,
+                __get_number(total_cpu.get("microseconds", 0)) or 0,
+            ),
+            "NNodes": str(__get_number(job.get("allocation_nodes", 0))),
+            "WorkDir": job.get("working_directory", ""),
+            "Elapsed": __get_duration_str(elapsed),
+            "ExitCode": __get_exit_code_str(job.get("exit_code", {})),
+            "AdminComment": comment.get("administrator", "") or "",
+            "Comment": comment.get("job", "") or "",
+            "Cluster": job.get("cluster", ""),
+            "NodeList": job.get("nodes", ""),
+            "TimeLimit": time_limit_str,
+            "TimelimitRaw": time_limit_raw,
+            "JobIdRaw": str(job_raw_id),
+            "AllocTRES": __get_tres_str(allocated),
+            "JobName": job.get("name", ""),
+        }
+        rows.append(job_row)
+        for step in job.get("steps", []):
+            row = dict.fromkeys(job_row, "")
+            row.update(__get_step_row(job_id_str, job_raw_id, step))
+            rows.append(row)
+        # unlike sacct -P, the output paths are available so scontrol
+        # does not need to be run
+        for key, field in [("StdErr", "stderr"), ("StdOut", "stdout")]:
+            path = __get_output_path(job, field)
+            if path is not None:
+                job_row[key] = path
+    return rows
+
+
+def iter_json_array(stream: TextIO, key: str) -> Iterator[Any]:
+    """
+    Incrementally read a JSON document containing an object from the
+    given stream, yielding each element of the array stored under `key`
+    in that object as soon as it has been read. Only one element is held
+    in memory at a time, so documents such as the output of
+    `sacct --json` for a large job array do not need to fit in memory.
+
+    Raises ValueError if the document is not valid JSON.
+    """
+    reader = JsonStreamReader(stream)
+    reader.expect("{")
+    if reader.peek() == "}":
+        return
+    while True:
+        name = reader.value()
+        reader.expect(":")
+        if name == key and reader.peek() == "[":
+            reader.expect("[")
+            if reader.peek() == "]":
+                reader.expect("]")
+            else:
+                while True:
+                    yield reader.value()
+                    if reader.expect(",]") == "]":
+                        break
+        else:
+            # other members, e.g. "meta", are small and are discarded
+            reader.value()
+        if reader.expect(",}") == "}":
+            return
+
+
+class JsonStreamReader:
+    """
+    Reads JSON tokens and values from a stream, keeping only the unread
+    part of the stream in memory.
+    """
+
+    def __init__(self, stream: TextIO):
+        self.__buffer = ""
+        self.__decoder = json.JSONDecoder()
+        self.__eof = False
+        self.__pos = 0
+        self.__stream = stream
+
+    def expect(self, chars: str) -> str:
+        """
+        Consume the next non-whitespace character, which must be one of
+        the given characters, and return it.
+        """
+        char = self.peek()
+        if char == "" or char not in chars:
+            raise ValueError(
+                "Expected one of '{0}' at offset {1}, found '{2}'".format(chars, self.__pos, char)
+            )
+        self.__pos += 1
+        return char
+
+    def peek(self) -> str:
+        """
+        Returns the next non-whitespace character without consuming it
+        or an empty string at the end of the stream.
+        """
+        while True:
+            self.__pos = JSON_WHITESPACE_RE.match(self.__buffer, self.__pos).end()  # type: ignore
+            if self.__pos < len(self.__buffer) or not self.__read():
+                return self.__buffer[self.__pos:self.__pos + 1]
+
+    def value(self) -> Any:
+        """
+        Consume and return the next JSON value.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.__decoder.raw_decode(self.__buffer, self.__pos)
+            except ValueError:
+                # the value may be incomplete
+                if self.__read():
+                    continue
+                raise
+            if end == len(self.__buffer) and not self.__eof and self.__buffer[end - 1] not in "]}\"":
+                # a number or literal may continue in the next read
+                if self.__read():
+                    continue
+            self.__pos = end
+            return value
+
+    def __read(self) -> bool:
+        """
+        Append the next chunk of the stream to the buffer, discarding the
+        part that has already been consumed. Returns False at the end of
+        the stream.
+
+        At least as much as is already pending is read, so that a value
+        larger than JSON_READ_SIZE is only decoded a few times.
+        """
+        if self.__eof:
+            return False
+        data = self.__stream.read(max(JSON_READ_SIZE, len(self.__buffer) - self.__pos))
+        if not data:
+            self.__eof = True
+            return False
+        self.__buffer = self.__buffer[self.__pos:] + data
+        self.__pos = 0
+        return True
@@ -0,0 +1,504 @@
+# pylint: disable=consider-using-f-string
+
+#
+#  This file is part of Slurm-Mail.
+#
+#  Slurm-Mail is a drop in replacement for Slurm's e-mails to give users
+#  much more information about their jobs compared to the standard Slurm
+#  e-mails.
+#
+#   Copyright (C) 2018-2026 Neil Munday (neil@mundayweb.com)
+#
+#  Slurm-Mail is free software: you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the
+#  Free Software Foundation, either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  Slurm-Mail is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Slurm-Mail.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""
+This module provides the source for the `slurm-spool-mail` application
+and the functions used to read and write the spool directory.
+
+slurmctld runs `slurm-spool-mail` (MailProg) once for every e-mail
+notification, so this module only imports what is needed to write a
+spool file or to send it to `slurm-send-mail --daemon`. In particular
+it does not import `slurmmail.cli` or `slurmmail.common`, which pull in
+the modules used to send e-mails.
+"""
+
+import configparser
+import json
+import logging
+import os
+import pathlib
+import re
+import socket
+import sys
+import time
+
+from typing import Optional
+
+from slurmmail import conf_file
+
+logger = logging.getLogger(__name__)
+
+SECTION = "slurm-spool-mail"
+# values of the spoolBackend option
+SPOOL_BACKENDS = ("files", "sqlite")
+# reply sent by the event receiver of slurm-send-mail --daemon once an
+# event has been spooled
+SPOOL_SOCKET_ACK = b"OK\n"
+# default number of seconds to wait for the event receiver to reply
+SPOOL_SOCKET_TIMEOUT = 2.0
+# a spool file claimed by slurm-send-mail is renamed to its name followed
+# by this, the claiming process's ID, the time it was claimed and its host
+# name, e.g. 1000_1673384400.1.mail.processing.1234.1673384460.node01
+SPOOL_LEASE_INFIX = ".processing."
+# default number of seconds after which a claimed spool file may be
+# claimed by another slurm-send-mail
+SPOOL_LEASE = 600
+# maximum value of the spoolSubdirs option
+MAX_SPOOL_SUBDIRS = 256
+# names of the hashed sub-directories of the spool directory, e.g. "0f"
+SPOOL_SUBDIR_RE = re.compile(r"[0-9a-f]{2}")
+# environment variables set by slurmctld when running MailProg that are
+# saved in each spool file
+SLURM_MAIL_ENV_VARS = [
+    "SLURM_ARRAY_JOB_ID",
+    "SLURM_ARRAY_TASK_ID",
+    "SLURM_CLUSTER_NAME",
+    "SLURM_JOB_ACCOUNT",
+    "SLURM_JOB_EXIT_CODE",
+    "SLURM_JOB_GROUP",
+    "SLURM_JOB_ID",
+    "SLURM_JOB_MAIL_TYPE",
+    "SLURM_JOB_NAME",
+    "SLURM_JOB_PARTITION",
+    "SLURM_JOB_STATE",
+    "SLURM_JOB_STDERR",
+    "SLURM_JOB_STDIN",
+    "SLURM_JOB_STDOUT",
+    "SLURM_JOB_USER",
+    "SLURM_JOB_WORK_DIR",
+]
+# e.g. "Slurm Array Task Job_id=1000_1 (1000) Began"
+ARRAY_INFO_RE = re.compile(
+    r"Slurm ((?P<array_summary>Array Summary)|Array Task)"
+    r" Job_id=[0-9]+_([0-9]+|\*)"
+    r" \((?P<job_id>[0-9]+)\).*?(?P<state>(Began|Ended|Failed|Requeued|Invalid"
+    r" dependency|Reached time limit|Reached (?P<limit>[0-9]+)% of time"
+    r" limit|Staged Out))"
+)
+# e.g. "Slurm Job_id=1000 Name=test.jcf Began, Queued time 00:00:01"
+JOB_INFO_RE = re.compile(
+    r"Slurm"
+    r" Job_id=(?P<job_id>[0-9]+).*?(?P<state>(Began|Ended|Failed|Requeued|Invalid"
+    r" dependency|Reached time limit|Reached (?P<limit>[0-9]+)% of time"
+    r" limit|Staged Out))"
+)
+# states written to spool files (see __get_spool_data)
+SPOOL_STATE_RE = re.compile(
+    r"Began|Ended|Failed|Requeued|Invalid dependency|Time limit reached|Time reached [0-9]+%|Staged Out"
+)
+
+
+def __check_dir(path: pathlib.Path):
+    """
+    Exit if the given directory does not exist or is not writeable.
+    """
+    if not path.is_dir():
+        __die("Error: {0} is not a directory".format(path))
+    if not os.access(str(path), os.W_OK):
+        __die("Error: {0} is not writeable".format(path))
+
+
+def __die(msg: str):
+    """
+    Exit the program with the given error message.
+    """
+    logger.error(msg)
+    sys.stderr.write("{0}\n".format(msg))
+    sys.exit(1)
+
+
+def __get_spool_data(info: str, email_to: str) -> dict:
+    """
+    Returns the contents of the spool file for the given Slurm e-mail
+    subject, e.g. "Slurm Job_id=1000 Name=test.jcf Began", and recipient.
+    """
+    if "Array" in info:
+        match = ARRAY_INFO_RE.search(info)
+        if not match:
+            __die("Failed to parse Slurm info.")
+        array_summary = match.group("array_summary") is not None
+    else:
+        match = JOB_INFO_RE.search(info)
+        if not match:
+            __die("Failed to parse Slurm info.")
+        array_summary = False
+
+    state = match.group("state")
+    if state == "Reached time limit":
+        state = "Time limit reached"
+    time_reached = match.group("limit")
+    if time_reached:
+        state = "Time reached {0}%".format(time_reached)
+
+    return {
+        "job_id": int(match.group("job_id")),
+        "state": state,
+        "email": email_to,
+        "array_summary": array_summary,
+        "slurm_env": {
+            var: os.environ[var] for var in SLURM_MAIL_ENV_VARS if var in os.environ
+        },
+    }
+
+
+def __insert_spool_event(spool_dir: pathlib.Path, data: dict, create: bool) -> bool:
+    """
+    Add the given event to the spool database, creating it if `create` is
+    True. Returns False if it could not be added, in which case a spool
+    file should be written instead.
+    """
+    try:
+        # sqlite3 is only imported when the spool database is used
+        from slurmmail.spooldb import SpoolDatabase, SPOOL_DB_NAME  # pylint: disable=import-outside-toplevel
+
+        if not create and not (spool_dir / SPOOL_DB_NAME).exists():
+            logger.debug("%s does not exist yet", spool_dir / SPOOL_DB_NAME)
+            return False
+        db = SpoolDatabase(spool_dir / SPOOL_DB_NAME, create=create)
+        try:
+            event_id = db.insert(data)
+        finally:
+            db.close()
+    except Exception as e:  # pylint: disable=broad-except
+        logger.error("Failed to add event to the spool database, writing a spool file instead: %s", e)
+        return False
+    logger.info("added event %d to %s", event_id, spool_dir / SPOOL_DB_NAME)
+    return True
+
+
+def __remove_stale_tmp_file(entry: os.DirEntry, lease: int, now: float):
+    """
+    Remove the given temporary file left behind by `write_spool_file`
+    (e.g. if slurm-spool-mail was killed whilst writing it) if it has not
+    been written to for `lease` seconds.
+    """
+    try:
+        if entry.stat().st_mtime + lease <= now:
+            logger.warning("Removing stale temporary file %s", entry.path)
+            os.unlink(entry.path)
+    except FileNotFoundError:
+        pass
+
+
+def __send_spool_event(socket_path: pathlib.Path, data: dict, timeout: float) -> bool:
+    """
+    Send the given event to the event receiver of `slurm-send-mail
+    --daemon`. Returns True once the receiver has acknowledged that the
+    event has been spooled, otherwise False, in which case the event
+    should be spooled by the caller.
+    """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(str(socket_path))
+            sock.sendall(json.dumps(data).encode() + b"\n")
+            reply = sock.makefile("rb").readline()
+    except OSError as e:
+        logger.warning("Failed to send event to %s, spooling it instead: %s", socket_path, e)
+        return False
+    if reply != SPOOL_SOCKET_ACK:
+        logger.warning("Event not accepted by %s, spooling it instead: %s", socket_path, reply.decode(errors="replace"))
+        return False
+    logger.info("sent event to %s", socket_path)
+    return True
+
+
+def claim_spool_file(path: pathlib.Path, now: Optional[float] = None) -> Optional[pathlib.Path]:
+    """
+    Claim the given spool file for this process by renaming it, so that
+    other instances of slurm-send-mail (on this or other hosts sharing the
+    spool directory) skip it. Returns the new path, or None if the spool
+    file has already been claimed or removed by another instance.
+    """
+    if now is None:
+        now = time.time()
+    lease = path.with_name(
+        "{0}{1}{2}.{3}.{4}".format(path.name, SPOOL_LEASE_INFIX, os.getpid(), int(now), os.uname().nodename)
+    )
+    try:
+        os.rename(str(path), str(lease))
+    except FileNotFoundError:
+        logger.debug("%s has been claimed by another process", path)
+        return None
+    return lease
+
+
+def get_spool_lease_renewed(entry: os.DirEntry) -> float:
+    """
+    Returns the time at which the claim on the given (claimed) spool file
+    was last renewed, see `renew_spool_file`.
+    """
+    try:
+        return entry.stat().st_mtime
+    except FileNotFoundError:
+        return 0
+
+
+def is_stale_spool_lease(name: str, lease: int, now: float, renewed: float = 0) -> bool:
+    """
+    Returns True if the given file name is that of a claimed spool file
+    whose claim is more than `lease` seconds old (or was last renewed at
+    `renewed` more than `lease` seconds ago) or whose claiming process is
+    no longer running on this host.
+    """
+    _, sep, owner = name.partition(SPOOL_LEASE_INFIX)
+    if not sep:
+        return False
+    try:
+        pid, claimed, host = owner.split(".", 2)
+        if max(int(claimed), renewed) + lease <= now:
+            return True
+        if host != os.uname().nodename or int(pid) == os.getpid():
+            return False
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except (PermissionError, ValueError):
+        # running as another user, or not a claim made by slurm-send-mail
+        pass
+    return False
+
+
+def release_spool_file(path: pathlib.Path) -> Optional[pathlib.Path]:
+    """
+    Release a claimed spool file by renaming it back to its original name
+    so that it is processed again. Returns the original path, or None if
+    the spool file no longer exists.
+    """
+    original = path.with_name(strip_spool_lease(path.name))
+    try:
+        os.rename(str(path), str(original))
+    except FileNotFoundError:
+        return None
+    return original
+
+
+def renew_spool_file(path: pathlib.Path, now: Optional[float] = None) -> bool:
+    """
+    Renew the claim on the given claimed spool file by updating its
+    modification time. Returns False if the claim has been lost, i.e. the
+    spool file has been released by another instance.
+    """
+    if now is None:
+        now = time.time()
+    try:
+        os.utime(str(path), (now, now))
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def strip_spool_lease(name: str) -> str:
+    """
+    Returns the original name of the given (possibly claimed) spool file.
+    """
+    return name.partition(SPOOL_LEASE_INFIX)[0]
+
+
+def get_spool_file_path(spool_dir: pathlib.Path, job_id: int, subdirs: int = 0) -> pathlib.Path:
+    """
+    Returns the path of a new spool file for the given job. If `subdirs`
+    is greater than zero the spool file is placed in one of `subdirs`
+    sub-directories of the spool directory, chosen by the job ID.
+    """
+    name = "{0}_{1}.mail".format(job_id, time.time())
+    if subdirs > 0:
+        return spool_dir / "{0:02x}".format(job_id % subdirs) / name
+    return spool_dir / name
+
+
+def get_spool_file_time(name: str) -> float:
+    """
+    Returns the time at which the spool file with the given (possibly
+    claimed or deferred) name was written, see `get_spool_file_path`.
+    Returns 0 if the name does not include it.
+    """
+    stem = strip_spool_lease(name)
+    if stem.endswith(".mail"):
+        stem = stem[:-len(".mail")]
+    try:
+        return float(stem.rpartition("_")[2])
+    except ValueError:
+        return 0
+
+
+def scan_spool_dir(spool_dir: pathlib.Path, limit: int = 0, lease: int = 0) -> list:
+    """
+    Returns the paths of the spool files in the given spool directory and
+    its hashed sub-directories. If `limit` is greater than zero then at
+    most `limit` spool files are returned and the remaining directory
+    entries are not read.
+
+    If `lease` is greater than zero then claimed spool files whose claim
+    is stale (see `is_stale_spool_lease`) are released and returned too,
+    and temporary files of spool files that are older than `lease`
+    seconds are removed.
+    """
+    spool_files = []
+    dirs = [str(spool_dir)]
+    now = time.time()
+    for path in dirs:
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    name = entry.name
+                    path_found: Optional[pathlib.Path] = None
+                    if name.endswith(".mail") and not name.startswith("."):
+                        path_found = pathlib.Path(entry.path)
+                    elif (
+                        lease > 0
+                        and SPOOL_LEASE_INFIX in name
+                        and is_stale_spool_lease(name, lease, now, get_spool_lease_renewed(entry))
+                    ):
+                        logger.warning("Releasing stale claim on %s", entry.path)
+                        path_found = release_spool_file(pathlib.Path(entry.path))
+                    elif lease > 0 and name.startswith(".") and name.endswith(".tmp"):
+                        __remove_stale_tmp_file(entry, lease, now)
+                    if path_found is not None:
+                        spool_files.append(path_found)
+                        if len(spool_files) == limit:
+                            return spool_files
+                    elif path is dirs[0] and SPOOL_SUBDIR_RE.fullmatch(name) and entry.is_dir():
+                        # sub-directories are read after the spool directory
+                        dirs.append(entry.path)  # pylint: disable=modified-iterating-list
+        except FileNotFoundError:
+            # e.g. removed by an administrator
+            pass
+    return spool_files
+
+
+def spool_event(
+    spool_dir: pathlib.Path, data: dict, backend: str = "files", subdirs: int = 0, create_db: bool = True
+):
+    """
+    Add the given event to the spool using the given backend. If the
+    event cannot be added to the spool database then a spool file is
+    written instead. The spool database is only created if `create_db`
+    is True.
+    """
+    if backend == "sqlite" and __insert_spool_event(spool_dir, data, create_db):
+        return
+    output_path = get_spool_file_path(spool_dir, data["job_id"], subdirs)
+    if subdirs > 0:
+        output_path.parent.mkdir(exist_ok=True)
+    logger.info("writing file: %s", output_path)
+    write_spool_file(output_path, data)
+
+
+def write_spool_file(path: pathlib.Path, data: dict):
+    """
+    Write the given spool file. The data is written to a temporary file
+    which is then renamed, so that slurm-send-mail never reads a partly
+    written spool file.
+    """
+    tmp_path = path.with_name(".{0}.{1}.tmp".format(path.name, os.getpid()))
+    try:
+        with tmp_path.open(mode="w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(str(tmp_path), str(path))
+    except BaseException:
+        try:
+            tmp_path.unlink()
+        except OSError:
+            pass
+        raise
+
+
+def spool_mail_main():
+    # pylint: disable=too-many-branches,too-many-statements
+    """
+    A drop in replacement for MailProg in Slurm's slurm.conf file.
+    Instead of sending an e-mail the details about the requested e-mail are
+    written to a spool directory (e.g. /var/spool/slurm-mail). Then when
+    slurm-send-mail is executed it will process these files and send
+    HTML e-mails to users containing additional information about their jobs
+    compared to the default Slurm e-mails.
+    """
+    if not conf_file.is_file():
+        __die("{0} does not exist".format(conf_file))
+    verbose = False
+    subdirs = 0
+    backend = "files"
+    socket_path = None
+    socket_timeout = SPOOL_SOCKET_TIMEOUT
+
+    try:
+        config = configparser.RawConfigParser()
+        config.read(str(conf_file))
+        if not config.has_section(SECTION):
+            __die("Could not find config section '{0}' in {1}".format(SECTION, conf_file))
+        spool_dir = pathlib.Path(config.get("common", "spoolDir"))
+        log_file = pathlib.Path(config.get(SECTION, "logFile"))
+        verbose = config.getboolean(SECTION, "verbose")
+        if config.has_option("common", "spoolBackend"):
+            backend = config.get("common", "spoolBackend")
+        if config.has_option(SECTION, "spoolSubdirs"):
+            subdirs = config.getint(SECTION, "spoolSubdirs")
+        if config.get("common", "spoolSocket", fallback=""):
+            socket_path = pathlib.Path(config.get("common", "spoolSocket"))
+        if config.has_option(SECTION, "spoolSocketTimeout"):
+            socket_timeout = config.getfloat(SECTION, "spoolSocketTimeout")
+    except Exception as e:  # pylint: disable=broad-except
+        __die("Error: {0}".format(e))
+
+    __check_dir(log_file.parent)
+    __check_dir(spool_dir)
+
+    logging.basicConfig(
+        format="%(asctime)s:%(levelname)s: %(message)s",
+        datefmt="%Y/%m/%d %H:%M:%S",
+        level=logging.DEBUG if verbose else logging.INFO,
+        filename=str(log_file),
+    )
+    logger.debug("Called with: %s", sys.argv)
+
+    if subdirs < 0 or subdirs > MAX_SPOOL_SUBDIRS:
+        # still write the spool file rather than losing the notification
+        logger.error("spoolSubdirs must be between 0 and %d", MAX_SPOOL_SUBDIRS)
+        subdirs = 0
+    if backend not in SPOOL_BACKENDS:
+        logger.error("spoolBackend must be one of: %s", ", ".join(SPOOL_BACKENDS))
+        backend = "files"
+    if socket_timeout <= 0:
+        logger.error("spoolSocketTimeout must be greater than zero")
+        socket_timeout = SPOOL_SOCKET_TIMEOUT
+
+    if len(sys.argv) != 4:
+        __die("Incorrect number of command line arguments")
+
+    try:
+        logger.debug("info str: %s", sys.argv[2])
+        data = __get_spool_data(sys.argv[2], sys.argv[3])
+        logger.debug("Job ID: %d", data["job_id"])
+        logger.debug("State: %s", data["state"])
+        logger.debug("Array Summary: %s", data["array_summary"])
+        logger.debug("E-mail to: %s", data["email"])
+
+        if socket_path is not None and __send_spool_event(socket_path, data, socket_timeout):
+            return
+        spool_event(spool_dir, data, backend, subdirs)
+    except Exception as e:  # pylint: disable=broad-except
+        logger.error(e, exc_info=True)
@@ -0,0 +1,317 @@
+# pylint: disable=consider-using-f-string
+
+#
+#  This file is part of Slurm-Mail.
+#
+#  Slurm-Mail is a drop in replacement for Slurm's e-mails to give users
+#  much more information about their jobs compared to the standard Slurm
+#  e-mails.
+#
+#   Copyright (C) 2018-2026 Neil Munday (neil@mundayweb.com)
+#
+#  Slurm-Mail is free software: you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the
+#  Free Software Foundation, either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  Slurm-Mail is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Slurm-Mail.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""
+This module provides a spool queue that keeps notifications in a SQLite
+database instead of one file per notification.
+
+The database is written by `slurm-spool-mail` and read by
+`slurm-send-mail`, which claims batches of events. A claimed event is
+deleted once its e-mail has been sent. Claims expire after `lease`
+seconds (`SPOOL_DB_LEASE` by default) so that the events of a
+`slurm-send-mail` that crashed are claimed again by a later run.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import pathlib
+import sqlite3
+import time
+
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from slurmmail.spoolitem import get_retry_delay, SpoolItem
+
+logger = logging.getLogger(__name__)
+
+# name of the database in the spool directory
+SPOOL_DB_NAME = "spool.db"
+# number of seconds after which a claimed event may be claimed again
+SPOOL_DB_LEASE = 600
+# number of seconds to wait for another process to release the database
+SPOOL_DB_TIMEOUT = 5.0
+# number of events claimed by each pass when no limit is given
+SPOOL_DB_BATCH_SIZE = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    email TEXT NOT NULL,
+    data TEXT NOT NULL,
+    enqueued REAL NOT NULL,
+    next_attempt REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    claimed_by TEXT,
+    claimed_at REAL
+);
+CREATE INDEX IF NOT EXISTS events_state ON events (state);
+CREATE INDEX IF NOT EXISTS events_job_id ON events (job_id);
+CREATE INDEX IF NOT EXISTS events_email ON events (email);
+CREATE INDEX IF NOT EXISTS events_enqueued ON events (enqueued);
+"""
+
+
+class SpoolEvent(SpoolItem):
+    """
+    An event claimed from the spool database by this process.
+    """
+
+    def __init__(self, db: "SpoolDatabase", event_id: int, enqueued: float, data: Dict[str, Any]):
+        self.db = db
+        self.id = event_id  # pylint: disable=invalid-name
+        self.data = data
+        self.__enqueued = enqueued
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, SpoolEvent) and self.db is other.db and self.id == other.id
+
+    def __hash__(self) -> int:
+        return hash(self.id)
+
+    def __repr__(self) -> str:
+        return "SpoolEvent({0!r}, {1})".format(self.db.path, self.id)
+
+    def __str__(self) -> str:
+        return "{0}#{1}".format(self.db.path, self.id)
+
+    @property
+    def enqueued(self) -> float:
+        return self.__enqueued
+
+    def defer(self, error: str) -> bool:
+        return self.db.defer(self, error)
+
+    def exists(self) -> bool:
+        return self.db.exists(self)
+
+    def read(self) -> Dict[str, Any]:
+        return self.data
+
+    def release(self):
+        self.db.release([self])
+
+    def renew(self) -> bool:
+        return self.db.renew([self]) == 1
+
+    def unlink(self):
+        self.db.ack(self)
+
+
+class SpoolDatabase:
+    """
+    A spool queue stored in a SQLite database using write-ahead logging,
+    so that `slurm-spool-mail` can add events while `slurm-send-mail` is
+    reading them.
+
+    Events that could not be sent are retried after a delay that doubles
+    from `base_delay` up to `max_delay` seconds, see `DeferredQueue`.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        path: pathlib.Path,
+        create: bool = False,
+        *,
+        base_delay: int = 60,
+        max_delay: int = 3600,
+        max_attempts: int = 10,
+        lease: int = SPOOL_DB_LEASE,
+    ):
+        """
+        Open the given database. Unless `create` is True the database must
+        already exist, so that it is always created by (and owned by) the
+        user that runs `slurm-spool-mail`. Claimed events may be claimed
+        again after `lease` seconds.
+        """
+        self.path = path
+        self.base_delay = base_delay
+        self.lease = lease
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.owner = "{0}:{1}".format(os.uname().nodename, os.getpid())
+        uri = "file:{0}?mode={1}".format(path, "rwc" if create else "rw")
+        self.__conn = sqlite3.connect(uri, timeout=SPOOL_DB_TIMEOUT, isolation_level=None, uri=True)
+        try:
+            self.__conn.execute("PRAGMA journal_mode = WAL")
+            # a committed event survives a crash of slurm-spool-mail, WAL
+            # mode only needs a sync on checkpoints to survive a power loss
+            self.__conn.execute("PRAGMA synchronous = NORMAL")
+            if create:
+                self.__conn.executescript(SCHEMA)
+        except sqlite3.Error:
+            self.__conn.close()
+            raise
+
+    def close(self):
+        """
+        Close the database connection.
+        """
+        self.__conn.close()
+
+    def ack(self, event: SpoolEvent):
+        """
+        Remove the given event from the spool, unless it has since been
+        claimed by another process.
+        """
+        self.__conn.execute("DELETE FROM events WHERE id = ? AND claimed_by = ?", (event.id, self.owner))
+
+    def backlog(self) -> List[Tuple[str, str, int]]:
+        """
+        Returns the number of pending events for each state and recipient.
+        """
+        return self.__conn.execute(
+            "SELECT state, email, COUNT(*) FROM events GROUP BY state, email ORDER BY state, email"
+        ).fetchall()
+
+    def claim(
+        self, limit: int = SPOOL_DB_BATCH_SIZE, now: Optional[float] = None
+    ) -> List[Tuple[SpoolEvent, Dict[str, Any]]]:
+        """
+        Claim up to `limit` of the oldest events that are due, including
+        those whose claim has expired. Returns each event and its
+        contents, which are in the same format as a spool file.
+        """
+        if now is None:
+            now = time.time()
+        with self.__transaction():
+            rows = self.__conn.execute(
+                "SELECT id, enqueued, data FROM events"
+                " WHERE next_attempt <= ? AND (claimed_at IS NULL OR claimed_at < ?)"
+                " ORDER BY enqueued LIMIT ?",
+                (now, now - self.lease, limit),
+            ).fetchall()
+            self.__conn.executemany(
+                "UPDATE events SET claimed_by = ?, claimed_at = ? WHERE id = ?",
+                [(self.owner, now, row[0]) for row in rows],
+            )
+        events = []
+        for event_id, enqueued, data in rows:
+            event = SpoolEvent(self, event_id, enqueued, json.loads(data))
+            events.append((event, event.data))
+        return events
+
+    def count(self, state: Optional[str] = None, email: Optional[str] = None) -> int:
+        """
+        Returns the number of pending events, optionally only those with
+        the given state and/or recipient.
+        """
+        sql = "SELECT COUNT(*) FROM events WHERE 1"
+        params = []
+        if state is not None:
+            sql += " AND state = ?"
+            params.append(state)
+        if email is not None:
+            sql += " AND email = ?"
+            params.append(email)
+        return self.__conn.execute(sql, params).fetchone()[0]
+
+    def defer(self, event: SpoolEvent, error: str) -> bool:
+        """
+        Release the given event so that it is tried again after a delay.
+        Returns False if it has already been attempted `max_attempts`
+        times, in which case it is left for the caller to remove. Events
+        that have been claimed by another process are left alone.
+        """
+        row = self.__conn.execute(
+            "SELECT attempts FROM events WHERE id = ? AND claimed_by = ?", (event.id, self.owner)
+        ).fetchone()
+        if row is None:
+            return True
+        attempts = row[0] + 1
+        if attempts >= self.max_attempts:
+            logger.error("Giving up on %s after %d attempts: %s", event, attempts, error)
+            return False
+        delay = get_retry_delay(attempts, self.base_delay, self.max_delay)
+        self.__conn.execute(
+            "UPDATE events SET attempts = ?, next_attempt = ?, error = ?, claimed_by = NULL, claimed_at = NULL"
+            " WHERE id = ? AND claimed_by = ?",
+            (attempts, time.time() + delay, error, event.id, self.owner),
+        )
+        logger.warning(
+            "Deferred %s for %ds after attempt %d of %d: %s", event, delay, attempts, self.max_attempts, error
+        )
+        return True
+
+    def exists(self, event: SpoolEvent) -> bool:
+        """
+        Returns True if the given event has not been removed and is still
+        claimed by this process, like a claimed spool file.
+        """
+        return self.__conn.execute(
+            "SELECT 1 FROM events WHERE id = ? AND claimed_by = ?", (event.id, self.owner)
+        ).fetchone() is not None
+
+    def insert(self, data: Dict[str, Any]) -> int:
+        """
+        Add an event, in the same format as a spool file, to the spool.
+        Returns its ID.
+        """
+        now = time.time()
+        cursor = self.__conn.execute(
+            "INSERT INTO events (job_id, state, email, data, enqueued, next_attempt) VALUES (?, ?, ?, ?, ?, ?)",
+            (data["job_id"], data["state"], data["email"], json.dumps(data), now, now),
+        )
+        return cursor.lastrowid
+
+    def release(self, events: Iterable[SpoolEvent]):
+        """
+        Release the given claimed events without changing when they are
+        due, e.g. events held back for a digest.
+        """
+        self.__conn.executemany(
+            "UPDATE events SET claimed_by = NULL, claimed_at = NULL WHERE id = ? AND claimed_by = ?",
+            [(event.id, self.owner) for event in events],
+        )
+
+    def renew(self, events: Iterable[SpoolEvent], now: Optional[float] = None) -> int:
+        """
+        Renew the claims on the given events so that they do not expire
+        while they are waiting to be processed. Returns the number of
+        events that are still claimed by this process.
+        """
+        if now is None:
+            now = time.time()
+        return self.__conn.executemany(
+            "UPDATE events SET claimed_at = ? WHERE id = ? AND claimed_by = ?",
+            [(now, event.id, self.owner) for event in events],
+        ).rowcount
+
+    @contextlib.contextmanager
+    def __transaction(self) -> Iterator[None]:
+        # BEGIN IMMEDIATE takes the write lock up front so that two
+        # processes cannot claim the same events
+        self.__conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.__conn.execute("ROLLBACK")
+            raise
+        self.__conn.execute("COMMIT")
@@ -0,0 +1,102 @@
+#
+#  This file is part of Slurm-Mail.
+#
+#  Slurm-Mail is a drop in replacement for Slurm's e-mails to give users
+#  much more information about their jobs compared to the standard Slurm
+#  e-mails.
+#
+#   Copyright (C) 2018-2026 Neil Munday (neil@mundayweb.com)
+#
+#  Slurm-Mail is free software: you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the
+#  Free Software Foundation, either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  Slurm-Mail is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Slurm-Mail.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""
+This module provides the interface shared by the notifications that
+slurm-send-mail claims from the spool, whether they are spool files or
+events in the spool database, so that they can be processed the same way.
+
+It must not import the other spool modules, so that the spool database
+can use it without importing them (see `spool.spool_event`).
+"""
+
+import abc
+import random
+
+from typing import Any, Dict
+
+
+class SpoolItem(abc.ABC):
+    """
+    A notification claimed from the spool by this process.
+    """
+
+    @property
+    @abc.abstractmethod
+    def enqueued(self) -> float:
+        """
+        The time at which the notification was spooled. Raises OSError if
+        it has been removed.
+        """
+
+    @abc.abstractmethod
+    def defer(self, error: str) -> bool:
+        """
+        Release the notification so that it is tried again after a delay.
+        Returns False if it cannot be tried again, in which case it is
+        left for the caller to remove.
+        """
+
+    @abc.abstractmethod
+    def exists(self) -> bool:
+        """
+        Returns True if the notification is still claimed by this process.
+        """
+
+    @abc.abstractmethod
+    def read(self) -> Dict[str, Any]:
+        """
+        Returns the contents of the notification. Raises OSError if it
+        cannot be read and ValueError if it is not valid JSON.
+        """
+
+    @abc.abstractmethod
+    def release(self):
+        """
+        Release the claim on the notification without changing when it is
+        due, so that it is processed again.
+        """
+
+    @abc.abstractmethod
+    def renew(self) -> bool:
+        """
+        Renew the claim on the notification. Returns False if the claim has
+        been lost to another process.
+        """
+
+    @abc.abstractmethod
+    def unlink(self):
+        """
+        Remove the notification from the spool.
+        """
+
+
+def get_retry_delay(attempts: int, base_delay: int, max_delay: int) -> float:
+    """
+    Returns the number of seconds to wait after the given number of failed
+    attempts. The delay doubles from `base_delay` up to `max_delay` seconds
+    and is randomly reduced by up to half.
+    """
+    delay = min(max_delay, base_delay * 2 ** (attempts - 1))
+    return random.uniform(delay / 2, delay)
@@ -0,0 +1,230 @@
+# pylint: disable=consider-using-f-string
+
+#
+#  This file is part of Slurm-Mail.
+#
+#  Slurm-Mail is a drop in replacement for Slurm's e-mails to give users
+#  much more information about their jobs compared to the standard Slurm
+#  e-mails.
+#
+#   Copyright (C) 2018-2026 Neil Munday (neil@mundayweb.com)
+#
+#  Slurm-Mail is free software: you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the
+#  Free Software Foundation, either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  Slurm-Mail is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Slurm-Mail.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module aggregates the sacct records of every task in a job array
+for array summary e-mails. Records are processed one at a time and the
+memory used does not depend on the number of tasks.
+"""
+
+import heapq
+import math
+import re
+
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from slurmmail.sacct import SacctRecord
+
+# relative accuracy of the percentiles reported by StreamingStatistic
+PERCENTILE_ACCURACY = 0.01
+# e.g. 1000_[5-10], tasks that never started
+TASK_RANGE_RE = re.compile(r"[0-9]+_\[([0-9]+)-([0-9]+)\]")
+
+
+class StreamingStatistic:
+    # pylint: disable=too-many-instance-attributes
+    """
+    Summarises a stream of non-negative values. The count, minimum,
+    maximum and mean are exact. Percentiles are estimated from a histogram
+    with logarithmically sized buckets, so they are within
+    `relative_accuracy` of a value in the stream and the number of buckets
+    only depends on the range of the values.
+    """
+
+    def __init__(self, relative_accuracy: float = PERCENTILE_ACCURACY):
+        self.count = 0
+        self.max: Optional[float] = None
+        self.min: Optional[float] = None
+        self.__buckets: Dict[int, int] = {}
+        self.__gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.__log_gamma = math.log(self.__gamma)
+        self.__total = 0.0
+        self.__zeros = 0
+
+    def add(self, value: float):
+        """
+        Add a value to the statistic.
+        """
+        self.count += 1
+        self.__total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if value <= 0:
+            self.__zeros += 1
+        else:
+            key = math.ceil(math.log(value) / self.__log_gamma)
+            self.__buckets[key] = self.__buckets.get(key, 0) + 1
+
+    @property
+    def mean(self) -> Optional[float]:
+        """
+        The mean of the values, or None if no values have been added.
+        """
+        if self.count == 0:
+            return None
+        return self.__total / self.count
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """
+        Returns an estimate of the given percentile (0 - 100) or None if
+        no values have been added.
+        """
+        if self.count == 0:
+            return None
+        assert self.min is not None and self.max is not None
+        rank = percent / 100.0 * (self.count - 1)
+        seen = self.__zeros
+        if rank < seen:
+            return self.min
+        for key in sorted(self.__buckets):
+            seen += self.__buckets[key]
+            if rank < seen:
+                value = 2 * self.__gamma ** key / (self.__gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+
+class TaskSummary(NamedTuple):
+    """
+    The statistics of a single array task.
+    """
+
+    job_id: str
+    state: str
+    exit_code: str
+    elapsed: Optional[int]
+    cpu_efficiency: Optional[float]
+    max_rss: Optional[int]
+
+    @property
+    def failed(self) -> bool:
+        """
+        True if the task did not complete successfully.
+        """
+        return self.state != "COMPLETED" or self.exit_code not in ("", "0:0")
+
+
+class ArrayStatistics:
+    # pylint: disable=too-many-instance-attributes
+    """
+    Aggregates the sacct records of the tasks of a job array: the number
+    of tasks in each state, statistics of their elapsed time, CPU
+    efficiency and maximum memory usage, and the `worst_tasks` worst tasks.
+    Tasks that did not complete successfully are the worst, followed by
+    the longest running tasks.
+    """
+
+    def __init__(self, array_job_id: int, worst_tasks: int = 5):
+        self.cpu_efficiency = StreamingStatistic()
+        self.elapsed = StreamingStatistic()
+        self.max_rss = StreamingStatistic()
+        self.states: Dict[str, int] = Counter()
+        self.tasks = 0
+        self.__array_prefix = "{0}_".format(array_job_id)
+        self.__record: Optional[SacctRecord] = None
+        self.__record_max_rss: Optional[int] = None
+        self.__seq = 0
+        self.__worst: List[Tuple[Tuple[bool, int], int, TaskSummary]] = []
+        self.__worst_tasks = worst_tasks
+
+    def add(self, record: SacctRecord):
+        """
+        Add a sacct record. Records must be in the order output by sacct,
+        i.e. each task followed by its steps.
+        """
+        if not record.is_job:
+            if self.__record is not None and record.job_id.startswith(self.__record.job_id + "."):
+                if record.max_rss is not None and (
+                    self.__record_max_rss is None or record.max_rss > self.__record_max_rss
+                ):
+                    self.__record_max_rss = record.max_rss
+            return
+        self.__add_task()
+        if not record.job_id.startswith(self.__array_prefix):
+            return
+        match = TASK_RANGE_RE.fullmatch(record.job_id)
+        if match:
+            # a single record for tasks that never started
+            count = max(1, int(match.group(2)) - int(match.group(1)) + 1)
+            self.tasks += count
+            self.states[record.state] += count
+            return
+        self.__record = record
+        self.__record_max_rss = record.max_rss
+
+    def finish(self):
+        """
+        Call once all records have been added.
+        """
+        self.__add_task()
+
+    def observe(self, records: Iterable[SacctRecord]) -> Iterator[SacctRecord]:
+        """
+        Add each of the given records as it is read, yielding it unchanged.
+        """
+        for record in records:
+            self.add(record)
+            yield record
+
+    def worst_tasks(self) -> List[TaskSummary]:
+        """
+        Returns the worst tasks, worst first.
+        """
+        return [task for _, _, task in sorted(self.__worst, reverse=True)]
+
+    def __add_task(self):
+        record = self.__record
+        if record is None:
+            return
+        self.__record = None
+        self.tasks += 1
+        self.states[record.state] += 1
+
+        elapsed = None
+        cpu_efficiency = None
+        if record.start_ts is not None and record.end_ts is not None:
+            elapsed = max(0, record.end_ts - record.start_ts)
+            self.elapsed.add(elapsed)
+            if elapsed > 0 and record.ncpus and record.total_cpu_usec is not None:
+                cpu_efficiency = record.total_cpu_usec / (elapsed * record.ncpus * 1000000) * 100.0
+                self.cpu_efficiency.add(cpu_efficiency)
+        if self.__record_max_rss is not None:
+            self.max_rss.add(self.__record_max_rss)
+
+        task = TaskSummary(
+            record.job_id, record.state, record.exit_code, elapsed, cpu_efficiency, self.__record_max_rss
+        )
+        if self.__worst_tasks < 1:
+            return
+        # earlier tasks are preferred when tasks are equally bad
+        self.__seq -= 1
+        item = ((task.failed, elapsed or 0), self.__seq, task)
+        if len(self.__worst) < self.__worst_tasks:
+            heapq.heappush(self.__worst, item)
+        else:
+            heapq.heappushpop(self.__worst, item)
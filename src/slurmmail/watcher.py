@@ -0,0 +1,230 @@
+#
+#  This file is part of Slurm-Mail.
+#
+#  Slurm-Mail is a drop in replacement for Slurm's e-mails to give users
+#  much more information about their jobs compared to the standard Slurm
+#  e-mails.
+#
+#   Copyright (C) 2018-2026 Neil Munday (neil@mundayweb.com)
+#
+#  Slurm-Mail is free software: you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the
+#  Free Software Foundation, either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  Slurm-Mail is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Slurm-Mail.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module provides a helper class to wait for new spool files using
+Linux's inotify API, falling back to periodic polling when inotify is
+not available.
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import pathlib
+import select
+import struct
+
+from typing import Dict, Optional, Pattern
+
+logger = logging.getLogger(__name__)
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+class SpoolWatcher:
+    # pylint: disable=too-many-instance-attributes
+    """
+    Waits for spool files to be written to a directory.
+    """
+
+    def __init__(
+        self,
+        path: pathlib.Path,
+        poll_interval: int,
+        suffix: str = ".mail",
+        subdir_re: Optional[Pattern] = None,
+        lease_infix: Optional[str] = None,
+    ):
+        """
+        Create a new SpoolWatcher for the given directory. If inotify
+        cannot be used then `wait` will simply sleep for `poll_interval`
+        seconds. When inotify is available `poll_interval` is used as a
+        safety net so that the directory is still periodically rescanned.
+
+        Sub-directories whose names match `subdir_re` are watched too,
+        including those created after the watcher.
+
+        If `lease_infix` is given then spool files renamed from a name
+        containing it, i.e. claimed spool files that are released, are
+        not reported as new spool files.
+        """
+        self.__inotify_fd: Optional[int] = None
+        self.__lease_infix = lease_infix.encode() if lease_infix is not None else None
+        self.__libc = None
+        self.__path = path
+        self.__poll_interval = poll_interval
+        self.__subdir_re = subdir_re
+        self.__suffix = suffix.encode()
+        # watch descriptors of the sub-directories being watched
+        self.__subdirs: Dict[int, str] = {}
+        # self-pipe used to interrupt wait() from a signal handler
+        self.__wake_read, self.__wake_write = os.pipe()
+        os.set_blocking(self.__wake_read, False)
+        os.set_blocking(self.__wake_write, False)
+
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+            mask = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+            if subdir_re is not None:
+                mask |= IN_CREATE
+            if libc.inotify_add_watch(fd, bytes(path), mask) < 0:
+                errno = ctypes.get_errno()
+                os.close(fd)
+                raise OSError(errno, os.strerror(errno))
+            self.__inotify_fd = fd
+            self.__libc = libc
+        except (AttributeError, OSError) as e:
+            logger.warning("inotify is not available for %s: %s", path, e)
+            return
+
+        if subdir_re is not None:
+            with os.scandir(str(path)) as entries:
+                for entry in entries:
+                    if subdir_re.fullmatch(entry.name) and entry.is_dir():
+                        self.__add_subdir(entry.name)
+
+    @property
+    def inotify_enabled(self) -> bool:
+        """
+        True if inotify is being used to watch the spool directory.
+        """
+        return self.__inotify_fd is not None
+
+    def close(self):
+        """
+        Release the file descriptors used by this watcher.
+        """
+        if self.__inotify_fd is not None:
+            os.close(self.__inotify_fd)
+            self.__inotify_fd = None
+        if self.__wake_read is not None:
+            os.close(self.__wake_read)
+            os.close(self.__wake_write)
+            self.__wake_read = None
+            self.__wake_write = None
+
+    def wait(self) -> bool:
+        """
+        Block until a spool file has been written, `wake` is called or
+        the poll interval expires.
+
+        Returns True if a spool file event was received.
+        """
+        fds = [self.__wake_read]
+        if self.__inotify_fd is not None:
+            fds.append(self.__inotify_fd)
+        readable, _, _ = select.select(fds, [], [], self.__poll_interval)
+
+        if self.__wake_read in readable:
+            self.__drain(self.__wake_read)
+
+        if self.__inotify_fd is not None and self.__inotify_fd in readable:
+            return self.__read_events()
+        return False
+
+    def wake(self):
+        """
+        Interrupt a call to `wait`. Safe to call from a signal handler.
+        """
+        try:
+            os.write(self.__wake_write, b"\0")
+        except (BlockingIOError, TypeError):
+            # pipe is full (a wake up is already pending) or closed
+            pass
+
+    def __add_subdir(self, name: str):
+        wd = self.__libc.inotify_add_watch(  # type: ignore
+            self.__inotify_fd, bytes(self.__path / name), IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+        )
+        if wd < 0:
+            errno = ctypes.get_errno()
+            logger.warning("Failed to watch %s: %s", self.__path / name, os.strerror(errno))
+        else:
+            self.__subdirs[wd] = name
+
+    @staticmethod
+    def __drain(fd: int) -> bytes:
+        data = b""
+        while True:
+            try:
+                chunk = os.read(fd, 4096)
+            except BlockingIOError:
+                break
+            if not chunk:
+                break
+            data += chunk
+        return data
+
+    def __read_events(self) -> bool:
+        data = self.__drain(self.__inotify_fd)
+        found = False
+        offset = 0
+        # the old names of renamed files, keyed on the event's cookie
+        moved_from: Dict[int, bytes] = {}
+        while offset + INOTIFY_EVENT.size <= len(data):
+            wd, mask, cookie, name_len = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = data[offset:offset + name_len].rstrip(b"\0")
+            offset += name_len
+            if mask & IN_Q_OVERFLOW:
+                logger.warning("inotify queue overflow for %s", self.__path)
+                found = True
+            elif mask & IN_ISDIR:
+                subdir = name.decode(errors="replace")
+                if (
+                    wd not in self.__subdirs
+                    and mask & (IN_CREATE | IN_MOVED_TO)
+                    and self.__subdir_re is not None
+                    and self.__subdir_re.fullmatch(subdir)
+                ):
+                    logger.debug("watching new sub-directory %s", subdir)
+                    self.__add_subdir(subdir)
+                    # spool files may have been written before the watch
+                    # was added
+                    found = True
+            elif mask & IN_MOVED_FROM:
+                moved_from[cookie] = name
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO) and name.endswith(self.__suffix):
+                if (
+                    mask & IN_MOVED_TO
+                    and self.__lease_infix is not None
+                    and self.__lease_infix in moved_from.get(cookie, b"")
+                ):
+                    logger.debug("ignoring released spool file %s", name.decode(errors="replace"))
+                    continue
+                logger.debug("inotify event for %s", name.decode(errors="replace"))
+                found = True
+        return found
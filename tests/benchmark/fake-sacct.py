@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+# pylint: disable=invalid-name
+
+#
+#  This file is part of Slurm-Mail.
+#
+#  Slurm-Mail is a drop in replacement for Slurm's e-mails to give users
+#  much more information about their jobs compared to the standard Slurm
+#  e-mails.
+#
+#   Copyright (C) 2018-2026 Neil Munday (neil@mundayweb.com)
+#
+#  Slurm-Mail is free software: you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the
+#  Free Software Foundation, either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  Slurm-Mail is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Slurm-Mail.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+fake-sacct.py
+
+A stand in for sacct used by run-benchmark.py. Prints the records held
+in the benchmark's job database for the requested job IDs in the same
+format as `sacct -P -n`.
+"""
+
+import argparse
+import json
+import os
+
+if __name__ == "__main__":
+    with open(os.environ["SLURMMAIL_BENCHMARK_CALLS"], "a", encoding="utf-8") as calls:
+        calls.write("sacct\n")
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-j", dest="job_ids", required=True)
+    parser.add_argument("-n", action="store_true")
+    parser.add_argument("-P", action="store_true")
+    parser.add_argument("-D", dest="duplicates", action="store_true")
+    parser.add_argument("-S", dest="start")
+    parser.add_argument("--fields", required=True)
+    args = parser.parse_args()
+
+    with open(os.environ["SLURMMAIL_BENCHMARK_DB"], encoding="utf-8") as f:
+        db = json.load(f)
+
+    # scron jobs report their last completed run when -D is used
+    records = db["cron_sacct"] if args.duplicates else db["sacct"]
+    fields = args.fields.split(",")
+    lines = []
+    seen = set()
+    for job_id in args.job_ids.split(","):
+        for record in records.get(job_id, []):
+            # like sacct, only report each record once even if it
+            # matches more than one of the requested IDs
+            if record["JobId"] in seen:
+                continue
+            seen.add(record["JobId"])
+            lines.append("|".join(record.get(field, "") for field in fields))
+    if lines:
+        print("\n".join(lines))
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+# pylint: disable=invalid-name
+
+#
+#  This file is part of Slurm-Mail.
+#
+#  Slurm-Mail is a drop in replacement for Slurm's e-mails to give users
+#  much more information about their jobs compared to the standard Slurm
+#  e-mails.
+#
+#   Copyright (C) 2018-2026 Neil Munday (neil@mundayweb.com)
+#
+#  Slurm-Mail is free software: you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the
+#  Free Software Foundation, either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  Slurm-Mail is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Slurm-Mail.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+fake-scontrol.py
+
+A stand in for scontrol used by run-benchmark.py. Supports
+`scontrol -o show job=<id>` using the benchmark's job database.
+"""
+
+import json
+import os
+import sys
+
+if __name__ == "__main__":
+    with open(os.environ["SLURMMAIL_BENCHMARK_CALLS"], "a", encoding="utf-8") as calls:
+        calls.write("scontrol\n")
+
+    job_id = None
+    for arg in sys.argv[1:]:
+        if arg.startswith("job="):
+            job_id = arg[4:]
+    if job_id is None:
+        sys.stderr.write("fake-scontrol: only '-o show job=<id>' is supported\n")
+        sys.exit(1)
+
+    with open(os.environ["SLURMMAIL_BENCHMARK_DB"], encoding="utf-8") as f:
+        db = json.load(f)
+
+    if job_id not in db["scontrol"]:
+        sys.stderr.write("slurm_load_jobs error: Invalid job id specified\n")
+        sys.exit(1)
+    print("\n".join(db["scontrol"][job_id]))
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+# pylint: disable=consider-using-f-string,invalid-name
+
+#
+#  This file is part of Slurm-Mail.
+#
+#  Slurm-Mail is a drop in replacement for Slurm's e-mails to give users
+#  much more information about their jobs compared to the standard Slurm
+#  e-mails.
+#
+#   Copyright (C) 2018-2026 Neil Munday (neil@mundayweb.com)
+#
+#  Slurm-Mail is free software: you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the
+#  Free Software Foundation, either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  Slurm-Mail is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Slurm-Mail.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+job-benchmark.py
+
+Measures the memory used by slurmmail.slurm.Job objects and the time
+taken to create them and to read the properties used when rendering
+e-mails. Optionally compares the results with the Job class from another
+git revision of Slurm-Mail.
+"""
+
+import argparse
+import gc
+import importlib.util
+import json
+import os
+import pathlib
+import pwd
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from typing import Any, Dict, List
+
+BENCHMARK_DIR = pathlib.Path(__file__).resolve().parent
+ROOT_DIR = BENCHMARK_DIR.parent.parent
+START_TS = 1675460419
+DATETIME_FORMAT = "%d/%m/%Y %H:%M:%S"
+# the properties read by get_job_table_values and the e-mail templates
+RENDER_PROPERTIES = [
+    "cpu_efficiency",
+    "end",
+    "max_rss_str",
+    "requested_mem_str",
+    "start",
+    "tres",
+    "used_cpu_str",
+    "user_real_name",
+    "wc_accuracy",
+    "wc_string",
+]
+
+sys.path.insert(0, str(ROOT_DIR / "src"))
+
+
+def load_job_class(revision: str) -> Any:
+    """
+    Load the Job class from the given git revision of slurm.py.
+    """
+    source = subprocess.check_output(
+        ["git", "show", "{0}:src/slurmmail/slurm.py".format(revision)], cwd=ROOT_DIR
+    )
+    spec = importlib.util.spec_from_loader("slurm_{0}".format(revision), loader=None)
+    module = importlib.util.module_from_spec(spec)  # type: ignore
+    exec(compile(source, "slurm.py@{0}".format(revision), "exec"), module.__dict__)  # pylint: disable=exec-used
+    return module.Job  # type: ignore
+
+
+def make_jobs(job_class: Any, num_jobs: int, user: str) -> List[Any]:
+    """
+    Create job array tasks in the same way as slurm-send-mail does.
+    """
+    jobs = []
+    for i in range(num_jobs):
+        job = job_class(DATETIME_FORMAT, "1000_{0}".format(i), 1000 + i)
+        job.cluster = "linux"
+        job.comment = ""
+        job.cpus = 4
+        job.cpu_time = 720
+        job.group = user
+        job.name = "test.jcf"
+        job.nodelist = "node01"
+        job.nodes = "1"
+        job.partition = "all"
+        job.account = "myaccount"
+        job.requested_mem_str = "500M"
+        job.start_ts = START_TS + i
+        job.end_ts = START_TS + i + 180
+        job.used_cpu_usec = 10000
+        job.user = user
+        job.workdir = "/home/{0}".format(user)
+        job.wallclock = 300
+        job.add_tres("billing", "4")
+        job.add_tres("cpu", "4")
+        job.add_tres("mem", "500M")
+        job.add_tres("node", "1")
+        job.state = "COMPLETED"
+        job.exit_code = "0:0"
+        job.max_rss_str = "4832K"
+        job.stdout = "/home/{0}/slurm-1000_{1}.out".format(user, i)
+        job.stderr = job.stdout
+        job.save()
+        jobs.append(job)
+    return jobs
+
+
+def run(job_class: Any, num_jobs: int, reads: int, user: str) -> Dict[str, float]:
+    """
+    Benchmark the given Job class.
+    """
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    jobs = make_jobs(job_class, num_jobs, user)
+    create_seconds = time.perf_counter() - start
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for job in jobs:
+        for _ in range(reads):
+            for prop in RENDER_PROPERTIES:
+                getattr(job, prop)
+    read_seconds = time.perf_counter() - start
+
+    return {
+        "bytes_per_job": round(memory / num_jobs, 1),
+        "create_us_per_job": round(create_seconds / num_jobs * 1e6, 2),
+        "render_us_per_job": round(read_seconds / num_jobs * 1e6, 2),
+    }
+
+
+def main():
+    """
+    Run the benchmark and report the results.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark slurmmail.slurm.Job", add_help=True)
+    parser.add_argument("--jobs", type=int, default=20000, help="number of jobs to create")
+    parser.add_argument(
+        "--reads", type=int, default=3, help="number of times each property is read per job"
+    )
+    parser.add_argument("--baseline", help="git revision to compare against, e.g. a release tag")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    # pylint: disable=import-outside-toplevel
+    from slurmmail.slurm import Job
+
+    user = pwd.getpwuid(os.getuid()).pw_name
+    results = {"current": run(Job, args.jobs, args.reads, user)}
+    if args.baseline:
+        results[args.baseline] = run(load_job_class(args.baseline), args.jobs, args.reads, user)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print("{0:<20} {1}".format("", " ".join("{0:>20}".format(name) for name in results)))
+        for key in results["current"]:
+            print("{0:<20} {1}".format(key, " ".join("{0:>20}".format(r[key]) for r in results.values())))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
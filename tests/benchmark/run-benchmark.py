@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+
+# pylint: disable=consider-using-f-string,invalid-name,too-many-locals
+
+#
+#  This file is part of Slurm-Mail.
+#
+#  Slurm-Mail is a drop in replacement for Slurm's e-mails to give users
+#  much more information about their jobs compared to the standard Slurm
+#  e-mails.
+#
+#   Copyright (C) 2018-2026 Neil Munday (neil@mundayweb.com)
+#
+#  Slurm-Mail is free software: you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the
+#  Free Software Foundation, either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  Slurm-Mail is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Slurm-Mail.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+run-benchmark.py
+
+Benchmarks slurm-send-mail against synthetic spool files. sacct and
+scontrol are replaced by the fake-*.py scripts in this directory and
+e-mails are delivered to an in-process aiosmtpd server.
+"""
+
+import argparse
+import configparser
+import grp
+import json
+import logging
+import os
+import pathlib
+import pwd
+import resource
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+from typing import Dict, List
+
+import aiosmtpd.controller
+
+BENCHMARK_DIR = pathlib.Path(__file__).resolve().parent
+ROOT_DIR = BENCHMARK_DIR.parent.parent
+START_TS = 1675460419
+
+logging.getLogger("mail.log").setLevel(logging.WARNING)
+
+
+class CountingHandler:
+    # pylint: disable=too-few-public-methods
+    """
+    aiosmtpd handler that counts the e-mails received.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.received = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        """
+        Handle the e-mail itself.
+        """
+        # pylint: disable=unused-argument
+        with self.lock:
+            self.received += 1
+        return "250 Message accepted for delivery"
+
+
+class JobDatabase:
+    # pylint: disable=too-many-instance-attributes
+    """
+    Builds the sacct and scontrol records returned by the fake commands
+    along with the spool files that slurm-spool-mail would have written.
+    """
+
+    def __init__(self, work_dir: pathlib.Path, user: str, group: str, output_lines: int):
+        self.cron_sacct: Dict[str, List[Dict[str, str]]] = {}
+        self.next_job_id = 1000
+        self.output_dir = work_dir / "output"
+        self.output_dir.mkdir()
+        self.output_lines = output_lines
+        self.sacct: Dict[str, List[Dict[str, str]]] = {}
+        self.scontrol: Dict[str, List[str]] = {}
+        self.spool: List[dict] = []
+        self.group = group
+        self.user = user
+
+    def __allocate(self, count: int) -> int:
+        job_id = self.next_job_id
+        self.next_job_id += count
+        return job_id
+
+    def __output_file(self, name: str) -> str:
+        path = self.output_dir / "slurm-{0}.out".format(name)
+        with path.open("w", encoding="utf-8") as f:
+            for i in range(self.output_lines):
+                f.write("step {0}: residual {1:.6e} converged=no\n".format(i, 1.0 / (i + 1)))
+        return str(path)
+
+    def __sacct_rows(self, job_id: str, raw_id: int, state: str = "COMPLETED") -> List[Dict[str, str]]:
+        job = {
+            "JobId": job_id,
+            "User": self.user,
+            "Group": self.group,
+            "Partition": "all",
+            "Account": "myaccount",
+            "Start": str(START_TS),
+            "End": str(START_TS + 180),
+            "State": state,
+            "ReqMem": "500M",
+            "MaxRSS": "",
+            "NCPUS": "4",
+            "CPUTimeRaw": "720",
+            "TotalCPU": "00:10:00",
+            "NNodes": "1",
+            "WorkDir": str(self.output_dir),
+            "Elapsed": "00:03:00",
+            "ExitCode": "0:0",
+            "AdminComment": "",
+            "Comment": "",
+            "Cluster": "benchmark",
+            "NodeList": "node01",
+            "TimeLimit": "00:05:00",
+            "TimelimitRaw": "5",
+            "JobIdRaw": str(raw_id),
+            "AllocTRES": "billing=4,cpu=4,mem=500M,node=1",
+            "JobName": "benchmark.jcf",
+        }
+        batch = dict(job)
+        batch.update(
+            {
+                "JobId": "{0}.batch".format(job_id),
+                "User": "",
+                "Group": "",
+                "Partition": "",
+                "MaxRSS": "4832K",
+                "JobIdRaw": "{0}.batch".format(raw_id),
+                "AllocTRES": "cpu=4,mem=500M,node=1",
+                "JobName": "batch",
+            }
+        )
+        return [job, batch]
+
+    def __scontrol_line(self, raw_id: int, output_file: str, extra: str = "") -> str:
+        return (
+            "JobId={0} {1}JobName=benchmark.jcf UserId={2}({3}) GroupId={4}({5})"
+            " Account=myaccount QOS=normal JobState=COMPLETED Reason=None ExitCode=0:0"
+            " RunTime=00:03:00 TimeLimit=00:05:00 Partition=all NodeList=node01"
+            " NumNodes=1 NumCPUs=4 TRES=cpu=4,mem=500M,node=1,billing=4"
+            " Command={6}/benchmark.jcf WorkDir={6} StdErr={7} StdIn=/dev/null"
+            " StdOut={7} Power= MailUser={2} MailType=END".format(
+                raw_id,
+                extra,
+                self.user,
+                os.getuid(),
+                self.group,
+                os.getgid(),
+                self.output_dir,
+                output_file,
+            )
+        )
+
+    def __spool(self, job_id: int, array_summary: bool = False):
+        self.spool.append(
+            {
+                "job_id": job_id,
+                "state": "Ended",
+                "email": "{0}@example.com".format(self.user),
+                "array_summary": array_summary,
+            }
+        )
+
+    def add_array(self, size: int):
+        """
+        Add a job array with `size` tasks, each of which sends an e-mail,
+        plus the array summary e-mail.
+        """
+        array_id = self.__allocate(size)
+        all_rows = []
+        all_lines = []
+        for task in range(size):
+            raw_id = array_id + task
+            job_id = "{0}_{1}".format(array_id, task)
+            rows = self.__sacct_rows(job_id, raw_id)
+            line = self.__scontrol_line(
+                raw_id,
+                self.__output_file(job_id),
+                "ArrayJobId={0} ArrayTaskId={1} ".format(array_id, task),
+            )
+            self.sacct[str(raw_id)] = rows
+            all_rows += rows
+            all_lines.append(line)
+            self.__spool(raw_id)
+        self.sacct[str(array_id)] = all_rows
+        self.scontrol[str(array_id)] = all_lines
+        self.__spool(array_id, array_summary=True)
+
+    def add_hetjob(self):
+        """
+        Add a heterogeneous job with two components.
+        """
+        het_id = self.__allocate(2)
+        rows = []
+        for component in range(2):
+            job_id = "{0}+{1}".format(het_id, component)
+            rows += self.__sacct_rows(job_id, het_id + component)
+            self.scontrol[job_id] = [
+                self.__scontrol_line(
+                    het_id + component,
+                    self.__output_file(job_id),
+                    "HetJobId={0} HetJobOffset={1} ".format(het_id, component),
+                )
+            ]
+        self.sacct[str(het_id)] = rows
+        self.__spool(het_id)
+
+    def add_job(self):
+        """
+        Add a single job.
+        """
+        job_id = self.__allocate(1)
+        self.sacct[str(job_id)] = self.__sacct_rows(str(job_id), job_id)
+        self.scontrol[str(job_id)] = [self.__scontrol_line(job_id, self.__output_file(str(job_id)))]
+        self.__spool(job_id)
+
+    def add_scron(self):
+        """
+        Add a scron job whose last run has completed.
+        """
+        job_id = self.__allocate(1)
+        self.sacct[str(job_id)] = self.__sacct_rows(str(job_id), job_id, "PENDING")
+        self.cron_sacct[str(job_id)] = self.__sacct_rows(str(job_id), job_id)
+        self.scontrol[str(job_id)] = [
+            self.__scontrol_line(job_id, self.__output_file(str(job_id)), "CronJob=Yes ")
+        ]
+        self.__spool(job_id)
+
+    def save(self, db_file: pathlib.Path, spool_dir: pathlib.Path):
+        """
+        Write the job database used by the fake commands and the spool files.
+        """
+        with db_file.open("w", encoding="utf-8") as f:
+            json.dump({"cron_sacct": self.cron_sacct, "sacct": self.sacct, "scontrol": self.scontrol}, f)
+        for i, data in enumerate(self.spool):
+            spool_file = spool_dir / "{0}_{1}.mail".format(data["job_id"], START_TS + i)
+            with spool_file.open("w", encoding="utf-8") as f:
+                json.dump(data, f)
+
+
+def get_free_port() -> int:
+    """
+    Returns a free TCP port on the loopback interface.
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values: List[float], pc: float) -> float:
+    """
+    Returns the given percentile (nearest rank) of the values.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pc / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def write_config(args: argparse.Namespace, work_dir: pathlib.Path, spool_dir: pathlib.Path, port: int):
+    """
+    Create a copy of Slurm-Mail's configuration that uses the fake commands
+    and the local mail server.
+    """
+    conf_dir = work_dir / "etc"
+    shutil.copytree(ROOT_DIR / "etc" / "slurm-mail", conf_dir)
+    config = configparser.RawConfigParser()
+    config.optionxform = str  # type: ignore
+    config.read(conf_dir / "slurm-mail.conf")
+    config.set("common", "spoolDir", str(spool_dir))
+    config.set("slurm-send-mail", "logFile", str(work_dir / "slurm-send-mail.log"))
+    config.set("slurm-send-mail", "sacctExe", str(BENCHMARK_DIR / "fake-sacct.py"))
+    config.set("slurm-send-mail", "scontrolExe", str(BENCHMARK_DIR / "fake-scontrol.py"))
+    config.set("slurm-send-mail", "smtpServer", "127.0.0.1")
+    config.set("slurm-send-mail", "smtpPort", str(port))
+    config.set("slurm-send-mail", "smtpConnections", str(args.smtp_connections))
+    config.set("slurm-send-mail", "includeOutputLines", str(args.tail_lines))
+    config.set("slurm-send-mail", "outputReaderProcesses", str(args.output_readers))
+    with (conf_dir / "slurm-mail.conf").open("w", encoding="utf-8") as f:
+        config.write(f)
+    return conf_dir
+
+
+def main():
+    # pylint: disable=too-many-statements
+    """
+    Generate the spool files, run slurm-send-mail and report the results.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark slurm-send-mail", add_help=True)
+    parser.add_argument("--jobs", type=int, default=200, help="number of single jobs")
+    parser.add_argument("--arrays", type=int, default=2, help="number of job arrays")
+    parser.add_argument("--array-size", type=int, default=100, help="number of tasks per job array")
+    parser.add_argument("--hetjobs", type=int, default=20, help="number of heterogeneous jobs")
+    parser.add_argument("--scron", type=int, default=20, help="number of scron jobs")
+    parser.add_argument("--output-lines", type=int, default=200, help="lines in each job output file")
+    parser.add_argument("--tail-lines", type=int, default=10, help="includeOutputLines setting")
+    parser.add_argument("--smtp-connections", type=int, default=1, help="smtpConnections setting")
+    parser.add_argument("--output-readers", type=int, default=2, help="outputReaderProcesses setting")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--keep", action="store_true", help="keep the working directory")
+    args = parser.parse_args()
+
+    work_dir = pathlib.Path(tempfile.mkdtemp(prefix="slurm-mail-benchmark-"))
+    spool_dir = work_dir / "spool"
+    spool_dir.mkdir()
+    calls_file = work_dir / "calls.log"
+    calls_file.touch()
+    db_file = work_dir / "jobs.json"
+
+    user = pwd.getpwuid(os.getuid()).pw_name
+    group = grp.getgrgid(os.getgid()).gr_name
+    db = JobDatabase(work_dir, user, group, args.output_lines)
+    for _ in range(args.jobs):
+        db.add_job()
+    for _ in range(args.arrays):
+        db.add_array(args.array_size)
+    for _ in range(args.hetjobs):
+        db.add_hetjob()
+    for _ in range(args.scron):
+        db.add_scron()
+    db.save(db_file, spool_dir)
+
+    handler = CountingHandler()
+    port = get_free_port()
+    controller = aiosmtpd.controller.Controller(handler, hostname="127.0.0.1", port=port)
+    controller.start()
+
+    conf_dir = write_config(args, work_dir, spool_dir, port)
+    os.environ["SLURMMAIL_CONF_DIR"] = str(conf_dir)
+    os.environ["SLURMMAIL_BENCHMARK_CALLS"] = str(calls_file)
+    os.environ["SLURMMAIL_BENCHMARK_DB"] = str(db_file)
+
+    # slurmmail reads SLURMMAIL_CONF_DIR on import
+    sys.path.insert(0, str(ROOT_DIR / "src"))
+    import slurmmail.cli  # pylint: disable=import-outside-toplevel
+
+    latencies: List[float] = []
+    process_spool_file = slurmmail.cli.__dict__["__process_spool_file"]
+
+    def timed_process_spool_file(*f_args, **f_kwargs):
+        start = time.perf_counter()
+        try:
+            return process_spool_file(*f_args, **f_kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    slurmmail.cli.__dict__["__process_spool_file"] = timed_process_spool_file
+
+    sys.argv = ["slurm-send-mail"]
+    try:
+        start = time.perf_counter()
+        slurmmail.cli.send_mail_main()
+        elapsed = time.perf_counter() - start
+        # give the mail server a moment to finish with the last e-mail
+        deadline = time.monotonic() + 5
+        while handler.received < len(db.spool) and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        controller.stop()
+
+    with calls_file.open(encoding="utf-8") as f:
+        calls = [line.strip() for line in f if line.strip()]
+
+    results = {
+        "spool_files": len(db.spool),
+        "mails_received": handler.received,
+        "elapsed_seconds": round(elapsed, 3),
+        "mails_per_second": round(handler.received / elapsed, 1) if elapsed > 0 else 0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "subprocesses": len(calls),
+        "sacct_calls": calls.count("sacct"),
+        "scontrol_calls": calls.count("scontrol"),
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "peak_child_rss_kb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+        "spool_files_left": len(list(spool_dir.glob("*.mail"))),
+    }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for key, value in results.items():
+            print("{0:<20} {1}".format(key, value))
+
+    if args.keep:
+        print("working directory: {0}".format(work_dir))
+    else:
+        shutil.rmtree(work_dir)
+
+    return 0 if results["mails_received"] == results["spool_files"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
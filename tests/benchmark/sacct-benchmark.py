@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+# pylint: disable=consider-using-f-string,invalid-name
+
+#
+#  This file is part of Slurm-Mail.
+#
+#  Slurm-Mail is a drop in replacement for Slurm's e-mails to give users
+#  much more information about their jobs compared to the standard Slurm
+#  e-mails.
+#
+#   Copyright (C) 2018-2026 Neil Munday (neil@mundayweb.com)
+#
+#  Slurm-Mail is free software: you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the
+#  Free Software Foundation, either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  Slurm-Mail is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Slurm-Mail.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+sacct-benchmark.py
+
+Compares decoding sacct output with slurmmail.sacct.SacctDecoder against
+parsing it into dictionaries and converting the values with the
+slurmmail.common helpers.
+"""
+
+import argparse
+import json
+import pathlib
+import re
+import sys
+import timeit
+
+from typing import Dict, List
+
+BENCHMARK_DIR = pathlib.Path(__file__).resolve().parent
+ROOT_DIR = BENCHMARK_DIR.parent.parent
+START_TS = 1675460419
+
+sys.path.insert(0, str(ROOT_DIR / "src"))
+
+# pylint: disable=wrong-import-position
+from slurmmail.cli import SACCT_DECODER, SACCT_FIELDS  # noqa: E402
+from slurmmail.common import get_kbytes_from_str, get_usec_from_str  # noqa: E402
+from slurmmail.sacct import decode_kbytes, decode_tres, decode_usec  # noqa: E402
+
+
+def make_sacct_output(tasks: int, steps: int) -> str:
+    """
+    Returns the output of sacct for a job array with the given number of
+    tasks, each of which has the given number of steps.
+    """
+    lines = []
+    for i in range(tasks):
+        job_id = "1000_{0}".format(i)
+        raw_id = 1001 + i
+        lines.append(
+            "{0}|user|group|all|account|{1}|{2}|COMPLETED|2Gc||4|720|1-02:03:04.500|1|/home/user|00:03:00|0:0|||"
+            "linux|node01|00:05:00|5|{3}|billing=4,cpu=4,mem=500M,node=1|test.jcf".format(
+                job_id, START_TS + i, START_TS + i + 180, raw_id
+            )
+        )
+        for step in ["batch", "extern"] + [str(s) for s in range(steps - 2)]:
+            lines.append(
+                "{0}.{1}||||account|{2}|{3}|COMPLETED||{4}K|4|720|02:{5:02d}.{6:03d}|1||00:03:00|0:0|||"
+                "linux|node01|||{7}.{1}|cpu=4,mem=500M,node=1|{1}".format(
+                    job_id, step, START_TS + i, START_TS + i + 180, 4832 + i, i % 60, i % 1000, raw_id
+                )
+            )
+    return "\n".join(lines) + "\n"
+
+
+def parse_sacct_output(stdout: str) -> List[Dict[str, str]]:
+    """
+    Split sacct output into dictionaries keyed by the names in
+    `SACCT_FIELDS`, as slurm-send-mail did before SacctDecoder.
+    """
+    field_num = len(SACCT_FIELDS)
+    rows = []
+    for line in stdout.split("\n"):
+        data = line.split("|", (field_num - 1))
+        if len(data) == field_num:
+            rows.append(dict(zip(SACCT_FIELDS, data)))
+    return rows
+
+
+def decode_with_helpers(stdout: str) -> List[Dict[str, object]]:
+    """
+    Convert sacct output the way slurm-send-mail did before SacctDecoder.
+    """
+    records = []
+    for row in parse_sacct_output(stdout):
+        record: Dict[str, object] = dict(row)
+        record["is_job"] = re.match(
+            r"^([0-9]+|[0-9]+_[0-9]+|[0-9]+_\[[0-9]+-[0-9]+\]|[0-9]+\+[0-9]+)$", row["JobId"]
+        ) is not None
+        record["MaxRSS"] = get_kbytes_from_str(row["MaxRSS"])
+        record["ReqMem"] = get_kbytes_from_str(row["ReqMem"][:-1])
+        record["TotalCPU"] = get_usec_from_str(row["TotalCPU"])
+        if record["is_job"]:
+            record["JobIdRaw"] = int(row["JobIdRaw"])
+            record["Start"] = int(row["Start"])
+            record["End"] = int(row["End"])
+            record["NCPUS"] = int(row["NCPUS"])
+            record["CPUTimeRaw"] = int(row["CPUTimeRaw"])
+            record["TimelimitRaw"] = int(row["TimelimitRaw"])
+            record["AllocTRES"] = [item.split("=", 1) for item in row["AllocTRES"].split(",")]
+        records.append(record)
+    return records
+
+
+def decode_block(stdout: str) -> list:
+    """
+    Decode sacct output with SacctDecoder, starting with empty caches.
+    """
+    for converter in [decode_kbytes, decode_tres, decode_usec]:
+        converter.cache_clear()  # type: ignore
+    return SACCT_DECODER.decode_block(stdout)
+
+
+def best_of(repeat: int, func, *args) -> float:
+    """
+    Returns the fastest time in seconds of calling func(*args).
+    """
+    return min(timeit.repeat(lambda: func(*args), number=1, repeat=repeat))
+
+
+def main():
+    """
+    Run the benchmark and report the results.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark slurmmail.sacct", add_help=True)
+    parser.add_argument("--tasks", type=int, default=2000, help="number of job array tasks")
+    parser.add_argument("--steps", type=int, default=4, help="number of steps per task (at least 2)")
+    parser.add_argument("--repeat", type=int, default=5, help="number of times to repeat each measurement")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    stdout = make_sacct_output(args.tasks, max(2, args.steps))
+    lines = stdout.count("\n")
+    # distinct values so that the decoders' caches do not help
+    kbytes_values = ["{0}K".format(4832 + i) for i in range(lines)]
+    usec_values = ["{0}-{1:02d}:{2:02d}:{3:02d}".format(i // 86400, i // 3600 % 24, i // 60 % 60, i % 60)
+                   for i in range(lines)]
+    results = {}
+    for name, helper, decoder, values in [
+        ("rows", decode_with_helpers, decode_block, None),
+        ("kbytes", get_kbytes_from_str, decode_kbytes, kbytes_values),
+        ("usec", get_usec_from_str, decode_usec, usec_values),
+    ]:
+        if values is None:
+            helper_seconds = best_of(args.repeat, helper, stdout)
+            decoder_seconds = best_of(args.repeat, decoder, stdout)
+        else:
+            helper_seconds = best_of(args.repeat, lambda f=helper, values=values: [f(v) for v in values])
+            # clear the cache so that each repeat decodes every value
+            decoder_seconds = best_of(
+                args.repeat, lambda f=decoder, values=values: (f.cache_clear(), [f(v) for v in values])  # type: ignore
+            )
+        results[name] = {
+            "common_us": round(helper_seconds / lines * 1e6, 3),
+            "decoder_us": round(decoder_seconds / lines * 1e6, 3),
+            "speedup": round(helper_seconds / decoder_seconds, 2),
+        }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print("{0:<20} {1:>12} {2:>12} {3:>12}".format("", "common_us", "decoder_us", "speedup"))
+        for name, result in results.items():
+            print("{0:<20} {1:>12} {2:>12} {3:>12}".format(
+                name, result["common_us"], result["decoder_us"], result["speedup"]
+            ))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+# pylint: disable=consider-using-f-string,invalid-name
+
+#
+#  This file is part of Slurm-Mail.
+#
+#  Slurm-Mail is a drop in replacement for Slurm's e-mails to give users
+#  much more information about their jobs compared to the standard Slurm
+#  e-mails.
+#
+#   Copyright (C) 2018-2026 Neil Munday (neil@mundayweb.com)
+#
+#  Slurm-Mail is free software: you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the
+#  Free Software Foundation, either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  Slurm-Mail is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Slurm-Mail.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""
+spool-benchmark.py
+
+Measures the start-up time of slurm-spool-mail, which slurmctld runs for
+every e-mail notification. Reports the cumulative import time of
+slurmmail.spool (from `python -X importtime`) and the wall-clock time of
+running slurm-spool-mail many times. Exits with a non-zero return code if
+slurmmail.spool imports any of the modules used to send e-mails or if a
+limit given on the command line is exceeded.
+"""
+
+import argparse
+import json
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR = pathlib.Path(__file__).resolve().parent
+ROOT_DIR = BENCHMARK_DIR.parent.parent
+SRC_DIR = ROOT_DIR / "src"
+# modules that slurm-spool-mail must not import
+FORBIDDEN_MODULES = [
+    "argparse",
+    "email.mime.multipart",
+    "grp",
+    "pwd",
+    "slurmmail.cli",
+    "slurmmail.common",
+    "slurmmail.slurm",
+    "smtplib",
+    "subprocess",
+]
+SPOOL_MAIN = "from slurmmail.spool import spool_mail_main; spool_mail_main()"
+
+
+def get_import_times(module: str, env: dict) -> dict:
+    """
+    Returns the cumulative import time in microseconds of each module
+    imported by `import module`.
+    """
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import {0}".format(module)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True, check=True
+    ).stderr
+    times = {}
+    for line in output.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdecimal():
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def run_spool_mail(runs: int, env: dict, spool_dir: pathlib.Path) -> list:
+    """
+    Run slurm-spool-mail the given number of times, returning the
+    wall-clock time in milliseconds of each run.
+    """
+    timings = []
+    for i in range(runs):
+        cmd = [
+            sys.executable, "-c", SPOOL_MAIN, "-s",
+            "Slurm Job_id={0} Name=test.jcf Began, Queued time 00:00:01".format(1000 + i), "root"
+        ]
+        start = time.perf_counter()
+        subprocess.run(cmd, env=env, check=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    spool_files = len(list(spool_dir.glob("*.mail")))
+    if spool_files != runs:
+        sys.stderr.write("Expected {0} spool files, found {1}\n".format(runs, spool_files))
+        sys.exit(1)
+    return timings
+
+
+def main():
+    # pylint: disable=too-many-locals
+    """
+    Run the benchmark and report the results.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark slurm-spool-mail start-up", add_help=True)
+    parser.add_argument("--runs", type=int, default=1000, help="number of times to run slurm-spool-mail")
+    parser.add_argument("--max-import-ms", type=float, help="fail if importing slurmmail.spool takes longer")
+    parser.add_argument("--max-p50-ms", type=float, help="fail if the median run time is longer")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_path = pathlib.Path(tmp_dir)
+        spool_dir = tmp_path / "spool"
+        spool_dir.mkdir()
+        conf_file = tmp_path / "slurm-mail.conf"
+        conf_file.write_text(
+            "[common]\nspoolDir = {0}\n[slurm-spool-mail]\nlogFile = {1}\nverbose = false\n".format(
+                spool_dir, tmp_path / "slurm-spool-mail.log"
+            )
+        )
+        env = dict(os.environ, PYTHONPATH=str(SRC_DIR), SLURMMAIL_CONF_FILE=str(conf_file))
+
+        spool_imports = get_import_times("slurmmail.spool", env)
+        cli_imports = get_import_times("slurmmail.cli", env)
+        baseline = get_import_times("json, logging, configparser", env)
+        timings = run_spool_mail(args.runs, env, spool_dir)
+
+    timings.sort()
+    results = {
+        "spool_import_ms": round(spool_imports["slurmmail.spool"] / 1000, 2),
+        "cli_import_ms": round(cli_imports["slurmmail.cli"] / 1000, 2),
+        "stdlib_import_ms": round(sum(baseline[m] for m in ["json", "logging", "configparser"]) / 1000, 2),
+        "imported_modules": len(spool_imports),
+        "runs": args.runs,
+        "p50_ms": round(statistics.median(timings), 2),
+        "p99_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.99))], 2),
+        "total_s": round(sum(timings) / 1000, 2),
+    }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, value in results.items():
+            print("{0:<20} {1:>12}".format(name, value))
+
+    rc = 0
+    forbidden = [module for module in FORBIDDEN_MODULES if module in spool_imports]
+    if forbidden:
+        sys.stderr.write("slurmmail.spool imports: {0}\n".format(", ".join(forbidden)))
+        rc = 1
+    if args.max_import_ms is not None and results["spool_import_ms"] > args.max_import_ms:
+        sys.stderr.write("Import time {0}ms exceeds {1}ms\n".format(results["spool_import_ms"], args.max_import_ms))
+        rc = 1
+    if args.max_p50_ms is not None and results["p50_ms"] > args.max_p50_ms:
+        sys.stderr.write("Median run time {0}ms exceeds {1}ms\n".format(results["p50_ms"], args.max_p50_ms))
+        rc = 1
+    return rc
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+# pylint: disable=invalid-name
+
+#
+#  This file is part of Slurm-Mail.
+#
+#  Slurm-Mail is a drop in replacement for Slurm's e-mails to give users
+#  much more information about their jobs compared to the standard Slurm
+#  e-mails.
+#
+#   Copyright (C) 2018-2026 Neil Munday (neil@mundayweb.com)
+#
+#  Slurm-Mail is free software: you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the
+#  Free Software Foundation, either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  Slurm-Mail is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Slurm-Mail.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+stub-slurmrestd.py
+
+A stand in for slurmrestd that serves recorded JSON responses so that
+the restd accounting backend can be tested without a Slurm cluster.
+
+GET /slurmdb/v0.0.40/job/2 returns responses/slurmdb/v0.0.40/job/2.json
+and so on. Requests for jobs without a recorded response receive the
+same "Invalid job id specified" error as slurmrestd.
+"""
+
+import argparse
+import json
+import pathlib
+import socketserver
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Union
+
+RESPONSE_DIR = pathlib.Path(__file__).parent / "responses"
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves recorded slurmrestd responses over keep-alive connections.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.handled = 0
+        with self.server.lock:  # type: ignore
+            self.server.connections += 1  # type: ignore
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """
+        Handle a GET request.
+        """
+        with self.server.lock:  # type: ignore
+            self.server.requests.append(self.path)  # type: ignore
+        self.handled += 1
+        if self.server.max_requests and self.handled >= self.server.max_requests:  # type: ignore
+            # drop the connection without telling the client, as an idle
+            # timeout would
+            self.close_connection = True
+        token = self.server.token  # type: ignore
+        if token is not None and self.headers.get("X-SLURM-USER-TOKEN") != token:
+            self.__send(401, {"errors": [{"description": "Authentication failure", "error_number": 1007}]})
+            return
+        response_file = (RESPONSE_DIR / self.path.lstrip("/")).with_suffix(".json")
+        if ".." in self.path or not response_file.is_file():
+            self.__send(
+                500,
+                {"jobs": [], "errors": [{"description": "Invalid job id specified", "error_number": 2017}]},
+            )
+            return
+        with response_file.open() as f:
+            self.__send(200, json.load(f))
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        if self.server.verbose:  # type: ignore
+            super().log_message(format, *args)
+
+    def __send(self, status: int, data: dict):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StubServerMixin:  # pylint: disable=too-few-public-methods
+    """
+    Records the connections and requests received by a stub server.
+    """
+
+    def init_stub(self, token=None, verbose=False, max_requests=0):
+        """
+        Initialise the request counters.
+        """
+        # pylint: disable=attribute-defined-outside-init
+        self.connections = 0
+        self.max_requests = max_requests
+        self.requests = []
+        self.lock = threading.Lock()
+        self.token = token
+        self.verbose = verbose
+
+
+class StubServer(StubServerMixin, ThreadingHTTPServer):
+    """
+    A stub slurmrestd listening on a TCP port.
+    """
+
+    daemon_threads = True
+
+
+class UnixStubServer(StubServerMixin, socketserver.ThreadingUnixStreamServer):
+    """
+    A stub slurmrestd listening on a Unix socket.
+    """
+
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler expects a (host, port) client address
+        return request, ("localhost", 0)
+
+
+def main():
+    """
+    Serve recorded slurmrestd responses until interrupted.
+    """
+    parser = argparse.ArgumentParser(description="Serve recorded slurmrestd responses")
+    parser.add_argument("--host", default="localhost", help="host name to listen on")
+    parser.add_argument("--port", type=int, default=6820, help="port to listen on")
+    parser.add_argument("--socket", help="listen on the given Unix socket instead")
+    parser.add_argument("--token", help="require the given X-SLURM-USER-TOKEN")
+    parser.add_argument(
+        "--max-requests", type=int, default=0, help="close each connection after this many requests"
+    )
+    parser.add_argument("-v", "--verbose", action="store_true", help="log each request")
+    args = parser.parse_args()
+
+    server: Union[StubServer, UnixStubServer]
+    if args.socket:
+        server = UnixStubServer(args.socket, StubRequestHandler)
+    else:
+        server = StubServer((args.host, args.port), StubRequestHandler)
+    server.init_stub(args.token, args.verbose, args.max_requests)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
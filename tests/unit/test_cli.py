@@ -28,18 +28,34 @@ Unit tests for Slurm-Mail.
 """
 
 import configparser
+import contextlib
+import email
+import io
+import itertools
 import tempfile
+import json
 import logging
+import os
 import pathlib
 from os import access
+import signal
 import smtplib
 from typing import Dict, List, Union
-from unittest.mock import MagicMock, mock_open, patch
+from unittest.mock import MagicMock, patch
 import sys
+import time
 
 import pytest  # type: ignore
 
 import slurmmail.cli
+import slurmmail.common
+import slurmmail.delivery
+import slurmmail.deferred
+from slurmmail.deferred import DEFERRED_DIR, DeferredQueue, SpoolFile
+import slurmmail.sacct
+import slurmmail.slurmdb
+import slurmmail.spool
+from slurmmail.spooldb import SPOOL_DB_NAME, SpoolDatabase, SpoolEvent
 
 DUMMY_PATH = pathlib.Path("/tmp")
 
@@ -48,6 +64,7 @@ CONF_FILE = CONF_DIR / "slurm-mail.conf"
 TEMPLATES_DIR = CONF_DIR / "templates"
 HTML_TEMPLATES_DIR = TEMPLATES_DIR / "html"
 TEXT_TEMPLATES_DIR = TEMPLATES_DIR / "text"
+RESTD_RESPONSE_DIR = pathlib.Path(__file__).parents[1] / "restd" / "responses"
 
 #
 # Fixtures
@@ -71,12 +88,6 @@ def mock_get_file_contents():
         yield the_mock
 
 
-@pytest.fixture
-def mock_json_dump():
-    with patch("json.dump") as the_mock:
-        yield the_mock
-
-
 @pytest.fixture
 def mock_os_setegid():
     with patch("os.setegid") as the_mock:
@@ -89,19 +100,6 @@ def mock_os_seteuid():
         yield the_mock
 
 
-@pytest.fixture
-def mock_path_glob():
-    with patch("pathlib.Path.glob") as the_mock:
-        the_mock.return_value = ["1_1673384400.mail", "2_1673384500.mail"]
-        yield the_mock
-
-
-@pytest.fixture
-def mock_path_open():
-    with patch("pathlib.Path.open", new_callable=mock_open) as the_mock:
-        yield the_mock
-
-
 @pytest.fixture
 def mock_raw_config_parser():
     with patch("configparser.RawConfigParser") as mock_config_parser:
@@ -119,21 +117,6 @@ def mock_raw_config_parser_missing_section():
         yield the_mock
 
 
-@pytest.fixture
-def mock_sleep():
-    with patch("slurmmail.cli.sleep") as the_mock:
-        yield the_mock
-
-
-@pytest.fixture
-def mock_sys_argv_job_began():
-    with patch(
-        "sys.argv",
-        ["spool_mail_main", "-s", "Slurm Job_id=1000 Began", "test@example.com"],
-    ) as the_mock:
-        yield the_mock
-
-
 #
 # slurmmail.cli fixtures
 #
@@ -145,12 +128,6 @@ def mock_slurmmail_cli__process_spool_file():
         yield the_mock
 
 
-@pytest.fixture
-def mock_slurmmail_cli_check_dir():
-    with patch("slurmmail.cli.check_dir", return_value=True) as the_mock:
-        yield the_mock
-
-
 @pytest.fixture
 def mock_slurmmail_cli_check_file():
     with patch("slurmmail.cli.check_file", return_value=True) as the_mock:
@@ -171,6 +148,7 @@ def mock_slurmmail_cli_delete_spool_file():
 
 @pytest.fixture
 def mock_slurmmail_cli_process_spool_file_options():
+    # pylint: disable=too-many-statements
     options = slurmmail.cli.ProcessSpoolFileOptions()
     options.array_max_notifications = 0
     options.datetime_format = "%d/%m/%Y %H:%M:%S"
@@ -187,10 +165,13 @@ def mock_slurmmail_cli_process_spool_file_options():
     options.html_templates = {}
     options.html_templates["array_ended"] = HTML_TEMPLATES_DIR / "ended-array.tpl"
     options.html_templates["array_started"] = HTML_TEMPLATES_DIR / "started-array.tpl"
+    options.html_templates["array_stats"] = HTML_TEMPLATES_DIR / "array-stats.tpl"
     options.html_templates["array_summary_started"] = (
         HTML_TEMPLATES_DIR / "started-array-summary.tpl"
     )
     options.html_templates["array_summary_ended"] = HTML_TEMPLATES_DIR / "ended-array-summary.tpl"
+    options.html_templates["digest"] = HTML_TEMPLATES_DIR / "digest.tpl"
+    options.html_templates["digest_job"] = HTML_TEMPLATES_DIR / "digest-job.tpl"
     options.html_templates["ended"] = HTML_TEMPLATES_DIR / "ended.tpl"
     options.html_templates["hetjob_started"] = HTML_TEMPLATES_DIR / "started-hetjob.tpl"
     options.html_templates["hetjob_ended"] = HTML_TEMPLATES_DIR / "ended-hetjob.tpl"
@@ -207,10 +188,13 @@ def mock_slurmmail_cli_process_spool_file_options():
     options.text_templates = {}
     options.text_templates["array_ended"] = TEXT_TEMPLATES_DIR / "ended-array.tpl"
     options.text_templates["array_started"] = TEXT_TEMPLATES_DIR / "started-array.tpl"
+    options.text_templates["array_stats"] = TEXT_TEMPLATES_DIR / "array-stats.tpl"
     options.text_templates["array_summary_started"] = (
         TEXT_TEMPLATES_DIR / "started-array-summary.tpl"
     )
     options.text_templates["array_summary_ended"] = TEXT_TEMPLATES_DIR / "ended-array-summary.tpl"
+    options.text_templates["digest"] = TEXT_TEMPLATES_DIR / "digest.tpl"
+    options.text_templates["digest_job"] = TEXT_TEMPLATES_DIR / "digest-job.tpl"
     options.text_templates["ended"] = TEXT_TEMPLATES_DIR / "ended.tpl"
     options.text_templates["hetjob_started"] = TEXT_TEMPLATES_DIR / "started-hetjob.tpl"
     options.text_templates["hetjob_ended"] = TEXT_TEMPLATES_DIR / "ended-hetjob.tpl"
@@ -230,7 +214,17 @@ def mock_slurmmail_cli_process_spool_file_options():
 @pytest.fixture
 def mock_slurmmail_cli_run_command():
     with patch("slurmmail.cli.run_command") as the_mock:
-        yield the_mock
+        # commands whose output is streamed (i.e. sacct) use the same mock,
+        # so that their output can be given as (rc, stdout, stderr)
+        @contextlib.contextmanager
+        def open_command(cmd):
+            rc, stdout, stderr = the_mock(cmd)
+            yield io.StringIO(stdout)
+            if rc != 0:
+                raise slurmmail.common.CommandException(f"Failed to run {cmd}: {stderr}")
+
+        with patch("slurmmail.cli.open_command", open_command):
+            yield the_mock
 
 
 @pytest.fixture
@@ -239,6 +233,24 @@ def mock_slurmmail_cli_run_scontrol():
         yield the_mock
 
 
+@pytest.fixture
+def mock_slurmmail_cli_run_scontrol_array():
+    with patch("slurmmail.cli.run_scontrol_array") as the_mock:
+        yield the_mock
+
+
+@pytest.fixture
+def mock_slurmmail_cli_scan_spool_dir():
+    # the spool files found are claimed as they are
+    with patch("slurmmail.cli.scan_spool_dir") as the_mock, patch(
+        "slurmmail.cli.claim_spool_file", side_effect=lambda f: f
+    ), patch("slurmmail.deferred.release_spool_file"), patch(
+        "slurmmail.deferred.renew_spool_file", return_value=True
+    ):
+        the_mock.return_value = ["1_1673384400.mail", "2_1673384500.mail"]
+        yield the_mock
+
+
 @pytest.fixture
 def mock_slurmmail_cli_tail_file():
     with patch("slurmmail.cli.tail_file") as the_mock:
@@ -292,6 +304,17 @@ def check_message_logged(caplog, log_level: int, message: str, partial_match: bo
     return False
 
 
+def write_fake_sacct(tmp_path: pathlib.Path, script: str) -> pathlib.Path:
+    """
+    Write a shell script to use instead of sacct. The arguments it was
+    called with are saved in tmp_path / "args".
+    """
+    sacct_exe = tmp_path / "sacct"
+    sacct_exe.write_text(f"#!/bin/sh\necho \"$@\" > {tmp_path / 'args'}\n{script}\n")
+    sacct_exe.chmod(0o755)
+    return sacct_exe
+
+
 def check_template_used(the_mock: MagicMock, template_name: str):
     call_found = False
     for call in the_mock.mock_calls:
@@ -375,6 +398,26 @@ class TestCli:
         assert scontrol_dict is None
         assert not check_message_logged(caplog, logging.ERROR, "Error")
 
+    def test_run_scontrol_array(self, mock_slurmmail_cli_run_command):
+        scontrol_output = (
+            "JobId=7 ArrayJobId=7 ArrayTaskId=1 JobName=test.jcf StdErr=/root/slurm-7_1.out"
+            " StdIn=/dev/null StdOut=/root/slurm-7_1.out\n"
+            "JobId=8 ArrayJobId=7 ArrayTaskId=0 JobName=test.jcf StdErr=/root/slurm-7_0.out"
+            " StdIn=/dev/null StdOut=/root/slurm-7_0.out\n"
+        )
+        mock_slurmmail_cli_run_command.return_value = (0, scontrol_output, "")
+
+        tasks = slurmmail.cli.run_scontrol_array("7", pathlib.Path("/usr/bin/scontrol"))
+
+        mock_slurmmail_cli_run_command.assert_called_once_with("/usr/bin/scontrol -o show job=7")
+        assert sorted(tasks) == ["7", "8"]
+        assert tasks["7"]["StdOut"] == "/root/slurm-7_1.out"
+        assert tasks["8"]["StdOut"] == "/root/slurm-7_0.out"
+
+    def test_run_scontrol_array_invalid_job_id(self, mock_slurmmail_cli_run_command):
+        mock_slurmmail_cli_run_command.return_value = (1, "", "Invalid job id specified")
+        assert slurmmail.cli.run_scontrol_array("7", pathlib.Path("/usr/bin/scontrol")) is None
+
     def test_get_scontrol_values(self):
         scontrol_output = (
             "JobId=1 JobName=test UserId=root(0) GroupId=root(0) MCS_label=N/A"
@@ -401,6 +444,107 @@ class TestCli:
         assert scontrol_dict["JobName"] == "test"
         assert "JobId" in scontrol_dict
         assert scontrol_dict["JobId"] == "1"
+        assert scontrol_dict["TRES"] == "cpu=1,node=1,billing=1"
+        assert scontrol_dict["AllocNode:Sid"] == "631cc24917ee:218"
+        assert scontrol_dict["Power"] == ""
+
+    def test_get_scontrol_values_spaces(self):
+        scontrol_dict = slurmmail.cli.get_scontrol_values(
+            "JobId=1 Command=/root/test.jcf --input a.txt WorkDir=/root Comment= StdOut=/root/slurm-1.out\n"
+        )
+        assert scontrol_dict == {
+            "JobId": "1",
+            "Command": "/root/test.jcf --input a.txt",
+            "WorkDir": "/root",
+            "Comment": "",
+            "StdOut": "/root/slurm-1.out",
+        }
+
+    def test_get_scontrol_jobs(self):
+        scontrol_output = (
+            "JobId=7 ArrayJobId=7 ArrayTaskId=1 TRES=cpu=1,node=1 StdOut=/root/slurm-7_1.out\n"
+            "JobId=8 ArrayJobId=7 ArrayTaskId=0 TRES=cpu=2,node=1 StdOut=/root/slurm-7_0.out\n"
+            "\n"
+        )
+        jobs = slurmmail.cli.get_scontrol_jobs(scontrol_output)
+        assert sorted(jobs) == ["7", "8"]
+        assert jobs["7"]["StdOut"] == "/root/slurm-7_1.out"
+        assert jobs["8"]["TRES"] == "cpu=2,node=1"
+        assert jobs["8"]["StdOut"] == "/root/slurm-7_0.out"
+        assert slurmmail.cli.get_scontrol_jobs("") == {}
+
+    def test_get_sacct_rows(self, mock_slurmmail_cli_run_command):
+        options = slurmmail.cli.ProcessSpoolFileOptions()
+        options.sacct_exe = pathlib.Path("/usr/bin/sacct")
+        options.sacct_batch_size = 2
+        sacct_output_1 = (
+            "1|root|root|all|myaccount|1674333232|Unknown|RUNNING|500M||1|0|00:00:00|1|/|00:00:11|0:0|||test|node01|01:00:00|60|1|billing=1,cpu=1,node=1|test.jcf\n"
+            "1.batch||||myaccount|1674333232|Unknown|RUNNING|||1|0|00:00:00|1||00:00:11|0:0|||test|node01|||1.batch|cpu=1,mem=0,node=1|batch\n"
+            "2_1|root|root|all|myaccount|1674333232|Unknown|RUNNING|500M||1|0|00:00:00|1|/|00:00:11|0:0|||test|node01|01:00:00|60|3|billing=1,cpu=1,node=1|test.jcf\n"
+        )
+        sacct_output_2 = ""
+        mock_slurmmail_cli_run_command.side_effect = [(0, sacct_output_1, ""), (0, sacct_output_2, "")]
+
+        rows = slurmmail.cli.get_sacct_rows([1, 3, 4, 1], options)
+
+        assert mock_slurmmail_cli_run_command.call_count == 2
+        assert "-j 1,3 " in mock_slurmmail_cli_run_command.call_args_list[0][0][0]
+        assert "-j 4 " in mock_slurmmail_cli_run_command.call_args_list[1][0][0]
+        assert [row.job_id for row in rows[1]] == ["1", "1.batch"]
+        # array task 2_1 has a raw job ID of 3
+        assert [row.job_id for row in rows[3]] == ["2_1"]
+        assert rows[4] == []
+
+    def test_get_sacct_rows_failure(self, mock_slurmmail_cli_run_command):
+        options = slurmmail.cli.ProcessSpoolFileOptions()
+        options.sacct_exe = pathlib.Path("/usr/bin/sacct")
+        mock_slurmmail_cli_run_command.return_value = (1, "", "Error")
+
+        rows = slurmmail.cli.get_sacct_rows([1, 2], options)
+
+        assert not rows
+
+    def test_get_sacct_rows_restd(self, mock_slurmmail_cli_run_command):
+        options = slurmmail.cli.ProcessSpoolFileOptions()
+        options.restd = MagicMock()
+        options.restd.get_sacct_rows.side_effect = [
+            [{"JobId": "1", "JobIdRaw": "1"}, {"JobId": "1.batch", "JobIdRaw": "1.batch"}],
+            [],
+        ]
+
+        rows = slurmmail.cli.get_sacct_rows([1, 2], options)
+
+        mock_slurmmail_cli_run_command.assert_not_called()
+        assert options.restd.get_sacct_rows.call_count == 2
+        assert [row.job_id for row in rows[1]] == ["1", "1.batch"]
+        assert rows[2] == []
+
+    def test_run_sacct_json(self, tmp_path):
+        options = slurmmail.cli.ProcessSpoolFileOptions()
+        options.accounting_backend = "sacct-json"
+        options.sacct_exe = write_fake_sacct(
+            tmp_path, f"cat {RESTD_RESPONSE_DIR / 'slurmdb' / 'v0.0.40' / 'job' / '7.json'}"
+        )
+
+        rows = slurmmail.cli.run_sacct([7], options)
+
+        assert (tmp_path / "args").read_text().strip() == "-j 7 --json"
+        assert [row.job_id for row in rows] == ["7_1", "7_1.batch", "7_2", "7_2.batch"]
+
+    def test_run_sacct_json_failure(self, caplog, tmp_path):
+        options = slurmmail.cli.ProcessSpoolFileOptions()
+        options.accounting_backend = "sacct-json"
+        options.sacct_exe = write_fake_sacct(tmp_path, "echo 'sacct: unrecognized option' >&2; exit 1")
+
+        assert slurmmail.cli.run_sacct([7], options) is None
+        assert check_message_logged(caplog, logging.ERROR, "sacct: unrecognized option", partial_match=True)
+
+    def test_run_sacct_json_invalid(self, tmp_path):
+        options = slurmmail.cli.ProcessSpoolFileOptions()
+        options.accounting_backend = "sacct-json"
+        options.sacct_exe = write_fake_sacct(tmp_path, "echo '{\"jobs\": [{\"job_id\": 7}, {'")
+
+        assert slurmmail.cli.run_sacct([7], options) is None
 
     def test_resolve_user_email(self):
         proccess_spool_file_options = slurmmail.cli.ProcessSpoolFileOptions()
@@ -421,6 +565,64 @@ class TestCli:
 
         assert slurmmail.cli.resolve_user_email("foo,bar", proccess_spool_file_options) is None
 
+    def test_iter_jobs(self, mock_slurmmail_cli_process_spool_file_options, mock_slurmmail_cli_run_scontrol):
+        mock_slurmmail_cli_run_scontrol.return_value = None
+        sacct_output = "1|root|root|all|myaccount|1674333232|1674333242|COMPLETED|500M||1|0|00:00:00|2|/|00:00:10|0:0|||test|node[01-02]|01:00:00|60|1|billing=1,cpu=1,node=2|test.jcf\n"  # noqa
+        iter_jobs = slurmmail.cli.__dict__["__iter_jobs"]
+        rows = slurmmail.cli.SACCT_DECODER.decode_block(sacct_output)
+        job = next(iter_jobs(
+            rows,
+            first_job_id=1,
+            state="Ended",
+            array_summary=False,
+            slurm_env={},
+            options=mock_slurmmail_cli_process_spool_file_options,
+            scontrol_arrays=None,
+        ))
+        # the values passed to the templates are the same types as sacct's
+        assert job.nodes == 2
+        assert job.nodelist == "node[01-02]"
+        assert job.exit_code == "0:0"
+
+
+class TestTemplateRegistry:
+    """
+    Test slurmmail.cli.TemplateRegistry
+    """
+
+    def test_templates_cached(self, mock_get_file_contents, mock_slurmmail_cli_process_spool_file_options):
+        options = mock_slurmmail_cli_process_spool_file_options
+        registry = slurmmail.cli.TemplateRegistry(options.html_templates, options.text_templates)
+        assert registry.html("job_table") is registry.html("job_table")
+        assert registry.text("job_table") is registry.text("job_table")
+        assert registry.html("job_table") is not registry.text("job_table")
+        assert mock_get_file_contents.call_count == 2
+
+    def test_refresh(self, mock_get_file_contents):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tpl_file = pathlib.Path(tmp_dir) / "signature.tpl"
+            tpl_file.write_text("From $EMAIL_FROM")
+            registry = slurmmail.cli.TemplateRegistry({"signature": tpl_file}, {"signature": tpl_file})
+            assert registry.signature("Admin").html == "From Admin"
+
+            # unchanged templates are not reloaded
+            registry.refresh()
+            registry.html("signature")
+            assert mock_get_file_contents.call_count == 1
+
+            tpl_file.write_text("Regards $EMAIL_FROM")
+            os.utime(tpl_file, (0, 0))
+            registry.refresh()
+            assert registry.signature("Admin").html == "Regards Admin"
+            assert registry.signature("Admin").text == "Regards Admin"
+            assert mock_get_file_contents.call_count == 2
+
+    def test_signature_cached(self, mock_slurmmail_cli_process_spool_file_options):
+        options = mock_slurmmail_cli_process_spool_file_options
+        registry = slurmmail.cli.TemplateRegistry(options.html_templates, options.text_templates)
+        assert registry.signature("Slurm Admin") is registry.signature("Slurm Admin")
+        assert "Slurm Admin" in registry.signature("Slurm Admin").text
+
 
 class MockRawConfigParser(configparser.RawConfigParser):
     """
@@ -508,7 +710,7 @@ class TestProcessSpoolFile:
             spool_file.flush()
 
             slurmmail.cli.__dict__["__process_spool_file"](
-                pathlib.Path(spool_file.name),
+                SpoolFile(pathlib.Path(spool_file.name)),
                 None,
                 mock_slurmmail_cli_process_spool_file_options,
             )
@@ -524,7 +726,7 @@ class TestProcessSpoolFile:
             spool_file.flush()
 
             slurmmail.cli.__dict__["__process_spool_file"](
-                pathlib.Path(spool_file.name),
+                SpoolFile(pathlib.Path(spool_file.name)),
                 None,
                 mock_slurmmail_cli_process_spool_file_options,
             )
@@ -546,7 +748,7 @@ class TestProcessSpoolFile:
             spool_file.flush()
 
             slurmmail.cli.__dict__["__process_spool_file"](
-                pathlib.Path(spool_file.name),
+                SpoolFile(pathlib.Path(spool_file.name)),
                 None,
                 mock_slurmmail_cli_process_spool_file_options,
             )
@@ -574,7 +776,7 @@ class TestProcessSpoolFile:
 
             mock_slurmmail_cli_process_spool_file_options.validate_email = True
             slurmmail.cli.__dict__["__process_spool_file"](
-                pathlib.Path(spool_file.name),
+                SpoolFile(pathlib.Path(spool_file.name)),
                 None,
                 mock_slurmmail_cli_process_spool_file_options,
             )
@@ -597,7 +799,7 @@ class TestProcessSpoolFile:
 
             mock_slurmmail_cli_run_command.return_value = (1, "", "")
             slurmmail.cli.__dict__["__process_spool_file"](
-                pathlib.Path(spool_file.name),
+                SpoolFile(pathlib.Path(spool_file.name)),
                 None,
                 mock_slurmmail_cli_process_spool_file_options,
             )
@@ -609,6 +811,7 @@ class TestProcessSpoolFile:
         mock_slurmmail_cli_process_spool_file_options,
         mock_slurmmail_cli_run_command,
         mock_slurmmail_cli_run_scontrol,
+        mock_slurmmail_cli_run_scontrol_array,
         mock_smtp_sendmail,
     ):
         with tempfile.NamedTemporaryFile(mode="w") as spool_file:
@@ -620,7 +823,7 @@ class TestProcessSpoolFile:
             }""")
             spool_file.flush()
 
-            mock_slurmmail_cli_run_scontrol.return_value = None
+            mock_slurmmail_cli_run_scontrol_array.return_value = None
 
             sacct_output = (
                 "1_1|root|root|all|myaccount|1674333232|Unknown|RUNNING|500M||1|0|00:00:00|1|/|00:00:11|0:0|||test|node01|01:00:00|60|1|billing=1,cpu=1,node=1|test.jcf\n"
@@ -631,13 +834,14 @@ class TestProcessSpoolFile:
             mock_slurmmail_cli_run_command.side_effect = [(0, sacct_output, "")]
 
             slurmmail.cli.__dict__["__process_spool_file"](
-                pathlib.Path(spool_file.name),
+                SpoolFile(pathlib.Path(spool_file.name)),
                 smtplib.SMTP(),
                 mock_slurmmail_cli_process_spool_file_options,
             )
 
             assert mock_slurmmail_cli_run_command.call_count == 1
-            assert mock_slurmmail_cli_run_scontrol.call_count == 1
+            assert mock_slurmmail_cli_run_scontrol_array.call_count == 1
+            mock_slurmmail_cli_run_scontrol.assert_not_called()
             mock_slurmmail_cli_delete_spool_file.assert_called_once()
             mock_smtp_sendmail.assert_called_once()
 
@@ -645,6 +849,71 @@ class TestProcessSpoolFile:
                 mock_get_file_contents,
                 ["started-array-summary.tpl", "job-table.tpl", "signature.tpl"],
             )
+
+    @pytest.mark.usefixtures("mock_get_file_contents", "mock_slurmmail_cli_delete_spool_file")
+    def test_array_scontrol_failure_cached(
+        self,
+        mock_slurmmail_cli_process_spool_file_options,
+        mock_slurmmail_cli_run_command,
+        mock_slurmmail_cli_run_scontrol,
+        mock_slurmmail_cli_run_scontrol_array,
+        mock_smtp_sendmail,
+    ):
+        mock_slurmmail_cli_run_scontrol_array.return_value = None
+        # shared by the spool files processed by a pass
+        scontrol_arrays: Dict[str, Dict[str, Dict[str, str]]] = {}
+        for task_id in [1, 2, 3]:
+            with tempfile.NamedTemporaryFile(mode="w") as spool_file:
+                spool_file.write(
+                    f'{{"job_id": {task_id}, "email": "root", "state": "Began", "array_summary": false}}'
+                )
+                spool_file.flush()
+                sacct_output = f"1_{task_id}|root|root|all|myaccount|1674333232|Unknown|RUNNING|500M||1|0|00:00:00|1|/|00:00:11|0:0|||test|node01|01:00:00|60|{task_id}|billing=1,cpu=1,node=1|test.jcf"  # noqa
+                mock_slurmmail_cli_run_command.side_effect = [(0, sacct_output, "")]
+                slurmmail.cli.__dict__["__process_spool_file"](
+                    SpoolFile(pathlib.Path(spool_file.name)),
+                    smtplib.SMTP(),
+                    mock_slurmmail_cli_process_spool_file_options,
+                    scontrol_arrays=scontrol_arrays,
+                )
+
+        # scontrol is not run again for the other tasks after it failed
+        assert mock_slurmmail_cli_run_scontrol_array.call_count == 1
+        assert scontrol_arrays == {"1": {}}
+        mock_slurmmail_cli_run_scontrol.assert_not_called()
+        assert mock_smtp_sendmail.call_count == 3
+
+    @pytest.mark.usefixtures("mock_get_file_contents")
+    def test_array_summary_stops_sacct(
+        self,
+        mock_slurmmail_cli_delete_spool_file,
+        mock_slurmmail_cli_process_spool_file_options,
+        mock_slurmmail_cli_run_scontrol_array,
+        mock_smtp_sendmail,
+        tmp_path,
+    ):
+        spool_file = tmp_path / "1_1673384400.mail"
+        spool_file.write_text('{"job_id": 1, "email": "root", "state": "Began", "array_summary": true}')
+        mock_slurmmail_cli_run_scontrol_array.return_value = None
+        # sacct is still outputting the rest of the array
+        mock_slurmmail_cli_process_spool_file_options.sacct_exe = write_fake_sacct(
+            tmp_path,
+            "echo '1_1|root|root|all|myaccount|1674333232|Unknown|RUNNING|500M||1|0|00:00:00|1|/|00:00:11|0:0|||test|node01|01:00:00|60|1|billing=1,cpu=1,node=1|test.jcf'\n"  # noqa
+            "echo '1_2|root|root|all|myaccount|1674333232|Unknown|RUNNING|500M||1|0|00:00:00|1|/|00:00:11|0:0|||test|node01|01:00:00|60|2|billing=1,cpu=1,node=1|test.jcf'\n"  # noqa
+            "exec sleep 60",
+        )
+        start = time.monotonic()
+
+        slurmmail.cli.__dict__["__process_spool_file"](
+            SpoolFile(spool_file),
+            smtplib.SMTP(),
+            mock_slurmmail_cli_process_spool_file_options,
+        )
+
+        assert time.monotonic() - start < 30
+        mock_smtp_sendmail.assert_called_once()
+        mock_slurmmail_cli_delete_spool_file.assert_called_once()
+
     def test_job_began(
         self,
         mock_get_file_contents,
@@ -669,7 +938,7 @@ class TestProcessSpoolFile:
             sacct_output += "1.batch||||myaccount|1674333232|Unknown|RUNNING|||1|0|00:00:00|1||00:00:11|0:0|||test|node01|||1.batch|cpu=1,mem=0,node=1|batch"  # noqa
             mock_slurmmail_cli_run_command.side_effect = [(0, sacct_output, "")]
             slurmmail.cli.__dict__["__process_spool_file"](
-                pathlib.Path(spool_file.name),
+                SpoolFile(pathlib.Path(spool_file.name)),
                 smtplib.SMTP(),
                 mock_slurmmail_cli_process_spool_file_options,
             )
@@ -683,6 +952,105 @@ class TestProcessSpoolFile:
             assert mock_smtp_sendmail.call_args[0][1] == ["root"]
             check_templates_used(mock_get_file_contents, ["started.tpl", "job-table.tpl", "signature.tpl"])
 
+    def test_job_began_sacct_rows_provided(
+        self,
+        mock_slurmmail_cli_delete_spool_file,
+        mock_slurmmail_cli_process_spool_file_options,
+        mock_slurmmail_cli_run_command,
+        mock_slurmmail_cli_run_scontrol,
+        mock_smtp_sendmail,
+    ):
+        with tempfile.NamedTemporaryFile(mode='w') as spool_file:
+            spool_file.write("""{
+                "job_id": 1,
+                "email": "root",
+                "state": "Began",
+                "array_summary": false
+                }""")
+            spool_file.flush()
+
+            mock_slurmmail_cli_run_scontrol.return_value = None
+
+            sacct_output = "1|root|root|all|myaccount|1674333232|Unknown|RUNNING|500M||1|0|00:00:00|1|/|00:00:11|0:0|||test|node01|01:00:00|60|1|billing=1,cpu=1,node=1|test.jcf\n"  # noqa
+            sacct_output += "1.batch||||myaccount|1674333232|Unknown|RUNNING|||1|0|00:00:00|1||00:00:11|0:0|||test|node01|||1.batch|cpu=1,mem=0,node=1|batch"  # noqa
+            slurmmail.cli.__dict__["__process_spool_file"](
+                SpoolFile(pathlib.Path(spool_file.name)),
+                smtplib.SMTP(),
+                mock_slurmmail_cli_process_spool_file_options,
+                sacct_rows=slurmmail.cli.SACCT_DECODER.decode_block(sacct_output),
+            )
+            mock_slurmmail_cli_run_command.assert_not_called()
+            mock_slurmmail_cli_delete_spool_file.assert_called_once()
+            mock_smtp_sendmail.assert_called_once()
+
+    def test_job_began_delivery_pool(
+        self,
+        mock_slurmmail_cli_delete_spool_file,
+        mock_slurmmail_cli_process_spool_file_options,
+        mock_slurmmail_cli_run_command,
+        mock_slurmmail_cli_run_scontrol,
+        mock_smtp_sendmail,
+    ):
+        with tempfile.NamedTemporaryFile(mode='w') as spool_file:
+            spool_file.write("""{
+                "job_id": 1,
+                "email": "root",
+                "state": "Began",
+                "array_summary": false
+                }""")
+            spool_file.flush()
+
+            mock_slurmmail_cli_run_scontrol.return_value = None
+
+            sacct_output = "1|root|root|all|myaccount|1674333232|Unknown|RUNNING|500M||1|0|00:00:00|1|/|00:00:11|0:0|||test|node01|01:00:00|60|1|billing=1,cpu=1,node=1|test.jcf\n"  # noqa
+            sacct_output += "1.batch||||myaccount|1674333232|Unknown|RUNNING|||1|0|00:00:00|1||00:00:11|0:0|||test|node01|||1.batch|cpu=1,mem=0,node=1|batch"  # noqa
+            mock_slurmmail_cli_run_command.side_effect = [(0, sacct_output, "")]
+            delivery = MagicMock()
+            slurmmail.cli.__dict__["__process_spool_file"](
+                SpoolFile(pathlib.Path(spool_file.name)),
+                None,
+                mock_slurmmail_cli_process_spool_file_options,
+                delivery=delivery,
+            )
+            delivery.submit.assert_called_once()
+            mail = delivery.submit.call_args[0][0]
+            assert mail.sender == mock_slurmmail_cli_process_spool_file_options.email_from_address
+            assert mail.recipients == ["root"]
+            assert mail.spool_file == SpoolFile(pathlib.Path(spool_file.name))
+            # the pool is responsible for sending and removing the spool file
+            mock_smtp_sendmail.assert_not_called()
+            mock_slurmmail_cli_delete_spool_file.assert_not_called()
+
+    def test_delivery_pool_error(
+        self,
+        mock_slurmmail_cli_delete_spool_file,
+        mock_slurmmail_cli_process_spool_file_options,
+        mock_slurmmail_cli_run_command,
+    ):
+        error = slurmmail.cli.CommandException("sacct failed")
+
+        def iter_jobs(*_args, **_kwargs):
+            yield MagicMock()
+            raise error
+
+        mock_slurmmail_cli_run_command.return_value = (0, "", "")
+        with tempfile.NamedTemporaryFile(mode="w") as spool_file, patch(
+            "slurmmail.cli.__iter_jobs", side_effect=iter_jobs
+        ), patch("slurmmail.cli.__send_job_notification", return_value=True) as mock_send_job_notification:
+            spool_file.write(json.dumps({"job_id": 1, "email": "root", "state": "Ended", "array_summary": False}))
+            spool_file.flush()
+            delivery = MagicMock()
+            slurmmail.cli.__dict__["__process_spool_file"](
+                SpoolFile(pathlib.Path(spool_file.name)),
+                None,
+                mock_slurmmail_cli_process_spool_file_options,
+                delivery=delivery,
+            )
+            mock_send_job_notification.assert_called_once()
+            # the spool file is retried once the queued e-mail is delivered
+            delivery.fail.assert_called_once_with(SpoolFile(pathlib.Path(spool_file.name)), error)
+            mock_slurmmail_cli_delete_spool_file.assert_not_called()
+
     def test_job_began_additonal_email_headers(
         self,
         mock_get_file_contents,
@@ -713,7 +1081,7 @@ class TestProcessSpoolFile:
             mock_slurmmail_cli_run_command.side_effect = [(0, sacct_output, "")]
             mock_slurmmail_cli_process_spool_file_options.email_headers = email_headers
             slurmmail.cli.__dict__["__process_spool_file"](
-                pathlib.Path(spool_file.name),
+                SpoolFile(pathlib.Path(spool_file.name)),
                 smtplib.SMTP(),
                 mock_slurmmail_cli_process_spool_file_options,
             )
@@ -732,7 +1100,7 @@ class TestProcessSpoolFile:
             assert mock_smtp_sendmail.call_args[0][1] == ["root"]
             check_templates_used(mock_get_file_contents, ["started.tpl", "job-table.tpl", "signature.tpl"])
 
-    def test_job_began_sendmail_fail_retry_on_failure(
+    def test_job_began_sendmail_fail_permanent(
         self,
         mock_get_file_contents,
         mock_slurmmail_cli_delete_spool_file,
@@ -741,80 +1109,94 @@ class TestProcessSpoolFile:
         mock_slurmmail_cli_run_scontrol,
         mock_smtp_sendmail,
     ):
-        with tempfile.NamedTemporaryFile(mode='w') as spool_file:
-            spool_file.write("""{
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            spool_file = pathlib.Path(tmp_dir) / "1.Began.mail"
+            spool_file.write_text("""{
                 "job_id": 1,
                 "email": "root",
                 "state": "Began",
                 "array_summary": false
                 }""")
-            spool_file.flush()
+            mock_slurmmail_cli_process_spool_file_options.deferred = DeferredQueue(pathlib.Path(tmp_dir))
 
             mock_slurmmail_cli_run_scontrol.return_value = None
 
             sacct_output = "1|root|root|all|myaccount|1674333232|Unknown|RUNNING|500M||1|0|00:00:00|1|/|00:00:11|0:0|||test|node01|01:00:00|60|1|billing=1,cpu=1,node=1|test.jcf\n"  # noqa
             sacct_output += "1.batch||||myaccount|1674333232|Unknown|RUNNING|||1|0|00:00:00|1||00:00:11|0:0|||test|node01|||1.batch|cpu=1,mem=0,node=1|batch"  # noqa
             mock_slurmmail_cli_run_command.side_effect = [(0, sacct_output, "")]
+            # 5xx replies are not retried
             mock_smtp_sendmail.side_effect = smtplib.SMTPSenderRefused(503, b'Error', 'root')
             slurmmail.cli.__dict__["__process_spool_file"](
-                pathlib.Path(spool_file.name),
+                SpoolFile(spool_file, mock_slurmmail_cli_process_spool_file_options.deferred),
                 smtplib.SMTP(),
                 mock_slurmmail_cli_process_spool_file_options,
             )
             assert mock_slurmmail_cli_run_command.call_count == 1
-            mock_slurmmail_cli_delete_spool_file.assert_called()
-            assert mock_smtp_sendmail.call_count == slurmmail.cli.MAX_EMAIL_SEND_ATTEMPTS
+            mock_slurmmail_cli_delete_spool_file.assert_called_once_with(SpoolFile(spool_file))
+            mock_smtp_sendmail.assert_called_once()
             assert (
                 mock_smtp_sendmail.call_args[0][0]
                 == mock_slurmmail_cli_process_spool_file_options.email_from_address
             )
             assert mock_smtp_sendmail.call_args[0][1] == ["root"]
+            assert not (pathlib.Path(tmp_dir) / DEFERRED_DIR).exists()
             check_templates_used(mock_get_file_contents, ["started.tpl", "job-table.tpl", "signature.tpl"])
 
-    def test_job_began_sendmail_fail_retry_on_failure_time_delay(
+    @pytest.mark.usefixtures("mock_get_file_contents")
+    def test_job_began_sendmail_fail_retry_on_failure(
         self,
-        mock_get_file_contents,
-        mock_sleep,
         mock_slurmmail_cli_delete_spool_file,
         mock_slurmmail_cli_process_spool_file_options,
         mock_slurmmail_cli_run_command,
         mock_slurmmail_cli_run_scontrol,
         mock_smtp_sendmail,
     ):
-        # set time delay
-        mock_slurmmail_cli_process_spool_file_options.retry_delay = 1
-
-        with tempfile.NamedTemporaryFile(mode='w') as spool_file:
-            spool_file.write("""{
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            spool_file = pathlib.Path(tmp_dir) / "1.Began.mail"
+            spool_file.write_text("""{
                 "job_id": 1,
                 "email": "root",
                 "state": "Began",
                 "array_summary": false
                 }""")
-            spool_file.flush()
+            deferred = DeferredQueue(pathlib.Path(tmp_dir))
+            mock_slurmmail_cli_process_spool_file_options.deferred = deferred
 
             mock_slurmmail_cli_run_scontrol.return_value = None
 
             sacct_output = "1|root|root|all|myaccount|1674333232|Unknown|RUNNING|500M||1|0|00:00:00|1|/|00:00:11|0:0|||test|node01|01:00:00|60|1|billing=1,cpu=1,node=1|test.jcf\n"  # noqa
             sacct_output += "1.batch||||myaccount|1674333232|Unknown|RUNNING|||1|0|00:00:00|1||00:00:11|0:0|||test|node01|||1.batch|cpu=1,mem=0,node=1|batch"  # noqa
-            mock_slurmmail_cli_run_command.side_effect = [(0, sacct_output, "")]
-            # simulate failure of first e-mail attempt and then success
-            mock_smtp_sendmail.side_effect = [smtplib.SMTPSenderRefused(503, b'Error', 'root'), None]
+            mock_slurmmail_cli_run_command.side_effect = [(0, sacct_output, ""), (0, sacct_output, "")]
+            # simulate a temporary failure and then success
+            mock_smtp_sendmail.side_effect = [smtplib.SMTPSenderRefused(451, b'Try again later', 'root'), None]
             slurmmail.cli.__dict__["__process_spool_file"](
-                pathlib.Path(spool_file.name),
+                SpoolFile(spool_file, deferred),
                 smtplib.SMTP(),
                 mock_slurmmail_cli_process_spool_file_options,
             )
-            assert mock_slurmmail_cli_run_command.call_count == 1
-            mock_slurmmail_cli_delete_spool_file.assert_called()
-            assert mock_smtp_sendmail.call_count == 2
-            assert (
-                mock_smtp_sendmail.call_args[0][0]
-                == mock_slurmmail_cli_process_spool_file_options.email_from_address
+            # the e-mail is not retried inline, the spool file is deferred
+            mock_smtp_sendmail.assert_called_once()
+            mock_slurmmail_cli_delete_spool_file.assert_not_called()
+            assert not spool_file.exists()
+            assert deferred.due() == []
+            deferred_files = list(deferred.path.glob("*.mail"))
+            assert len(deferred_files) == 1
+            data = json.loads(deferred_files[0].read_text())
+            assert data["attempts"] == 1
+            assert data["next_attempt"] > time.time()
+            assert "451" in data["error"]
+
+            # a later run tries the spool file again once it is due
+            due = deferred.due(now=data["next_attempt"])
+            assert due == deferred_files
+            slurmmail.cli.__dict__["__process_spool_file"](
+                SpoolFile(due[0], deferred),
+                smtplib.SMTP(),
+                mock_slurmmail_cli_process_spool_file_options,
             )
+            assert mock_smtp_sendmail.call_count == 2
             assert mock_smtp_sendmail.call_args[0][1] == ["root"]
-            mock_sleep.assert_called_with(mock_slurmmail_cli_process_spool_file_options.retry_delay)
-            check_templates_used(mock_get_file_contents, ["started.tpl", "job-table.tpl", "signature.tpl"])
+            mock_slurmmail_cli_delete_spool_file.assert_called_once_with(SpoolFile(due[0]))
 
     def test_job_began_sendmail_fail_no_retry_failure(
         self,
@@ -842,7 +1224,7 @@ class TestProcessSpoolFile:
             mock_slurmmail_cli_process_spool_file_options.retry_on_failure = False
             mock_smtp_sendmail.side_effect = smtplib.SMTPSenderRefused(503, b'Error', 'root')
             slurmmail.cli.__dict__["__process_spool_file"](
-                pathlib.Path(spool_file.name),
+                SpoolFile(pathlib.Path(spool_file.name)),
                 smtplib.SMTP(),
                 mock_slurmmail_cli_process_spool_file_options,
             )
@@ -900,7 +1282,7 @@ class TestProcessSpoolFile:
                 (0, scontrol_output, ""),
             ]
             slurmmail.cli.__dict__["__process_spool_file"](
-                pathlib.Path(spool_file.name),
+                SpoolFile(pathlib.Path(spool_file.name)),
                 smtplib.SMTP(),
                 mock_slurmmail_cli_process_spool_file_options,
             )
@@ -967,7 +1349,7 @@ class TestProcessSpoolFile:
                 (0, sacct_duplicate_output, ""),
             ]
             slurmmail.cli.__dict__["__process_spool_file"](
-                pathlib.Path(spool_file.name),
+                SpoolFile(pathlib.Path(spool_file.name)),
                 smtplib.SMTP(),
                 mock_slurmmail_cli_process_spool_file_options,
             )
@@ -984,6 +1366,67 @@ class TestProcessSpoolFile:
                 ["ended.tpl", "job-table.tpl", "tres.tpl", "signature.tpl"]
             )
 
+    @pytest.mark.usefixtures("mock_get_file_contents", "mock_slurmmail_cli_delete_spool_file")
+    def test_job_scronjob_ended_slurm_env(
+        self,
+        mock_slurmmail_cli_process_spool_file_options,
+        mock_slurmmail_cli_run_command,
+        mock_smtp_sendmail,
+    ):
+        with tempfile.NamedTemporaryFile(mode='w') as spool_file:
+            spool_file.write("""{
+                "job_id": 2,
+                "email": "root",
+                "state": "Ended",
+                "array_summary": false,
+                "slurm_env": {
+                    "SLURM_JOB_ID": "2",
+                    "SLURM_JOB_STDOUT": "/root/slurm-2.out"
+                }
+                }""")
+            spool_file.flush()
+
+            sacct_output = "2|root|root|all|myaccount|1674340451|1674340571|PENDING|500M||1|1|00:00:00|1|/root|0|0:0|||test|node01|0|60|2|billing=1,cpu=1,node=1|test.jcf\n"  # noqa
+            sacct_output += "2.batch||||myaccount|1674340451|1674340571|PENDING||4880K|1|1|00:00:00|1||0|0:0|||test|node01|||2.batch|cpu=1,mem=0,node=1|batch"  # noqa
+
+            sacct_duplicate_output = "2|root|root|all|myaccount|1674340451|1674340571|COMPLETED|500M||1|1|00:00.010|1|/root|00:02:00|0:0|||test|node01|01:00:00|60|2|billing=1,cpu=1,node=1|test.jcf\n"  # noqa
+            sacct_duplicate_output += "2.batch||||myaccount|1674340451|1674340571|COMPLETED||4880K|1|1|00:00.010|1||00:02:00|0:0|||test|node01|||2.batch|cpu=1,mem=0,node=1|batch"  # noqa
+
+            scontrol_output = (
+                "JobId=2 JobName=test.jcf UserId=root(0) GroupId=root(0) MCS_label=N/A"
+                " Priority=4294901758 Nice=0 Account=root QOS=normal JobState=COMPLETED"
+                " Reason=None Dependency=(null) Requeue=1 Restarts=0 BatchFlag=1"
+                " Reboot=0 ExitCode=0:0 RunTime=00:02:00 TimeLimit=01:00:00 TimeMin=N/A"
+                " SubmitTime=2023-01-21T22:34:11 EligibleTime=2023-01-21T22:34:11"
+                " AccrueTime=2023-01-21T22:34:11 StartTime=2023-01-21T22:34:11"
+                " CronJob=Yes CrontabSpec=\"10 16 16 9 *\""
+                " EndTime=2023-01-21T22:36:11 Deadline=N/A SuspendTime=None"
+                " SecsPreSuspend=0 LastSchedEval=2023-01-21T22:34:11 Scheduler=Main"
+                " Partition=all AllocNode:Sid=ac2c384f02af:204 ReqNodeList=(null)"
+                " ExcNodeList=(null) NodeList=node01 BatchHost=node01 NumNodes=1"
+                " NumCPUs=1 NumTasks=1 CPUs/Task=1 ReqB:S:C:T=0:0:*:*"
+                " TRES=cpu=1,node=1,billing=1 Socks/Node=* NtasksPerN:B:S:C=0:0:*:*"
+                " CoreSpec=* MinCPUsNode=1 MinMemoryNode=0 MinTmpDiskNode=0"
+                " Features=(null) DelayBoot=00:00:00 OverSubscribe=OK Contiguous=0"
+                " Licenses=(null) Network=(null) Command=/root/test.jcf WorkDir=/root"
+                " StdErr=/root/slurm-2.out StdIn=/dev/null StdOut=/root/slurm-2.out"
+                " Power= MailUser=root"
+                " MailType=INVALID_DEPEND,BEGIN,END,FAIL,REQUEUE,STAGE_OUT"
+            )
+            mock_slurmmail_cli_run_command.side_effect = [
+                (0, sacct_output, ""),
+                (0, scontrol_output, ""),
+                (0, sacct_duplicate_output, ""),
+            ]
+            slurmmail.cli.__dict__["__process_spool_file"](
+                SpoolFile(pathlib.Path(spool_file.name)),
+                smtplib.SMTP(),
+                mock_slurmmail_cli_process_spool_file_options,
+            )
+            # scontrol is still required to identify the scron job
+            assert mock_slurmmail_cli_run_command.call_count == 3
+            mock_smtp_sendmail.assert_called_once()
+
     def test_job_ended_ignore_tres(
         self,
         mock_get_file_contents,
@@ -1033,7 +1476,7 @@ class TestProcessSpoolFile:
             ]
 
             slurmmail.cli.__dict__["__process_spool_file"](
-                pathlib.Path(spool_file.name),
+                SpoolFile(pathlib.Path(spool_file.name)),
                 smtplib.SMTP(),
                 mock_slurmmail_cli_process_spool_file_options,
             )
@@ -1095,7 +1538,7 @@ class TestProcessSpoolFile:
                 (0, scontrol_output, ""),
             ]
             slurmmail.cli.__dict__["__process_spool_file"](
-                pathlib.Path(spool_file.name),
+                SpoolFile(pathlib.Path(spool_file.name)),
                 smtplib.SMTP(),
                 mock_slurmmail_cli_process_spool_file_options,
             )
@@ -1157,7 +1600,7 @@ class TestProcessSpoolFile:
                 (0, scontrol_output, ""),
             ]
             slurmmail.cli.__dict__["__process_spool_file"](
-                pathlib.Path(spool_file.name),
+                SpoolFile(pathlib.Path(spool_file.name)),
                 smtplib.SMTP(),
                 mock_slurmmail_cli_process_spool_file_options,
             )
@@ -1219,7 +1662,7 @@ class TestProcessSpoolFile:
                 (0, scontrol_output, ""),
             ]
             slurmmail.cli.__dict__["__process_spool_file"](
-                pathlib.Path(spool_file.name),
+                SpoolFile(pathlib.Path(spool_file.name)),
                 smtplib.SMTP(),
                 mock_slurmmail_cli_process_spool_file_options,
             )
@@ -1260,9 +1703,6 @@ class TestProcessSpoolFile:
 
             mock_slurmmail_cli_check_job_output_file_path.return_value = True
             mock_slurmmail_cli_process_spool_file_options.tail_lines = 10
-            mock_slurmmail_cli_process_spool_file_options.tail_exe = pathlib.Path(
-                "/usr/bin/tail"
-            )
             sacct_output = "2|root|root|all|myaccount|1674340451|1674340571|COMPLETED|500M||1|1|00:00.010|1|/root|00:02:00|0:0|||test|node01|01:00:00|60|2|billing=1,cpu=1,node=1|test.jcf\n"  # noqa
             sacct_output += "2.batch||||myaccount|1674340451|1674340571|COMPLETED||4880K|1|1|00:00.010|1||00:02:00|0:0|||test|node01|||2.batch|cpu=1,mem=0,node=1|batch"  # noqa
             scontrol_output = (
@@ -1290,7 +1730,7 @@ class TestProcessSpoolFile:
                 (0, scontrol_output, ""),
             ]
             slurmmail.cli.__dict__["__process_spool_file"](
-                pathlib.Path(spool_file.name),
+                SpoolFile(pathlib.Path(spool_file.name)),
                 smtplib.SMTP(),
                 mock_slurmmail_cli_process_spool_file_options,
             )
@@ -1310,36 +1750,201 @@ class TestProcessSpoolFile:
                 ["ended.tpl", "job-table.tpl", "tres.tpl", "job-output.tpl", "signature.tpl"]
             )
 
-    def test_job_array_began_summary(
+    @pytest.mark.usefixtures("mock_get_file_contents", "mock_os_setegid", "mock_os_seteuid")
+    def test_job_ended_slurm_env(
         self,
-        mock_get_file_contents,
+        mock_slurmmail_cli_check_job_output_file_path,
         mock_slurmmail_cli_delete_spool_file,
         mock_slurmmail_cli_process_spool_file_options,
         mock_slurmmail_cli_run_command,
-        mock_slurmmail_cli_run_scontrol,
         mock_smtp_sendmail,
+        mock_slurmmail_cli_tail_file,
     ):
         with tempfile.NamedTemporaryFile(mode='w') as spool_file:
             spool_file.write("""{
-                "job_id": 7,
+                "job_id": 2,
                 "email": "root",
-                "state": "Began",
-                "array_summary": true
+                "state": "Ended",
+                "array_summary": false,
+                "slurm_env": {
+                    "SLURM_JOB_ID": "2",
+                    "SLURM_JOB_STDERR": "/root/slurm-2.err",
+                    "SLURM_JOB_STDOUT": "/root/slurm-2.out"
+                }
                 }
             """)
             spool_file.flush()
 
-            mock_slurmmail_cli_run_scontrol.return_value = None
-
-            sacct_output = "7_0|root|root|all|myaccount|1675460419|Unknown|RUNNING|500M||1|0|00:00:00|1|/root|00:00:43|0:0|||test|node01|00:05:00|5|8|billing=1,cpu=1,node=1|test.jcf\n"  # noqa
-            sacct_output += "7_0.batch||||myaccount|1675460419|Unknown|RUNNING|||1|0|00:00:00|1||00:00:43|0:0|||test|node01|||8.batch|cpu=1,mem=0,node=1|batch\n"  # noqa
-            sacct_output += (
-                "7_1|root|root|all|myaccount|Unknown|Unknown|PENDING|500M||1|0|00:00:00|1|/root|00:00:00|0:0||test|None"  # noqa
+            mock_slurmmail_cli_check_job_output_file_path.return_value = True
+            mock_slurmmail_cli_process_spool_file_options.tail_lines = 10
+            sacct_output = "2|root|root|all|myaccount|1674340451|1674340571|COMPLETED|500M||1|1|00:00.010|1|/root|00:02:00|0:0|||test|node01|01:00:00|60|2|billing=1,cpu=1,node=1|test.jcf\n"  # noqa
+            sacct_output += "2.batch||||myaccount|1674340451|1674340571|COMPLETED||4880K|1|1|00:00.010|1||00:02:00|0:0|||test|node01|||2.batch|cpu=1,mem=0,node=1|batch"  # noqa
+            # scontrol should not be needed
+            mock_slurmmail_cli_run_command.side_effect = [
+                (0, sacct_output, ""),
+            ]
+            slurmmail.cli.__dict__["__process_spool_file"](
+                SpoolFile(pathlib.Path(spool_file.name)),
+                smtplib.SMTP(),
+                mock_slurmmail_cli_process_spool_file_options,
+            )
+            mock_slurmmail_cli_run_command.assert_called_once()
+            assert mock_slurmmail_cli_tail_file.call_count == 2
+            assert mock_slurmmail_cli_tail_file.call_args_list[0][0][0] == "/root/slurm-2.out"
+            assert mock_slurmmail_cli_tail_file.call_args_list[1][0][0] == "/root/slurm-2.err"
+            mock_slurmmail_cli_delete_spool_file.assert_called_once()
+            mock_smtp_sendmail.assert_called_once()
+
+    @pytest.mark.usefixtures("mock_get_file_contents", "mock_os_setegid", "mock_os_seteuid")
+    def test_job_ended_sacct_json(
+        self,
+        mock_slurmmail_cli_check_job_output_file_path,
+        mock_slurmmail_cli_delete_spool_file,
+        mock_slurmmail_cli_process_spool_file_options,
+        mock_slurmmail_cli_run_command,
+        mock_smtp_sendmail,
+        mock_slurmmail_cli_tail_file,
+    ):
+        with tempfile.NamedTemporaryFile(mode='w') as spool_file:
+            spool_file.write("""{
+                "job_id": 2,
+                "email": "root",
+                "state": "Ended",
+                "array_summary": false
+                }
+            """)
+            spool_file.flush()
+
+            mock_slurmmail_cli_check_job_output_file_path.return_value = True
+            mock_slurmmail_cli_process_spool_file_options.tail_lines = 10
+            with (RESTD_RESPONSE_DIR / "slurmdb" / "v0.0.40" / "job" / "2.json").open() as f:
+                sacct_jobs = json.load(f)["jobs"]
+            sacct_jobs[0]["stdout_expanded"] = "/root/slurm-2.out"
+            sacct_jobs[0]["stderr_expanded"] = "/root/slurm-2.err"
+            slurmmail.cli.__dict__["__process_spool_file"](
+                SpoolFile(pathlib.Path(spool_file.name)),
+                smtplib.SMTP(),
+                mock_slurmmail_cli_process_spool_file_options,
+                sacct_rows=[
+                    slurmmail.sacct.decode_row(row) for row in slurmmail.slurmdb.get_sacct_rows_from_jobs(sacct_jobs)
+                ],
+            )
+            # scontrol should not be needed
+            mock_slurmmail_cli_run_command.assert_not_called()
+            assert mock_slurmmail_cli_tail_file.call_count == 2
+            assert mock_slurmmail_cli_tail_file.call_args_list[0][0][0] == "/root/slurm-2.out"
+            assert mock_slurmmail_cli_tail_file.call_args_list[1][0][0] == "/root/slurm-2.err"
+            mock_slurmmail_cli_delete_spool_file.assert_called_once()
+            mock_smtp_sendmail.assert_called_once()
+
+    def test_job_ended_tail_file_output_readers(
+        self,
+        mock_get_file_contents,
+        mock_slurmmail_cli_check_job_output_file_path,
+        mock_slurmmail_cli_delete_spool_file,
+        mock_os_setegid,
+        mock_os_seteuid,
+        mock_slurmmail_cli_process_spool_file_options,
+        mock_slurmmail_cli_run_command,
+        mock_smtp_sendmail,
+        mock_slurmmail_cli_tail_file,
+    ):
+        with tempfile.NamedTemporaryFile(mode='w') as spool_file:
+            spool_file.write("""{
+                "job_id": 2,
+                "email": "root",
+                "state": "Ended",
+                "array_summary": false
+                }
+            """)
+            spool_file.flush()
+
+            mock_slurmmail_cli_check_job_output_file_path.return_value = True
+            mock_slurmmail_cli_process_spool_file_options.tail_lines = 10
+            output_readers = MagicMock()
+            output_readers.submit.return_value.result.return_value = ["output"]
+            mock_slurmmail_cli_process_spool_file_options.output_readers = output_readers
+            mock_slurmmail_cli_process_spool_file_options.output_reader_processes = 2
+            sacct_output = "2|root|root|all|myaccount|1674340451|1674340571|COMPLETED|500M||1|1|00:00.010|1|/root|00:02:00|0:0|||test|node01|01:00:00|60|2|billing=1,cpu=1,node=1|test.jcf\n"  # noqa
+            sacct_output += "2.batch||||myaccount|1674340451|1674340571|COMPLETED||4880K|1|1|00:00.010|1||00:02:00|0:0|||test|node01|||2.batch|cpu=1,mem=0,node=1|batch"  # noqa
+            scontrol_output = (
+                "JobId=2 JobName=test.jcf UserId=root(0) GroupId=root(0) MCS_label=N/A"
+                " Priority=4294901758 Nice=0 Account=root QOS=normal JobState=COMPLETED"
+                " Reason=None Dependency=(null) Requeue=1 Restarts=0 BatchFlag=1"
+                " Reboot=0 ExitCode=0:0 RunTime=00:02:00 TimeLimit=01:00:00 TimeMin=N/A"
+                " SubmitTime=2023-01-21T22:34:11 EligibleTime=2023-01-21T22:34:11"
+                " AccrueTime=2023-01-21T22:34:11 StartTime=2023-01-21T22:34:11"
+                " EndTime=2023-01-21T22:36:11 Deadline=N/A SuspendTime=None"
+                " SecsPreSuspend=0 LastSchedEval=2023-01-21T22:34:11 Scheduler=Main"
+                " Partition=all AllocNode:Sid=ac2c384f02af:204 ReqNodeList=(null)"
+                " ExcNodeList=(null) NodeList=node01 BatchHost=node01 NumNodes=1"
+                " NumCPUs=1 NumTasks=1 CPUs/Task=1 ReqB:S:C:T=0:0:*:*"
+                " TRES=cpu=1,node=1,billing=1 Socks/Node=* NtasksPerN:B:S:C=0:0:*:*"
+                " CoreSpec=* MinCPUsNode=1 MinMemoryNode=0 MinTmpDiskNode=0"
+                " Features=(null) DelayBoot=00:00:00 OverSubscribe=OK Contiguous=0"
+                " Licenses=(null) Network=(null) Command=/root/test.jcf WorkDir=/root"
+                " StdErr=/root/slurm-2.out StdIn=/dev/null StdOut=/root/slurm-2.out"
+                " Power= MailUser=root"
+                " MailType=INVALID_DEPEND,BEGIN,END,FAIL,REQUEUE,STAGE_OUT"
+            )
+            mock_slurmmail_cli_run_command.side_effect = [
+                (0, sacct_output, ""),
+                (0, scontrol_output, ""),
+            ]
+            slurmmail.cli.__dict__["__process_spool_file"](
+                SpoolFile(pathlib.Path(spool_file.name)),
+                smtplib.SMTP(),
+                mock_slurmmail_cli_process_spool_file_options,
+            )
+            assert mock_slurmmail_cli_run_command.call_count == 2
+            # the main process keeps its privileges
+            mock_os_setegid.assert_not_called()
+            mock_os_seteuid.assert_not_called()
+            mock_slurmmail_cli_tail_file.assert_not_called()
+            output_readers.submit.assert_called_once_with(0, 0, [("/root/slurm-2.out", 10)])
+            output_readers.submit.return_value.result.assert_called_once()
+            mock_slurmmail_cli_delete_spool_file.assert_called_once()
+            mock_smtp_sendmail.assert_called_once()
+            assert (
+                mock_smtp_sendmail.call_args[0][0]
+                == mock_slurmmail_cli_process_spool_file_options.email_from_address
+            )
+            assert mock_smtp_sendmail.call_args[0][1] == ["root"]
+            check_templates_used(
+                mock_get_file_contents,
+                ["ended.tpl", "job-table.tpl", "tres.tpl", "job-output.tpl", "signature.tpl"]
+            )
+
+    def test_job_array_began_summary(
+        self,
+        mock_get_file_contents,
+        mock_slurmmail_cli_delete_spool_file,
+        mock_slurmmail_cli_process_spool_file_options,
+        mock_slurmmail_cli_run_command,
+        mock_slurmmail_cli_run_scontrol_array,
+        mock_smtp_sendmail,
+    ):
+        with tempfile.NamedTemporaryFile(mode='w') as spool_file:
+            spool_file.write("""{
+                "job_id": 7,
+                "email": "root",
+                "state": "Began",
+                "array_summary": true
+                }
+            """)
+            spool_file.flush()
+
+            mock_slurmmail_cli_run_scontrol_array.return_value = None
+
+            sacct_output = "7_0|root|root|all|myaccount|1675460419|Unknown|RUNNING|500M||1|0|00:00:00|1|/root|00:00:43|0:0|||test|node01|00:05:00|5|8|billing=1,cpu=1,node=1|test.jcf\n"  # noqa
+            sacct_output += "7_0.batch||||myaccount|1675460419|Unknown|RUNNING|||1|0|00:00:00|1||00:00:43|0:0|||test|node01|||8.batch|cpu=1,mem=0,node=1|batch\n"  # noqa
+            sacct_output += (
+                "7_1|root|root|all|myaccount|Unknown|Unknown|PENDING|500M||1|0|00:00:00|1|/root|00:00:00|0:0||test|None"  # noqa
                 " assigned|00:05:00|5|7|test.jcf"
             )
             mock_slurmmail_cli_run_command.side_effect = [(0, sacct_output, "")]
             slurmmail.cli.__dict__["__process_spool_file"](
-                pathlib.Path(spool_file.name),
+                SpoolFile(pathlib.Path(spool_file.name)),
                 smtplib.SMTP(),
                 mock_slurmmail_cli_process_spool_file_options,
             )
@@ -1440,7 +2045,7 @@ class TestProcessSpoolFile:
                 (0, scontrol_output_1, ""),
             ]
             slurmmail.cli.__dict__["__process_spool_file"](
-                pathlib.Path(spool_file.name),
+                SpoolFile(pathlib.Path(spool_file.name)),
                 smtplib.SMTP(),
                 mock_slurmmail_cli_process_spool_file_options,
             )
@@ -1457,6 +2062,55 @@ class TestProcessSpoolFile:
                 ["ended-array-summary.tpl", "job-table.tpl", "tres.tpl", "signature.tpl"]
             )
 
+    @pytest.mark.usefixtures("mock_slurmmail_cli_run_scontrol")
+    def test_job_array_ended_summary_stats(
+        self,
+        mock_get_file_contents,
+        mock_slurmmail_cli_delete_spool_file,
+        mock_slurmmail_cli_process_spool_file_options,
+        mock_slurmmail_cli_run_scontrol_array,
+        mock_smtp_sendmail,
+    ):
+        with tempfile.NamedTemporaryFile(mode='w') as spool_file:
+            spool_file.write("""{
+                "job_id": 7,
+                "email": "root",
+                "state": "Ended",
+                "array_summary": true
+                }
+            """)
+            spool_file.flush()
+
+            mock_slurmmail_cli_run_scontrol_array.return_value = None
+            mock_slurmmail_cli_process_spool_file_options.array_summary_stats = True
+            sacct_output = "7_0|root|root|all|myaccount|1675460419|1675460599|COMPLETED|500M||1|180|00:01:30|1|/root|00:03:00|0:0|||test|node01|00:05:00|5|8|billing=1,cpu=1,node=1|test.jcf\n"  # noqa
+            sacct_output += "7_0.batch||||myaccount|1675460419|1675460599|COMPLETED||4832K|1|180|00:01:30|1||00:03:00|0:0|||test|node01|||8.batch|cpu=1,mem=0,node=1|batch\n"  # noqa
+            sacct_output += "7_1|root|root|all|myaccount|1675460599|1675460899|FAILED|500M||1|300|00:00:30|1|/root|00:05:00|1:0|||test|node01|00:05:00|5|7|billing=1,cpu=1,node=1|test.jcf\n"  # noqa
+            sacct_output += "7_1.batch||||myaccount|1675460599|1675460899|FAILED||2048K|1|300|00:00:30|1||00:05:00|1:0|||test|node01|||7.batch|cpu=1,mem=0,node=1|batch\n"  # noqa
+            sacct_output += "7_[2-4]|root|root|all|myaccount|None|Unknown|CANCELLED|500M||1|0|00:00:00|1|/root|00:00:00|0:0|||test|None assigned|00:05:00|5|7|billing=1|test.jcf"  # noqa
+            slurmmail.cli.__dict__["__process_spool_file"](
+                SpoolFile(pathlib.Path(spool_file.name)),
+                smtplib.SMTP(),
+                mock_slurmmail_cli_process_spool_file_options,
+                sacct_rows=slurmmail.cli.SACCT_DECODER.decode_block(sacct_output),
+            )
+            mock_slurmmail_cli_delete_spool_file.assert_called_once()
+            mock_smtp_sendmail.assert_called_once()
+            check_templates_used(
+                mock_get_file_contents,
+                ["ended-array-summary.tpl", "array-stats.tpl", "job-table.tpl", "tres.tpl", "signature.tpl"]
+            )
+            message = email.message_from_string(mock_smtp_sendmail.call_args[0][2])
+            text, html = [part.get_payload(decode=True).decode() for part in message.get_payload()]
+            for body in (text, html):
+                assert "Statistics for the 5 jobs in the array (CANCELLED: 3, COMPLETED: 1, FAILED: 1)" in body
+            assert "Elapsed:" in text
+            assert "max 0:05:00" in text
+            assert "min 10.00%" in text
+            assert "7_1: FAILED, exit code 1:0, elapsed 0:05:00, CPU efficiency 10.00%" in text
+            assert text.index("7_1: FAILED") < text.index("7_0: COMPLETED")
+            assert "<td>4.72MiB</td>" in html
+
     def test_job_array_ended_no_summary(
         self,
         mock_get_file_contents,
@@ -1503,7 +2157,7 @@ class TestProcessSpoolFile:
                 (0, scontrol_output, ""),
             ]
             slurmmail.cli.__dict__["__process_spool_file"](
-                pathlib.Path(spool_file.name),
+                SpoolFile(pathlib.Path(spool_file.name)),
                 smtplib.SMTP(),
                 mock_slurmmail_cli_process_spool_file_options,
             )
@@ -1523,6 +2177,44 @@ class TestProcessSpoolFile:
                 ["ended-array.tpl", "job-table.tpl", "tres.tpl", "signature.tpl"]
             )
 
+    def test_job_array_tasks_share_scontrol(
+        self,
+        mock_slurmmail_cli_delete_spool_file,
+        mock_slurmmail_cli_process_spool_file_options,
+        mock_slurmmail_cli_run_command,
+        mock_slurmmail_cli_run_scontrol,
+        mock_smtp_sendmail,
+    ):
+        sacct_output = "7_0|root|root|all|myaccount|1675460419|1675460599|COMPLETED|500M||1|1|00:00.010|1|/root|00:03:00|0:0|||test|node01|00:05:00|5|8|billing=1,cpu=1,node=1|test.jcf\n"  # noqa
+        sacct_output += "7_1|root|root|all|myaccount|1675460599|1675460779|COMPLETED|500M||1|1|00:00.010|1|/root|00:03:00|0:0|||test|node01|00:05:00|5|7|billing=1,cpu=1,node=1|test.jcf"  # noqa
+        scontrol_output = (
+            "JobId=7 ArrayJobId=7 ArrayTaskId=1 JobName=test.jcf StdErr=/root/slurm-7_1.out"
+            " StdIn=/dev/null StdOut=/root/slurm-7_1.out\n"
+            "JobId=8 ArrayJobId=7 ArrayTaskId=0 JobName=test.jcf StdErr=/root/slurm-7_0.out"
+            " StdIn=/dev/null StdOut=/root/slurm-7_0.out\n"
+        )
+        mock_slurmmail_cli_run_command.side_effect = [(0, scontrol_output, "")]
+        scontrol_arrays: Dict[str, Dict[str, Dict[str, str]]] = {}
+        for job_id in [7, 8]:
+            with tempfile.NamedTemporaryFile(mode='w') as spool_file:
+                spool_file.write(
+                    f'{{"job_id": {job_id}, "email": "root", "state": "Began", "array_summary": false}}'
+                )
+                spool_file.flush()
+                slurmmail.cli.__dict__["__process_spool_file"](
+                    SpoolFile(pathlib.Path(spool_file.name)),
+                    smtplib.SMTP(),
+                    mock_slurmmail_cli_process_spool_file_options,
+                    sacct_rows=slurmmail.cli.SACCT_DECODER.decode_block(sacct_output),
+                    scontrol_arrays=scontrol_arrays,
+                )
+        # one scontrol call for both tasks of the array
+        mock_slurmmail_cli_run_command.assert_called_once()
+        mock_slurmmail_cli_run_scontrol.assert_not_called()
+        assert sorted(scontrol_arrays["7"]) == ["7", "8"]
+        assert mock_slurmmail_cli_delete_spool_file.call_count == 2
+        assert mock_smtp_sendmail.call_count == 2
+
     def test_job_array_ended_no_summary_max_notifications_exceeded(
         self,
         mock_get_file_contents,
@@ -1571,7 +2263,7 @@ class TestProcessSpoolFile:
                 (0, scontrol_output, ""),
             ]
             slurmmail.cli.__dict__["__process_spool_file"](
-                pathlib.Path(spool_file.name),
+                SpoolFile(pathlib.Path(spool_file.name)),
                 smtplib.SMTP(),
                 mock_slurmmail_cli_process_spool_file_options,
             )
@@ -1620,7 +2312,7 @@ class TestProcessSpoolFile:
                 (1, "error", "error"),
             ]
             slurmmail.cli.__dict__["__process_spool_file"](
-                pathlib.Path(spool_file.name),
+                SpoolFile(pathlib.Path(spool_file.name)),
                 smtplib.SMTP(),
                 mock_slurmmail_cli_process_spool_file_options,
             )
@@ -1685,7 +2377,7 @@ class TestProcessSpoolFile:
                 (0, scontrol_output, ""),
             ]
             slurmmail.cli.__dict__["__process_spool_file"](
-                pathlib.Path(spool_file.name),
+                SpoolFile(pathlib.Path(spool_file.name)),
                 smtplib.SMTP(),
                 mock_slurmmail_cli_process_spool_file_options,
             )
@@ -1748,7 +2440,7 @@ class TestProcessSpoolFile:
                 (0, scontrol_output, ""),
             ]
             slurmmail.cli.__dict__["__process_spool_file"](
-                pathlib.Path(spool_file.name),
+                SpoolFile(pathlib.Path(spool_file.name)),
                 smtplib.SMTP(),
                 mock_slurmmail_cli_process_spool_file_options,
             )
@@ -1814,7 +2506,7 @@ class TestProcessSpoolFile:
                 (0, scontrol_output, ""),
             ]
             slurmmail.cli.__dict__["__process_spool_file"](
-                pathlib.Path(spool_file.name),
+                SpoolFile(pathlib.Path(spool_file.name)),
                 smtplib.SMTP(),
                 mock_slurmmail_cli_process_spool_file_options,
             )
@@ -1882,7 +2574,7 @@ class TestProcessSpoolFile:
                 (0, scontrol_output, ""),
             ]
             slurmmail.cli.__dict__["__process_spool_file"](
-                pathlib.Path(spool_file.name),
+                SpoolFile(pathlib.Path(spool_file.name)),
                 smtplib.SMTP(),
                 mock_slurmmail_cli_process_spool_file_options,
             )
@@ -1924,7 +2616,7 @@ class TestProcessSpoolFile:
             sacct_output += "3.batch||||myaccount|1674770321|Unknown|RUNNING|||1|0|00:00:00|1||00:02:22|0:0|||test|node01|||3.batch|cpu=1,mem=0,node=1|batch"  # noqa
             mock_slurmmail_cli_run_command.side_effect = [(0, sacct_output, "")]
             slurmmail.cli.__dict__["__process_spool_file"](
-                pathlib.Path(spool_file.name),
+                SpoolFile(pathlib.Path(spool_file.name)),
                 smtplib.SMTP(),
                 mock_slurmmail_cli_process_spool_file_options,
             )
@@ -1966,7 +2658,7 @@ class TestProcessSpoolFile:
             sacct_output += "3.batch||||myaccount|1674770321|Unknown|PENDING|||1|0|00:00:00|1||00:00:00|0:0|||test|node01|||3.batch|cpu=1,mem=0,node=1|batch"  # noqa
             mock_slurmmail_cli_run_command.side_effect = [(0, sacct_output, "")]
             slurmmail.cli.__dict__["__process_spool_file"](
-                pathlib.Path(spool_file.name),
+                SpoolFile(pathlib.Path(spool_file.name)),
                 smtplib.SMTP(),
                 mock_slurmmail_cli_process_spool_file_options,
             )
@@ -2000,7 +2692,7 @@ class TestSendMailMain:
         with pytest.raises(SystemExit):
             slurmmail.cli.send_mail_main()
 
-    @pytest.mark.usefixtures("mock_path_glob")
+    @pytest.mark.usefixtures("mock_slurmmail_cli_scan_spool_dir")
     def test_config_file_retry_delay_negative(self, caplog, mock_raw_config_parser, mock_smtp):
         mock_raw_config_parser.side_effect.add_mock_value("slurm-send-mail", "retryDelay", -1)
         slurmmail.cli.send_mail_main()
@@ -2011,7 +2703,7 @@ class TestSendMailMain:
         )
         mock_smtp.assert_called_once()
 
-    @pytest.mark.usefixtures("mock_path_glob")
+    @pytest.mark.usefixtures("mock_slurmmail_cli_scan_spool_dir")
     def test_config_file_retry_delay_too_long(self, caplog, mock_raw_config_parser, mock_smtp):
         mock_raw_config_parser.side_effect.add_mock_value("slurm-send-mail", "retryDelay", 21)
         slurmmail.cli.send_mail_main()
@@ -2022,6 +2714,158 @@ class TestSendMailMain:
         )
         mock_smtp.assert_called_once()
 
+    @pytest.mark.usefixtures("mock_slurmmail_cli_scan_spool_dir")
+    def test_config_file_spool_max_files_negative(self, caplog, mock_raw_config_parser, mock_smtp):
+        mock_raw_config_parser.side_effect.add_mock_value("slurm-send-mail", "spoolMaxFiles", -1)
+        slurmmail.cli.send_mail_main()
+        assert check_message_logged(caplog, logging.ERROR, "spoolMaxFiles must be greater than or equal to zero")
+        mock_smtp.assert_called_once()
+
+    @pytest.mark.usefixtures("mock_smtp")
+    def test_spool_max_files(
+        self, mock_raw_config_parser, mock_slurmmail_cli_scan_spool_dir, mock_slurmmail_cli__process_spool_file
+    ):
+        mock_raw_config_parser.side_effect.add_mock_value("slurm-send-mail", "spoolMaxFiles", 2)
+        # passes are repeated while every spool file read was processed
+        # (i.e. no longer exists), until fewer than spoolMaxFiles are found
+        mock_slurmmail_cli_scan_spool_dir.side_effect = [
+            [DUMMY_PATH / "1_1673384400.mail", DUMMY_PATH / "2_1673384500.mail"],
+            [DUMMY_PATH / "3_1673384600.mail"],
+        ]
+        slurmmail.cli.send_mail_main()
+        assert mock_slurmmail_cli_scan_spool_dir.call_count == 2
+        assert mock_slurmmail_cli_scan_spool_dir.call_args[0][1] == 2
+        assert mock_slurmmail_cli__process_spool_file.call_count == 3
+
+    def test_config_file_spool_backend_invalid(self, caplog, mock_raw_config_parser):
+        mock_raw_config_parser.side_effect.add_mock_value("common", "spoolBackend", "foo")
+        slurmmail.cli.send_mail_main()
+        assert check_message_logged(caplog, logging.ERROR, "spoolBackend must be one of: files, sqlite")
+
+    @pytest.mark.usefixtures("mock_smtp")
+    def test_config_file_spool_lease_invalid(self, caplog, mock_raw_config_parser):
+        mock_raw_config_parser.side_effect.add_mock_value("slurm-send-mail", "spoolLease", 0)
+        slurmmail.cli.send_mail_main()
+        assert check_message_logged(caplog, logging.ERROR, "spoolLease must be greater than zero")
+
+    def test_spool_files_claimed(
+        self, mock_slurmmail_cli_process_spool_file_options, mock_slurmmail_cli__process_spool_file
+    ):
+        options = mock_slurmmail_cli_process_spool_file_options
+        process_spool_dir = slurmmail.cli.__dict__["__process_spool_dir"]
+        with tempfile.TemporaryDirectory() as tmp_dir, patch(
+            "slurmmail.cli.get_sacct_rows", return_value={}
+        ), patch("slurmmail.cli.__check_smtp_connection"):
+            spool_dir = pathlib.Path(tmp_dir)
+            for job_id in [1, 2]:
+                (spool_dir / f"{job_id}_1673384400.mail").write_text(
+                    json.dumps({"job_id": job_id, "state": "Began", "email": "root", "array_summary": False})
+                )
+            # claimed by an overlapping run of slurm-send-mail
+            other = spool_dir / f"2_1673384400.mail.processing.{os.getppid()}.{int(time.time())}.{os.uname().nodename}"
+            (spool_dir / "2_1673384400.mail").rename(other)
+
+            def process_spool_file(f, *_args, **_kwargs):
+                assert f".mail.processing.{os.getpid()}." in f.path.name
+                f.unlink()
+
+            mock_slurmmail_cli__process_spool_file.side_effect = process_spool_file
+            process_spool_dir(spool_dir, options)
+            mock_slurmmail_cli__process_spool_file.assert_called_once()
+            assert list(spool_dir.glob("*.mail*")) == [other]
+
+            # spool files that are not processed are released
+            other.rename(spool_dir / "2_1673384400.mail")
+            mock_slurmmail_cli__process_spool_file.side_effect = None
+            process_spool_dir(spool_dir, options)
+            assert list(spool_dir.glob("*.mail*")) == [spool_dir / "2_1673384400.mail"]
+
+    def test_spool_files_claim_lost(
+        self, caplog, mock_slurmmail_cli_process_spool_file_options, mock_slurmmail_cli__process_spool_file
+    ):
+        options = mock_slurmmail_cli_process_spool_file_options
+        options.spool_lease = 2
+        process_spool_dir = slurmmail.cli.__dict__["__process_spool_dir"]
+        with tempfile.TemporaryDirectory() as tmp_dir, patch(
+            "slurmmail.cli.get_sacct_rows", return_value={}
+        ), patch("slurmmail.cli.__check_smtp_connection"):
+            spool_dir = pathlib.Path(tmp_dir)
+            for job_id in [1, 2, 3]:
+                (spool_dir / f"{job_id}_1673384400.mail").write_text(
+                    json.dumps({"job_id": job_id, "state": "Began", "email": "root", "array_summary": False})
+                )
+
+            def process_spool_file(*_args, **_kwargs):
+                # the pass is slow enough for the claims on the other spool
+                # files to expire, and they are taken by another instance
+                for other in spool_dir.glob("*.mail.*"):
+                    other.unlink()
+
+            mock_slurmmail_cli__process_spool_file.side_effect = process_spool_file
+            with patch("slurmmail.cli.time") as mock_time, patch(
+                "slurmmail.deferred.renew_spool_file", wraps=slurmmail.deferred.renew_spool_file
+            ) as mock_renew:
+                # each call is a second later
+                mock_time.time.side_effect = itertools.count()
+                process_spool_dir(spool_dir, options)
+            mock_slurmmail_cli__process_spool_file.assert_called_once()
+            assert "has been claimed by another process" in caplog.text
+            # the claims on the spool files still waiting were renewed
+            assert mock_renew.call_count > 3
+            assert not list(spool_dir.glob("*.mail*"))
+
+    def test_backlog(self, caplog, capsys, mock_raw_config_parser):
+        with patch("sys.argv", ["slurm-send-mail", "--backlog"]):
+            with pytest.raises(SystemExit):
+                slurmmail.cli.send_mail_main()
+            assert check_message_logged(caplog, logging.ERROR, "--backlog requires spoolBackend = sqlite")
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                mock_raw_config_parser.side_effect.add_mock_value("common", "spoolDir", tmp_dir)
+                mock_raw_config_parser.side_effect.add_mock_value("common", "spoolBackend", "sqlite")
+                db = SpoolDatabase(pathlib.Path(tmp_dir) / SPOOL_DB_NAME, create=True)
+                for job_id, state in [(1, "Ended"), (2, "Began"), (3, "Ended")]:
+                    db.insert({"job_id": job_id, "state": state, "email": "root", "array_summary": False})
+                db.close()
+                slurmmail.cli.send_mail_main()
+        assert capsys.readouterr().out == "Began\troot\t1\nEnded\troot\t2\n"
+
+    def test_spool_db(self, mock_slurmmail_cli_process_spool_file_options, mock_slurmmail_cli__process_spool_file):
+        options = mock_slurmmail_cli_process_spool_file_options
+        options.spool_backend = "sqlite"
+        process_spool_dir = slurmmail.cli.__dict__["__process_spool_dir"]
+        data = {"job_id": 1, "state": "Began", "email": "root", "array_summary": False, "slurm_env": {}}
+        with tempfile.TemporaryDirectory() as tmp_dir, patch(
+            "slurmmail.cli.get_sacct_rows", return_value={}
+        ), patch("slurmmail.cli.__check_smtp_connection") as mock_check_smtp_connection:
+            spool_dir = pathlib.Path(tmp_dir)
+            # the database is created by slurm-spool-mail
+            assert process_spool_dir(spool_dir, options) == (None, False)
+            assert options.spool_db is None
+            assert not (spool_dir / SPOOL_DB_NAME).exists()
+
+            db = SpoolDatabase(spool_dir / SPOOL_DB_NAME, create=True)
+            db.insert(data)
+            try:
+                assert process_spool_dir(spool_dir, options) == (mock_check_smtp_connection.return_value, False)
+                mock_slurmmail_cli__process_spool_file.assert_called_once()
+                event = mock_slurmmail_cli__process_spool_file.call_args[0][0]
+                assert isinstance(event, SpoolEvent)
+                assert mock_slurmmail_cli__process_spool_file.call_args[1]["data"] == data
+                # events that are not removed are released for the next pass
+                process_spool_dir(spool_dir, options)
+                assert mock_slurmmail_cli__process_spool_file.call_count == 2
+
+                # failed events are deferred in the database
+                slurmmail.cli.__dict__["__retry_later"](event, smtplib.SMTPServerDisconnected(), options, True)
+                assert not event.exists()
+                assert db.count() == 1
+                assert db.claim(now=time.time() + options.retry_backoff + 1)
+                slurmmail.cli.__dict__["__retry_later"](event, smtplib.SMTPRecipientsRefused({}), options, False)
+                assert db.count() == 0
+            finally:
+                db.close()
+                slurmmail.cli.__dict__["__close_spool_db"](options)
+
     @pytest.mark.usefixtures("mock_raw_config_parser")
     def test_bad_spool_dir_permissons(self, mock_os_access):
         def os_access_fn(path, mode: int) -> bool:
@@ -2034,39 +2878,318 @@ class TestSendMailMain:
             slurmmail.cli.send_mail_main()
 
     @pytest.mark.usefixtures("mock_raw_config_parser")
-    def test_no_spool_files(self, mock_path_glob):
-        mock_path_glob.return_value = []
+    def test_no_spool_files(self, mock_slurmmail_cli_scan_spool_dir):
+        mock_slurmmail_cli_scan_spool_dir.return_value = []
         slurmmail.cli.send_mail_main()
 
     @pytest.mark.usefixtures("mock_raw_config_parser")
     def test_spool_files_present_smtp_ok(
-        self, mock_path_glob, mock_slurmmail_cli__process_spool_file, mock_smtp
+        self, mock_slurmmail_cli_scan_spool_dir, mock_slurmmail_cli__process_spool_file, mock_smtp
     ):
         slurmmail.cli.send_mail_main()
         assert mock_slurmmail_cli__process_spool_file.call_count == len(
-            mock_path_glob.return_value
+            mock_slurmmail_cli_scan_spool_dir.return_value
         )
         mock_smtp.assert_called_once()
 
+    @pytest.mark.usefixtures("mock_raw_config_parser", "mock_smtp")
+    def test_spool_files_present_sacct_batched(
+        self, mock_slurmmail_cli_scan_spool_dir, mock_slurmmail_cli__process_spool_file, mock_slurmmail_cli_run_command
+    ):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            spool_files = []
+            for job_id in [1, 2]:
+                spool_file = pathlib.Path(tmp_dir) / f"{job_id}_1673384400.mail"
+                spool_file.write_text(
+                    f'{{"job_id": {job_id}, "email": "root", "state": "Began", "array_summary": false}}'
+                )
+                spool_files.append(spool_file)
+            mock_slurmmail_cli_scan_spool_dir.return_value = spool_files
+            mock_slurmmail_cli_run_command.return_value = (0, "", "")
+
+            slurmmail.cli.send_mail_main()
+
+            mock_slurmmail_cli_run_command.assert_called_once()
+            assert "-j 1,2 " in mock_slurmmail_cli_run_command.call_args[0][0]
+            assert mock_slurmmail_cli__process_spool_file.call_count == 2
+            assert mock_slurmmail_cli__process_spool_file.call_args[1]["sacct_rows"] == []
+
+    def test_spool_files_present_smtp_connections(
+        self,
+        mock_raw_config_parser,
+        mock_slurmmail_cli_scan_spool_dir,
+        mock_slurmmail_cli__process_spool_file,
+        mock_slurmmail_cli_delete_spool_file,
+        mock_smtp,
+    ):
+        mock_raw_config_parser.side_effect.add_mock_value("slurm-send-mail", "smtpConnections", 2)
+
+        def submit(f, smtp_conn, _options, delivery=None, **_kwargs):
+            assert smtp_conn is None
+            delivery.submit(slurmmail.delivery.OutgoingMail("root", ["root"], "message", f, "test"))
+
+        mock_slurmmail_cli__process_spool_file.side_effect = submit
+        slurmmail.cli.send_mail_main()
+        assert mock_slurmmail_cli__process_spool_file.call_count == len(
+            mock_slurmmail_cli_scan_spool_dir.return_value
+        )
+        assert mock_smtp.return_value.sendmail.call_count == len(mock_slurmmail_cli_scan_spool_dir.return_value)
+        assert mock_slurmmail_cli_delete_spool_file.call_count == len(mock_slurmmail_cli_scan_spool_dir.return_value)
+        mock_smtp.return_value.noop.assert_not_called()
+
+    def test_handle_deliveries(self, mock_slurmmail_cli_process_spool_file_options):
+        options = mock_slurmmail_cli_process_spool_file_options
+        options.retry_on_failure = True
+        spool_file = MagicMock()
+        errors = [slurmmail.cli.CommandException("sacct failed")]
+        with patch("slurmmail.cli.delete_spool_file") as mock_delete_spool_file:
+            slurmmail.cli.__dict__["__handle_deliveries"]([(spool_file, errors)], options)
+            # sacct errors are temporary, so the spool file is deferred
+            spool_file.defer.assert_called_once_with("sacct failed")
+            mock_delete_spool_file.assert_not_called()
+            spool_file.defer.return_value = False
+            slurmmail.cli.__dict__["__handle_deliveries"]([(spool_file, errors)], options)
+            mock_delete_spool_file.assert_called_once_with(spool_file)
+
+    @pytest.mark.usefixtures("mock_smtp")
+    def test_spool_files_coalesced(
+        self,
+        caplog,
+        mock_slurmmail_cli_scan_spool_dir,
+        mock_raw_config_parser,
+        mock_slurmmail_cli__process_spool_file,
+        mock_slurmmail_cli_delete_spool_file,
+        mock_slurmmail_cli_run_command,
+    ):
+        mock_slurmmail_cli_run_command.return_value = (0, "", "")
+        caplog.set_level(logging.INFO)
+        mock_raw_config_parser.side_effect.add_mock_value("slurm-send-mail", "coalesceEvents", "yes")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            spool_files = []
+            for i, (job_id, state) in enumerate(
+                [(1, "Began"), (1, "Time reached 50%"), (1, "Ended"), (2, "Began"), (2, "Requeued")]
+            ):
+                spool_file = pathlib.Path(tmp_dir) / f"{job_id}_167338440{i}.mail"
+                spool_file.write_text(
+                    f'{{"job_id": {job_id}, "email": "root", "state": "{state}", "array_summary": false}}'
+                )
+                spool_files.append(spool_file)
+            mock_slurmmail_cli_scan_spool_dir.return_value = spool_files
+
+            slurmmail.cli.send_mail_main()
+
+            assert [c[0][0] for c in mock_slurmmail_cli__process_spool_file.call_args_list] == [SpoolFile(f) for f in spool_files[2:]]
+            assert [c[0][0] for c in mock_slurmmail_cli_delete_spool_file.call_args_list] == [SpoolFile(f) for f in spool_files[:2]]
+            assert check_message_logged(caplog, logging.INFO, "Suppressed 2 superseded event(s)")
+
+    @pytest.mark.usefixtures("mock_smtp")
+    def test_spool_files_coalesce_rules(
+        self,
+        caplog,
+        mock_slurmmail_cli_scan_spool_dir,
+        mock_raw_config_parser,
+        mock_slurmmail_cli__process_spool_file,
+        mock_slurmmail_cli_delete_spool_file,
+        mock_slurmmail_cli_run_command,
+    ):
+        mock_slurmmail_cli_run_command.return_value = (0, "", "")
+        mock_raw_config_parser.side_effect.add_mock_value("slurm-send-mail", "coalesceEvents", "yes")
+        mock_raw_config_parser.side_effect.add_mock_value("slurm-send-mail", "coalesceRules", "Began: Ended; bad")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            spool_files = []
+            for i, state in enumerate(["Began", "Ended"]):
+                spool_file = pathlib.Path(tmp_dir) / f"1_167338440{i}.mail"
+                spool_file.write_text(f'{{"job_id": 1, "email": "root", "state": "{state}", "array_summary": false}}')
+                spool_files.append(spool_file)
+            mock_slurmmail_cli_scan_spool_dir.return_value = spool_files
+
+            slurmmail.cli.send_mail_main()
+
+            assert check_message_logged(caplog, logging.ERROR, "Ignoring invalid coalesce rule: 'bad'")
+            mock_slurmmail_cli__process_spool_file.assert_called_once()
+            assert mock_slurmmail_cli__process_spool_file.call_args[0][0] == SpoolFile(spool_files[0])
+            mock_slurmmail_cli_delete_spool_file.assert_called_once_with(SpoolFile(spool_files[1]))
+
+    @pytest.mark.usefixtures("mock_slurmmail_cli_run_scontrol")
+    def test_spool_files_digest(
+        self,
+        mock_slurmmail_cli_scan_spool_dir,
+        mock_raw_config_parser,
+        mock_slurmmail_cli__process_spool_file,
+        mock_slurmmail_cli_delete_spool_file,
+        mock_slurmmail_cli_run_command,
+        mock_smtp,
+    ):
+        mock_raw_config_parser.side_effect.add_mock_value("slurm-send-mail", "digestStates", "Began, Ended")
+        mock_raw_config_parser.side_effect.add_mock_value("slurm-send-mail", "digestWindow", 0)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            spool_files = []
+            for job_id, state in [(1, "Began"), (2, "Began"), (3, "Failed")]:
+                spool_file = pathlib.Path(tmp_dir) / f"{job_id}_1673384400.mail"
+                spool_file.write_text(
+                    f'{{"job_id": {job_id}, "email": "root", "state": "{state}", "array_summary": false}}'
+                )
+                spool_files.append(spool_file)
+            mock_slurmmail_cli_scan_spool_dir.return_value = spool_files
+            mock_slurmmail_cli_run_command.return_value = (
+                0,
+                "1|root|root|all|myaccount|1674333232|Unknown|RUNNING|500M||1|0|00:00:00|1|/|00:00:11|0:0|||test|node01|01:00:00|60|1|billing=1,cpu=1,node=1|job1.jcf\n"  # noqa
+                "2|root|root|all|myaccount|1674333232|Unknown|RUNNING|500M||1|0|00:00:00|1|/|00:00:11|0:0|||test|node01|01:00:00|60|2|billing=1,cpu=1,node=1|job2.jcf\n",  # noqa
+                "",
+            )
+
+            slurmmail.cli.send_mail_main()
+
+            # the Failed event is not part of the digest
+            mock_slurmmail_cli__process_spool_file.assert_called_once()
+            assert mock_slurmmail_cli__process_spool_file.call_args[0][0] == SpoolFile(spool_files[2])
+            assert mock_slurmmail_cli__process_spool_file.call_args[1]["data"]["state"] == "Failed"
+            mock_slurmmail_cli_run_command.assert_called_once()
+            assert "-j 3,1,2 " in mock_slurmmail_cli_run_command.call_args[0][0]
+            mock_smtp.return_value.sendmail.assert_called_once()
+            message = email.message_from_string(mock_smtp.return_value.sendmail.call_args[0][2])
+            assert message["Subject"] == "test: 2 job notifications"
+            text = message.get_payload()[0].get_payload(decode=True).decode()
+            assert "Job 1 (job1.jcf): Began" in text
+            assert "Job 2 (job2.jcf): Began" in text
+            assert [c[0][0] for c in mock_slurmmail_cli_delete_spool_file.call_args_list] == [SpoolFile(f) for f in spool_files[:2]]
+
+    @pytest.mark.usefixtures("mock_slurmmail_cli_run_command")
+    def test_spool_files_digest_window(
+        self,
+        mock_slurmmail_cli_scan_spool_dir,
+        mock_raw_config_parser,
+        mock_slurmmail_cli__process_spool_file,
+        mock_slurmmail_cli_delete_spool_file,
+        mock_smtp,
+    ):
+        mock_raw_config_parser.side_effect.add_mock_value("slurm-send-mail", "digestStates", "Began")
+        mock_raw_config_parser.side_effect.add_mock_value("slurm-send-mail", "digestUsers", "root")
+        mock_raw_config_parser.side_effect.add_mock_value("slurm-send-mail", "digestWindow", 3600)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            spool_file = pathlib.Path(tmp_dir) / f"1_{time.time()}.mail"
+            spool_file.write_text('{"job_id": 1, "email": "root", "state": "Began", "array_summary": false}')
+            mock_slurmmail_cli_scan_spool_dir.return_value = [spool_file]
+
+            slurmmail.cli.send_mail_main()
+
+            # held back until the next pass
+            mock_slurmmail_cli__process_spool_file.assert_not_called()
+            mock_slurmmail_cli_delete_spool_file.assert_not_called()
+            mock_smtp.return_value.sendmail.assert_not_called()
+
+    @pytest.mark.usefixtures("mock_raw_config_parser")
+    def test_daemon(self, mock_slurmmail_cli_scan_spool_dir, mock_slurmmail_cli__process_spool_file, mock_smtp):
+        with patch("slurmmail.cli.SpoolWatcher") as mock_watcher:
+            def stop_daemon():
+                os.kill(os.getpid(), signal.SIGTERM)
+
+            mock_watcher.return_value.wait.side_effect = stop_daemon
+            with patch("sys.argv", ["slurm-send-mail", "--daemon"]):
+                slurmmail.cli.send_mail_main()
+
+            mock_watcher.return_value.wait.assert_called_once()
+            mock_watcher.return_value.close.assert_called_once()
+        assert mock_slurmmail_cli__process_spool_file.call_count == len(
+            mock_slurmmail_cli_scan_spool_dir.return_value
+        )
+        mock_smtp.assert_called_once()
+        mock_smtp.return_value.quit.assert_called_once()
+        assert signal.getsignal(signal.SIGTERM) == signal.SIG_DFL
+
+    @pytest.mark.usefixtures("mock_slurmmail_cli_scan_spool_dir", "mock_slurmmail_cli__process_spool_file", "mock_smtp")
+    def test_daemon_event_receiver(self, mock_raw_config_parser):
+        with tempfile.TemporaryDirectory() as tmp_dir, patch("slurmmail.cli.SpoolWatcher") as mock_watcher:
+            spool_dir = pathlib.Path(tmp_dir)
+            socket_path = spool_dir / "spool.sock"
+            mock_raw_config_parser.side_effect.add_mock_value("common", "spoolDir", tmp_dir)
+            mock_raw_config_parser.side_effect.add_mock_value("common", "spoolSocket", str(socket_path))
+            data = {"job_id": 1, "state": "Began", "email": "root", "array_summary": False, "slurm_env": {}}
+            sent = []
+
+            def send_event():
+                sent.append(slurmmail.spool.__dict__["__send_spool_event"](socket_path, data, 2.0))
+                os.kill(os.getpid(), signal.SIGTERM)
+
+            mock_watcher.return_value.wait.side_effect = send_event
+            with patch("sys.argv", ["slurm-send-mail", "--daemon"]):
+                slurmmail.cli.send_mail_main()
+
+            # the event is spooled before it is acknowledged
+            assert sent == [True]
+            spool_files = slurmmail.spool.scan_spool_dir(spool_dir)
+            assert [json.loads(f.read_text()) for f in spool_files] == [data]
+            mock_watcher.return_value.wake.assert_called()
+            assert not socket_path.exists()
+
+    @pytest.mark.usefixtures("mock_raw_config_parser")
+    def test_daemon_reload(self, mock_slurmmail_cli_scan_spool_dir, mock_slurmmail_cli__process_spool_file, mock_smtp):
+        with patch("slurmmail.cli.SpoolWatcher") as mock_watcher:
+            signals = [signal.SIGHUP, signal.SIGTERM]
+
+            def send_signal():
+                os.kill(os.getpid(), signals.pop(0))
+
+            mock_watcher.return_value.wait.side_effect = send_signal
+            with patch("sys.argv", ["slurm-send-mail", "--daemon"]):
+                slurmmail.cli.send_mail_main()
+
+        # two passes over the spool directory and a new SMTP connection after the reload
+        assert mock_slurmmail_cli__process_spool_file.call_count == 2 * len(
+            mock_slurmmail_cli_scan_spool_dir.return_value
+        )
+        assert mock_smtp.call_count == 2
+
     @pytest.mark.usefixtures("mock_raw_config_parser")
     def test_spool_files_present_smtp_noop_exception(
-        self, mock_path_glob, mock_slurmmail_cli__process_spool_file, mock_smtp
+        self, mock_slurmmail_cli_scan_spool_dir, mock_slurmmail_cli__process_spool_file, mock_smtp
     ):
         smtp_noop_mock = MagicMock()
         smtp_noop_mock.side_effect = Exception("SMTP error")
         smtp_instance_mock = MagicMock()
         smtp_instance_mock.noop = smtp_noop_mock
         mock_smtp.return_value = smtp_instance_mock
-        slurmmail.cli.send_mail_main()
+        # the connection is idle by the time each spool file is processed
+        with patch("slurmmail.cli.SMTP_IDLE_CHECK_SECONDS", -1):
+            slurmmail.cli.send_mail_main()
         assert mock_slurmmail_cli__process_spool_file.call_count == len(
-            mock_path_glob.return_value
+            mock_slurmmail_cli_scan_spool_dir.return_value
         )
         # smtplib.SMTP will be called for each file due to noop exceptions
-        assert mock_smtp.call_count == len(mock_path_glob.return_value)
+        assert mock_smtp.call_count == len(mock_slurmmail_cli_scan_spool_dir.return_value)
+
+    @pytest.mark.usefixtures("mock_raw_config_parser")
+    def test_spool_files_present_smtp_reused(
+        self, mock_slurmmail_cli_scan_spool_dir, mock_slurmmail_cli__process_spool_file, mock_smtp
+    ):
+        slurmmail.cli.send_mail_main()
+        assert mock_slurmmail_cli__process_spool_file.call_count == len(
+            mock_slurmmail_cli_scan_spool_dir.return_value
+        )
+        # a connection that has just been used is not checked, and is
+        # closed once the spool directory has been processed
+        mock_smtp.assert_called_once()
+        mock_smtp.return_value.noop.assert_not_called()
+        mock_smtp.return_value.quit.assert_called_once()
+
+    def test_smtp_checked_after_send_error(self, mock_slurmmail_cli_process_spool_file_options):
+        options = mock_slurmmail_cli_process_spool_file_options
+        check_smtp_connection = slurmmail.cli.__dict__["__check_smtp_connection"]
+        send_message = slurmmail.cli.__dict__["__send_message"]
+        smtp_conn = MagicMock()
+        send_message(MagicMock(), "root", smtp_conn, options)
+        assert check_smtp_connection(smtp_conn, options, False) is smtp_conn
+        smtp_conn.noop.assert_not_called()
+
+        smtp_conn.sendmail.side_effect = smtplib.SMTPServerDisconnected("gone away")
+        with pytest.raises(smtplib.SMTPServerDisconnected):
+            send_message(MagicMock(), "root", smtp_conn, options)
+        assert check_smtp_connection(smtp_conn, options, False) is smtp_conn
+        smtp_conn.noop.assert_called_once()
 
     def test_spool_files_present_email_headers(
         self,
-        mock_path_glob,
+        mock_slurmmail_cli_scan_spool_dir,
         mock_raw_config_parser,
         mock_slurmmail_cli__process_spool_file,
         mock_smtp,
@@ -2076,7 +3199,7 @@ class TestSendMailMain:
         )
         slurmmail.cli.send_mail_main()
         assert mock_slurmmail_cli__process_spool_file.call_count == len(
-            mock_path_glob.return_value
+            mock_slurmmail_cli_scan_spool_dir.return_value
         )
 
         assert mock_slurmmail_cli__process_spool_file.call_args[0][2].email_headers == {
@@ -2089,7 +3212,7 @@ class TestSendMailMain:
     def test_spool_files_present_bad_email_headers(
         self,
         caplog,
-        mock_path_glob,
+        mock_slurmmail_cli_scan_spool_dir,
         mock_raw_config_parser,
         mock_slurmmail_cli__process_spool_file,
         mock_smtp,
@@ -2100,7 +3223,7 @@ class TestSendMailMain:
         slurmmail.cli.send_mail_main()
 
         assert mock_slurmmail_cli__process_spool_file.call_count == len(
-            mock_path_glob.return_value
+            mock_slurmmail_cli_scan_spool_dir.return_value
         )
         assert check_message_logged(caplog, logging.ERROR, "Ignoring invalid e-mail header: 'Bad option'")
         assert mock_slurmmail_cli__process_spool_file.call_args[0][2].email_headers == {}
@@ -2109,7 +3232,7 @@ class TestSendMailMain:
 
     def test_spool_files_present_use_ssl(
         self,
-        mock_path_glob,
+        mock_slurmmail_cli_scan_spool_dir,
         mock_raw_config_parser,
         mock_slurmmail_cli__process_spool_file,
         mock_smtp,
@@ -2120,14 +3243,14 @@ class TestSendMailMain:
         )
         slurmmail.cli.send_mail_main()
         assert mock_slurmmail_cli__process_spool_file.call_count == len(
-            mock_path_glob.return_value
+            mock_slurmmail_cli_scan_spool_dir.return_value
         )
         mock_smtp_ssl.assert_called_once()
         mock_smtp.assert_not_called()
 
     def test_spool_files_present_use_starttls(
         self,
-        mock_path_glob,
+        mock_slurmmail_cli_scan_spool_dir,
         mock_raw_config_parser,
         mock_slurmmail_cli__process_spool_file,
         mock_smtp,
@@ -2140,14 +3263,14 @@ class TestSendMailMain:
         )
         slurmmail.cli.send_mail_main()
         assert mock_slurmmail_cli__process_spool_file.call_count == len(
-            mock_path_glob.return_value
+            mock_slurmmail_cli_scan_spool_dir.return_value
         )
         mock_smtp.assert_called_once()
         smtp_instance.starttls.assert_called_once()
 
     def test_spool_files_present_use_smtp_login(
         self,
-        mock_path_glob,
+        mock_slurmmail_cli_scan_spool_dir,
         mock_raw_config_parser,
         mock_slurmmail_cli__process_spool_file,
         mock_smtp,
@@ -2165,148 +3288,7 @@ class TestSendMailMain:
         )
         slurmmail.cli.send_mail_main()
         assert mock_slurmmail_cli__process_spool_file.call_count == len(
-            mock_path_glob.return_value
+            mock_slurmmail_cli_scan_spool_dir.return_value
         )
         mock_smtp.assert_called_once()
         smtp_instance.login.assert_called_once_with(smtp_username, smtp_password)
-
-
-@pytest.mark.usefixtures("set_slurmmail_cli_values")
-class TestSpoolMailMain:
-    """
-    Test spool_mail_main.
-    """
-
-    def test_incorrect_args(self):
-        with patch("sys.argv", []):
-            with pytest.raises(SystemExit):
-                slurmmail.cli.spool_mail_main()
-
-    def test_config_file_error(self):
-        with patch(
-            "sys.argv",
-            ["spool_mail_main", "-s", "Slurm Job_id=1000 Began", "test@example.com"],
-        ):
-            with patch("configparser.RawConfigParser.read") as mock_configparser_read:
-                mock_configparser_read.side_effect = Exception(
-                    "Failed to read config file"
-                )
-                with pytest.raises(SystemExit):
-                    slurmmail.cli.spool_mail_main()
-
-    @pytest.mark.usefixtures(
-        "mock_raw_config_parser_missing_section", "mock_sys_argv_job_began"
-    )
-    def test_config_file_missing_section(self):
-        with pytest.raises(SystemExit):
-            slurmmail.cli.spool_mail_main()
-
-    @pytest.mark.usefixtures("mock_slurmmail_cli_check_dir", "mock_sys_argv_job_began")
-    def test_config_file_verbose_logging(
-        self, mock_json_dump, mock_path_open, mock_raw_config_parser
-    ):
-        mock_raw_config_parser.side_effect.add_mock_value(
-            "slurm-spool-mail", "verbose", True
-        )
-        slurmmail.cli.spool_mail_main()
-        mock_path_open.assert_called_once_with(mode="w", encoding="utf-8")
-        mock_json_dump.assert_called_once()
-
-    @pytest.mark.usefixtures("mock_slurmmail_cli_check_dir")
-    def test_bad_slurm_info(self):
-        with patch(
-            "sys.argv",
-            ["spool_mail_main", "-s", "Slurm Job_id=1000 Foo", "test@example.com"],
-        ):
-            with pytest.raises(SystemExit):
-                slurmmail.cli.spool_mail_main()
-
-    @pytest.mark.usefixtures(
-        "mock_raw_config_parser",
-        "mock_slurmmail_cli_check_dir",
-        "mock_sys_argv_job_began",
-    )
-    def test_job_began(self, mock_json_dump, mock_path_open):
-        slurmmail.cli.spool_mail_main()
-        mock_path_open.assert_called_once_with(mode="w", encoding="utf-8")
-        mock_json_dump.assert_called_once()
-
-    @pytest.mark.usefixtures(
-        "mock_raw_config_parser",
-        "mock_slurmmail_cli_check_dir",
-        "mock_sys_argv_job_began",
-    )
-    def test_write_error(self, mock_json_dump, mock_path_open):
-        mock_path_open.side_effect = Exception("Failed to write to file")
-        slurmmail.cli.spool_mail_main()
-        mock_path_open.assert_called_once_with(mode="w", encoding="utf-8")
-        mock_json_dump.assert_not_called()
-
-    @pytest.mark.usefixtures("mock_raw_config_parser", "mock_slurmmail_cli_check_dir")
-    def test_job_ended(self, mock_json_dump, mock_path_open):
-        with patch(
-            "sys.argv",
-            ["spool_mail_main", "-s", "Slurm Job_id=1000 Ended", "test@example.com"],
-        ):
-            slurmmail.cli.spool_mail_main()
-            mock_path_open.assert_called_once_with(mode="w", encoding="utf-8")
-            mock_json_dump.assert_called_once()
-
-    @pytest.mark.usefixtures("mock_raw_config_parser", "mock_slurmmail_cli_check_dir")
-    def test_job_reached_time_limit(self, mock_json_dump, mock_path_open):
-        with patch(
-            "sys.argv",
-            [
-                "spool_mail_main",
-                "-s",
-                "Slurm Job_id=1000 Reached time limit",
-                "test@example.com",
-            ],
-        ):
-            slurmmail.cli.spool_mail_main()
-            mock_path_open.assert_called_once_with(mode="w", encoding="utf-8")
-            mock_json_dump.assert_called_once()
-
-    @pytest.mark.usefixtures("mock_raw_config_parser", "mock_slurmmail_cli_check_dir")
-    def test_job_reached_percent_time_limit(self, mock_json_dump, mock_path_open):
-        with patch(
-            "sys.argv",
-            [
-                "spool_mail_main",
-                "-s",
-                "Slurm Job_id=1000 Reached 50% of time limit",
-                "test@example.com",
-            ],
-        ):
-            slurmmail.cli.spool_mail_main()
-            mock_path_open.assert_called_once_with(mode="w", encoding="utf-8")
-            mock_json_dump.assert_called_once()
-
-    @pytest.mark.usefixtures("mock_raw_config_parser", "mock_slurmmail_cli_check_dir")
-    def test_bad_slurm_array_info(self):
-        with patch(
-            "sys.argv",
-            [
-                "spool_mail_main",
-                "-s",
-                "Slurm Array Task Job_id=1000_1 (1000) Foo",
-                "test@example.com",
-            ],
-        ):
-            with pytest.raises(SystemExit):
-                slurmmail.cli.spool_mail_main()
-
-    @pytest.mark.usefixtures("mock_raw_config_parser", "mock_slurmmail_cli_check_dir")
-    def test_job_array_began(self, mock_json_dump, mock_path_open):
-        with patch(
-            "sys.argv",
-            [
-                "spool_mail_main",
-                "-s",
-                "Slurm Array Task Job_id=1000_1 (1000) Began",
-                "test@example.com",
-            ],
-        ):
-            slurmmail.cli.spool_mail_main()
-            mock_path_open.assert_called_once_with(mode="w", encoding="utf-8")
-            mock_json_dump.assert_called_once()
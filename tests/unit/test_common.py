@@ -26,7 +26,10 @@
 """
 Unit tests for slurmmail.common
 """
+import os
 import pathlib
+import subprocess
+import tempfile
 from unittest.mock import MagicMock, mock_open, patch
 
 import pytest  # type: ignore
@@ -34,15 +37,21 @@ import pytest  # type: ignore
 from slurmmail.common import (
     check_dir,
     check_file,
+    CommandException,
     delete_spool_file,
     die,
     get_file_contents,
     get_kbytes_from_str,
     get_str_from_kbytes,
     get_usec_from_str,
+    LookupCache,
+    open_command,
+    read_last_lines,
     run_command,
     tail_file,
+    TAIL_EXE_TIMEOUT,
 )
+from slurmmail.deferred import SpoolFile
 
 DUMMY_PATH = pathlib.Path("/tmp")
 TAIL_EXE = "/usr/bin/tail"
@@ -143,7 +152,7 @@ class TestCommon:
         mock_die.assert_not_called()
 
     def test_delete_file(self, mock_path_unlink):
-        delete_spool_file(pathlib.Path("/foo/bar"))
+        delete_spool_file(SpoolFile(pathlib.Path("/foo/bar")))
         mock_path_unlink.assert_called_once()
 
     def test_die(self):
@@ -191,6 +200,25 @@ class TestCommon:
         with pytest.raises(SystemExit):
             get_usec_from_str("2")
 
+    def test_open_command(self):
+        with open_command("printf 'line 1\\nline 2\\n'") as stdout:
+            assert list(stdout) == ["line 1\n", "line 2\n"]
+
+    def test_open_command_failure(self):
+        with pytest.raises(CommandException, match="No such file"):
+            with open_command("ls /nonexistent-slurm-mail-dir") as stdout:
+                stdout.read()
+
+    def test_open_command_closed_early(self):
+        # the command would never finish if it was not killed
+        def read_first_line():
+            with open_command("yes") as stdout:
+                yield stdout.readline()
+
+        lines = read_first_line()
+        assert next(lines) == "y\n"
+        lines.close()
+
     def test_run_command(self, mock_subprocess_popen):
         stdout = "output"
         stderr = "stderr"
@@ -207,48 +235,139 @@ class TestCommon:
         assert stdout_rslt == stdout
         assert stderr_rslt == stderr
 
-    def test_tail_file(self, mock_path_exists, mock_subprocess_popen):
-        mock_path_exists.return_value = True
-        stdout = "\n".join([f"line {i + 1}" for i in range(11)])
-        attrs = {
-            "communicate.return_value": (stdout.encode(), "error".encode()),
-            "returncode": 0,
-        }
-        mock_subprocess_popen.return_value.__enter__.return_value.configure_mock(
-            **attrs
-        )
-        rslt = tail_file(str(DUMMY_PATH), 10, pathlib.Path(TAIL_EXE))
-        assert rslt == stdout
+    def test_tail_file_native(self, mock_subprocess_popen):
+        with tempfile.NamedTemporaryFile(mode="w") as output_file:
+            output_file.write("\n".join([f"line {i + 1}" for i in range(10000)]) + "\n")
+            output_file.flush()
+            rslt = tail_file(output_file.name, 3)
+        assert rslt == "line 9998\nline 9999\nline 10000\n"
+        mock_subprocess_popen.assert_not_called()
+
+    def test_tail_file_not_regular_file(self, mock_subprocess_popen):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            fifo = os.path.join(tmp_dir, "slurm-1.out")
+            os.mkfifo(fifo)
+            # returns straight away rather than waiting for a writer
+            rslt = tail_file(fifo, 10, tail_exe=pathlib.Path(TAIL_EXE))
+        assert rslt == f"slurm-mail: {fifo} is not a regular file"
+        mock_subprocess_popen.assert_not_called()
+
+    def test_tail_file_fallback(self, mock_subprocess_popen):
+        process = mock_subprocess_popen.return_value.__enter__.return_value
+        process.configure_mock(**{"communicate.return_value": (b"line 1\nline 2\n", b""), "returncode": 0})
+        with tempfile.NamedTemporaryFile(mode="w") as output_file, patch(
+            "slurmmail.common.read_last_lines", side_effect=OSError("Input/output error")
+        ):
+            assert tail_file(output_file.name, 2, max_bytes=7, tail_exe=pathlib.Path(TAIL_EXE)) == "line 2\n"
+            assert mock_subprocess_popen.call_args[0][0] == [TAIL_EXE, "-2", output_file.name]
+            process.communicate.assert_called_once_with(timeout=TAIL_EXE_TIMEOUT)
+            # without tailExe the error is returned instead
+            rslt = tail_file(output_file.name, 2)
+        assert rslt == "Unable to return contents of file: Input/output error"
+
+    def test_tail_file_fallback_timeout(self, mock_subprocess_popen):
+        process = mock_subprocess_popen.return_value.__enter__.return_value
+        process.communicate.side_effect = [subprocess.TimeoutExpired(TAIL_EXE, TAIL_EXE_TIMEOUT), (b"", b"")]
+        with tempfile.NamedTemporaryFile(mode="w") as output_file, patch(
+            "slurmmail.common.read_last_lines", side_effect=OSError("Input/output error")
+        ):
+            rslt = tail_file(output_file.name, 2, tail_exe=pathlib.Path(TAIL_EXE))
+        assert rslt == f"slurm-mail: timed out trying to read the last 2 lines of {output_file.name}"
+        process.kill.assert_called_once()
+
+    def test_read_last_lines(self):
+        with tempfile.NamedTemporaryFile(mode="w") as output_file:
+            output_file.write("line 1\nline 2\nline 3")
+            output_file.flush()
+            assert read_last_lines(output_file.name, 2) == "line 2\nline 3"
+            assert read_last_lines(output_file.name, 10) == "line 1\nline 2\nline 3"
+
+    def test_read_last_lines_max_bytes(self):
+        with tempfile.NamedTemporaryFile(mode="wb") as output_file:
+            # a single line much larger than the limit
+            output_file.write(b"x" * 100000 + b"end\n")
+            output_file.flush()
+            rslt = read_last_lines(output_file.name, 10, max_bytes=1000)
+        assert len(rslt) == 1000
+        assert rslt.endswith("xend\n")
+
+    def test_read_last_lines_binary(self):
+        with tempfile.NamedTemporaryFile(mode="wb") as output_file:
+            output_file.write(b"line 1\n\xff\xfe\x00binary\nline 3\n")
+            output_file.flush()
+            rslt = read_last_lines(output_file.name, 2)
+        assert rslt == "\ufffd\ufffdbinary\nline 3\n"
 
     def test_tail_file_not_exists(self, mock_path_exists):
         mock_path_exists.return_value = False
-        rslt = tail_file(str(DUMMY_PATH), 10, pathlib.Path(TAIL_EXE))
+        rslt = tail_file(str(DUMMY_PATH), 10)
         assert rslt == f"slurm-mail: file {DUMMY_PATH} does not exist"
 
     def test_tail_file_invalid_lines(self):
         for lines in [0, -1]:
-            rslt = tail_file(str(DUMMY_PATH), lines, pathlib.Path(TAIL_EXE))
+            rslt = tail_file(str(DUMMY_PATH), lines)
             assert rslt == f"slurm-mail: invalid number of lines to tail: {lines}"
 
     def test_tail_file_exception(self, mock_path_exists):
         err_msg = "Dummy Error"
         mock_path_exists.return_value = True
         mock_path_exists.side_effect = Exception(err_msg)
-        rslt = tail_file(str(DUMMY_PATH), 10, pathlib.Path(TAIL_EXE))
+        rslt = tail_file(str(DUMMY_PATH), 10)
         assert rslt == f"Unable to return contents of file: {err_msg}"
 
-    def test_tail_file_exe_failed(self, mock_path_exists, mock_subprocess_popen):
-        lines = 10
-        mock_path_exists.return_value = True
-        attrs = {
-            "communicate.return_value": ("output".encode(), "error".encode()),
-            "returncode": 1,
-        }
-        mock_subprocess_popen.return_value.__enter__.return_value.configure_mock(
-            **attrs
-        )
-        rslt = tail_file(str(DUMMY_PATH), lines, pathlib.Path(TAIL_EXE))
-        assert (
-            rslt
-            == f"slurm-mail: error trying to read the last {lines} lines of {DUMMY_PATH}"  # noqa
-        )
+
+class TestLookupCache:
+    """
+    Test slurmmail.common.LookupCache
+    """
+
+    def test_cached(self):
+        lookup = MagicMock(return_value="entry")
+        cache = LookupCache(lookup)
+        assert cache.get("foo") == "entry"
+        assert cache.get("foo") == "entry"
+        lookup.assert_called_once_with("foo")
+
+    def test_unknown_name_cached(self):
+        lookup = MagicMock(side_effect=KeyError("name not found"))
+        cache = LookupCache(lookup)
+        for _ in range(2):
+            with pytest.raises(KeyError):
+                cache.get("foo")
+        lookup.assert_called_once_with("foo")
+
+    def test_max_size(self):
+        lookup = MagicMock(side_effect=lambda name: name.upper())
+        cache = LookupCache(lookup, max_size=2)
+        cache.get("a")
+        cache.get("b")
+        cache.get("a")  # "b" is now the least recently used
+        cache.get("c")
+        assert len(cache) == 2
+        assert lookup.call_count == 3
+        cache.get("a")
+        assert lookup.call_count == 3
+        cache.get("b")
+        assert lookup.call_count == 4
+
+    def test_ttl(self):
+        lookup = MagicMock(return_value="entry")
+        cache = LookupCache(lookup, ttl=60)
+        with patch("slurmmail.common.time.monotonic") as mock_monotonic:
+            mock_monotonic.return_value = 1000
+            cache.get("foo")
+            mock_monotonic.return_value = 1059
+            cache.get("foo")
+            assert lookup.call_count == 1
+            mock_monotonic.return_value = 1060
+            cache.get("foo")
+            assert lookup.call_count == 2
+
+    def test_clear(self):
+        lookup = MagicMock(return_value="entry")
+        cache = LookupCache(lookup)
+        cache.get("foo")
+        cache.clear()
+        assert len(cache) == 0
+        cache.get("foo")
+        assert lookup.call_count == 2
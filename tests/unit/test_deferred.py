@@ -0,0 +1,179 @@
+# pylint: disable=missing-function-docstring,redefined-outer-name
+
+#
+#  This file is part of Slurm-Mail.
+#
+#  Slurm-Mail is a drop in replacement for Slurm's e-mails to give users
+#  much more information about their jobs compared to the standard Slurm
+#  e-mails.
+#
+#   Copyright (C) 2018-2026 Neil Munday (neil@mundayweb.com)
+#
+#  Slurm-Mail is free software: you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the
+#  Free Software Foundation, either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  Slurm-Mail is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Slurm-Mail.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Unit tests for slurmmail.deferred
+"""
+
+import json
+import os
+import pathlib
+import tempfile
+import time
+from unittest.mock import patch
+
+import pytest  # type: ignore
+
+from slurmmail.deferred import DEFERRED_DIR, DeferredQueue, SpoolFile
+from slurmmail.spool import claim_spool_file
+from slurmmail.spoolitem import SpoolItem
+
+#
+# Fixtures
+#
+
+
+@pytest.fixture
+def spool_dir():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        yield pathlib.Path(tmp_dir)
+
+
+def make_spool_file(spool_dir: pathlib.Path, name: str = "1.Began.mail") -> pathlib.Path:
+    spool_file = spool_dir / name
+    spool_file.write_text(json.dumps({"job_id": 1, "email": "root", "state": "Began", "array_summary": False}))
+    return spool_file
+
+
+#
+# Test classes
+#
+
+
+class TestDeferredQueue:
+    """
+    Test slurmmail.deferred.DeferredQueue
+    """
+
+    def test_defer(self, spool_dir):
+        spool_file = make_spool_file(spool_dir)
+        queue = DeferredQueue(spool_dir, base_delay=60)
+        assert queue.defer(spool_file, "451 try again later")
+        assert not spool_file.exists()
+        deferred_files = list((spool_dir / DEFERRED_DIR).iterdir())
+        assert len(deferred_files) == 1
+        data = json.loads(deferred_files[0].read_text())
+        assert data["job_id"] == 1
+        assert data["attempts"] == 1
+        assert data["error"] == "451 try again later"
+        assert time.time() + 30 - 1 <= data["next_attempt"] <= time.time() + 60
+        assert deferred_files[0].name == f"{data['next_attempt']}-1.Began.mail"
+
+    def test_due(self, spool_dir):
+        queue = DeferredQueue(spool_dir)
+        assert queue.due() == []
+        queue.defer(make_spool_file(spool_dir), "error")
+        assert queue.due() == []
+        next_attempt = json.loads(next(queue.path.iterdir()).read_text())["next_attempt"]
+        assert queue.due(now=next_attempt) == list(queue.path.iterdir())
+        # temporary files are ignored
+        (queue.path / ".1.Began.mail.tmp").write_text("{}")
+        assert len(queue.due(now=next_attempt)) == 1
+
+    def test_defer_again(self, spool_dir):
+        queue = DeferredQueue(spool_dir, max_attempts=3)
+        queue.defer(make_spool_file(spool_dir), "error")
+        deferred_file = next(queue.path.iterdir())
+        assert queue.defer(deferred_file, "error")
+        deferred_files = list(queue.path.iterdir())
+        assert len(deferred_files) == 1
+        assert deferred_files[0].name.endswith("-1.Began.mail")
+        assert deferred_files[0].name.count("-") == 1
+        assert json.loads(deferred_files[0].read_text())["attempts"] == 2
+        # give up after max_attempts, the caller deletes the spool file
+        assert not queue.defer(deferred_files[0], "error")
+        assert deferred_files[0].exists()
+
+    def test_defer_claimed(self, spool_dir):
+        queue = DeferredQueue(spool_dir, base_delay=60, lease=600)
+        assert queue.defer(claim_spool_file(make_spool_file(spool_dir)), "error")
+        deferred_file = next(queue.path.iterdir())
+        assert deferred_file.name.endswith("-1.Began.mail")
+        assert queue.defer(claim_spool_file(deferred_file), "error")
+        assert [f.name.partition("-")[2] for f in queue.path.iterdir()] == ["1.Began.mail"]
+        assert [f for f in spool_dir.iterdir() if f.is_file()] == []
+
+    def test_due_stale_lease(self, spool_dir):
+        queue = DeferredQueue(spool_dir, lease=600)
+        queue.path.mkdir()
+        (queue.path / "1000-1.Began.mail.processing.1.1000.host").write_text("{}")
+        os.utime(str(queue.path / "1000-1.Began.mail.processing.1.1000.host"), (1000, 1000))
+        (queue.path / f"1000-2.Began.mail.processing.1.{int(time.time())}.host").write_text("{}")
+        assert queue.due() == [queue.path / "1000-1.Began.mail"]
+        assert DeferredQueue(spool_dir).due() == [queue.path / "1000-1.Began.mail"]
+
+    def test_defer_invalid(self, spool_dir):
+        spool_file = spool_dir / "1.Began.mail"
+        spool_file.write_text("not json")
+        assert not DeferredQueue(spool_dir).defer(spool_file, "error")
+        # e.g. processed by another instance after its claim expired
+        assert DeferredQueue(spool_dir).defer(spool_dir / "missing.mail", "error")
+        assert not (spool_dir / DEFERRED_DIR).exists()
+
+    def test_get_delay(self, spool_dir):
+        queue = DeferredQueue(spool_dir, base_delay=60, max_delay=300)
+        with patch("slurmmail.spoolitem.random.uniform", side_effect=lambda a, b: b):
+            assert [queue.get_delay(attempts) for attempts in range(1, 6)] == [60, 120, 240, 300, 300]
+        for attempts in range(1, 6):
+            assert 30 <= queue.get_delay(attempts) <= 300
+
+
+class TestSpoolFile:
+    """
+    Test slurmmail.deferred.SpoolFile
+    """
+
+    def test_spool_item(self, spool_dir):
+        item = SpoolFile(claim_spool_file(make_spool_file(spool_dir, "1_1673384400.5.mail")))
+        assert isinstance(item, SpoolItem)
+        assert item == SpoolFile(item.path)
+        assert str(item) == str(item.path)
+        assert item.enqueued == 1673384400.5
+        # renewing the claim does not change when it was spooled
+        assert item.renew()
+        assert item.enqueued == 1673384400.5
+        assert item.exists()
+        assert item.read()["job_id"] == 1
+        item.unlink()
+        assert not item.exists()
+        assert not item.renew()
+        with pytest.raises(OSError):
+            item.enqueued  # pylint: disable=pointless-statement
+
+    def test_release(self, spool_dir):
+        item = SpoolFile(claim_spool_file(make_spool_file(spool_dir)))
+        item.release()
+        assert not item.exists()
+        assert [f.name for f in spool_dir.iterdir()] == ["1.Began.mail"]
+
+    def test_defer(self, spool_dir):
+        item = SpoolFile(claim_spool_file(make_spool_file(spool_dir)), DeferredQueue(spool_dir, base_delay=60))
+        assert item.defer("451 try again later")
+        assert not item.exists()
+        assert len(list((spool_dir / DEFERRED_DIR).iterdir())) == 1
+        # without a deferred queue the spool file is left to be removed
+        item = SpoolFile(claim_spool_file(make_spool_file(spool_dir, "2.Began.mail")))
+        assert not item.defer("451 try again later")
+        assert item.exists()
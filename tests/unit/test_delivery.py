@@ -0,0 +1,174 @@
+# pylint: disable=missing-function-docstring,redefined-outer-name
+
+#
+#  This file is part of Slurm-Mail.
+#
+#  Slurm-Mail is a drop in replacement for Slurm's e-mails to give users
+#  much more information about their jobs compared to the standard Slurm
+#  e-mails.
+#
+#   Copyright (C) 2018-2026 Neil Munday (neil@mundayweb.com)
+#
+#  Slurm-Mail is free software: you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the
+#  Free Software Foundation, either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  Slurm-Mail is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Slurm-Mail.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Unit tests for slurmmail.delivery
+"""
+
+import smtplib
+from unittest.mock import MagicMock, patch
+
+import pytest  # type: ignore
+
+from slurmmail.delivery import is_transient_error, OutgoingMail, SmtpDeliveryPool
+
+#
+# Fixtures
+#
+
+
+@pytest.fixture
+def connection_factory():
+    return MagicMock()
+
+
+def make_mail(spool_file: str, recipient: str = "root") -> OutgoingMail:
+    return OutgoingMail("slurm@localhost", [recipient], "message", spool_file, "test")
+
+
+#
+# Test classes
+#
+
+
+class TestSmtpDeliveryPool:
+    """
+    Test slurmmail.delivery.SmtpDeliveryPool
+    """
+
+    def test_deliver(self, connection_factory):
+        pool = SmtpDeliveryPool(connection_factory, 2)
+        pool.submit(make_mail("1.mail"))
+        pool.submit(make_mail("1.mail", "user"))
+        pool.submit(make_mail("2.mail"))
+        completed = pool.close()
+        assert sorted(completed) == [("1.mail", []), ("2.mail", [])]
+        assert connection_factory.return_value.sendmail.call_count == 3
+        # at most one connection per worker
+        assert connection_factory.call_count <= 2
+        assert connection_factory.return_value.quit.call_count == connection_factory.call_count
+        connection_factory.return_value.noop.assert_not_called()
+
+    def test_no_mail(self, connection_factory):
+        pool = SmtpDeliveryPool(connection_factory, 2)
+        assert not pool.close()
+        connection_factory.assert_not_called()
+
+    def test_failure(self, connection_factory):
+        error = smtplib.SMTPRecipientsRefused({"root": (450, b"mailbox unavailable")})
+        connection_factory.return_value.sendmail.side_effect = error
+        pool = SmtpDeliveryPool(connection_factory, 1, max_attempts=3)
+        pool.submit(make_mail("1.mail"))
+        assert pool.close() == [("1.mail", [error])]
+        assert connection_factory.return_value.sendmail.call_count == 3
+
+    @pytest.mark.parametrize(
+        "error",
+        [
+            smtplib.SMTPRecipientsRefused({"root": (550, b"unknown user")}),
+            smtplib.SMTPDataError(554, b"message rejected"),
+        ],
+    )
+    def test_failure_permanent(self, caplog, connection_factory, error):
+        connection_factory.return_value.sendmail.side_effect = [error, {}]
+        pool = SmtpDeliveryPool(connection_factory, 1, max_attempts=3)
+        pool.submit(make_mail("1.mail"))
+        pool.submit(make_mail("2.mail"))
+        assert pool.close() == [("1.mail", [error]), ("2.mail", [])]
+        # not retried, and the connection is used for the next e-mail
+        assert connection_factory.return_value.sendmail.call_count == 2
+        connection_factory.assert_called_once()
+        assert "Failed to create SMTP connection" not in caplog.text
+
+    def test_fail(self, connection_factory):
+        pool = SmtpDeliveryPool(connection_factory, 1)
+        pool.submit(make_mail("1.mail"))
+        error = OSError("sacct failed")
+        pool.fail("1.mail", error)
+        pool.submit(make_mail("2.mail"))
+        # the spool file is reported with the error once its e-mail is sent
+        assert sorted(pool.close()) == [("1.mail", [error]), ("2.mail", [])]
+        assert connection_factory.return_value.sendmail.call_count == 2
+
+    def test_failure_no_retry(self, connection_factory):
+        error = smtplib.SMTPDataError(452, b"insufficient storage")
+        connection_factory.return_value.sendmail.side_effect = error
+        pool = SmtpDeliveryPool(connection_factory, 1, max_attempts=3, retry_on_failure=False)
+        pool.submit(make_mail("1.mail"))
+        assert pool.close() == [("1.mail", [error])]
+        connection_factory.return_value.sendmail.assert_called_once()
+
+    def test_reconnect(self, connection_factory):
+        connection_factory.return_value.sendmail.side_effect = [
+            smtplib.SMTPServerDisconnected("gone away"),
+            {},
+        ]
+        pool = SmtpDeliveryPool(connection_factory, 1)
+        pool.submit(make_mail("1.mail"))
+        assert pool.close() == [("1.mail", [])]
+        assert connection_factory.call_count == 2
+
+    def test_idle_connection_checked(self, connection_factory):
+        pool = SmtpDeliveryPool(connection_factory, 1)
+        with patch("slurmmail.delivery.SMTP_IDLE_CHECK_SECONDS", -1):
+            pool.submit(make_mail("1.mail"))
+            assert pool.wait() == [("1.mail", [])]
+            connection_factory.return_value.noop.assert_not_called()
+            pool.submit(make_mail("2.mail"))
+            assert pool.close() == [("2.mail", [])]
+        connection_factory.return_value.noop.assert_called_once()
+        connection_factory.assert_called_once()
+
+    def test_idle_connection_failed(self, connection_factory):
+        connection_factory.return_value.noop.side_effect = smtplib.SMTPServerDisconnected("gone away")
+        pool = SmtpDeliveryPool(connection_factory, 1)
+        with patch("slurmmail.delivery.SMTP_IDLE_CHECK_SECONDS", -1):
+            pool.submit(make_mail("1.mail"))
+            pool.submit(make_mail("2.mail"))
+            assert pool.close() == [("1.mail", []), ("2.mail", [])]
+        assert connection_factory.call_count == 2
+
+
+class TestIsTransientError:  # pylint: disable=too-few-public-methods
+    """
+    Test slurmmail.delivery.is_transient_error
+    """
+
+    @pytest.mark.parametrize(
+        "error, transient",
+        [
+            (smtplib.SMTPSenderRefused(451, b"try again later", "root"), True),
+            (smtplib.SMTPSenderRefused(503, b"error", "root"), False),
+            (smtplib.SMTPDataError(452, b"insufficient storage"), True),
+            (smtplib.SMTPRecipientsRefused({"root": (450, b"busy"), "user": (451, b"busy")}), True),
+            (smtplib.SMTPRecipientsRefused({"root": (450, b"busy"), "user": (550, b"unknown user")}), False),
+            (smtplib.SMTPServerDisconnected("gone away"), True),
+            (smtplib.SMTPNotSupportedError("no STARTTLS"), False),
+            (ConnectionRefusedError("refused"), True),
+            (ValueError("invalid"), False),
+        ],
+    )
+    def test_is_transient_error(self, error, transient):
+        assert is_transient_error(error) == transient
@@ -0,0 +1,116 @@
+# pylint: disable=missing-function-docstring,redefined-outer-name
+
+#
+#  This file is part of Slurm-Mail.
+#
+#  Slurm-Mail is a drop in replacement for Slurm's e-mails to give users
+#  much more information about their jobs compared to the standard Slurm
+#  e-mails.
+#
+#   Copyright (C) 2018-2026 Neil Munday (neil@mundayweb.com)
+#
+#  Slurm-Mail is free software: you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the
+#  Free Software Foundation, either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  Slurm-Mail is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Slurm-Mail.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Unit tests for slurmmail.output
+"""
+
+import os
+import pathlib
+import tempfile
+from unittest.mock import call, MagicMock, patch
+
+import pytest  # type: ignore
+
+from slurmmail.output import OutputReaderPool, read_job_output
+
+#
+# Fixtures
+#
+
+
+@pytest.fixture
+def output_file():
+    with tempfile.NamedTemporaryFile(mode="w") as f:
+        f.write("line 1\nline 2\nline 3\n")
+        f.flush()
+        yield pathlib.Path(f.name)
+
+
+#
+# Test classes
+#
+
+
+class TestReadJobOutput:
+    """
+    Test slurmmail.output.read_job_output
+    """
+
+    def test_read(self, output_file):
+        ids = MagicMock()
+        with patch("os.setegid", ids.setegid), patch("os.seteuid", ids.seteuid):
+            rslt = read_job_output(1000, 100, [(str(output_file), 2), (str(output_file), 1)])
+        assert rslt == ["line 2\nline 3\n", "line 3\n"]
+        # privileges are dropped and then restored in the reverse order
+        assert ids.mock_calls == [
+            call.setegid(100),
+            call.seteuid(1000),
+            call.seteuid(os.geteuid()),
+            call.setegid(os.getegid()),
+        ]
+
+    def test_read_restores_on_error(self):
+        ids = MagicMock()
+        with patch("os.setegid", ids.setegid), patch("os.seteuid", ids.seteuid), patch(
+            "slurmmail.output.tail_file", side_effect=Exception("Dummy Error")
+        ):
+            with pytest.raises(Exception):
+                read_job_output(1000, 100, [("/tmp/missing", 2)])
+        assert ids.mock_calls[-2:] == [call.seteuid(os.geteuid()), call.setegid(os.getegid())]
+
+    def test_read_tail_exe(self):
+        tail_exe = pathlib.Path("/usr/bin/tail")
+        with patch("os.setegid"), patch("os.seteuid"), patch(
+            "slurmmail.output.tail_file", return_value="line 3\n"
+        ) as mock_tail_file:
+            assert read_job_output(1000, 100, [("/tmp/slurm-1.out", 1)], 100, tail_exe) == ["line 3\n"]
+        mock_tail_file.assert_called_once_with("/tmp/slurm-1.out", 1, 100, tail_exe)
+
+
+class TestOutputReaderPool:
+    """
+    Test slurmmail.output.OutputReaderPool
+    """
+
+    def test_submit(self, output_file):
+        pool = OutputReaderPool(2)
+        try:
+            # read as ourselves, which does not require root
+            futures = [
+                pool.submit(os.geteuid(), os.getegid(), [(str(output_file), lines)])
+                for lines in [1, 2, 3]
+            ]
+            assert [f.result() for f in futures] == [
+                ["line 3\n"],
+                ["line 2\nline 3\n"],
+                ["line 1\nline 2\nline 3\n"],
+            ]
+        finally:
+            pool.close()
+
+    def test_close_unused(self):
+        pool = OutputReaderPool(2)
+        pool.close()
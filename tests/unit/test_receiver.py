@@ -0,0 +1,165 @@
+# pylint: disable=missing-function-docstring,redefined-outer-name
+
+#
+#  This file is part of Slurm-Mail.
+#
+#  Slurm-Mail is a drop in replacement for Slurm's e-mails to give users
+#  much more information about their jobs compared to the standard Slurm
+#  e-mails.
+#
+#   Copyright (C) 2018-2026 Neil Munday (neil@mundayweb.com)
+#
+#  Slurm-Mail is free software: you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the
+#  Free Software Foundation, either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  Slurm-Mail is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Slurm-Mail.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Unit tests for slurmmail.receiver
+"""
+
+import os
+import pathlib
+import socket
+import tempfile
+import time
+
+import pytest  # type: ignore
+
+import slurmmail.spool
+from slurmmail.receiver import EventReceiver
+
+EVENT = {"job_id": 1, "state": "Began", "email": "root", "array_summary": False, "slurm_env": {}}
+
+#
+# Fixtures
+#
+
+
+@pytest.fixture
+def socket_path():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        yield pathlib.Path(tmp_dir) / "spool.sock"
+
+
+def send_event(socket_path: pathlib.Path, data: dict, timeout: float = 2.0) -> bool:
+    return slurmmail.spool.__dict__["__send_spool_event"](socket_path, data, timeout)
+
+
+#
+# Test classes
+#
+
+
+class TestEventReceiver:
+    """
+    Test slurmmail.receiver.EventReceiver
+    """
+
+    def test_receive(self, socket_path):
+        events = []
+        receiver = EventReceiver(socket_path, events.append, [os.getuid()])
+        receiver.start()
+        try:
+            assert send_event(socket_path, EVENT)
+            assert send_event(socket_path, dict(EVENT, job_id=2))
+        finally:
+            receiver.close()
+        assert events == [EVENT, dict(EVENT, job_id=2)]
+        assert not socket_path.exists()
+
+    def test_invalid_event(self, caplog, socket_path):
+        events = []
+        receiver = EventReceiver(socket_path, events.append, [os.getuid()])
+        receiver.start()
+        try:
+            assert not send_event(socket_path, {"job_id": 1})
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.connect(str(socket_path))
+                sock.sendall(b"not json\n")
+                assert sock.makefile("rb").readline().startswith(b"ERROR")
+        finally:
+            receiver.close()
+        assert not events
+        assert "Failed to receive event: invalid event" in caplog.text
+
+    def test_invalid_job_id_or_state(self, caplog, socket_path):
+        events = []
+        receiver = EventReceiver(socket_path, events.append, [os.getuid()])
+        receiver.start()
+        try:
+            # rejected events are not acknowledged, so nothing is spooled
+            assert not send_event(socket_path, dict(EVENT, job_id="1"))
+            assert not send_event(socket_path, dict(EVENT, job_id=True))
+            assert not send_event(socket_path, dict(EVENT, state="Exploded"))
+            assert not send_event(socket_path, dict(EVENT, state=None))
+            assert send_event(socket_path, dict(EVENT, state="Time reached 80%"))
+        finally:
+            receiver.close()
+        assert events == [dict(EVENT, state="Time reached 80%")]
+        assert "Failed to receive event: invalid job id: '1'" in caplog.text
+        assert "Failed to receive event: invalid state: 'Exploded'" in caplog.text
+
+    def test_handler_error(self, caplog, socket_path):
+        def handler(_data):
+            raise OSError("No space left on device")
+
+        receiver = EventReceiver(socket_path, handler, [os.getuid()])
+        receiver.start()
+        try:
+            # the client spools the event itself
+            assert not send_event(socket_path, EVENT)
+        finally:
+            receiver.close()
+        assert "No space left on device" in caplog.text
+
+    def test_not_allowed(self, caplog, socket_path):
+        events = []
+        receiver = EventReceiver(socket_path, events.append, [])
+        receiver.start()
+        try:
+            assert not send_event(socket_path, EVENT)
+        finally:
+            receiver.close()
+        assert not events
+        assert f"Rejected event from uid {os.getuid()}" in caplog.text
+
+    def test_timeout(self, socket_path):
+        receiver = EventReceiver(socket_path, lambda data: time.sleep(1), [os.getuid()])
+        receiver.start()
+        try:
+            assert not send_event(socket_path, EVENT, timeout=0.1)
+        finally:
+            receiver.close()
+
+    def test_no_receiver(self, caplog, socket_path):
+        assert not send_event(socket_path, EVENT)
+        assert "spooling it instead" in caplog.text
+
+    def test_stale_socket(self, socket_path):
+        # e.g. left behind by a slurm-send-mail that was killed
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.bind(str(socket_path))
+        events = []
+        receiver = EventReceiver(socket_path, events.append, [os.getuid()])
+        receiver.start()
+        try:
+            assert send_event(socket_path, EVENT)
+        finally:
+            receiver.close()
+        assert events == [EVENT]
+
+    def test_not_a_socket(self, socket_path):
+        socket_path.write_text("")
+        with pytest.raises(OSError):
+            EventReceiver(socket_path, print, [os.getuid()])
+        assert socket_path.read_text() == ""
@@ -0,0 +1,165 @@
+# pylint: disable=missing-function-docstring,redefined-outer-name
+
+#
+#  This file is part of Slurm-Mail.
+#
+#  Slurm-Mail is a drop in replacement for Slurm's e-mails to give users
+#  much more information about their jobs compared to the standard Slurm
+#  e-mails.
+#
+#   Copyright (C) 2018-2026 Neil Munday (neil@mundayweb.com)
+#
+#  Slurm-Mail is free software: you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the
+#  Free Software Foundation, either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  Slurm-Mail is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Slurm-Mail.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Unit tests for slurmmail.restd, using the stub slurmrestd in tests/restd
+"""
+
+import importlib.util
+import pathlib
+import tempfile
+import threading
+
+import pytest  # type: ignore
+
+from slurmmail.restd import RestdClient, RestdException
+
+STUB_FILE = pathlib.Path(__file__).parents[1] / "restd" / "stub-slurmrestd.py"
+
+#
+# Fixtures
+#
+
+
+@pytest.fixture(scope="module")
+def stub_module():
+    spec = importlib.util.spec_from_file_location("stub_slurmrestd", STUB_FILE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def start_server(server, token=None):
+    server.init_stub(token)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+@pytest.fixture
+def stub_server(stub_module):
+    server = start_server(stub_module.StubServer(("localhost", 0), stub_module.StubRequestHandler))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def stub_url(stub_server):
+    return f"http://localhost:{stub_server.server_address[1]}"
+
+
+#
+# Test classes
+#
+
+
+class TestRestdClient:
+    """
+    Test slurmmail.restd.RestdClient
+    """
+
+    def test_bad_url(self):
+        with pytest.raises(RestdException):
+            RestdClient("ftp://localhost")
+
+    def test_get_sacct_rows(self, stub_server, stub_url):
+        client = RestdClient(stub_url)
+        rows = client.get_sacct_rows(2)
+        client.close()
+        assert [row["JobId"] for row in rows] == ["2", "2.batch"]
+        assert rows[0]["State"] == "COMPLETED"
+        assert stub_server.requests == ["/slurmdb/v0.0.40/job/2"]
+
+    def test_get_sacct_rows_invalid_job(self, stub_url):
+        client = RestdClient(stub_url)
+        # as when sacct returns no records, so the spool file is deleted
+        assert client.get_sacct_rows(3) == []
+        client.close()
+
+    def test_get_scontrol_values(self, stub_url):
+        client = RestdClient(stub_url)
+        assert client.get_scontrol_values(2) == {
+            "JobId": "2",
+            "StdErr": "/root/slurm-2.out",
+            "StdOut": "/root/slurm-2.out",
+        }
+        assert client.get_scontrol_values(3) is None
+        client.close()
+
+    def test_connection_reused(self, stub_server, stub_url):
+        client = RestdClient(stub_url, size=2)
+        for _ in range(5):
+            assert client.get_sacct_rows(2) is not None
+            assert client.get_scontrol_values(2) is not None
+        client.close()
+        assert len(stub_server.requests) == 10
+        assert stub_server.connections == 1
+
+    def test_reconnect(self, stub_server, stub_url):
+        # the server closing idle connections should not cause a failure
+        stub_server.max_requests = 1
+        client = RestdClient(stub_url)
+        assert client.get_sacct_rows(2) is not None
+        assert client.get_sacct_rows(2) is not None
+        client.close()
+        assert stub_server.connections == 2
+
+    def test_server_unavailable(self, stub_server, stub_url):
+        stub_server.shutdown()
+        stub_server.server_close()
+        client = RestdClient(stub_url)
+        assert client.get_sacct_rows(2) is None
+        client.close()
+
+    def test_token(self, stub_module):
+        server = start_server(
+            stub_module.StubServer(("localhost", 0), stub_module.StubRequestHandler), token="secret"
+        )
+        url = f"http://localhost:{server.server_address[1]}"
+        try:
+            client = RestdClient(url, token="wrong")
+            assert client.get_sacct_rows(2) is None
+            client.close()
+            client = RestdClient(url, token="secret", user="slurm")
+            assert client.get_sacct_rows(2) is not None
+            client.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_unix_socket(self, stub_module):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            socket_path = str(pathlib.Path(tmp_dir) / "slurmrestd.socket")
+            server = start_server(stub_module.UnixStubServer(socket_path, stub_module.StubRequestHandler))
+            try:
+                client = RestdClient(f"unix://{socket_path}")
+                assert [row["JobId"] for row in client.get_sacct_rows(7)] == [
+                    "7_1", "7_1.batch", "7_2", "7_2.batch"
+                ]
+                client.close()
+            finally:
+                server.shutdown()
+                server.server_close()
@@ -0,0 +1,156 @@
+# pylint: disable=missing-function-docstring,redefined-outer-name
+
+#
+#  This file is part of Slurm-Mail.
+#
+#  Slurm-Mail is a drop in replacement for Slurm's e-mails to give users
+#  much more information about their jobs compared to the standard Slurm
+#  e-mails.
+#
+#   Copyright (C) 2018-2026 Neil Munday (neil@mundayweb.com)
+#
+#  Slurm-Mail is free software: you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the
+#  Free Software Foundation, either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  Slurm-Mail is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Slurm-Mail.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Unit tests for slurmmail.sacct
+"""
+
+import pytest  # type: ignore
+
+from slurmmail.cli import SACCT_FIELDS
+from slurmmail.common import get_kbytes_from_str, get_usec_from_str
+from slurmmail.sacct import (
+    decode_is_job_id,
+    decode_job_id_base,
+    decode_kbytes,
+    decode_row,
+    decode_tres,
+    decode_usec,
+    SacctDecoder,
+)
+
+SACCT_OUTPUT = (
+    "1|root|root|all|myaccount|1674333232|1674333242|COMPLETED|500M||1|10|00:01.500|1|/|00:00:11|0:0|||test|node01"
+    "|01:00:00|60|1|billing=1,cpu=1,node=1|test.jcf\n"
+    "1.batch||||myaccount|1674333232|1674333242|COMPLETED||4832K|1|10|00:01.500|1||00:00:11|0:0|||test|node01"
+    "|||1.batch|cpu=1,mem=0,node=1|batch\n"
+    "2_[1-10]|root|root|all|myaccount|None|Unknown|PENDING|2Gc||4|0|00:00:00|1|/|00:00:00|0:0|||test|None assigned"
+    "|UNLIMITED|UNLIMITED|2|billing=4|test.jcf\n"
+)
+
+#
+# Test classes
+#
+
+
+class TestDecoders:
+    """
+    Test the slurmmail.sacct value decoders
+    """
+
+    @pytest.mark.parametrize(
+        "value", ["100K", "100.0M", "100.0G", "10.0T", "0", "4832K", "1.5G"]
+    )
+    def test_kbytes(self, value):
+        assert decode_kbytes(value) == get_kbytes_from_str(value)
+
+    def test_kbytes_suffixes(self):
+        assert decode_kbytes("500Mn") == 512000
+        assert decode_kbytes("500Mc") == 512000
+        assert decode_kbytes("") is None
+        assert decode_kbytes("?") is None
+        assert decode_kbytes("foo") == 0
+        assert decode_kbytes("1X") == 0
+
+    @pytest.mark.parametrize(
+        "value", ["2:0.0", "2:0", "3:0:0.0", "4-3:2:0.0", "00:01.500", "1-02:03:04"]
+    )
+    def test_usec(self, value):
+        assert decode_usec(value) == get_usec_from_str(value)
+
+    def test_usec_invalid(self):
+        assert decode_usec("2") is None
+        assert decode_usec("") is None
+
+    def test_job_ids(self):
+        for job_id in ["1", "1_2", "1_[2-10]", "1+2"]:
+            assert decode_is_job_id(job_id)
+        for job_id in ["1.batch", "1_2.extern", "1+2.0", ""]:
+            assert not decode_is_job_id(job_id)
+        assert decode_job_id_base("1000_5.batch") == 1000
+        assert decode_job_id_base("batch") is None
+
+    def test_tres(self):
+        assert decode_tres("billing=1,cpu=1,mem=500M") == (("billing", "1"), ("cpu", "1"), ("mem", "500M"))
+        assert not decode_tres("")
+
+
+class TestSacctDecoder:
+    """
+    Test slurmmail.sacct.SacctDecoder
+    """
+
+    def test_decode_block(self):
+        records = SacctDecoder(SACCT_FIELDS).decode_block(SACCT_OUTPUT + "bad|line\n")
+        assert [record.job_id for record in records] == ["1", "1.batch", "2_[1-10]"]
+        job, step, pending = records
+
+        assert job.is_job
+        assert job.job_id_raw == 1
+        assert job.job_id_base == 1
+        assert job.start_ts == 1674333232
+        assert job.end_ts == 1674333242
+        assert job.req_mem == 512000
+        assert not job.req_mem_per_cpu
+        assert job.max_rss is None
+        assert job.ncpus == 1
+        assert job.nnodes == 1
+        assert job.node_list == "node01"
+        assert job.total_cpu_usec == 1000500
+        assert job.time_limit_mins == 60
+        assert job.alloc_tres == (("billing", "1"), ("cpu", "1"), ("node", "1"))
+        assert job.stdout is None
+
+        assert not step.is_job
+        assert step.job_id_raw is None
+        assert step.job_id_raw_base == 1
+        assert step.max_rss == 4832
+
+        assert pending.is_job
+        assert pending.job_id_base == 2
+        assert pending.start_ts is None
+        assert pending.start == "None"
+        assert pending.end_ts is None
+        assert pending.req_mem == 2097152
+        assert pending.req_mem_per_cpu
+        assert pending.time_limit_mins is None
+        assert pending.time_limit == "UNLIMITED"
+
+    def test_field_order(self):
+        fields = list(reversed(SACCT_FIELDS))
+        line = SACCT_OUTPUT.split("\n", maxsplit=1)[0]
+        decoder = SacctDecoder(fields)
+        assert decoder.decode("|".join(reversed(line.split("|")))) == SacctDecoder(SACCT_FIELDS).decode(line)
+        assert decoder.decode("1|2") is None
+
+    def test_decode_row(self):
+        rows = [dict(zip(SACCT_FIELDS, line.split("|"))) for line in SACCT_OUTPUT.splitlines()]
+        decoder = SacctDecoder(SACCT_FIELDS)
+        assert [decode_row(row) for row in rows] == decoder.decode_block(SACCT_OUTPUT)
+
+        row = dict(rows[0], StdOut="/home/test/slurm-1.out", StdErr="/home/test/slurm-1.err")
+        record = decode_row(row)
+        assert record.stdout == "/home/test/slurm-1.out"
+        assert record.stderr == "/home/test/slurm-1.err"
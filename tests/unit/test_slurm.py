@@ -32,6 +32,7 @@ from unittest.mock import MagicMock, patch
 import pytest  # type: ignore
 
 from slurmmail import DEFAULT_DATETIME_FORMAT
+from slurmmail.common import clear_nss_cache
 from slurmmail.slurm import check_job_output_file_path, Job, JobException
 
 
@@ -77,7 +78,9 @@ def mock_pwd_getpwnam():
             return pw_struct
 
         the_mock.side_effect = get_pwnam
+        clear_nss_cache()
         yield the_mock
+        clear_nss_cache()
 
 
 @pytest.mark.usefixtures("mock_pwd_getpwnam")
@@ -167,6 +170,28 @@ class TestSlurmJob:
     def test_print_job(self, job):
         print(job)
 
+    def test_derived_values_updated(self, job):
+        job.start_ts = 1673384400  # Tue 10 Jan 21:00:00 GMT 2023
+        job.end_ts = 1673470800  # Wed 11 Jan 21:00:00 GMT 2023
+        job.max_rss = 1048576
+        job.used_cpu_usec = 1000000
+        job.wallclock = 60
+        assert job.start == "10/01/2023 21:00:00"
+        assert job.end == "11/01/2023 21:00:00"
+        assert job.max_rss_str == "1.00GiB"
+        assert job.used_cpu_str == "0:00:01"
+        assert job.wc_string == "0:01:00"
+        job.start_ts = 1673470800
+        job.end_ts = 1673557200
+        job.max_rss_str = "2G"
+        job.used_cpu_usec = 2000000
+        job.wallclock = 120
+        assert job.start == "11/01/2023 21:00:00"
+        assert job.end == "12/01/2023 21:00:00"
+        assert job.max_rss_str == "2.00GiB"
+        assert job.used_cpu_str == "0:00:02"
+        assert job.wc_string == "0:02:00"
+
     def test_requested_mem_str(self, job):
         job.requested_mem = 1048576
         assert job.requested_mem_str == "1.00GiB"
@@ -220,10 +245,24 @@ class TestSlurmJob:
         job.state = "TIMEOUT"
         assert job.state == "WALLCLOCK EXCEEDED"
 
+    def test_slots(self, job):
+        with pytest.raises(AttributeError):
+            job.unknown = 1  # pylint: disable=attribute-defined-outside-init
+
     def test_start_time(self, job):
         job.start_ts = 1673384400  # Tue 10 Jan 21:00:00 GMT 2023
         assert job.start == "10/01/2023 21:00:00"
 
+    def test_tres(self, job):
+        job.add_tres("cpu", "1")
+        tres = job.tres
+        assert tres == {"cpu": "1"}
+        # a copy is returned
+        tres["cpu"] = "2"
+        assert job.tres == {"cpu": "1"}
+        job.add_tres("mem", "1G")
+        assert job.tres == {"cpu": "1", "mem": "1G"}
+
     def test_used_cpu_str(self, job):
         job.start_ts = 1673384400  # Tue 10 Jan 21:00:00 GMT 2023
         job.end_ts = 1673470800  # Wed 11 Jan 21:00:00 GMT 2023
@@ -244,6 +283,12 @@ class TestSlurmJob:
         job.user = "jsmith"
         assert job.user_real_name == "John"
 
+    def test_user_real_name_cached(self, job, mock_pwd_getpwnam):
+        name = job.user_real_name
+        assert job.user_real_name == name
+        assert job.user_real_name == name
+        mock_pwd_getpwnam.assert_called_once_with("foo")
+
     def test_wc_accuracy_100pc(self, job):
         job.start_ts = 1673384400  # Tue 10 Jan 21:00:00 GMT 2023
         job.end_ts = 1673470800  # Wed 11 Jan 21:00:00 GMT 2023
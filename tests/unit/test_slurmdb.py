@@ -0,0 +1,200 @@
+# pylint: disable=missing-function-docstring,redefined-outer-name
+
+#
+#  This file is part of Slurm-Mail.
+#
+#  Slurm-Mail is a drop in replacement for Slurm's e-mails to give users
+#  much more information about their jobs compared to the standard Slurm
+#  e-mails.
+#
+#   Copyright (C) 2018-2026 Neil Munday (neil@mundayweb.com)
+#
+#  Slurm-Mail is free software: you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the
+#  Free Software Foundation, either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  Slurm-Mail is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Slurm-Mail.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Unit tests for slurmmail.slurmdb
+"""
+
+import io
+import json
+import pathlib
+
+import pytest  # type: ignore
+
+import slurmmail.slurmdb
+from slurmmail.cli import SACCT_FIELDS
+from slurmmail.slurmdb import get_sacct_rows_from_jobs, iter_json_array
+
+RESPONSE_DIR = pathlib.Path(__file__).parents[1] / "restd" / "responses"
+
+#
+# Fixtures
+#
+
+
+@pytest.fixture
+def slurmdb_jobs():
+    def load(job_id: int):
+        with (RESPONSE_DIR / "slurmdb" / "v0.0.40" / "job" / f"{job_id}.json").open() as f:
+            return json.load(f)["jobs"]
+    return load
+
+
+#
+# Test classes
+#
+
+
+class TestGetSacctRowsFromJobs:
+    """
+    Test slurmmail.slurmdb.get_sacct_rows_from_jobs
+    """
+
+    def test_job(self, slurmdb_jobs):
+        rows = get_sacct_rows_from_jobs(slurmdb_jobs(2))
+        assert len(rows) == 2
+        for row in rows:
+            assert set(row) == set(SACCT_FIELDS)
+        assert rows[0] == {
+            "JobId": "2",
+            "User": "root",
+            "Group": "root",
+            "Partition": "all",
+            "Account": "myaccount",
+            "Start": "1674340451",
+            "End": "1674340571",
+            "State": "COMPLETED",
+            "ReqMem": "500M",
+            "MaxRSS": "",
+            "NCPUS": "1",
+            "CPUTimeRaw": "120",
+            "TotalCPU": "00:00.010",
+            "NNodes": "1",
+            "WorkDir": "/root",
+            "Elapsed": "00:02:00",
+            "ExitCode": "0:0",
+            "AdminComment": "",
+            "Comment": "",
+            "Cluster": "linux",
+            "NodeList": "node01",
+            "TimeLimit": "01:00:00",
+            "TimelimitRaw": "60",
+            "JobIdRaw": "2",
+            "AllocTRES": "billing=1,cpu=1,mem=500M,node=1",
+            "JobName": "test.jcf",
+        }
+        assert rows[1]["JobId"] == "2.batch"
+        assert rows[1]["JobIdRaw"] == "2.batch"
+        assert rows[1]["MaxRSS"] == "4880K"
+        assert rows[1]["State"] == "COMPLETED"
+
+    def test_job_array(self, slurmdb_jobs):
+        rows = get_sacct_rows_from_jobs(slurmdb_jobs(7))
+        assert [(row["JobId"], row["JobIdRaw"]) for row in rows] == [
+            ("7_1", "8"),
+            ("7_1.batch", "8.batch"),
+            ("7_2", "7"),
+            ("7_2.batch", "7.batch"),
+        ]
+
+    def test_pending_job_array(self):
+        rows = get_sacct_rows_from_jobs([
+            {
+                "job_id": 7,
+                "array": {"job_id": 7, "task": "1-10", "task_id": {"set": False, "infinite": False, "number": 0}},
+                "state": {"current": ["PENDING"]},
+                "time": {"start": 0, "end": 0, "limit": {"set": True, "infinite": True, "number": 0}},
+            }
+        ])
+        assert len(rows) == 1
+        assert rows[0]["JobId"] == "7_[1-10]"
+        assert rows[0]["State"] == "PENDING"
+        assert rows[0]["Start"] == "Unknown"
+        assert rows[0]["End"] == "Unknown"
+        assert rows[0]["TimeLimit"] == "UNLIMITED"
+
+    def test_het_job(self):
+        rows = get_sacct_rows_from_jobs([
+            {"job_id": 11, "het": {"job_id": 10, "job_offset": {"set": True, "infinite": False, "number": 1}}}
+        ])
+        assert rows[0]["JobId"] == "10+1"
+        assert rows[0]["JobIdRaw"] == "11"
+
+    def test_old_api(self):
+        # older versions of the API use plain numbers and strings
+        rows = get_sacct_rows_from_jobs([
+            {
+                "job_id": 3,
+                "state": {"current": "FAILED"},
+                "exit_code": {"return_code": 1, "signal": {"signal_id": 9}},
+                "time": {"elapsed": 90000, "limit": 1500, "start": 1674340451, "end": 1674430451},
+                "tres": {"allocated": [{"type": "mem", "count": 4096}, {"type": "gres", "name": "gpu", "count": 2}]},
+            }
+        ])
+        assert rows[0]["State"] == "FAILED"
+        assert rows[0]["ExitCode"] == "1:9"
+        assert rows[0]["Elapsed"] == "1-01:00:00"
+        assert rows[0]["TimeLimit"] == "1-01:00:00"
+        assert rows[0]["TimelimitRaw"] == "1500"
+        assert rows[0]["AllocTRES"] == "gres/gpu=2,mem=4G"
+
+    def test_output_paths(self):
+        rows = get_sacct_rows_from_jobs([
+            {"job_id": 1, "stdout": "/home/user/slurm-%j.out", "stdout_expanded": "/home/user/slurm-1.out",
+             "stderr": "/home/user/slurm-%j.out", "stderr_expanded": "/home/user/slurm-1.out",
+             "steps": [{"step": {"id": "1.batch", "name": "batch"}}]},
+            {"job_id": 2, "stdout": "/home/user/job.out", "stderr": "/home/user/job-%j.err"},
+            {"job_id": 3, "stdout": "job.out"},
+        ])
+        assert rows[0]["StdOut"] == "/home/user/slurm-1.out"
+        assert rows[0]["StdErr"] == "/home/user/slurm-1.out"
+        # steps do not have output paths
+        assert "StdOut" not in rows[1]
+        # unexpanded paths can only be used without replacement symbols
+        assert rows[2]["StdOut"] == "/home/user/job.out"
+        assert "StdErr" not in rows[2]
+        assert "StdOut" not in rows[3]
+
+
+class TestIterJsonArray:
+    """
+    Test slurmmail.slurmdb.iter_json_array
+    """
+
+    def test_jobs(self):
+        with (RESPONSE_DIR / "slurmdb" / "v0.0.40" / "job" / "7.json").open() as f:
+            expected = json.load(f)["jobs"]
+            f.seek(0)
+            assert list(iter_json_array(f, "jobs")) == expected
+
+    @pytest.mark.parametrize("read_size", [1, 3, 64])
+    def test_small_reads(self, monkeypatch, read_size):
+        monkeypatch.setattr(slurmmail.slurmdb, "JSON_READ_SIZE", read_size)
+        document = {
+            "meta": {"plugin": {"type": "openapi/slurmdbd"}, "strings": ["]", "}", "\\\""]},
+            "jobs": [{"job_id": 1, "name": "a|b]}"}, 12345, "job", None, True, [1.5, -2e3]],
+            "errors": [],
+        }
+        assert list(iter_json_array(io.StringIO(json.dumps(document, indent=2)), "jobs")) == document["jobs"]
+
+    def test_empty(self):
+        assert not list(iter_json_array(io.StringIO('{"jobs": [], "errors": []}'), "jobs"))
+        assert not list(iter_json_array(io.StringIO("{}"), "jobs"))
+        assert not list(iter_json_array(io.StringIO('{"jobs": null}'), "jobs"))
+
+    @pytest.mark.parametrize("document", ["", "[]", '{"jobs": [1 2]}', '{"jobs": [{"job_id": 1}, {"job'])
+    def test_invalid(self, document):
+        with pytest.raises(ValueError):
+            list(iter_json_array(io.StringIO(document), "jobs"))
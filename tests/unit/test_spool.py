@@ -0,0 +1,379 @@
+# pylint: disable=missing-function-docstring,redefined-outer-name
+
+#
+#  This file is part of Slurm-Mail.
+#
+#  Slurm-Mail is a drop in replacement for Slurm's e-mails to give users
+#  much more information about their jobs compared to the standard Slurm
+#  e-mails.
+#
+#   Copyright (C) 2018-2026 Neil Munday (neil@mundayweb.com)
+#
+#  Slurm-Mail is free software: you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the
+#  Free Software Foundation, either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  Slurm-Mail is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Slurm-Mail.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Unit tests for slurmmail.spool
+"""
+
+import json
+import os
+import pathlib
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from unittest.mock import patch
+
+import pytest  # type: ignore
+
+import slurmmail.spool
+from slurmmail.receiver import EventReceiver
+from slurmmail.spool import (
+    claim_spool_file,
+    get_spool_file_path,
+    get_spool_file_time,
+    is_stale_spool_lease,
+    release_spool_file,
+    renew_spool_file,
+    scan_spool_dir,
+    strip_spool_lease,
+    write_spool_file,
+)
+from slurmmail.spooldb import SPOOL_DB_NAME, SpoolDatabase
+
+#
+# Fixtures
+#
+
+
+@pytest.fixture
+def spool_dir():
+    """
+    Yields a spool directory, with a configuration file for it in its
+    parent directory.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_path = pathlib.Path(tmp_dir)
+        conf_file = tmp_path / "slurm-mail.conf"
+        conf_file.write_text(
+            "[common]\n"
+            f"spoolDir = {tmp_dir}/spool\n"
+            "[slurm-spool-mail]\n"
+            f"logFile = {tmp_dir}/slurm-spool-mail.log\n"
+            "verbose = true\n"
+        )
+        (tmp_path / "spool").mkdir()
+        with patch("slurmmail.spool.conf_file", conf_file):
+            yield tmp_path / "spool"
+
+
+def spool_mail(info: str, email_to: str = "test@example.com"):
+    with patch("sys.argv", ["spool_mail_main", "-s", info, email_to]):
+        slurmmail.spool.spool_mail_main()
+
+
+def set_spool_backend(spool_dir: pathlib.Path, backend: str):
+    conf_file = spool_dir.parent / "slurm-mail.conf"
+    conf_file.write_text(conf_file.read_text().replace("[common]\n", f"[common]\nspoolBackend = {backend}\n"))
+
+
+def read_spool_files(spool_dir: pathlib.Path) -> list:
+    return [json.loads(f.read_text()) for f in sorted(spool_dir.iterdir())]
+
+
+#
+# Test classes
+#
+
+
+class TestSpoolMailMain:
+    """
+    Test slurmmail.spool.spool_mail_main
+    """
+
+    def test_incorrect_args(self, spool_dir):
+        with patch("sys.argv", ["spool_mail_main"]):
+            with pytest.raises(SystemExit):
+                slurmmail.spool.spool_mail_main()
+        assert read_spool_files(spool_dir) == []
+
+    def test_config_file_missing(self):
+        with patch("slurmmail.spool.conf_file", pathlib.Path("/tmp/missing/slurm-mail.conf")):
+            with pytest.raises(SystemExit):
+                spool_mail("Slurm Job_id=1000 Began")
+
+    def test_config_file_missing_section(self, spool_dir):
+        (spool_dir.parent / "slurm-mail.conf").write_text(f"[common]\nspoolDir = {spool_dir}\n")
+        with pytest.raises(SystemExit):
+            spool_mail("Slurm Job_id=1000 Began")
+
+    def test_spool_dir_missing(self, spool_dir):
+        spool_dir.rmdir()
+        with pytest.raises(SystemExit):
+            spool_mail("Slurm Job_id=1000 Began")
+
+    def test_bad_slurm_info(self, spool_dir):
+        for info in ["Slurm Job_id=1000 Foo", "Slurm Array Task Job_id=1000_1 (1000) Foo"]:
+            with pytest.raises(SystemExit):
+                spool_mail(info)
+        assert read_spool_files(spool_dir) == []
+
+    @pytest.mark.parametrize(
+        "info, job_id, state, array_summary",
+        [
+            ("Slurm Job_id=1000 Name=test.jcf Began, Queued time 00:00:01", 1000, "Began", False),
+            ("Slurm Job_id=1000 Name=test.jcf Ended, Run time 00:01:00, COMPLETED, ExitCode 0", 1000, "Ended", False),
+            ("Slurm Job_id=1000 Name=test.jcf Reached time limit", 1000, "Time limit reached", False),
+            ("Slurm Job_id=1000 Name=test.jcf Reached 50% of time limit", 1000, "Time reached 50%", False),
+            ("Slurm Array Task Job_id=1000_1 (1001) Name=test.jcf Began", 1001, "Began", False),
+            ("Slurm Array Summary Job_id=1000_* (1000) Name=test.jcf Ended", 1000, "Ended", True),
+        ],
+    )
+    def test_spool_file(self, spool_dir, info, job_id, state, array_summary):
+        spool_mail(info)
+        spool_files = list(spool_dir.iterdir())
+        assert len(spool_files) == 1
+        assert spool_files[0].name.startswith(f"{job_id}_")
+        assert spool_files[0].suffix == ".mail"
+        assert read_spool_files(spool_dir) == [
+            {
+                "job_id": job_id,
+                "state": state,
+                "email": "test@example.com",
+                "array_summary": array_summary,
+                "slurm_env": {},
+            }
+        ]
+
+    def test_slurm_env(self, spool_dir):
+        env = {
+            "SLURM_JOB_ID": "1000",
+            "SLURM_JOB_STDOUT": "/home/user/slurm-1000.out",
+            "SLURM_JOB_USER": "user",
+        }
+        with patch.dict(os.environ, env):
+            spool_mail("Slurm Job_id=1000 Began")
+        slurm_env = read_spool_files(spool_dir)[0]["slurm_env"]
+        assert slurm_env == env
+
+    def test_write_error(self, caplog, spool_dir):
+        with patch("pathlib.Path.open", side_effect=OSError("Failed to write to file")):
+            spool_mail("Slurm Job_id=1000 Began")
+        assert read_spool_files(spool_dir) == []
+        assert "Failed to write to file" in caplog.text
+
+    def test_spool_subdirs(self, spool_dir):
+        with (spool_dir.parent / "slurm-mail.conf").open("a") as f:
+            f.write("spoolSubdirs = 16\n")
+        spool_mail("Slurm Job_id=1000 Began")
+        spool_mail("Slurm Job_id=1001 Began")
+        assert sorted(f.name for f in spool_dir.iterdir()) == ["08", "09"]
+        assert [f.name[:5] for f in (spool_dir / "08").iterdir()] == ["1000_"]
+        assert scan_spool_dir(spool_dir)[0].parent == spool_dir / "08"
+
+    def test_spool_subdirs_invalid(self, caplog, spool_dir):
+        with (spool_dir.parent / "slurm-mail.conf").open("a") as f:
+            f.write("spoolSubdirs = 257\n")
+        spool_mail("Slurm Job_id=1000 Began")
+        assert len(read_spool_files(spool_dir)) == 1
+        assert "spoolSubdirs must be between 0 and 256" in caplog.text
+
+    def test_spool_db(self, spool_dir):
+        set_spool_backend(spool_dir, "sqlite")
+        spool_mail("Slurm Job_id=1000 Began")
+        assert not scan_spool_dir(spool_dir)
+        db = SpoolDatabase(spool_dir / SPOOL_DB_NAME)
+        try:
+            assert [data for _, data in db.claim()] == [
+                {
+                    "job_id": 1000,
+                    "state": "Began",
+                    "email": "test@example.com",
+                    "array_summary": False,
+                    "slurm_env": {},
+                }
+            ]
+        finally:
+            db.close()
+
+    def test_spool_db_error(self, caplog, spool_dir):
+        set_spool_backend(spool_dir, "sqlite")
+        with patch("slurmmail.spooldb.SpoolDatabase.insert", side_effect=sqlite3.OperationalError("disk I/O error")):
+            spool_mail("Slurm Job_id=1000 Began")
+        # the notification is written to a spool file instead
+        assert len(scan_spool_dir(spool_dir)) == 1
+        assert "writing a spool file instead: disk I/O error" in caplog.text
+
+    def test_spool_backend_invalid(self, caplog, spool_dir):
+        set_spool_backend(spool_dir, "foo")
+        spool_mail("Slurm Job_id=1000 Began")
+        assert len(read_spool_files(spool_dir)) == 1
+        assert "spoolBackend must be one of: files, sqlite" in caplog.text
+
+    def test_spool_socket(self, caplog, spool_dir):
+        socket_path = spool_dir.parent / "spool.sock"
+        conf_file = spool_dir.parent / "slurm-mail.conf"
+        conf_file.write_text(
+            conf_file.read_text().replace("[common]\n", f"[common]\nspoolSocket = {socket_path}\n")
+        )
+        # slurm-send-mail --daemon is not running
+        spool_mail("Slurm Job_id=1000 Began")
+        assert len(read_spool_files(spool_dir)) == 1
+        assert "spooling it instead" in caplog.text
+
+        events = []
+        receiver = EventReceiver(socket_path, events.append, [os.getuid()])
+        receiver.start()
+        try:
+            spool_mail("Slurm Job_id=1001 Began")
+        finally:
+            receiver.close()
+        assert [event["job_id"] for event in events] == [1001]
+        assert len(read_spool_files(spool_dir)) == 1
+
+    def test_imports(self):
+        # slurm-spool-mail is run for every notification so must not
+        # import the modules used to send e-mails
+        modules = subprocess.check_output(
+            [sys.executable, "-c", "import slurmmail.spool, sys; print(' '.join(sys.modules))"],
+            env=dict(os.environ, PYTHONPATH=str(pathlib.Path(slurmmail.spool.__file__).parents[1])),
+            universal_newlines=True,
+        ).split()
+        for module in ["email.mime.multipart", "slurmmail.cli", "slurmmail.common", "smtplib", "subprocess"]:
+            assert module not in modules
+
+
+class TestSpoolDir:
+    """
+    Test the slurmmail.spool spool directory functions
+    """
+
+    def test_get_spool_file_path(self):
+        path = get_spool_file_path(pathlib.Path("/spool"), 1000)
+        assert path.parent == pathlib.Path("/spool")
+        assert path.name.startswith("1000_") and path.suffix == ".mail"
+        assert get_spool_file_path(pathlib.Path("/spool"), 1000, 16).parent == pathlib.Path("/spool/08")
+        assert get_spool_file_path(pathlib.Path("/spool"), 1023, 256).parent == pathlib.Path("/spool/ff")
+
+    def test_get_spool_file_time(self):
+        now = time.time()
+        assert get_spool_file_time(get_spool_file_path(pathlib.Path("/spool"), 1000).name) >= now
+        assert get_spool_file_time("1000_1673384400.5.mail") == 1673384400.5
+        # claimed and deferred spool files
+        assert get_spool_file_time("1000_1673384400.5.mail.processing.1234.1673384460.node01") == 1673384400.5
+        assert get_spool_file_time("1673385000-1000_1673384400.5.mail") == 1673384400.5
+        assert get_spool_file_time("1000.Began.mail") == 0
+
+    def test_scan_spool_dir(self, spool_dir):
+        for name in ["1_1.mail", "00/2_1.mail", "ff/3_1.mail", "deferred/4_1.mail", "00/01/5_1.mail"]:
+            (spool_dir / name).parent.mkdir(parents=True, exist_ok=True)
+            (spool_dir / name).write_text("{}")
+        # ignored: partly written spool files and other files
+        (spool_dir / ".6_1.mail.123.tmp").write_text("{}")
+        (spool_dir / ".7_1.mail").write_text("{}")
+        (spool_dir / "8_1.txt").write_text("{}")
+
+        spool_files = scan_spool_dir(spool_dir)
+        # spool files in the spool directory are returned first
+        assert spool_files[0] == spool_dir / "1_1.mail"
+        assert sorted(spool_files) == [spool_dir / "00/2_1.mail", spool_dir / "1_1.mail", spool_dir / "ff/3_1.mail"]
+        assert len(scan_spool_dir(spool_dir, 2)) == 2
+        assert not scan_spool_dir(spool_dir / "missing")
+
+    def test_scan_spool_dir_stale_tmp_files(self, spool_dir):
+        (spool_dir / "00").mkdir()
+        stale = [spool_dir / ".1_1.mail.123.tmp", spool_dir / "00" / ".2_1.mail.123.tmp"]
+        for path in stale:
+            path.write_text("{")
+            os.utime(str(path), (1000, 1000))
+        # still being written
+        (spool_dir / ".3_1.mail.123.tmp").write_text("{")
+
+        assert not scan_spool_dir(spool_dir)
+        assert all(path.exists() for path in stale)
+        assert not scan_spool_dir(spool_dir, lease=600)
+        assert not any(path.exists() for path in stale)
+        assert list(spool_dir.glob(".*.tmp")) == [spool_dir / ".3_1.mail.123.tmp"]
+
+    def test_write_spool_file(self, spool_dir):
+        path = spool_dir / "1_1.mail"
+        write_spool_file(path, {"job_id": 1})
+        assert json.loads(path.read_text()) == {"job_id": 1}
+        assert list(spool_dir.iterdir()) == [path]
+
+    def test_write_spool_file_error(self, spool_dir):
+        with patch("json.dump", side_effect=TypeError("not serializable")):
+            with pytest.raises(TypeError):
+                write_spool_file(spool_dir / "1_1.mail", {"job_id": 1})
+        # the temporary file is removed
+        assert not list(spool_dir.iterdir())
+
+    def test_claim_spool_file(self, spool_dir):
+        path = spool_dir / "1_1.mail"
+        path.write_text("{}")
+        now = int(time.time())
+        lease = claim_spool_file(path, now=now)
+        assert lease == spool_dir / f"1_1.mail.processing.{os.getpid()}.{now}.{os.uname().nodename}"
+        assert list(spool_dir.iterdir()) == [lease]
+        assert strip_spool_lease(lease.name) == "1_1.mail"
+        # claimed by this process so not returned by scan_spool_dir
+        assert not scan_spool_dir(spool_dir, lease=600)
+        # e.g. another instance of slurm-send-mail
+        assert claim_spool_file(path) is None
+
+        assert release_spool_file(lease) == path
+        assert list(spool_dir.iterdir()) == [path]
+        assert release_spool_file(lease) is None
+
+    def test_renew_spool_file(self, spool_dir):
+        path = spool_dir / "1_1.mail"
+        path.write_text("{}")
+        os.utime(str(path), (900, 900))
+        lease = claim_spool_file(path, now=1000)
+        assert is_stale_spool_lease(lease.name, 600, 1600, os.stat(str(lease)).st_mtime)
+        assert renew_spool_file(lease, now=1500)
+        assert not is_stale_spool_lease(lease.name, 600, 1600, os.stat(str(lease)).st_mtime)
+        release_spool_file(lease)
+        # the claim has been lost
+        assert not renew_spool_file(lease)
+
+    def test_stale_spool_lease(self):
+        host = os.uname().nodename
+        # a process that is no longer running
+        with subprocess.Popen(["true"]) as process:
+            process.wait()
+        assert not is_stale_spool_lease(f"1_1.mail.processing.{os.getpid()}.1000.{host}", 600, 1599)
+        assert is_stale_spool_lease(f"1_1.mail.processing.{os.getpid()}.1000.{host}", 600, 1600)
+        assert is_stale_spool_lease(f"1_1.mail.processing.{process.pid}.1000.{host}", 600, 1500)
+        # processes on other hosts cannot be checked
+        assert not is_stale_spool_lease(f"1_1.mail.processing.{process.pid}.1000.other.host", 600, 1500)
+        assert is_stale_spool_lease(f"1_1.mail.processing.{process.pid}.1000.other.host", 600, 1600)
+        for name in ["1_1.mail", "1_1.mail.processing.foo", "1_1.mail.processing.1.foo.host"]:
+            assert not is_stale_spool_lease(name, 600, 1600)
+
+    def test_scan_spool_dir_stale_lease(self, caplog, spool_dir):
+        (spool_dir / "00").mkdir()
+        for name in ["1_1.mail.processing.1.1000.host", "00/2_1.mail.processing.1.1000.host"]:
+            (spool_dir / name).write_text("{}")
+            os.utime(str(spool_dir / name), (1000, 1000))
+        (spool_dir / f"3_1.mail.processing.1.{int(time.time())}.host").write_text("{}")
+        # a renewed claim is not stale
+        (spool_dir / "4_1.mail.processing.1.1000.host").write_text("{}")
+
+        assert not scan_spool_dir(spool_dir)
+        assert sorted(scan_spool_dir(spool_dir, lease=600)) == [spool_dir / "00/2_1.mail", spool_dir / "1_1.mail"]
+        assert "Releasing stale claim on" in caplog.text
+        assert len(list(spool_dir.glob("*.processing.*"))) == 2
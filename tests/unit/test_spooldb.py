@@ -0,0 +1,197 @@
+# pylint: disable=missing-function-docstring,redefined-outer-name
+
+#
+#  This file is part of Slurm-Mail.
+#
+#  Slurm-Mail is a drop in replacement for Slurm's e-mails to give users
+#  much more information about their jobs compared to the standard Slurm
+#  e-mails.
+#
+#   Copyright (C) 2018-2026 Neil Munday (neil@mundayweb.com)
+#
+#  Slurm-Mail is free software: you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the
+#  Free Software Foundation, either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  Slurm-Mail is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Slurm-Mail.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Unit tests for slurmmail.spooldb
+"""
+
+import pathlib
+import sqlite3
+import tempfile
+import time
+
+import pytest  # type: ignore
+
+from slurmmail.spooldb import SPOOL_DB_LEASE, SPOOL_DB_NAME, SpoolDatabase
+from slurmmail.spoolitem import SpoolItem
+
+#
+# Fixtures
+#
+
+
+@pytest.fixture
+def spool_db():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = SpoolDatabase(pathlib.Path(tmp_dir) / SPOOL_DB_NAME, create=True, base_delay=60, max_attempts=3)
+        yield db
+        db.close()
+
+
+def make_event(job_id: int = 1, state: str = "Began", email: str = "root") -> dict:
+    return {"job_id": job_id, "state": state, "email": email, "array_summary": False, "slurm_env": {}}
+
+
+#
+# Test classes
+#
+
+
+class TestSpoolDatabase:
+    """
+    Test slurmmail.spooldb.SpoolDatabase
+    """
+
+    def test_missing(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with pytest.raises(sqlite3.Error):
+                SpoolDatabase(pathlib.Path(tmp_dir) / SPOOL_DB_NAME)
+            assert not list(pathlib.Path(tmp_dir).iterdir())
+
+    def test_claim(self, spool_db):
+        for job_id in [1, 2, 3]:
+            spool_db.insert(make_event(job_id))
+        claimed = spool_db.claim(2)
+        assert [data for _, data in claimed] == [make_event(1), make_event(2)]
+        # claimed events are not claimed again
+        assert [data["job_id"] for _, data in spool_db.claim()] == [3]
+        assert spool_db.claim() == []
+
+        event, _ = claimed[0]
+        assert str(event) == f"{spool_db.path}#{event.id}"
+        assert event.exists()
+        event.unlink()
+        assert not event.exists()
+        assert spool_db.count() == 2
+
+    def test_claim_other_process(self, spool_db):
+        spool_db.insert(make_event())
+        other = SpoolDatabase(spool_db.path)
+        try:
+            assert len(other.claim()) == 1
+            assert spool_db.claim() == []
+        finally:
+            other.close()
+
+    def test_claim_expired(self, spool_db):
+        spool_db.insert(make_event())
+        now = time.time()
+        assert len(spool_db.claim(now=now)) == 1
+        assert spool_db.claim(now=now + SPOOL_DB_LEASE - 1) == []
+        # the claims of a crashed slurm-send-mail expire
+        assert len(spool_db.claim(now=now + SPOOL_DB_LEASE + 1)) == 1
+
+    def test_renew(self, spool_db):
+        spool_db.insert(make_event())
+        now = time.time()
+        events = [event for event, _ in spool_db.claim(now=now)]
+        assert spool_db.renew(events, now=now + SPOOL_DB_LEASE - 1) == 1
+        assert spool_db.claim(now=now + SPOOL_DB_LEASE + 1) == []
+        # the claim expires and is taken by another process
+        other = SpoolDatabase(spool_db.path)
+        other.owner = "other:1"
+        try:
+            assert len(other.claim(now=now + 2 * SPOOL_DB_LEASE)) == 1
+            assert spool_db.renew(events) == 0
+            assert not events[0].exists()
+        finally:
+            other.close()
+
+    def test_claimed_by_other_process(self, spool_db):
+        spool_db.insert(make_event())
+        now = time.time()
+        event, _ = spool_db.claim(now=now)[0]
+        other = SpoolDatabase(spool_db.path)
+        other.owner = "other:1"
+        try:
+            assert len(other.claim(now=now + SPOOL_DB_LEASE + 1)) == 1
+            # the event is neither removed nor deferred by its previous owner
+            spool_db.ack(event)
+            assert spool_db.defer(event, "451 try again later")
+            assert spool_db.count() == 1
+            assert other.exists(event)
+            other.ack(event)
+            assert spool_db.count() == 0
+        finally:
+            other.close()
+
+    def test_release(self, spool_db):
+        spool_db.insert(make_event())
+        events = [event for event, _ in spool_db.claim()]
+        spool_db.release(events)
+        assert [event for event, _ in spool_db.claim()] == events
+
+    def test_defer(self, spool_db):
+        spool_db.insert(make_event())
+        event, _ = spool_db.claim()[0]
+        assert spool_db.defer(event, "451 try again later")
+        assert spool_db.claim() == []
+        # due again after 60 seconds, then 120 seconds
+        now = time.time()
+        assert len(spool_db.claim(now=now + 61)) == 1
+        assert spool_db.defer(event, "451 try again later")
+        assert spool_db.claim(now=now + 61) == []
+        assert len(spool_db.claim(now=now + 121)) == 1
+        # given up after three attempts, the event is left to be removed
+        assert not spool_db.defer(event, "451 try again later")
+        assert event.exists()
+
+    def test_count(self, spool_db):
+        spool_db.insert(make_event(1, "Began", "root"))
+        spool_db.insert(make_event(2, "Began", "user"))
+        spool_db.insert(make_event(3, "Ended", "user"))
+        assert spool_db.count() == 3
+        assert spool_db.count(state="Began") == 2
+        assert spool_db.count(email="user") == 2
+        assert spool_db.count("Ended", "root") == 0
+        assert spool_db.backlog() == [("Began", "root", 1), ("Began", "user", 1), ("Ended", "user", 1)]
+
+
+class TestSpoolEvent:
+    """
+    Test slurmmail.spooldb.SpoolEvent
+    """
+
+    def test_spool_item(self, spool_db):
+        spool_db.insert(make_event(1))
+        event, _ = spool_db.claim()[0]
+        assert isinstance(event, SpoolItem)
+        assert event.read() == make_event(1)
+        assert event.exists()
+        assert event.renew()
+        event.unlink()
+        assert not event.exists()
+        assert not event.renew()
+
+    def test_defer_release(self, spool_db):
+        spool_db.max_attempts = 1
+        for job_id in [1, 2]:
+            spool_db.insert(make_event(job_id))
+        event, other = [event for event, _ in spool_db.claim()]
+        # given up after one attempt, the event is left to be removed
+        assert not event.defer("451 try again later")
+        assert event.exists()
+        other.release()
+        assert [event for event, _ in spool_db.claim()] == [other]
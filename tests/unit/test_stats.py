@@ -0,0 +1,141 @@
+# pylint: disable=missing-function-docstring,redefined-outer-name
+
+#
+#  This file is part of Slurm-Mail.
+#
+#  Slurm-Mail is a drop in replacement for Slurm's e-mails to give users
+#  much more information about their jobs compared to the standard Slurm
+#  e-mails.
+#
+#   Copyright (C) 2018-2026 Neil Munday (neil@mundayweb.com)
+#
+#  Slurm-Mail is free software: you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the
+#  Free Software Foundation, either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  Slurm-Mail is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Slurm-Mail.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Unit tests for slurmmail.stats
+"""
+
+import random
+
+import pytest  # type: ignore
+
+from slurmmail.cli import SACCT_DECODER
+from slurmmail.stats import ArrayStatistics, PERCENTILE_ACCURACY, StreamingStatistic
+
+START_TS = 1675460419
+
+
+def make_task(task_id: int, elapsed: int, state: str = "COMPLETED", exit_code: str = "0:0", max_rss: str = "100M"):
+    """
+    Returns the sacct output of a job array task and its batch step.
+    """
+    end_ts = START_TS + elapsed
+    raw_id = 100 + task_id
+    return (
+        f"7_{task_id}|root|root|all|myaccount|{START_TS}|{end_ts}|{state}|500M||2|0|00:00:{elapsed:02d}|1|/root"
+        f"|00:00:00|{exit_code}|||test|node01|00:05:00|5|{raw_id}|billing=2,cpu=2,node=1|test.jcf\n"
+        f"7_{task_id}.batch||||myaccount|{START_TS}|{end_ts}|{state}||{max_rss}|2|0|00:00:00|1||00:00:00|{exit_code}"
+        f"|||test|node01|||{raw_id}.batch|cpu=2,mem=0,node=1|batch\n"
+    )
+
+
+#
+# Test classes
+#
+
+
+class TestStreamingStatistic:
+    """
+    Test slurmmail.stats.StreamingStatistic
+    """
+
+    def test_empty(self):
+        statistic = StreamingStatistic()
+        assert statistic.count == 0
+        assert statistic.min is None
+        assert statistic.max is None
+        assert statistic.mean is None
+        assert statistic.percentile(50) is None
+
+    def test_values(self):
+        statistic = StreamingStatistic()
+        for value in [0, 10, 20, 30, 40]:
+            statistic.add(value)
+        assert statistic.count == 5
+        assert statistic.min == 0
+        assert statistic.max == 40
+        assert statistic.mean == 20
+        assert statistic.percentile(0) == 0
+        assert statistic.percentile(50) == pytest.approx(20, rel=PERCENTILE_ACCURACY)
+        assert statistic.percentile(100) == 40
+
+    def test_percentile_accuracy(self):
+        rng = random.Random(1)
+        values = [rng.lognormvariate(5, 2) for _ in range(10000)]
+        statistic = StreamingStatistic()
+        for value in values:
+            statistic.add(value)
+        values.sort()
+        for percent in [1, 25, 50, 75, 95, 99]:
+            expected = values[int(percent / 100 * (len(values) - 1))]
+            assert statistic.percentile(percent) == pytest.approx(expected, rel=PERCENTILE_ACCURACY)
+
+
+class TestArrayStatistics:
+    """
+    Test slurmmail.stats.ArrayStatistics
+    """
+
+    def test_add(self):
+        sacct_output = (
+            make_task(0, 60)
+            + make_task(1, 30, "FAILED", "1:0", "200M")
+            + make_task(2, 90)
+            + "70|root|root|all|myaccount|1|2|COMPLETED|500M||1|0|00:00:00|1|/|00:00:00|0:0|||test|node01"
+            "|00:05:00|5|70|billing=1|test.jcf\n"
+            + "7_[3-5]|root|root|all|myaccount|None|Unknown|CANCELLED|500M||2|0|00:00:00|1|/root|00:00:00|0:0|||test"
+            "|None assigned|00:05:00|5|7|billing=2|test.jcf\n"
+        )
+        stats = ArrayStatistics(7, 2)
+        records = SACCT_DECODER.decode_block(sacct_output)
+        assert list(stats.observe(records)) == records
+        stats.finish()
+
+        assert stats.tasks == 6
+        assert stats.states == {"COMPLETED": 2, "FAILED": 1, "CANCELLED": 3}
+        assert stats.elapsed.count == 3
+        assert stats.elapsed.min == 30
+        assert stats.elapsed.max == 90
+        assert stats.elapsed.mean == 60
+        # TotalCPU equals the elapsed time and each task has 2 CPUs
+        assert stats.cpu_efficiency.min == pytest.approx(50)
+        assert stats.cpu_efficiency.max == pytest.approx(50)
+        assert stats.max_rss.max == 204800
+        assert [(task.job_id, task.failed) for task in stats.worst_tasks()] == [("7_1", True), ("7_2", False)]
+
+    def test_worst_tasks(self):
+        stats = ArrayStatistics(7, 3)
+        for record in SACCT_DECODER.decode_block("".join(make_task(i, 60) for i in range(10))):
+            stats.add(record)
+        stats.finish()
+        # equally bad tasks are listed in the order they finished
+        assert [task.job_id for task in stats.worst_tasks()] == ["7_0", "7_1", "7_2"]
+
+        stats = ArrayStatistics(7, 0)
+        for record in SACCT_DECODER.decode_block(make_task(0, 60)):
+            stats.add(record)
+        stats.finish()
+        assert stats.tasks == 1
+        assert stats.worst_tasks() == []
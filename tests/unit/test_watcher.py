@@ -0,0 +1,135 @@
+# pylint: disable=missing-function-docstring,redefined-outer-name
+
+#
+#  This file is part of Slurm-Mail.
+#
+#  Slurm-Mail is a drop in replacement for Slurm's e-mails to give users
+#  much more information about their jobs compared to the standard Slurm
+#  e-mails.
+#
+#   Copyright (C) 2018-2026 Neil Munday (neil@mundayweb.com)
+#
+#  Slurm-Mail is free software: you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the
+#  Free Software Foundation, either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  Slurm-Mail is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Slurm-Mail.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Unit tests for slurmmail.watcher
+"""
+
+import os
+import pathlib
+import sys
+import tempfile
+from unittest.mock import patch
+
+import pytest  # type: ignore
+
+from slurmmail.spool import claim_spool_file, release_spool_file, SPOOL_LEASE_INFIX, SPOOL_SUBDIR_RE
+from slurmmail.watcher import SpoolWatcher
+
+#
+# Fixtures
+#
+
+
+@pytest.fixture
+def spool_dir():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        yield pathlib.Path(tmp_dir)
+
+
+#
+# Test classes
+#
+
+
+class TestSpoolWatcher:
+    """
+    Test slurmmail.watcher.SpoolWatcher
+    """
+
+    @pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify requires Linux")
+    def test_inotify_event(self, spool_dir):
+        watcher = SpoolWatcher(spool_dir, 5)
+        try:
+            assert watcher.inotify_enabled
+            (spool_dir / "1_1673384400.mail").write_text("{}")
+            assert watcher.wait()
+        finally:
+            watcher.close()
+
+    @pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify requires Linux")
+    def test_inotify_ignores_other_files(self, spool_dir):
+        watcher = SpoolWatcher(spool_dir, 0)
+        try:
+            (spool_dir / "1_1673384400.tmp").write_text("{}")
+            assert not watcher.wait()
+        finally:
+            watcher.close()
+
+    @pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify requires Linux")
+    def test_inotify_subdirs(self, spool_dir):
+        (spool_dir / "00").mkdir()
+        (spool_dir / "deferred").mkdir()
+        watcher = SpoolWatcher(spool_dir, 0, subdir_re=SPOOL_SUBDIR_RE)
+        try:
+            (spool_dir / "deferred" / "1_1673384400.mail").write_text("{}")
+            assert not watcher.wait()
+            (spool_dir / "00" / "1_1673384400.mail").write_text("{}")
+            assert watcher.wait()
+            # new sub-directories are watched too
+            (spool_dir / "01").mkdir()
+            assert watcher.wait()
+            (spool_dir / "01" / ".1_1673384400.mail.1.tmp").write_text("{}")
+            assert not watcher.wait()
+            os.replace(str(spool_dir / "01" / ".1_1673384400.mail.1.tmp"), str(spool_dir / "01" / "1_1673384400.mail"))
+            assert watcher.wait()
+        finally:
+            watcher.close()
+
+    @pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify requires Linux")
+    def test_inotify_ignores_released_spool_files(self, spool_dir):
+        spool_file = spool_dir / "1_1673384400.mail"
+        spool_file.write_text("{}")
+        watcher = SpoolWatcher(spool_dir, 0, lease_infix=SPOOL_LEASE_INFIX)
+        try:
+            lease = claim_spool_file(spool_file)
+            assert not watcher.wait()
+            release_spool_file(lease)  # type: ignore
+            assert not watcher.wait()
+            # other renames are still reported
+            os.replace(str(spool_file), str(spool_dir / "2_1673384400.mail"))
+            assert watcher.wait()
+        finally:
+            watcher.close()
+
+    def test_polling_fallback(self, spool_dir):
+        with patch("ctypes.CDLL", side_effect=OSError("libc not found")):
+            watcher = SpoolWatcher(spool_dir, 0)
+        try:
+            assert not watcher.inotify_enabled
+            (spool_dir / "1_1673384400.mail").write_text("{}")
+            assert not watcher.wait()
+        finally:
+            watcher.close()
+
+    def test_wake(self, spool_dir):
+        watcher = SpoolWatcher(spool_dir, 60)
+        try:
+            watcher.wake()
+            assert not watcher.wait()
+        finally:
+            watcher.close()
+        # waking a closed watcher is harmless
+        watcher.wake()